@@ -16,6 +16,8 @@ from effect import (
     perform,
     sync_performer)
 
+from pyrsistent import pvector
+
 import six
 
 from toolz.dicttoolz import get_in
@@ -662,47 +664,66 @@ def list_servers_details_page(parameters=None):
     )
 
 
-def list_servers_details_all(parameters=None):
+def fold_servers_details_pages(func, initial, parameters=None):
     """
-    List all pages of servers details, starting at the page specified by the
-    given filtering and pagination parameters.
+    Fold over all pages of servers details, starting at the page specified by
+    the given filtering and pagination parameters. ``func`` is called with
+    the servers of each page as soon as the page is received so that callers
+    can filter or aggregate servers without holding all of them.
 
+    :param callable func: Called with the accumulated value and ``list`` of
+        server details `dict` of a page. Returns new accumulated value.
+    :param initial: Initial accumulated value
     :ivar dict parameters: A dictionary with pagination information,
         changes-since filters, and name filters.
 
     Succeed on 200.
 
-    :return: a `list` of server details `dict`s
+    :return: Effect of accumulated value returned by ``func`` on last page
     :raise: :class:`NovaRateLimitError`, :class:`NovaComputeFaultError`,
         :class:`APIError`
     """
-    last_link = []
-
-    def continue_(result, servers_so_far=None):
-        if servers_so_far is None:
-            servers_so_far = []
-
+    def continue_(acc, last_link, result):
         _response, body = result
-        servers = servers_so_far + body['servers']
+        acc = func(acc, body['servers'])
 
         # Only continue if pagination is supported and there is another page
         continuation = [link['href'] for link in body.get('servers_links', [])
                         if link['rel'] == 'next']
         if continuation:
             # blow up if we try to fetch the same link twice
-            if last_link and last_link[-1] == continuation[0]:
+            if last_link == continuation[0]:
                 raise NovaComputeFaultError(
                     "When gathering server details, got the same 'next' link "
-                    "twice from Nova: {0}".format(last_link[-1]))
+                    "twice from Nova: {0}".format(last_link))
 
-            last_link[:] = [continuation[0]]
             parsed_query = parse_qs(urlparse(continuation[0]).query)
             return list_servers_details_page(parsed_query).on(
-                partial(continue_, servers_so_far=servers))
+                partial(continue_, acc, continuation[0]))
+
+        return acc
+
+    return list_servers_details_page(parameters).on(
+        partial(continue_, initial, None))
 
-        return servers
 
-    return list_servers_details_page(parameters).on(continue_)
+def list_servers_details_all(parameters=None):
+    """
+    List all pages of servers details, starting at the page specified by the
+    given filtering and pagination parameters.
+
+    :ivar dict parameters: A dictionary with pagination information,
+        changes-since filters, and name filters.
+
+    Succeed on 200.
+
+    :return: a `list` of server details `dict`s
+    :raise: :class:`NovaRateLimitError`, :class:`NovaComputeFaultError`,
+        :class:`APIError`
+    """
+    return fold_servers_details_pages(
+        lambda servers, page: servers.extend(page), pvector(),
+        parameters).on(list)
 
 
 _nova_standard_errors = [
@@ -5,6 +5,7 @@ from twisted.python.constants import NamedConstant, Names
 
 CONVERGENCE_DIRTY_DIR = '/groups/divergent'
 CONVERGENCE_PARTITIONER_PATH = '/convergence-partitioner'
+CONVERGENCE_WEIGHTS_PATH = '/convergence-weights'
 
 
 class ServiceType(Names):
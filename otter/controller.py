@@ -51,7 +51,8 @@ from otter.convergence.composition import tenant_is_enabled
 from otter.convergence.model import group_id_from_metadata
 from otter.convergence.planning import DRAINING_METADATA
 from otter.convergence.service import (
-    delete_divergent_flag, mark_divergent, trigger_convergence)
+    DIVERGENT_DIRTY, DIVERGENT_POLICY, delete_divergent_flag, mark_divergent,
+    trigger_convergence)
 from otter.json_schema.group_schemas import MAX_ENTITIES
 from otter.log import audit
 from otter.log.intents import BoundFields, msg, with_log
@@ -314,6 +315,11 @@ def empty_group(log, trans_id, group):
     return d
 
 
+# `modify_state_reason`s of user initiated policy executions whose convergence
+# is prioritized. See note [Convergence priority] in otter.convergence.service
+_POLICY_EXECUTION_REASONS = ('execute_policy', 'execute_webhook')
+
+
 @defer.inlineCallbacks
 def modify_and_trigger(dispatcher, group, logargs, modifier, *args, **kwargs):
     """
@@ -340,9 +346,14 @@ def modify_and_trigger(dispatcher, group, logargs, modifier, *args, **kwargs):
     except CannotExecutePolicyError as ce:
         cannot_exec_pol_err = ce
     if tenant_is_enabled(group.tenant_id, config_value):
+        reason = (
+            DIVERGENT_POLICY
+            if kwargs.get('modify_state_reason') in _POLICY_EXECUTION_REASONS
+            else DIVERGENT_DIRTY)
         eff = Effect(
             BoundFields(
-                trigger_convergence(group.tenant_id, group.uuid), logargs))
+                trigger_convergence(group.tenant_id, group.uuid, reason),
+                logargs))
         yield perform(dispatcher, eff)
     if cannot_exec_pol_err is not None:
         raise cannot_exec_pol_err
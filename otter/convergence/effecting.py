@@ -1,14 +1,268 @@
 """Code related to effecting change based on a convergence plan."""
 
-from effect import parallel
+# # Note [Step throttling]
+# Without "converger.step_throttling", all the steps of an iteration are
+# executed at once. Converging many groups of a tenant that way can fire
+# hundreds of requests at a service and get them rate limited (e.g. Nova's
+# 413), which fails the steps and makes the groups converge again.
+#
+# "converger.step_throttling" maps a ServiceType name to the limits of steps
+# of that service, like {"CLOUD_SERVERS": {"concurrency": 10, "rate": 2,
+# "burst": 5}}. Steps of a configured service are executed in a window of at
+# most "concurrency" steps at a time per tenant, shared by all the tenant's
+# groups converging in this node, and they are started at most "rate" per
+# second on average with bursts of "burst" (a token bucket). Each service has
+# its own window, so steps of different services are executed at the same
+# time.
+#
+# A window is a `PrioritySemaphore`: steps waiting for it are woken as soon as
+# a slot frees up, in the order of STEP_PRIORITY across all the tenant's
+# groups, so removing servers from load balancers, draining them and deleting
+# servers are not starved behind creating servers. Once in the window, a step
+# takes a token. If the bucket is empty the token is borrowed from the future
+# and the step is delayed until it would have been refilled, so steps get
+# their tokens in the order they got their windows and nothing polls. Steps of
+# unconfigured services and steps that do not call any service are executed
+# at once as before.
+#
+# This is independent of "cloud_client.throttling", which serializes some
+# requests (like creating servers) of all tenants with a delay between them.
 
+import time
+
+from effect import Constant, Delay, Effect, Func, parallel
+from effect.do import do, do_return
+from effect.ref import Reference
+
+import six
+
+from toolz.itertoolz import concat
+
+from otter.constants import ServiceType
+from otter.convergence.gathering import invalidate_clb_contents
 from otter.convergence.model import ErrorReason, StepResult
+from otter.convergence.steps import (
+    AddNodesToCLB,
+    BulkAddToRCv3,
+    BulkRemoveFromRCv3,
+    ChangeCLBNode,
+    CheckStack,
+    CreateServer,
+    CreateStack,
+    DeleteServer,
+    DeleteStack,
+    RemoveNodesFromCLB,
+    SetMetadataItemOnServer,
+    UpdateStack)
+from otter.convergence.tracing import span
+from otter.util.config import config_value
+from otter.util.semaphore import PrioritySemaphore
+
+
+STEP_SERVICES = {
+    CreateServer: ServiceType.CLOUD_SERVERS,
+    DeleteServer: ServiceType.CLOUD_SERVERS,
+    SetMetadataItemOnServer: ServiceType.CLOUD_SERVERS,
+    AddNodesToCLB: ServiceType.CLOUD_LOAD_BALANCERS,
+    RemoveNodesFromCLB: ServiceType.CLOUD_LOAD_BALANCERS,
+    ChangeCLBNode: ServiceType.CLOUD_LOAD_BALANCERS,
+    BulkAddToRCv3: ServiceType.RACKCONNECT_V3,
+    BulkRemoveFromRCv3: ServiceType.RACKCONNECT_V3,
+    CreateStack: ServiceType.CLOUD_ORCHESTRATION,
+    CheckStack: ServiceType.CLOUD_ORCHESTRATION,
+    UpdateStack: ServiceType.CLOUD_ORCHESTRATION,
+    DeleteStack: ServiceType.CLOUD_ORCHESTRATION,
+}
+"""Service called by each step class. See note [Step throttling]."""
+
+STEP_PRIORITY = [
+    RemoveNodesFromCLB, BulkRemoveFromRCv3, ChangeCLBNode, DeleteServer,
+    DeleteStack, SetMetadataItemOnServer, AddNodesToCLB, BulkAddToRCv3,
+    CheckStack, UpdateStack, CreateServer, CreateStack]
+"""
+Order in which throttled steps of a tenant are started. See note
+[Step throttling].
+"""
+
+
+def step_priority(step):
+    """Position of the step's class in :obj:`STEP_PRIORITY`, if any."""
+    try:
+        return STEP_PRIORITY.index(type(step))
+    except ValueError:
+        return len(STEP_PRIORITY)
+
+
+class StepLimiter(object):
+    """
+    Windows and token buckets of steps being executed, keyed on
+    (tenant ID, :obj:`ServiceType`). See note [Step throttling].
+    """
+
+    def __init__(self):
+        # key -> PrioritySemaphore of the steps executing in the window
+        self.windows = {}
+        # key -> (tokens, time they were counted)
+        self.buckets = {}
+
+    def window(self, key, concurrency):
+        """
+        Return :obj:`PrioritySemaphore` of the window of ``key`` that lets
+        ``concurrency`` steps execute at a time.
+        """
+        window = self.windows.get(key)
+        if window is None or window.limit != concurrency:
+            window = self.windows[key] = PrioritySemaphore(concurrency)
+        return window
+
+    def forget_idle(self, key):
+        """Forget the window of ``key`` if no step is using it."""
+        window = self.windows.get(key)
+        if window is not None and window.idle:
+            del self.windows[key]
+
+    def take_token(self, key, limits, now):
+        """
+        Take a token from the bucket of ``key``, borrowing it from the future
+        if the bucket is empty.
+
+        :param key: (tenant ID, :obj:`ServiceType`) of the step
+        :param dict limits: Throttling config of the step's service
+        :param float now: Current time in seconds
+
+        :return: 0 if the step can start now, otherwise seconds to wait before
+            the token is refilled
+        """
+        rate = limits.get('rate')
+        if rate is None:
+            return 0
+        burst = limits.get('burst', 1)
+        tokens, last = self.buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - last) * rate) - 1
+        self.buckets[key] = (tokens, now)
+        return 0 if tokens >= 0 else -tokens / float(rate)
+
 
+STEP_LIMITER = StepLimiter()
+"""Limiter of all the steps executed in this process"""
 
-def steps_to_effect(steps):
-    """Turns a collection of :class:`IStep` providers into an effect."""
+
+def _with_token(limiter, key, limits, eff):
+    """Perform ``eff`` once a token of ``key`` is taken from ``limiter``."""
+    wait = Effect(Func(lambda: limiter.take_token(key, limits, time.time())))
+    return wait.on(
+        lambda seconds: Effect(Delay(seconds)) if seconds
+        else Effect(Constant(None))).on(lambda _: eff)
+
+
+def _throttled(limiter, key, limits, priority, eff):
+    """
+    Perform ``eff`` in the window of ``key`` with ``priority`` once
+    ``limiter`` lets it start.
+    """
+    eff = _with_token(limiter, key, limits, eff)
+    concurrency = limits.get('concurrency')
+    if concurrency is None:
+        return eff
+    forget = Effect(Func(limiter.forget_idle, key))
+    return Effect(Func(limiter.window, key, concurrency)).on(
+        lambda window: window.run(eff, priority=priority)).on(
+        success=lambda r: forget.on(lambda _: r),
+        error=lambda e: forget.on(lambda _: six.reraise(*e)))
+
+
+def bounded_parallel(effs, limit):
+    """
+    Like :func:`parallel` but perform at most ``limit`` effects at a time, in
+    the given order. All of them are performed at once if ``limit`` is None.
+
+    :return: Effect of ``list`` of results in the order of ``effs``
+    """
+    if limit is None:
+        return parallel(effs)
+    # (next item, remaining items) where an item is (index, effect)
+    queue = Reference(((), tuple(enumerate(effs))))
+
+    def pop():
+        return queue.modify(lambda (_, items): (items[:1], items[1:])).on(
+            lambda (item, _): item)
+
+    @do
+    def worker():
+        results = []
+        item = yield pop()
+        while item:
+            [(index, eff)] = item
+            results.append((index, (yield eff)))
+            item = yield pop()
+        yield do_return(results)
+
+    workers = parallel([worker() for _ in range(min(limit, len(effs)))])
+    return workers.on(
+        lambda results: [result for _, result in sorted(concat(results))])
+
+
+def _step_effect(step, tenant_id, get_config_value):
+    """
+    Effect of the step that invalidates the cached contents of the tenant's
+    CLB changed by the step, if any.
+    """
+    eff = step.as_effect()
+    if tenant_id is not None and \
+            isinstance(step, (AddNodesToCLB, RemoveNodesFromCLB,
+                              ChangeCLBNode)):
+        eff = invalidate_clb_contents(tenant_id, step.lb_id, eff,
+                                      get_config_value=get_config_value)
+    return eff
+
+
+def steps_to_effect(steps, tenant_id=None, get_config_value=config_value,
+                    limiter=STEP_LIMITER):
+    """
+    Turns a collection of :class:`IStep` providers into an effect.
+
+    :param steps: Steps to execute
+    :param tenant_id: Tenant whose windows the steps are executed in and
+        whose cached CLB contents are invalidated by steps changing CLBs
+    :param get_config_value: config getter
+    :param limiter: :obj:`StepLimiter` of the windows
+
+    :return: Effect of ``list`` of step results in the order of ``steps``
+    """
     # Treat unknown errors as RETRY.
-    return parallel([
-        s.as_effect().on(error=lambda e: (StepResult.RETRY,
-                                          [ErrorReason.Exception(e)]))
-        for s in steps])
+    effs = [
+        span('step-' + type(s).__name__,
+             _step_effect(s, tenant_id, get_config_value),
+             get_config_value).on(
+            error=lambda e: (StepResult.RETRY, [ErrorReason.Exception(e)]))
+        for s in steps]
+    throttling = get_config_value('converger.step_throttling')
+    if not throttling:
+        return parallel(effs)
+
+    by_service = {}
+    for index, step in enumerate(steps):
+        service = STEP_SERVICES.get(type(step))
+        limits = None if service is None else throttling.get(service.name)
+        by_service.setdefault(
+            service if limits is not None else None, []).append(index)
+
+    indices = []
+    queues = []
+    for service, service_indices in by_service.items():
+        if service is None:
+            indices.append(service_indices)
+            queues.append(parallel([effs[i] for i in service_indices]))
+            continue
+        limits = throttling[service.name]
+        service_indices.sort(key=lambda i: step_priority(steps[i]))
+        indices.append(service_indices)
+        queues.append(parallel(
+            [_throttled(limiter, (tenant_id, service), limits,
+                        step_priority(steps[i]), effs[i])
+             for i in service_indices]))
+
+    return parallel(queues).on(
+        lambda results: [
+            result for _, result in
+            sorted(zip(concat(indices), concat(results)))])
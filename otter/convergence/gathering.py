@@ -1,11 +1,18 @@
 """Code related to gathering data to inform convergence."""
 import re
+import time
+from datetime import timedelta
 from functools import partial
 
-from effect import catch, parallel
+import attr
+
+from effect import Constant, Effect, Func, catch, parallel
 from effect.do import do, do_return
+from effect.ref import Reference
+
+from pyrsistent import pmap, pvector
 
-from pyrsistent import pmap
+import six
 
 from toolz.curried import filter, groupby, keyfilter, map
 from toolz.dicttoolz import assoc, get_in, merge
@@ -14,6 +21,8 @@ from toolz.itertoolz import concat
 
 from otter.auth import NoSuchEndpoint
 from otter.cloud_client import (
+    fold_servers_details_pages,
+    has_code,
     list_servers_details_all,
     list_stacks_all,
     service_request
@@ -28,21 +37,24 @@ from otter.cloud_client.clb import (
 from otter.constants import ServiceType
 from otter.convergence.model import (
     CLB,
+    CLBDescription,
     CLBNode,
     CLBNodeCondition,
     HeatStack,
-    NovaServer,
     RCv3Description,
     RCv3Node,
     get_stack_tag_for_group,
-    group_id_from_metadata
+    group_id_from_metadata,
+    server_from_details_json
 )
+from otter.convergence.tracing import span
 from otter.indexer import atom
 from otter.models.cass import CassScalingGroupServersCache
+from otter.util.config import config_value
 from otter.util.http import append_segments
 from otter.util.retry import (
     exponential_backoff_interval, retry_effect, retry_times)
-from otter.util.timestamp import timestamp_to_epoch
+from otter.util.timestamp import datetime_to_epoch, timestamp_to_epoch
 
 
 def _retry(eff):
@@ -51,6 +63,13 @@ def _retry(eff):
         eff, retry_times(5), exponential_backoff_interval(2))
 
 
+def _server_details_query(changes_since, batch_size):
+    query = {'limit': [str(batch_size)]}
+    if changes_since is not None:
+        query['changes-since'] = ['{0}Z'.format(changes_since.isoformat())]
+    return query
+
+
 def get_all_server_details(changes_since=None, batch_size=100):
     """
     Return all servers of a tenant.
@@ -61,20 +80,45 @@ def get_all_server_details(changes_since=None, batch_size=100):
 
     NOTE: This really screams to be a independent fxcloud-type API
     """
-    query = {'limit': [str(batch_size)]}
-    if changes_since is not None:
-        query['changes-since'] = ['{0}Z'.format(changes_since.isoformat())]
-
-    return list_servers_details_all(query)
+    return list_servers_details_all(
+        _server_details_query(changes_since, batch_size))
 
 
 def get_all_scaling_group_servers(changes_since=None,
-                                  server_predicate=identity):
+                                  server_predicate=identity,
+                                  batch_size=100):
     """
     Return tenant's servers that belong to any scaling group as
     {group_id: [server1, server2]} ``dict``. No specific ordering is guaranteed
 
+    Servers are grouped page by page as they are fetched so that servers not
+    belonging to any scaling group are never held all at once.
+
     :param datetime changes_since: Get server since this time. Must be UTC
+    :param server_predicate: function of server -> bool that determines whether
+        the server should be included in the result.
+    :param int batch_size: number of servers to fetch *per batch*.
+    :return: dict mapping group IDs to lists of Nova servers.
+    """
+    def add_page(groups, servers):
+        page_groups = group_servers(servers, server_predicate)
+        for group_id, page_servers in page_groups.items():
+            groups = groups.set(
+                group_id, groups.get(group_id, pvector()).extend(
+                    page_servers))
+        return groups
+
+    return fold_servers_details_pages(
+        add_page, pmap(), _server_details_query(changes_since, batch_size)
+    ).on(lambda groups: {group_id: list(servers)
+                         for group_id, servers in groups.items()})
+
+
+def group_servers(servers, server_predicate=identity):
+    """
+    Group servers that belong to any scaling group on their group ID.
+
+    :param list servers: list of Nova server JSON dicts
     :param server_predicate: function of server -> bool that determines whether
         the server should be included in the result.
     :return: dict mapping group IDs to lists of Nova servers.
@@ -91,7 +135,7 @@ def get_all_scaling_group_servers(changes_since=None,
                             filter(server_predicate),
                             filter(has_group_id))
 
-    return get_all_server_details(changes_since).on(servers_apply)
+    return servers_apply(servers)
 
 
 def mark_deleted_servers(old, new):
@@ -115,6 +159,21 @@ def mark_deleted_servers(old, new):
     return merge(old, new).values()
 
 
+def apply_server_changes(old, changed):
+    """
+    Given old servers and servers that changed since they were fetched, return
+    a list of all current servers. Deleted servers are expected to be in
+    ``changed`` with a status of DELETED as returned by Nova's changes-since
+    query.
+
+    :param list old: List of old servers
+    :param list changed: List of servers changed since ``old`` was fetched
+    :return: List of updated servers
+    """
+    return merge({s['id']: s for s in old},
+                 {s['id']: s for s in changed}).values()
+
+
 @curry
 def server_of_group(group_id, server):
     """
@@ -123,11 +182,42 @@ def server_of_group(group_id, server):
     return group_id_from_metadata(server.get('metadata', {})) == group_id
 
 
+def get_changes_since(now, last_update, get_config_value=config_value):
+    """
+    Return the time since which changed servers should be fetched to update
+    servers cached at ``last_update``, or None if all the servers should be
+    fetched instead.
+
+    Incremental gathering is enabled by the
+    ``converger.incremental_gather.resync_interval`` config, which is the
+    number of seconds in which all servers are fetched at least once to bound
+    any drift of the cached servers. ``overlap`` is the number of seconds
+    before ``last_update`` from which changes are fetched, to cover changes
+    that happened between gathering and caching the servers.
+
+    :param datetime now: Current time
+    :param datetime last_update: Time at which the servers were cached
+    :param callable get_config_value: config key -> config value.
+    :rtype: ``datetime`` or None
+    """
+    conf = get_config_value('converger.incremental_gather')
+    if conf is None:
+        return None
+    interval = conf['resync_interval']
+    # Stateless resync: fetch all servers on first gather of each interval
+    if (datetime_to_epoch(now) // interval !=
+            datetime_to_epoch(last_update) // interval):
+        return None
+    return last_update - timedelta(seconds=conf.get('overlap', 0))
+
+
 @do
 def get_scaling_group_servers(tenant_id, group_id, now,
                               all_as_servers=get_all_scaling_group_servers,
                               all_servers=get_all_server_details,
-                              cache_class=CassScalingGroupServersCache):
+                              cache_class=CassScalingGroupServersCache,
+                              incremental=True,
+                              get_config_value=config_value):
     """
     Get a group's servers taken from cache if it exists. Updates cache
     if it is empty from newly fetched servers
@@ -135,6 +225,12 @@ def get_scaling_group_servers(tenant_id, group_id, now,
     # scoped on the tenant because cache calls require tenant_id. Should
     # they also not take tenant_id and work on the scope?
 
+    If incremental gathering is configured (see :func:`get_changes_since`),
+    only the servers changed since the cache was last updated are fetched and
+    applied to the cached servers.
+
+    :param bool incremental: Can only changed servers be fetched? Should be
+        False when ``all_servers`` returns already fetched servers.
     :return: Servers as list of dicts
     :rtype: Effect
     """
@@ -143,8 +239,15 @@ def get_scaling_group_servers(tenant_id, group_id, now,
     if last_update is None:
         servers = (yield all_as_servers()).get(group_id, [])
     else:
-        current = yield all_servers()
-        servers = mark_deleted_servers(cached_servers, current)
+        changes_since = (
+            get_changes_since(now, last_update, get_config_value)
+            if incremental else None)
+        if changes_since is None:
+            current = yield all_servers()
+            servers = mark_deleted_servers(cached_servers, current)
+        else:
+            changed = yield all_servers(changes_since)
+            servers = apply_server_changes(cached_servers, changed)
         servers = list(filter(server_of_group(group_id), servers))
     yield do_return(servers)
 
@@ -162,13 +265,127 @@ def get_scaling_group_stacks(group_id, get_all_stacks=get_all_stacks):
     return get_all_stacks(stack_tag=get_stack_tag_for_group(group_id))
 
 
+@attr.s
+class CLBCacheEntry(object):
+    """
+    Cached contents of a single CLB. See :func:`get_clb_contents`.
+
+    :ivar int generation: Incremented every time this entry is invalidated.
+        Contents are only stored if the generation has not changed since the
+        contents started getting fetched.
+    :ivar float fetched_at: EPOCH in seconds when the contents were fetched.
+        None if the entry was invalidated.
+    :ivar list nodes: Node JSON as returned by the CLB API
+    :ivar dict health_monitor: Health monitor JSON as returned by the CLB API
+    :ivar drained_at: `pmap` of node ID to the time the node was put in
+        DRAINING. Only contains nodes that were DRAINING when ``nodes`` were
+        fetched.
+    """
+    generation = attr.ib(default=0)
+    fetched_at = attr.ib(default=None)
+    nodes = attr.ib(default=())
+    health_monitor = attr.ib(default=None)
+    drained_at = attr.ib(default=pmap())
+
+    def is_fresh(self, now, ttl):
+        """
+        Were the contents fetched less than ``ttl`` seconds before ``now``?
+        """
+        return self.fetched_at is not None and now - self.fetched_at < ttl
+
+
+# `pmap` of (tenant ID, CLB ID) to :obj:`CLBCacheEntry`. Entries are keyed
+# on the tenant too so that a tenant is never given contents fetched with
+# another tenant's credentials.
+CLB_CONTENTS_CACHE = Reference(pmap())
+
+
+def invalidate_clb_contents(tenant_id, lb_id, eff, cache=CLB_CONTENTS_CACHE,
+                            get_config_value=config_value):
+    """
+    Invalidate cached contents of a tenant's CLB after ``eff`` completes,
+    whether it succeeds or fails. Effects of steps that change a CLB are
+    wrapped with this when executed (see
+    :func:`otter.convergence.effecting.steps_to_effect`) so that the next
+    convergence cycle sees their changes.
+
+    :param str tenant_id: ID of the tenant owning the CLB
+    :param str lb_id: ID of the CLB being changed by ``eff``
+    :param eff: Effect changing the CLB
+    :return: Effect with same result as ``eff``
+    """
+    if get_config_value('converger.clb_cache_ttl') is None:
+        return eff
+    key = (tenant_id, lb_id)
+
+    def invalidate(entries):
+        entry = entries.get(key, CLBCacheEntry())
+        return entries.set(
+            key, CLBCacheEntry(generation=entry.generation + 1))
+
+    after = cache.modify(invalidate)
+    return eff.on(success=lambda r: after.on(lambda _: r),
+                  error=lambda e: after.on(lambda _: six.reraise(*e)))
+
+
+def _update_clb_cache(entries, tenant_id, observed, now, ttl, contents,
+                      nodes, deleted_lbs):
+    """
+    Store CLB contents fetched by :func:`get_clb_contents` in the cache.
+    Entries that have expired are removed.
+
+    :param entries: Current cache contents
+    :param str tenant_id: ID of the tenant owning the CLBs
+    :param observed: Cache entries of the tenant's CLBs mapped on CLB ID when
+        the CLBs started getting fetched
+    :param float now: EPOCH when the CLBs started getting fetched
+    :param dict contents: CLB ID -> (fetched_at, nodes JSON, health monitor)
+    :param list nodes: ``list`` of :obj:`CLBNode` returned
+    :param set deleted_lbs: IDs of CLBs found to be deleted
+    :return: Updated cache contents
+    """
+    drained_at = groupby(lambda n: n.description.lb_id,
+                         [n for n in nodes if n._drained_at is not None])
+    entries = pmap({lb_id: entry for lb_id, entry in entries.items()
+                    if entry.fetched_at is None or entry.is_fresh(now, ttl)})
+    for lb_id, (fetched_at, lb_nodes, health_monitor) in contents.items():
+        key = (tenant_id, lb_id)
+        generation = observed.get(lb_id, CLBCacheEntry()).generation
+        current = entries.get(key, CLBCacheEntry())
+        if current.generation != generation:
+            # Invalidated while getting fetched
+            continue
+        if lb_id in deleted_lbs or health_monitor is None:
+            entries = entries.discard(key)
+            continue
+        entries = entries.set(key, CLBCacheEntry(
+            generation=generation, fetched_at=fetched_at, nodes=lb_nodes,
+            health_monitor=health_monitor,
+            drained_at=pmap({n.node_id: n.drained_at
+                             for n in drained_at.get(lb_id, [])})))
+    return entries
+
+
 @do
-def get_clb_contents():
+def get_clb_contents(lb_ids=None, tenant_id=None, cache=CLB_CONTENTS_CACHE,
+                     get_config_value=config_value):
     """
     Get Rackspace Cloud Load Balancer contents as list of `CLBNode`. CLB
     health monitor information is also returned as a pmap of :obj:`CLB` objects
     mapped on LB ID.
 
+    :param lb_ids: IDs of the CLBs to get contents of. If None, all the CLBs
+        of the tenant are listed and their contents returned.
+    :param str tenant_id: ID of the tenant whose CLBs are fetched. Contents
+        are not cached if it is None.
+
+    If ``converger.clb_cache_ttl`` is configured, nodes and health monitor of
+    each CLB are cached for that many seconds in ``cache`` along with the
+    times when its DRAINING nodes were put in DRAINING. The times are
+    fetched again whenever the nodes are, since a node could have been
+    enabled and drained again in the meantime. The CLBs themselves are always
+    listed if ``lb_ids`` is None.
+
     :return: Effect of (``list`` of :obj:`CLBNode`, `pmap` of :obj:`CLB`)
     :rtype: :obj:`Effect`
     """
@@ -182,29 +399,57 @@ def get_clb_contents():
     def gone(r):
         return catch(CLBNotFoundError, lambda exc: r)
 
-    lb_ids = [lb['id'] for lb in (yield _retry(get_clbs()))]
+    ttl = get_config_value('converger.clb_cache_ttl')
+    if lb_ids is None:
+        lb_ids = [lb['id'] for lb in (yield _retry(get_clbs()))]
+    lb_ids = list(map(str, lb_ids))
+    caching = ttl is not None and tenant_id is not None
+    if not caching:
+        now, observed = None, pmap()
+    else:
+        now = yield Effect(Func(time.time))
+        observed = pmap({
+            lb_id: entry
+            for (entry_tenant_id, lb_id), entry in (yield cache.read()).items()
+            if entry_tenant_id == tenant_id})
+    cached = {
+        lb_id: (entry.fetched_at, entry.nodes, entry.health_monitor)
+        for lb_id, entry in observed.items()
+        if lb_id in lb_ids and entry.is_fresh(now, ttl)}
+    to_fetch = [lb_id for lb_id in lb_ids if lb_id not in cached]
     node_reqs = [_retry(get_clb_nodes(lb_id).on(error=gone([])))
-                 for lb_id in lb_ids]
+                 for lb_id in to_fetch]
     healthmon_reqs = [
         _retry(get_clb_health_monitor(lb_id).on(error=gone(None)))
-        for lb_id in lb_ids]
+        for lb_id in to_fetch]
     all_nodes_hms = yield parallel(node_reqs + healthmon_reqs)
-    all_nodes, hms = all_nodes_hms[:len(lb_ids)], all_nodes_hms[len(lb_ids):]
-    lb_nodes = {
-        lb_id: [CLBNode.from_node_json(lb_id, node)
-                for node in nodes]
-        for lb_id, nodes in zip(lb_ids, all_nodes)}
+    all_nodes = all_nodes_hms[:len(to_fetch)]
+    hms = all_nodes_hms[len(to_fetch):]
+    contents = merge(
+        cached,
+        {lb_id: (now, nodes, hm)
+         for lb_id, nodes, hm in zip(to_fetch, all_nodes, hms)})
+    lb_nodes = [CLBNode.from_node_json(lb_id, node)
+                for lb_id in lb_ids for node in contents[lb_id][1]]
     clbs = {
-        str(lb_id): CLB(bool(health_mon))
-        for lb_id, health_mon in zip(lb_ids, hms) if health_mon is not None}
-    draining = [n for n in concat(lb_nodes.values())
+        lb_id: CLB(bool(contents[lb_id][2]))
+        for lb_id in lb_ids if contents[lb_id][2] is not None}
+    memoized = {
+        (lb_id, node_id): drained_at
+        for lb_id, entry in observed.items() if lb_id in cached
+        for node_id, drained_at in entry.drained_at.items()}
+    draining = [n for n in lb_nodes
                 if n.description.condition == CLBNodeCondition.DRAINING]
-    feeds = yield parallel(
-        [_retry(get_clb_node_feed(n.description.lb_id, n.node_id).on(
+    to_fetch_feeds = [
+        n for n in draining
+        if (n.description.lb_id, n.node_id) not in memoized]
+    feed_reqs = [
+        _retry(get_clb_node_feed(n.description.lb_id, n.node_id).on(
             error=gone(None)))
-         for n in draining]
-    )
-    nodes_to_feeds = dict(zip(draining, feeds))
+        for n in to_fetch_feeds]
+    feeds = yield span('gather-clb-feeds', parallel(feed_reqs),
+                       get_config_value)
+    nodes_to_feeds = dict(zip(to_fetch_feeds, feeds))
     deleted_lbs = set([
         node.description.lb_id
         for (node, feed) in nodes_to_feeds.items() if feed is None])
@@ -215,11 +460,19 @@ def get_clb_contents():
             return None
         if feed is not None:
             node.drained_at = extract_clb_drained_at(feed)
+        elif node.description.condition == CLBNodeCondition.DRAINING:
+            node.drained_at = memoized.get(
+                (node.description.lb_id, node.node_id))
         return node
 
-    nodes = map(update_drained_at, concat(lb_nodes.values()))
+    nodes = list(filter(bool, map(update_drained_at, lb_nodes)))
+    if caching:
+        yield cache.modify(
+            lambda entries: _update_clb_cache(
+                entries, tenant_id, observed, now, ttl, contents, nodes,
+                deleted_lbs))
     yield do_return((
-        list(filter(bool, nodes)),
+        nodes,
         pmap(keyfilter(lambda k: k not in deleted_lbs, clbs))))
 
 
@@ -250,24 +503,36 @@ def extract_clb_drained_at(feed):
     return None
 
 
-def get_rcv3_contents():
+def get_rcv3_contents(lb_ids=None):
     """
     Get Rackspace Cloud Load Balancer contents as list of `RCv3Node`.
+
+    :param lb_ids: IDs of the RCv3 load balancer pools to get nodes of. If
+        None, all the pools of the tenant are listed and their nodes returned.
+        Pools that do not exist are ignored.
     """
     eff = service_request(ServiceType.RACKCONNECT_V3, 'GET',
                           'load_balancer_pools')
 
-    def on_listing_pools(lblist_result):
-        _, body = lblist_result
+    def get_nodes(lb_ids, success_pred=has_code(200),
+                  on_response=identity):
         return parallel([
             service_request(ServiceType.RACKCONNECT_V3, 'GET',
                             append_segments('load_balancer_pools',
-                                            lb_pool['id'], 'nodes')).on(
-                partial(on_listing_nodes,
-                        RCv3Description(lb_id=lb_pool['id'])))
-            for lb_pool in body
+                                            lb_id, 'nodes'),
+                            success_pred=success_pred).on(on_response).on(
+                partial(on_listing_nodes, RCv3Description(lb_id=lb_id)))
+            for lb_id in lb_ids
         ])
 
+    def ignore_not_found(lbnodes_result):
+        response, body = lbnodes_result
+        return (response, [] if response.code == 404 else body)
+
+    def on_listing_pools(lblist_result):
+        _, body = lblist_result
+        return get_nodes([lb_pool['id'] for lb_pool in body])
+
     def on_listing_nodes(rcv3_description, lbnodes_result):
         _, body = lbnodes_result
         return [
@@ -276,31 +541,197 @@ def get_rcv3_contents():
             for node in body
         ]
 
-    return eff.on(on_listing_pools).on(
+    if lb_ids is not None:
+        eff = get_nodes(lb_ids, success_pred=has_code(200, 404),
+                        on_response=ignore_not_found)
+    else:
+        eff = eff.on(on_listing_pools)
+    return eff.on(
         success=compose(list, concat),
         error=catch(NoSuchEndpoint, lambda _: []))
 
 
+@attr.s
+class GatherSnapshot(object):
+    """
+    Tenant-wide data required to converge any ``launch_server`` group of the
+    tenant. It is gathered once per convergence cycle and shared between all
+    the tenant's groups that converge in that cycle.
+
+    :ivar list servers: All servers of the tenant as Nova JSON dicts
+    :ivar dict group_servers: ``servers`` that belong to a scaling group,
+        grouped on group ID. See :func:`group_servers`.
+    :ivar list clb_nodes: ``list`` of :obj:`CLBNode` or None if CLBs were
+        not gathered
+    :ivar clbs: ``pmap`` of :obj:`CLB` mapped on LB ID or None if CLBs were
+        not gathered
+    :ivar list rcv3_nodes: ``list`` of :obj:`RCv3Node` or None if RCv3 nodes
+        were not gathered
+    """
+    servers = attr.ib()
+    group_servers = attr.ib()
+    clb_nodes = attr.ib()
+    clbs = attr.ib()
+    rcv3_nodes = attr.ib()
+
+
+def get_tenant_gather_snapshot(
+        tenant_id,
+        desired_lbs=None,
+        group_ids=None,
+        get_all_server_details=get_all_server_details,
+        get_clb_contents=get_clb_contents,
+        get_rcv3_contents=get_rcv3_contents,
+        get_config_value=config_value):
+    """
+    Gather tenant-wide launch_server data in parallel.
+
+    :param str tenant_id: ID of the tenant
+    :param desired_lbs: `ILBDescription` providers the servers of converging
+        groups should be on. If given along with ``group_ids``, CLBs or RCv3
+        nodes are gathered only if they are referred to by it or by the
+        metadata of the groups' servers, after getting the servers. Otherwise
+        everything is gathered. The snapshot has None in place of what is not
+        gathered.
+    :param group_ids: IDs of the groups that will use the snapshot
+    :param get_config_value: config getter
+
+    :return: Effect of :obj:`GatherSnapshot`
+    """
+    def snapshot((servers, (clb_nodes, clbs), rcv3_nodes)):
+        return GatherSnapshot(
+            servers=servers,
+            group_servers=group_servers(servers),
+            clb_nodes=clb_nodes,
+            clbs=clbs,
+            rcv3_nodes=rcv3_nodes)
+
+    servers_eff = span('gather-servers', get_all_server_details(),
+                       get_config_value)
+    if desired_lbs is None or group_ids is None:
+        return parallel(
+            [servers_eff,
+             span('gather-clb', get_clb_contents(tenant_id=tenant_id),
+                  get_config_value),
+             span('gather-rcv3', get_rcv3_contents(),
+                  get_config_value)]).on(snapshot)
+
+    def gather_lbs(servers):
+        servers_of_groups = group_servers(servers)
+        lbs = set(desired_lbs).union(*[
+            server_from_details_json(server).desired_lbs
+            for group_id in group_ids
+            for server in servers_of_groups.get(group_id, [])])
+        lb_types = set(type(lb) for lb in lbs)
+        return parallel(
+            [Effect(Constant(servers)),
+             span('gather-clb', get_clb_contents(tenant_id=tenant_id),
+                  get_config_value)
+             if CLBDescription in lb_types
+             else Effect(Constant((None, None))),
+             span('gather-rcv3', get_rcv3_contents(), get_config_value)
+             if RCv3Description in lb_types
+             else Effect(Constant(None))]).on(snapshot)
+
+    return servers_eff.on(gather_lbs)
+
+
+def get_group_lb_contents(tenant_id, desired_lbs, servers,
+                          get_clb_contents=get_clb_contents,
+                          get_rcv3_contents=get_rcv3_contents,
+                          get_config_value=config_value):
+    """
+    Get contents of only the load balancers a group refers to: the ones it
+    should be on as per its launch config and the ones its servers were put
+    on as per their metadata. The latter ensures that servers are still
+    removed from load balancers that are no longer in the launch config.
+
+    :param str tenant_id: ID of the tenant
+    :param PSet desired_lbs: `ILBDescription` providers the group's servers
+        should be on
+    :param list servers: ``list`` of :obj:`NovaServer` of the group
+    :param get_config_value: config getter
+
+    :return: Effect of ((``list`` of :obj:`CLBNode`, `pmap` of :obj:`CLB`),
+        ``list`` of :obj:`RCv3Node`)
+    """
+    lbs = set(desired_lbs).union(*[server.desired_lbs for server in servers])
+    lb_ids = groupby(type, lbs)
+    return parallel([
+        span('gather-clb', get_clb_contents(
+            lb_ids=sorted(set(
+                lb.lb_id for lb in lb_ids.get(CLBDescription, []))),
+            tenant_id=tenant_id),
+            get_config_value),
+        span('gather-rcv3', get_rcv3_contents(lb_ids=sorted(set(
+            lb.lb_id for lb in lb_ids.get(RCv3Description, [])))),
+            get_config_value)])
+
+
 def get_all_launch_server_data(
         tenant_id,
         group_id,
         now,
+        snapshot=None,
+        desired_group_state=None,
         get_scaling_group_servers=get_scaling_group_servers,
         get_clb_contents=get_clb_contents,
-        get_rcv3_contents=get_rcv3_contents):
+        get_rcv3_contents=get_rcv3_contents,
+        get_config_value=config_value):
     """
     Gather all launch_server data relevant for convergence w.r.t given time,
     in parallel where possible.
 
+    :param snapshot: :obj:`GatherSnapshot` of the tenant. If given, the
+        tenant-wide data is sliced from it instead of being fetched again.
+        The load balancers it doesn't have are fetched as usual.
+    :param desired_group_state: :obj:`DesiredServerGroupState` of the group.
+        If given and ``converger.scoped_lb_gather`` is configured, only the
+        load balancers the group refers to are fetched (see
+        :func:`get_group_lb_contents`) after getting the servers.
+
     Returns an Effect of {'servers': [NovaServer], 'lb_nodes': [LBNode],
                           'lbs': pmap(LB_ID -> CLB)}.
     """
-    return parallel(
-        [get_scaling_group_servers(tenant_id, group_id, now)
-         .on(map(NovaServer.from_server_details_json)).on(list),
-         get_clb_contents(),
-         get_rcv3_contents()]
-    ).on(lambda (servers, clb_nodes_and_clbs, rcv3_nodes): {
+    scoped = (snapshot is None and desired_group_state is not None and
+              get_config_value('converger.scoped_lb_gather'))
+    if snapshot is None:
+        servers_eff = span(
+            'gather-servers',
+            get_scaling_group_servers(tenant_id, group_id, now),
+            get_config_value)
+    else:
+        servers_eff = get_scaling_group_servers(
+            tenant_id, group_id, now,
+            all_as_servers=lambda: Effect(Constant(snapshot.group_servers)),
+            all_servers=lambda: Effect(Constant(snapshot.servers)),
+            incremental=False)
+    servers_eff = servers_eff.on(
+        map(server_from_details_json)).on(list)
+    if scoped:
+        eff = servers_eff.on(
+            lambda servers: get_group_lb_contents(
+                tenant_id, desired_group_state.desired_lbs, servers,
+                get_clb_contents, get_rcv3_contents,
+                get_config_value).on(
+                lambda contents: [servers] + contents))
+    elif snapshot is None:
+        eff = parallel(
+            [servers_eff,
+             span('gather-clb', get_clb_contents(tenant_id=tenant_id),
+                  get_config_value),
+             span('gather-rcv3', get_rcv3_contents(), get_config_value)])
+    else:
+        eff = parallel(
+            [servers_eff,
+             span('gather-clb', get_clb_contents(tenant_id=tenant_id),
+                  get_config_value)
+             if snapshot.clbs is None
+             else Effect(Constant((snapshot.clb_nodes, snapshot.clbs))),
+             span('gather-rcv3', get_rcv3_contents(), get_config_value)
+             if snapshot.rcv3_nodes is None
+             else Effect(Constant(snapshot.rcv3_nodes))])
+    return eff.on(lambda (servers, clb_nodes_and_clbs, rcv3_nodes): {
         'servers': servers,
         'lb_nodes': clb_nodes_and_clbs[0] + rcv3_nodes,
         'lbs': clb_nodes_and_clbs[1]
@@ -311,9 +742,13 @@ def get_all_launch_stack_data(
         tenant_id,
         group_id,
         now,
+        snapshot=None,
+        desired_group_state=None,
         get_scaling_group_stacks=get_scaling_group_stacks):
     """
-    Gather all launch_stack data relevant for convergence w.r.t given time
+    Gather all launch_stack data relevant for convergence w.r.t given time.
+    ``snapshot`` and ``desired_group_state`` are ignored since stacks are
+    always listed per group.
 
     Returns an Effect of {'stacks': [HeatStack]}.
     """
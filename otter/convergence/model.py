@@ -24,6 +24,7 @@ from twisted.python.constants import NamedConstant, Names
 from zope.interface import Attribute as IAttribute, Interface, implementer
 
 from otter.util.fp import set_in
+from otter.util.lru import LRUCache
 from otter.util.timestamp import timestamp_to_epoch
 
 
@@ -232,7 +233,7 @@ def _validate_state(_1, _2, state):
         raise AssertionError("{0} is not a ServerState".format(state))
 
 
-@attr.s(repr=False)
+@attr.s(repr=False, slots=True)
 class NovaServer(object):
     """
     Information about a server that was retrieved from Nova.
@@ -286,6 +287,8 @@ class NovaServer(object):
         if server_json.get("OS-EXT-STS:task_state", "") == "deleting":
             server_state = ServerState.DELETED
         metadata = server_json.get('metadata', {})
+        # links are part of the JSON; share them instead of freezing twice
+        json = freeze(server_json)
 
         return cls(
             id=server_json['id'],
@@ -293,10 +296,10 @@ class NovaServer(object):
             created=timestamp_to_epoch(server_json['created']),
             image_id=get_in(["image", "id"], server_json),
             flavor_id=server_json['flavor']['id'],
-            links=freeze(server_json['links']),
+            links=json['links'],
             desired_lbs=_lbs_from_metadata(metadata),
             servicenet_address=_servicenet_address(server_json),
-            json=freeze(server_json))
+            json=json)
 
     def __repr__(self):
         """
@@ -319,6 +322,47 @@ class NovaServer(object):
         return repr(self)
 
 
+NOVA_SERVERS_CACHE = LRUCache(10000)
+"""
+:obj:`LRUCache` of key returned by :func:`_server_cache_key` ->
+:obj:`NovaServer` used by :func:`server_from_details_json`
+"""
+
+
+def server_from_details_json(server_json, cache=NOVA_SERVERS_CACHE):
+    """
+    Same as :meth:`NovaServer.from_server_details_json` but return the
+    already built :obj:`NovaServer` if the same server JSON was seen before.
+
+    Servers are looked up by their id and ``updated`` timestamp along with
+    the fields otter changes without changing ``updated``: the status, when
+    marking servers deleted, and the metadata, when draining servers. Server
+    JSON without ``updated`` is not cached.
+
+    :param dict server_json: Server details JSON
+    :param cache: :obj:`LRUCache` to store the servers in
+    :return: :obj:`NovaServer` instance
+    """
+    if 'updated' not in server_json:
+        return NovaServer.from_server_details_json(server_json)
+    key = _server_cache_key(server_json)
+    server = cache.get(key)
+    if server is None:
+        server = NovaServer.from_server_details_json(server_json)
+        cache.set(key, server)
+    return server
+
+
+def _server_cache_key(server_json):
+    """
+    Return key of server JSON in :obj:`NOVA_SERVERS_CACHE`
+    """
+    return (server_json['id'], server_json['updated'],
+            server_json.get('status'),
+            server_json.get('OS-EXT-STS:task_state'),
+            frozenset(server_json.get('metadata', {}).items()))
+
+
 @attr.s
 class HeatStack(object):
     action = attr.ib()
@@ -495,6 +539,14 @@ class ILBNode(Interface):
         :rtype: `bool`
         """
 
+    def match_key():  # pragma: no cover
+        """
+        The key identifying servers that correspond to this LB Node. A server
+        matches this node if this key is one of its :func:`server_match_keys`.
+
+        :return: hashable key
+        """
+
     def is_active():  # pragma: no cover
         """
         :return: Whether this node is currently active or enabled on the load
@@ -526,13 +578,7 @@ class IDrainable(Interface):
 
 
 @implementer(ILBDescription)
-@attributes([Attribute("lb_id", instance_of=basestring),
-             Attribute("port", instance_of=int),
-             Attribute("weight", default_value=1, instance_of=int),
-             Attribute("condition", default_value=CLBNodeCondition.ENABLED,
-                       instance_of=NamedConstant),
-             Attribute("type", default_value=CLBNodeType.PRIMARY,
-                       instance_of=NamedConstant)])
+@attr.s(slots=True)
 class CLBDescription(object):
     """
     Information representing a Rackspace CLB port mapping; how a particular
@@ -552,6 +598,14 @@ class CLBDescription(object):
     :ivar type: One of ``PRIMARY`` or ``SECONDARY`` - default is ``PRIMARY``
     :type type: A member of :class:`CLBNodeType`
     """
+    lb_id = attr.ib(validator=instance_of(basestring))
+    port = attr.ib(validator=instance_of(int))
+    weight = attr.ib(default=1, validator=instance_of(int))
+    condition = attr.ib(default=CLBNodeCondition.ENABLED,
+                        validator=instance_of(NamedConstant))
+    type = attr.ib(default=CLBNodeType.PRIMARY,
+                   validator=instance_of(NamedConstant))
+
     def equivalent_definition(self, other_description):
         """
         Whether the other description is also a :class:`CLBDescription` and
@@ -583,7 +637,7 @@ class DrainingUnavailable(Exception):
 
 
 @implementer(ILBNode, IDrainable)
-@attr.s
+@attr.s(slots=True)
 class CLBNode(object):
     """
     A Rackspace Cloud Load Balancer node.
@@ -640,7 +694,13 @@ class CLBNode(object):
         See :func:`ILBNode.matches`.
         """
         return (isinstance(server, NovaServer) and
-                server.servicenet_address == self.address)
+                self.match_key() in server_match_keys(server))
+
+    def match_key(self):
+        """
+        See :func:`ILBNode.match_key`.
+        """
+        return ('servicenet_address', self.address)
 
     def currently_draining(self):
         """
@@ -679,7 +739,7 @@ class CLBNode(object):
 
 
 @implementer(ILBDescription)
-@attributes([Attribute("lb_id", instance_of=basestring)])
+@attr.s(slots=True)
 class RCv3Description(object):
     """
     Information representing a RackConnect V3/server mapping: how a particular
@@ -690,6 +750,8 @@ class RCv3Description(object):
 
     :ivar int lb_id: The Load Balancer ID.
     """
+    lb_id = attr.ib(validator=instance_of(basestring))
+
     def equivalent_definition(self, other_description):
         """
         Given that no customization is available, is the same as testing
@@ -701,9 +763,7 @@ class RCv3Description(object):
 
 
 @implementer(ILBNode)
-@attributes([Attribute("node_id", instance_of=basestring),
-             Attribute("description", instance_of=RCv3Description),
-             Attribute("cloud_server_id", instance_of=basestring)])
+@attr.s(slots=True)
 class RCv3Node(object):
     """
     A RackConnect V3 node.
@@ -715,9 +775,53 @@ class RCv3Node(object):
     :ivar str cloud_server_id: The ID of the cloud server represented by this
         node
     """
+    node_id = attr.ib(validator=instance_of(basestring))
+    description = attr.ib(validator=instance_of(RCv3Description))
+    cloud_server_id = attr.ib(validator=instance_of(basestring))
+
     def matches(self, server):
         """
         See :func:`ILBNode.matches`.
         """
         return (isinstance(server, NovaServer) and
-                server.id == self.cloud_server_id)
+                self.match_key() in server_match_keys(server))
+
+    def match_key(self):
+        """
+        See :func:`ILBNode.match_key`.
+        """
+        return ('id', self.cloud_server_id)
+
+
+def server_match_keys(server):
+    """
+    Keys of the LB nodes that the server could match. See
+    :func:`ILBNode.match_key`.
+
+    :param server: :obj:`NovaServer`
+    :return: ``tuple`` of keys
+    """
+    return (('servicenet_address', server.servicenet_address),
+            ('id', server.id))
+
+
+def index_lb_nodes(lb_nodes):
+    """
+    Index LB nodes on the servers they match so that the nodes matching a
+    server can be found without checking every node.
+
+    :param lb_nodes: Sequence of :obj:`ILBNode` providers
+    :return: Function that takes a :obj:`NovaServer` and returns ``list`` of
+        nodes in ``lb_nodes`` that match it, in the same order as
+        ``lb_nodes``
+    """
+    index = groupby(lambda (_, node): node.match_key(), enumerate(lb_nodes))
+
+    def matching_nodes(server):
+        if not isinstance(server, NovaServer):
+            return []
+        return [node for _, node in sorted(
+            entry for key in server_match_keys(server)
+            for entry in index.get(key, []))]
+
+    return matching_nodes
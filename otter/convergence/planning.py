@@ -82,7 +82,8 @@ from otter.convergence.model import (
     RCv3Description,
     RCv3Node,
     ServerState,
-    StackState)
+    StackState,
+    index_lb_nodes)
 from otter.convergence.steps import (
     AddNodesToCLB,
     BulkAddToRCv3,
@@ -100,7 +101,7 @@ from otter.convergence.steps import (
     UpdateStack,
 )
 from otter.convergence.transforming import limit_steps_by_count, optimize_steps
-from otter.util.fp import assoc_obj, partition_bool
+from otter.util.fp import partition_bool
 
 
 DRAINING_METADATA = ('rax:autoscale:server:state', 'DRAINING')
@@ -365,6 +366,7 @@ def converge_launch_server(desired_state, servers_with_cheese,
 
     """
     newest_to_oldest = sorted(servers_with_cheese, key=lambda s: -s.created)
+    lb_nodes_of = index_lb_nodes(load_balancer_nodes)
 
     servers = defaultdict(lambda: [], groupby(get_destiny, newest_to_oldest))
     servers_in_active = servers[Destiny.CONSIDER_AVAILABLE]
@@ -401,7 +403,7 @@ def converge_launch_server(desired_state, servers_with_cheese,
         return _drain_and_delete(
             server,
             desired_state.draining_timeout,
-            [node for node in load_balancer_nodes if node.matches(server)],
+            lb_nodes_of(server),
             now)
 
     try:
@@ -421,7 +423,7 @@ def converge_launch_server(desired_state, servers_with_cheese,
     cleanup_errored_and_deleted_steps = [
         remove_node_from_lb(lb_node)
         for server in servers[Destiny.DELETE] + servers[Destiny.CLEANUP]
-        for lb_node in load_balancer_nodes if lb_node.matches(server)]
+        for lb_node in lb_nodes_of(server)]
 
     # converge all the servers that remain to their desired load balancer state
     still_active_servers = filter(lambda s: s not in servers_to_delete,
@@ -432,7 +434,7 @@ def converge_launch_server(desired_state, servers_with_cheese,
             for server in still_active_servers
             for step in _converge_lb_state(
                 server,
-                [node for node in load_balancer_nodes if node.matches(server)],
+                lb_nodes_of(server),
                 load_balancers,
                 now,
                 # Temporarily using build timeout as node offline timeout.
@@ -604,8 +606,8 @@ def add_server_to_lb(server, description, load_balancer):
                 return fail_convergence(
                     CLBHealthInfoNotFound(description.lb_id))
             if load_balancer.health_monitor:
-                description = assoc_obj(description,
-                                        condition=CLBNodeCondition.DRAINING)
+                description = attr.assoc(description,
+                                         condition=CLBNodeCondition.DRAINING)
             return AddNodesToCLB(
                 lb_id=description.lb_id,
                 address_configs=pset(
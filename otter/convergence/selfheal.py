@@ -4,23 +4,28 @@ distributing the triggering over a period of time in effect "heal"ing the
 groups.
 """
 
+from functools import partial
+
 import attr
 
-from effect import ComposedDispatcher, Effect, TypeDispatcher
+from effect import ComposedDispatcher, Effect, TypeDispatcher, parallel
 from effect.do import do
 
 from toolz.curried import filter
+from toolz.itertoolz import groupby, partition_all
 
 from twisted.internet.defer import inlineCallbacks, returnValue
 from twisted.internet.interfaces import IReactorTime
 
-from txeffect import perform
+from txeffect import exc_info_to_failure, perform
 
 from otter.convergence.composition import tenant_is_enabled
-from otter.convergence.service import trigger_convergence
+from otter.convergence.service import (
+    DIVERGENT_SELFHEAL, trigger_convergence, trigger_convergence_many)
 from otter.log import BoundLog
-from otter.log.intents import msg, with_log
-from otter.models.intents import GetAllValidGroups, GetScalingGroupInfo
+from otter.log.intents import err, msg, with_log
+from otter.models.intents import (
+    GetAllValidGroups, GetScalingGroupInfo, GetScalingGroupStatuses)
 from otter.models.interface import NoSuchScalingGroupError, ScalingGroupStatus
 
 
@@ -40,8 +45,12 @@ class SelfHeal(object):
     :ivar float time_range: Seconds over which convergence triggerring will be
         spread evenly
     :ivar log: :obj:`BoundLog` object used to log messages
+    :ivar int batch_size: If given, convergence is triggered on batches of
+        this many groups at a time with :func:`check_and_trigger_groups`
+        instead of one group at a time
     :ivar list _calls: List of :obj:`IDelayedCall` objects. Each object
-        represents scheduled call to trigger convergence on a group
+        represents scheduled call to trigger convergence on a group or batch
+        of groups
     """
 
     clock = attr.ib(validator=attr.validators.provides(IReactorTime))
@@ -55,6 +64,7 @@ class SelfHeal(object):
         validator=attr.validators.instance_of(BoundLog),
         convert=lambda l: l.bind(otter_service="selfheal"),
         cmp=False)
+    batch_size = attr.ib(default=None)
     _calls = attr.ib(default=attr.Factory(list))
 
     def setup(self):
@@ -93,13 +103,17 @@ class SelfHeal(object):
                          "selfheal-calls-err", active=active)
         if not groups:
             returnValue(None)
-        wait_time = self.time_range / len(groups)
-        for i, group in enumerate(groups):
+        if self.batch_size is None:
+            effs = [check_and_trigger(group["tenantId"], group["groupId"])
+                    for group in groups]
+        else:
+            effs = [check_and_trigger_groups(list(batch))
+                    for batch in partition_all(self.batch_size, groups)]
+        wait_time = self.time_range / len(effs)
+        for i, eff in enumerate(effs):
             self._calls.append(
                 self.clock.callLater(
-                    i * wait_time, perform, self.dispatcher,
-                    check_and_trigger(group["tenantId"], group["groupId"]))
-            )
+                    i * wait_time, perform, self.dispatcher, eff))
 
 
 def get_groups_to_converge(config_func):
@@ -129,5 +143,49 @@ def check_and_trigger(tenant_id, group_id):
         if (state.status == ScalingGroupStatus.ACTIVE and
                 not (state.paused or state.suspended)):
             yield with_log(
-                trigger_convergence(tenant_id, group_id),
+                trigger_convergence(tenant_id, group_id, DIVERGENT_SELFHEAL),
                 tenant_id=tenant_id, scaling_group_id=group_id)
+
+
+@do
+def check_and_trigger_groups(groups):
+    """
+    Trigger convergence on given groups that are ACTIVE and not paused, like
+    :func:`check_and_trigger` does for one group. Statuses of a tenant's
+    groups are read in one query and the groups are marked divergent in bulk.
+    If reading a tenant's statuses fails, the error is logged and the other
+    tenants' groups are still triggered.
+
+    :param list groups: ``list`` of dict with "tenantId" and "groupId" keys
+    """
+    tenant_groups = groupby(lambda g: g["tenantId"], groups)
+    tenant_ids = sorted(tenant_groups)
+    statuses = yield parallel([
+        Effect(GetScalingGroupStatuses(
+            tenant_id, [g["groupId"] for g in tenant_groups[tenant_id]])).on(
+            error=partial(_statuses_failed, tenant_id))
+        for tenant_id in tenant_ids])
+    to_trigger = []
+    for tenant_id, tenant_statuses in zip(tenant_ids, statuses):
+        if tenant_statuses is None:
+            continue
+        for group in tenant_groups[tenant_id]:
+            status = tenant_statuses.get(group["groupId"])
+            if status is None:
+                yield msg("selfheal-group-deleted", tenant_id=tenant_id,
+                          scaling_group_id=group["groupId"])
+            elif (status["status"] == ScalingGroupStatus.ACTIVE and
+                    not (status["paused"] or status["suspended"])):
+                to_trigger.append((tenant_id, group["groupId"]))
+    if to_trigger:
+        yield trigger_convergence_many(to_trigger, DIVERGENT_SELFHEAL)
+
+
+def _statuses_failed(tenant_id, exc_info):
+    """
+    Log failure to get statuses of ``tenant_id``'s groups.
+
+    :return: Effect of None
+    """
+    return err(exc_info_to_failure(exc_info), "selfheal-group-statuses-err",
+               tenant_id=tenant_id).on(lambda _: None)
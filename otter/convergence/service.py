@@ -84,6 +84,90 @@ The top-level entry-points into this module are :func:`trigger_convergence` and
 # convergence, since convergence always uses the most recent data.
 
 
+# # Note [Sharded divergent flags]
+#
+# By default all divergent flags are children of CONVERGENCE_DIRTY_DIR, so
+# every converger node watches and lists all of them, and during an incident
+# the list can grow big enough to hit ZooKeeper's limits on response size.
+# When "converger.sharded_dirty_flags" is configured, `mark_divergent` creates
+# the flag under a directory of the tenant's bucket instead, i.e.
+# CONVERGENCE_DIRTY_DIR/<bucket>/<tenant>_<group>. Each converger then watches
+# only the directories of the buckets it has acquired and stops watching a
+# bucket the next time its directory changes after the bucket is lost. This
+# needs "converger.buckets" to be the same on all the nodes.
+#
+# To migrate from the flat layout, enable the config on all the nodes. A
+# converger keeps watching CONVERGENCE_DIRTY_DIR itself for flags of nodes
+# that are not migrated yet and converges them in place, deleting them from
+# where they were found. Once the flat flags are all gone, that directory
+# only has the bucket directories and rarely changes.
+
+
+# # Note [Bulk divergent flags]
+#
+# Marking thousands of groups divergent one `CreateOrSet` at a time, e.g.
+# during a selfheal sweep, takes as many ZooKeeper round trips.
+# `mark_divergent_many` writes the flags in chunks instead, each in one
+# ZooKeeper multi operation that creates them. Flags are deleted once their
+# groups converge, so most of them don't exist and are created without
+# having to list the flags first. If a chunk's transaction fails, the
+# operations that failed, like creating a flag that exists or one in a bucket
+# directory that does not exist yet, are done with `CreateOrSet` one at a
+# time and the ones that were only rolled back are tried again in another
+# transaction. `CreateOrSet` bumps the version of existing flags, which keeps
+# the guarantees of note [Divergent flags].
+
+
+# # Note [Convergence priority]
+#
+# By default all divergent groups found in a cycle are converged at once. A
+# storm of policy executions or a selfheal sweep can then start hundreds of
+# convergences simultaneously on a node. When "converger.max_concurrent_groups"
+# is configured, at most that many groups are converged at a time by the node:
+# the converger keeps one `PrioritySemaphore` of group slots that every cycle
+# queues its groups on. Groups of a tenant are converged together since they
+# share the tenant's gathered snapshot, so a tenant waits for as many slots as
+# it has groups (or all the slots if it has more, converging that many of them
+# at a time). Tenants get slots in order of their most important group and a
+# tenant is never overtaken by a less important one that needs fewer slots.
+# Groups are added to the currently converging groups when they are queued,
+# so a later cycle doesn't queue them again while they wait for slots, and
+# each is removed when its convergence is done.
+#
+# Importance comes from the reason the group was last marked divergent, which
+# is stored as the content of its divergent flag, and whether the last
+# iteration on this node planned to create servers:
+#
+# 0. a user executed a policy (API or webhook)
+# 1. the group is under capacity
+# 2. anything else, like a group config change
+# 3. selfheal
+#
+# The flag content is overwritten on every trigger, so a group triggered by
+# selfheal right after a policy execution gets selfheal priority until it is
+# under capacity.
+
+
+# # Note [Convergence backoff]
+#
+# A group waiting for its servers to build plans only `ConvergeLater` steps
+# and is otherwise converged again every interval, listing servers and LBs
+# each time, for as long as the servers take to build. When
+# "converger.max_backoff_interval" is configured, the converger remembers a
+# `Backoff` for such a group: the version of its divergent flag and the digest
+# of the gathered data (see note [Converged digest]). Every following
+# iteration that plans only `ConvergeLater` steps with the same flag version
+# and digest doubles the time the group is left alone, up to the configured
+# maximum. Any other plan forgets the backoff. Since the flag version is
+# checked before the group is skipped, a new trigger of the group converges
+# it right away. The version is the one read along with the flag's contents
+# (see note [Convergence priority]), so checking it costs nothing extra. The
+# backoff is forgotten when the group's flag is deleted or found gone, or the
+# group is deleted, so that backoffs of groups that are no longer divergent
+# don't pile up. Note that LIMITED_RETRY steps are counted in iterations, so
+# backing off lengthens the time they are waited for.
+
+
 # # Note [Convergence servers cache]
 # Each convergence cycle runs 3 primary steps: gather, generate plan and
 # execute plan. For launch_server type convergence it keeps cache of servers
@@ -98,32 +182,74 @@ The top-level entry-points into this module are :func:`trigger_convergence` and
 # See https://github.com/rackerlabs/otter/issues/1966
 
 
+# # Note [Converged digest]
+# Most groups converged due to selfheal or a webhook are already converged:
+# at desired capacity with all servers ACTIVE and in their LBs. Planning them
+# always results in no steps, yet it costs CPU and writes servers cache twice.
+# When "converger.converged_fast_path" is configured, a digest of the desired
+# state, servers (including their metadata, which marks them draining), their
+# LB nodes and LBs is computed after gathering an ACTIVE group. If an
+# iteration plans no steps, the group is converged and its digest is
+# remembered. Since planning only depends on time when there are steps
+# (like waiting for builds or draining), a later iteration that gathers the
+# same digest is converged too. It skips planning and stops right away,
+# updating the servers cache only once to keep its `last_update` current for
+# incremental gathering. The digests are kept in memory of the node, so a
+# group converged by another node is planned the first time. A group's digest
+# is forgotten when it is being deleted or is found deleted.
+
+
+# # Note [Tenant gather snapshot]
+# Servers, CLBs (with their nodes, health monitors and feeds) and RCv3 nodes
+# are listed tenant-wide and every launch_server group of the tenant needs all
+# of it. So when more than one launch_server group of a tenant is converged in
+# a cycle, `converge_all_groups` gathers this data once into a
+# `GatherSnapshot` and each group's gather step slices its servers out of it
+# instead of listing everything again. Groups whose divergent flag is gone or
+# that are already converging are left out before that, and the launch
+# configs are read (from the configs cache, mostly) to leave out launch_stack
+# groups. CLBs and RCv3 nodes are put in the snapshot only if the launch
+# configs of these groups or the metadata of their servers refer to them; a
+# group gathers whatever the snapshot doesn't have itself, in case its launch
+# config changed in the meantime. A tenant with a single group to converge
+# gathers as usual. If gathering the snapshot fails, each group gathers its
+# own data so that the error is handled per group like it always has been.
+
+
+import json
 import operator
 import time
 import uuid
+from collections import Mapping, Sequence, Set
 from datetime import datetime
 from functools import partial
 from hashlib import sha1
 
 import attr
 
-from effect import Constant, Effect, FirstError, Func, parallel
+from effect import (
+    Constant, Effect, FirstError, Func, catch, parallel, sync_perform)
 from effect.do import do, do_return
 from effect.ref import Reference
 
-from kazoo.exceptions import BadVersionError, NoNodeError
+from kazoo.exceptions import (
+    BadVersionError, NoNodeError, NodeExistsError, RolledBackError)
 from kazoo.recipe.partitioner import PartitionState
 
-from pyrsistent import pmap, pset
+from pyrsistent import freeze, pmap, pset
 from pyrsistent import thaw
 
 import six
 
 from sumtypes import match
 
-from toolz.functoolz import curry
+from toolz.dicttoolz import merge
+from toolz.functoolz import compose, curry
+from toolz.itertoolz import concat, unique
 
+from twisted.application.internet import TimerService
 from twisted.application.service import MultiService
+from twisted.python.constants import NamedConstant
 
 from txeffect import exc_info_to_failure, perform
 
@@ -131,27 +257,38 @@ from otter.auth import NoSuchEndpoint
 from otter.cloud_client import TenantScope
 from otter.constants import CONVERGENCE_DIRTY_DIR
 from otter.convergence.composition import (get_desired_server_group_state,
-                                           get_desired_stack_group_state)
-from otter.convergence.effecting import steps_to_effect
+                                           get_desired_stack_group_state,
+                                           json_to_LBConfigs)
+from otter.convergence.effecting import bounded_parallel, steps_to_effect
 from otter.convergence.errors import present_reasons, structure_reason
 from otter.convergence.gathering import (get_all_launch_server_data,
-                                         get_all_launch_stack_data)
+                                         get_all_launch_stack_data,
+                                         get_tenant_gather_snapshot)
 from otter.convergence.logging import log_steps
 from otter.convergence.model import (
     ConvergenceIterationStatus,
     ErrorReason,
     ServerState,
-    StepResult)
+    StepResult,
+    index_lb_nodes)
 from otter.convergence.planning import plan_launch_server, plan_launch_stack
+from otter.convergence.steps import ConvergeLater, CreateServer, CreateStack
+from otter.convergence.tracing import span
 from otter.convergence.transforming import get_step_limits_from_conf
 from otter.log.cloudfeeds import cf_err, cf_msg
 from otter.log.intents import err, msg, msg_with_time, with_log
 from otter.models.intents import (
-    DeleteGroup, GetScalingGroupInfo, LoadAndUpdateGroupStatus,
+    DeleteGroup, GetLaunchConfig, GetScalingGroupInfo,
+    LoadAndUpdateGroupStatus,
     UpdateGroupErrorReasons, UpdateGroupStatus, UpdateServersCache)
 from otter.models.interface import NoSuchScalingGroupError, ScalingGroupStatus
+from otter.util.config import config_value
+from otter.util.lru import LRUCache
+from otter.util.semaphore import PrioritySemaphore
 from otter.util.timestamp import datetime_to_epoch
-from otter.util.zk import CreateOrSet, DeleteNode, GetChildren, GetStat
+from otter.util.zk import (
+    CreateNode, CreateOrSet, DeleteNode, GetChildren, GetData, Transaction,
+    TransactionFailed)
 
 
 def get_executor(launch_config):
@@ -213,9 +350,10 @@ def update_servers_cache(group, now, servers, lb_nodes, lbs,
     :param include_deleted: Include deleted servers in cache. Defaults to True.
     """
     server_dicts = []
+    lb_nodes_of = index_lb_nodes(lb_nodes)
     for server in servers:
         sd = thaw(server.json)
-        if is_autoscale_active(server, lb_nodes):
+        if is_autoscale_active(server, lb_nodes_of(server)):
             sd["_is_as_active"] = True
         if server.state != ServerState.DELETED or include_deleted:
             server_dicts.append(sd)
@@ -224,17 +362,75 @@ def update_servers_cache(group, now, servers, lb_nodes, lbs,
         UpdateServersCache(group.tenant_id, group.uuid, now, server_dicts))
 
 
+def _canonical(obj):
+    """
+    Return JSON serializable form of ``obj`` that is same for equal objects:
+    mappings and sets are turned into sorted lists, ``attrs`` instances into
+    a list of class name and attributes and constants into their names.
+    """
+    def sort(items):
+        return sorted(items, key=json.dumps)
+
+    if isinstance(obj, NamedConstant):
+        return obj.name
+    if attr.has(type(obj)):
+        return [type(obj).__name__,
+                _canonical(attr.asdict(obj, recurse=False))]
+    if isinstance(obj, Mapping):
+        return sort([_canonical(k), _canonical(v)] for k, v in obj.items())
+    if isinstance(obj, Set):
+        return sort(map(_canonical, obj))
+    if isinstance(obj, Sequence) and not isinstance(obj, six.string_types):
+        return map(_canonical, obj)
+    return obj
+
+
+def converged_servers_digest(desired_group_state, servers, lb_nodes, lbs):
+    """
+    Digest of everything that planning of a ``launch_server`` group depends
+    on. See note [Converged digest].
+
+    :param desired_group_state: :obj:`DesiredServerGroupState` of the group
+    :param list servers: list of :obj:`NovaServer` of the group
+    :param list lb_nodes: list of :obj:`ILBNode` providers
+    :param dict lbs: load balancer objects keyed on ID
+
+    :return: SHA-1 hex digest of canonical JSON serialization of the data
+    """
+    lb_nodes_of = index_lb_nodes(lb_nodes)
+    data = [
+        [desired_group_state.server_config, desired_group_state.capacity,
+         desired_group_state.desired_lbs,
+         desired_group_state.draining_timeout],
+        set((s.id, s.state, s.created, s.image_id, s.flavor_id,
+             s.desired_lbs, s.servicenet_address,
+             s.json.get('metadata', pmap()), frozenset(lb_nodes_of(s)))
+            for s in servers),
+        lbs]
+    return sha1(json.dumps(_canonical(data))).hexdigest()
+
+
+def stacks_digest(desired_group_state, stacks):
+    """
+    ``launch_stack`` groups are always planned, so they do not have a digest.
+
+    :return: None
+    """
+    return None
+
+
 @do
-def _execute_steps(steps):
+def _execute_steps(steps, tenant_id=None, get_config_value=config_value):
     """
     Given a set of steps, executes them, logs the result, and returns the worst
-    priority with a list of reasons for that result.
+    priority with a list of reasons for that result. Steps are executed in
+    ``tenant_id``'s windows; see note [Step throttling].
 
     :return: a tuple of (:class:`StepResult` constant,
                          list of :obj:`ErrorReason`)
     """
     if len(steps) > 0:
-        results = yield steps_to_effect(steps)
+        results = yield steps_to_effect(steps, tenant_id, get_config_value)
 
         severity = [StepResult.FAILURE, StepResult.RETRY,
                     StepResult.LIMITED_RETRY, StepResult.SUCCESS]
@@ -261,12 +457,31 @@ def _execute_steps(steps):
 
 
 @do
-def convergence_exec_data(tenant_id, group_id, now, get_executor):
+def convergence_exec_data(tenant_id, group_id, now, get_executor,
+                          snapshot=None, with_digest=False,
+                          converged_digest=None,
+                          get_config_value=config_value):
     """
     Get data required while executing convergence
+
+    :param snapshot: :obj:`GatherSnapshot` of the tenant shared with other
+        groups converging in the same cycle or None to gather everything
+    :param bool with_digest: Should the digest of gathered data be returned?
+        See note [Converged digest]
+    :param converged_digest: Digest of the last iteration that found the
+        group converged or None. If the digest of gathered data is same as
+        this, the servers cache is updated without deleted servers as a
+        converged iteration would.
+    :param get_config_value: config getter
+
+    :return: (executor, scaling group, group state, desired group state,
+        resources, digest) where digest is None if ``with_digest`` is False or
+        the group is not ACTIVE
     """
-    sg_eff = Effect(GetScalingGroupInfo(tenant_id=tenant_id,
-                                        group_id=group_id))
+    sg_eff = span('get-scaling-group-info',
+                  Effect(GetScalingGroupInfo(tenant_id=tenant_id,
+                                             group_id=group_id)),
+                  get_config_value)
 
     (scaling_group, manifest) = yield sg_eff
 
@@ -275,20 +490,31 @@ def convergence_exec_data(tenant_id, group_id, now, get_executor):
 
     executor = get_executor(launch_config)
 
-    resources = yield executor.gather(tenant_id, group_id, now)
-
-    if group_state.status == ScalingGroupStatus.DELETING:
-        desired_capacity = 0
-    else:
-        desired_capacity = group_state.desired
-        # See [Convergence servers cache] comment on top of the file.
-        yield executor.update_cache(scaling_group, now, **resources)
-
+    deleting = group_state.status == ScalingGroupStatus.DELETING
+    desired_capacity = 0 if deleting else group_state.desired
     desired_group_state = executor.get_desired_group_state(
         group_id, launch_config, desired_capacity)
 
+    resources = yield span(
+        'gather', executor.gather(tenant_id, group_id, now, snapshot,
+                                  desired_group_state),
+        get_config_value)
+
+    digest = None
+    if with_digest and group_state.status == ScalingGroupStatus.ACTIVE:
+        digest = executor.digest(desired_group_state, **resources)
+
+    if not deleting:
+        # See [Convergence servers cache] comment on top of the file.
+        converged = digest is not None and digest == converged_digest
+        yield span('update-cache',
+                   executor.update_cache(scaling_group, now,
+                                         include_deleted=not converged,
+                                         **resources),
+                   get_config_value)
+
     yield do_return((executor, scaling_group, group_state, desired_group_state,
-                     resources))
+                     resources, digest))
 
 
 def _clean_waiting(waiting, group_id):
@@ -296,10 +522,126 @@ def _clean_waiting(waiting, group_id):
         lambda group_iterations: group_iterations.discard(group_id))
 
 
+def _converged_digest(converged_digests, group_id):
+    """
+    Return Effect of the digest remembered for the group by
+    :func:`_remember_digest` or None if there isn't one.
+    """
+    if converged_digests is None:
+        return Effect(Constant(None))
+    return converged_digests.read().on(lambda digests: digests.get(group_id))
+
+
+def _remember_digest(converged_digests, group_id, digest, steps):
+    """
+    Remember ``digest`` of the group if there are no ``steps`` since that
+    means the group is converged and will remain so until something in the
+    digest changes. Otherwise, or if there is no digest (like when the group
+    is being deleted), forget the group's digest.
+
+    :param Reference converged_digests: pmap of group ID to digest or None
+        if the converged fast path is not configured
+    """
+    if converged_digests is None:
+        return Effect(Constant(None))
+    return converged_digests.modify(
+        lambda digests: (digests.set(group_id, digest)
+                         if digest is not None and len(steps) == 0
+                         else digests.discard(group_id)))
+
+
+def _remember_under_capacity(under_capacity, group_id, steps):
+    """
+    Remember that the group is under capacity if ``steps`` create servers or
+    stacks. Otherwise forget it. See note [Convergence priority].
+    """
+    if under_capacity is None:
+        return Effect(Constant(None))
+    creating = any(isinstance(step, (CreateServer, CreateStack))
+                   for step in steps)
+    return under_capacity.modify(
+        lambda groups: (groups.add(group_id) if creating
+                        else groups.discard(group_id)))
+
+
+@attr.s
+class Backoff(object):
+    """
+    Backoff of a group whose iterations only wait for something. See note
+    [Convergence backoff].
+
+    :ivar int version: Version of the divergent flag of the iterations
+    :ivar digest: Digest of the data gathered by the iterations
+    :ivar int count: Number of times the iteration was repeated with the same
+        version and digest
+    :ivar float time: EPOCH of the start of the last iteration
+    """
+    version = attr.ib()
+    digest = attr.ib()
+    count = attr.ib()
+    time = attr.ib()
+
+    def backing_off(self, version, now, interval, max_interval):
+        """
+        Should the group be left alone at EPOCH ``now`` if its divergent flag
+        has ``version``? The first iteration waits for ``interval`` seconds
+        and each repetition doubles it up to ``max_interval`` seconds.
+        """
+        delay = min(interval * 2 ** self.count, max_interval)
+        return version == self.version and now - self.time < delay
+
+
+def _remember_backoff(backoffs, group_id, version, digest, steps, now):
+    """
+    Remember the backoff of the group if ``steps`` only wait for something.
+    Otherwise forget it. See note [Convergence backoff].
+
+    :param Reference backoffs: pmap of group ID to :obj:`Backoff` or None to
+        not back off
+    :param int version: Version of the group's divergent flag
+    :param digest: Digest of gathered data or None if there isn't one
+    :param now: EPOCH of the start of the iteration
+    """
+    if backoffs is None:
+        return Effect(Constant(None))
+    waiting = (digest is not None and len(steps) > 0 and
+               all(isinstance(step, ConvergeLater) for step in steps))
+
+    def update(entries):
+        if not waiting:
+            return entries.discard(group_id)
+        old = entries.get(group_id)
+        repeated = (old is not None and old.version == version and
+                    old.digest == digest)
+        return entries.set(
+            group_id,
+            Backoff(version, digest, old.count + 1 if repeated else 0, now))
+
+    return backoffs.modify(update)
+
+
+def _forget_backoff(backoffs, group_id):
+    """
+    Forget the backoff of the group, if any. See note [Convergence backoff].
+
+    :param Reference backoffs: pmap of group ID to :obj:`Backoff`
+    """
+    return backoffs.modify(lambda entries: entries.discard(group_id))
+
+
+# `pmap` of group ID to the digest of the last iteration that found the group
+# converged. See note [Converged digest].
+CONVERGED_DIGESTS = Reference(pmap())
+
+
 @do
 def execute_convergence(tenant_id, group_id, build_timeout, waiting,
                         limited_retry_iterations, step_limits,
-                        get_executor=get_executor):
+                        snapshot=None, get_executor=get_executor,
+                        converged_digests=CONVERGED_DIGESTS,
+                        under_capacity=None, backoffs=None,
+                        dirty_version=None,
+                        get_config_value=config_value):
     """
     Gather data, plan a convergence, save active and pending servers to the
     group state, and then execute the convergence.
@@ -313,70 +655,136 @@ def execute_convergence(tenant_id, group_id, build_timeout, waiting,
         LIMITED_RETRY steps
     :param dict step_limits: Mapping of step class to number of executions
         allowed in a convergence cycle
+    :param snapshot: :obj:`GatherSnapshot` of the tenant to slice gathered
+        data from. If None, all the data is fetched for this group.
     :param callable get_executor: like :func`get_executor`, used for testing.
+    :param Reference converged_digests: pmap of group ID to digest of the
+        last iteration that found the group converged. Used only if
+        "converger.converged_fast_path" is configured.
+    :param Reference under_capacity: pset of IDs of groups under capacity,
+        updated with this group if given.
+    :param Reference backoffs: pmap of group ID to :obj:`Backoff`, updated
+        with this group if given. See note [Convergence backoff].
+    :param int dirty_version: Version of the group's divergent flag. Needed
+        if ``backoffs`` is given.
 
     :return: Effect of :obj:`ConvergenceIterationStatus`.
     :raise: :obj:`NoSuchScalingGroupError` if the group doesn't exist.
     """
     clean_waiting = _clean_waiting(waiting, group_id)
+    fast_path = bool(get_config_value('converger.converged_fast_path'))
+    if not fast_path:
+        converged_digests = None
 
     # Begin convergence by updating group status to ACTIVE
     yield msg("begin-convergence")
     try:
-        yield Effect(LoadAndUpdateGroupStatus(tenant_id, group_id,
-                                              ScalingGroupStatus.ACTIVE))
+        yield span('update-status',
+                   Effect(LoadAndUpdateGroupStatus(tenant_id, group_id,
+                                                   ScalingGroupStatus.ACTIVE)),
+                   get_config_value)
     except NoSuchScalingGroupError:
         # Expected for DELETING group. Ignore.
         pass
 
+    converged_digest = yield _converged_digest(converged_digests, group_id)
+
     # Gather data
     now_dt = yield Effect(Func(datetime.utcnow))
     try:
         all_data = yield msg_with_time(
             "gather-convergence-data",
             convergence_exec_data(tenant_id, group_id, now_dt,
-                                  get_executor=get_executor))
+                                  get_executor=get_executor,
+                                  snapshot=snapshot,
+                                  with_digest=(fast_path or
+                                               backoffs is not None),
+                                  converged_digest=converged_digest,
+                                  get_config_value=get_config_value))
         (executor, scaling_group, group_state, desired_group_state,
-         resources) = all_data
+         resources, digest) = all_data
+    except NoSuchScalingGroupError as e:
+        yield _remember_digest(converged_digests, group_id, None, [])
+        raise e
     except FirstError as fe:
         if fe.exc_info[0] is NoSuchEndpoint:
             result = yield convergence_failed(
-                tenant_id, group_id, [ErrorReason.Exception(fe.exc_info)])
+                tenant_id, group_id, [ErrorReason.Exception(fe.exc_info)],
+                get_config_value=get_config_value)
             yield do_return(result)
         raise fe
 
+    if digest is not None and digest == converged_digest:
+        yield msg('converge-digest-unchanged')
+        yield clean_waiting
+        yield do_return(ConvergenceIterationStatus.Stop())
+
     # prepare plan
-    steps = executor.plan(desired_group_state, datetime_to_epoch(now_dt),
-                          build_timeout, step_limits, **resources)
+    steps = yield _plan(
+        partial(executor.plan, desired_group_state, datetime_to_epoch(now_dt),
+                build_timeout, step_limits, **resources),
+        get_config_value)
     yield log_steps(steps)
+    yield _remember_under_capacity(under_capacity, group_id, steps)
+    yield _remember_backoff(backoffs, group_id, dirty_version, digest, steps,
+                            datetime_to_epoch(now_dt))
 
     # Execute plan
     yield msg('execute-convergence',
               steps=steps, now=now_dt, desired=desired_group_state,
               **resources)
-    worst_status, reasons = yield _execute_steps(steps)
+    worst_status, reasons = yield _execute_steps(steps, tenant_id,
+                                                 get_config_value)
 
     if worst_status != StepResult.LIMITED_RETRY:
         # If we're not waiting any more, there's no point in keeping track of
         # the group
         yield clean_waiting
 
-    # Handle the status from execution
+    result = yield _iteration_result(
+        tenant_id, group_id, worst_status, reasons, executor, scaling_group,
+        group_state, resources, waiting, limited_retry_iterations,
+        get_config_value)
+    yield _remember_digest(converged_digests, group_id, digest, steps)
+    yield do_return(result)
+
+
+def _plan(plan, get_config_value):
+    """
+    Return Effect of calling ``plan``, in a span if tracing is configured.
+    See note [Convergence tracing].
+    """
+    if get_config_value('converger.tracing'):
+        return span('plan', Effect(Func(plan)), get_config_value)
+    return Effect(Constant(plan()))
+
+
+@do
+def _iteration_result(tenant_id, group_id, worst_status, reasons, executor,
+                      scaling_group, group_state, resources, waiting,
+                      limited_retry_iterations, get_config_value):
+    """
+    Handle the worst status of executing the steps of an iteration of
+    :func:`execute_convergence`.
+
+    :return: Effect of :obj:`ConvergenceIterationStatus`
+    """
     if worst_status == StepResult.SUCCESS:
         result = yield convergence_succeeded(
-            executor, scaling_group, group_state, resources)
+            executor, scaling_group, group_state, resources, get_config_value)
     elif worst_status == StepResult.FAILURE:
-        result = yield convergence_failed(tenant_id, group_id, reasons)
+        result = yield convergence_failed(tenant_id, group_id, reasons,
+                                          get_config_value=get_config_value)
     elif worst_status is StepResult.LIMITED_RETRY:
         # We allow further iterations to proceed as long as we haven't been
         # waiting for a LIMITED_RETRY for N consecutive iterations.
         current_iterations = (yield waiting.read()).get(group_id, 0)
         if current_iterations > limited_retry_iterations:
             yield msg('converge-limited-retry-too-long')
-            yield clean_waiting
+            yield _clean_waiting(waiting, group_id)
             # Prefix "Timed out" to all limited retry reasons
             result = yield convergence_failed(tenant_id, group_id, reasons,
-                                              True)
+                                              True, get_config_value)
         else:
             yield waiting.modify(
                 lambda group_iterations:
@@ -392,30 +800,38 @@ def update_stacks_cache(scaling_group, now, stacks, include_deleted=True):
 
 
 @do
-def convergence_succeeded(executor, scaling_group, group_state, resources):
+def convergence_succeeded(executor, scaling_group, group_state, resources,
+                          get_config_value=config_value):
     """
     Handle convergence success
     """
     if group_state.status == ScalingGroupStatus.DELETING:
         # servers have been deleted. Delete the group for real
-        yield Effect(DeleteGroup(tenant_id=scaling_group.tenant_id,
-                                 group_id=scaling_group.uuid))
+        yield span('update-status',
+                   Effect(DeleteGroup(tenant_id=scaling_group.tenant_id,
+                                      group_id=scaling_group.uuid)),
+                   get_config_value)
         yield do_return(ConvergenceIterationStatus.GroupDeleted())
     elif group_state.status == ScalingGroupStatus.ERROR:
-        yield Effect(UpdateGroupStatus(scaling_group=scaling_group,
-                                       status=ScalingGroupStatus.ACTIVE))
+        yield span('update-status',
+                   Effect(UpdateGroupStatus(scaling_group=scaling_group,
+                                            status=ScalingGroupStatus.ACTIVE)),
+                   get_config_value)
         yield cf_msg('group-status-active',
                      status=ScalingGroupStatus.ACTIVE.name)
     # update servers cache with latest servers.
     # See [Convergence servers cache] comment on top of the file.
     now = yield Effect(Func(datetime.utcnow))
-    yield executor.update_cache(scaling_group, now, include_deleted=False,
-                                **resources)
+    yield span('update-cache',
+               executor.update_cache(scaling_group, now, include_deleted=False,
+                                     **resources),
+               get_config_value)
     yield do_return(ConvergenceIterationStatus.Stop())
 
 
 @do
-def convergence_failed(tenant_id, group_id, reasons, timedout=False):
+def convergence_failed(tenant_id, group_id, reasons, timedout=False,
+                       get_config_value=config_value):
     """
     Handle convergence failure
 
@@ -423,12 +839,15 @@ def convergence_failed(tenant_id, group_id, reasons, timedout=False):
     :param str group_id: Group ID
     :param reasons: List of :obj:`ErrorReason` objects
     :param bool timedout: Has convergence failed due to reason timing out?
+    :param get_config_value: config getter
 
     :return: convergence execution status
     :rtype: :obj:`ConvergenceIterationStatus`
     """
-    yield Effect(LoadAndUpdateGroupStatus(tenant_id, group_id,
-                                          ScalingGroupStatus.ERROR))
+    yield span('update-status',
+               Effect(LoadAndUpdateGroupStatus(tenant_id, group_id,
+                                               ScalingGroupStatus.ERROR)),
+               get_config_value)
     presented_reasons = sorted(present_reasons(reasons))
     if len(presented_reasons) == 0:
         presented_reasons = [u"Unknown error occurred"]
@@ -438,22 +857,57 @@ def convergence_failed(tenant_id, group_id, reasons, timedout=False):
     yield cf_err(
         'group-status-error', status=ScalingGroupStatus.ERROR.name,
         reasons=presented_reasons)
-    yield Effect(UpdateGroupErrorReasons(tenant_id, group_id,
-                                         presented_reasons))
+    yield span('update-status',
+               Effect(UpdateGroupErrorReasons(tenant_id, group_id,
+                                              presented_reasons)),
+               get_config_value)
     yield do_return(ConvergenceIterationStatus.Stop())
 
 
-def format_dirty_flag(tenant_id, group_id):
-    """Format a dirty flag ZooKeeper node name."""
-    return tenant_id + '_' + group_id
+def format_dirty_flag(tenant_id, group_id, bucket=None):
+    """
+    Format a dirty flag ZooKeeper node name relative to
+    ``CONVERGENCE_DIRTY_DIR``. It is in the directory of ``bucket`` if given.
+    See note [Sharded divergent flags].
+    """
+    flag = tenant_id + '_' + group_id
+    if bucket is None:
+        return flag
+    return '{}/{}'.format(bucket, flag)
 
 
 def parse_dirty_flag(flag):
     """Parse a dirty flag ZooKeeper node name into (tenant_id, group_id)."""
-    return flag.split('_', 1)
+    return flag.rsplit('/', 1)[-1].split('_', 1)
+
+
+def bucket_dirty_dir(bucket):
+    """
+    Path of the directory of ``bucket``'s dirty flags. See note [Sharded
+    divergent flags].
+    """
+    return '{}/{}'.format(CONVERGENCE_DIRTY_DIR, bucket)
+
 
+def dirty_flag_of(tenant_id, group_id, get_config_value=config_value):
+    """
+    Name of the group's dirty flag in the configured layout. See note
+    [Sharded divergent flags].
+    """
+    if not get_config_value('converger.sharded_dirty_flags'):
+        return format_dirty_flag(tenant_id, group_id)
+    num_buckets = get_config_value('converger.buckets') or 10
+    return format_dirty_flag(tenant_id, group_id,
+                             bucket_of_tenant(tenant_id, num_buckets))
+
+
+# Reasons for marking a group divergent. See note [Convergence priority].
+DIVERGENT_POLICY = 'policy'
+DIVERGENT_DIRTY = 'dirty'
+DIVERGENT_SELFHEAL = 'selfheal'
 
-def mark_divergent(tenant_id, group_id):
+
+def mark_divergent(tenant_id, group_id, reason=DIVERGENT_DIRTY):
     """
     Indicate that a group should be converged.
 
@@ -462,27 +916,80 @@ def mark_divergent(tenant_id, group_id):
 
     :param tenant_id: tenant ID that owns the group.
     :param group_id: ID of the group to converge.
+    :param str reason: One of ``DIVERGENT_*`` reasons the group is divergent.
+        It is stored as content of the flag.
 
     :return: an Effect which succeeds when the information has been
         recorded.
     """
     # See note [Divergent flags]
-    flag = format_dirty_flag(tenant_id, group_id)
+    flag = dirty_flag_of(tenant_id, group_id)
     path = CONVERGENCE_DIRTY_DIR + '/' + flag
-    eff = Effect(CreateOrSet(path=path, content='dirty'))
+    eff = Effect(CreateOrSet(path=path, content=reason))
     return eff
 
 
+MARK_DIVERGENT_CHUNK_SIZE = 100
+"""Maximum number of divergent flags written in one ZooKeeper transaction"""
+
+
+def mark_divergent_many(groups, reason=DIVERGENT_DIRTY,
+                        chunk_size=MARK_DIVERGENT_CHUNK_SIZE):
+    """
+    Indicate that many groups should be converged, like :func:`mark_divergent`
+    does for one group. See note [Bulk divergent flags].
+
+    :param groups: ``list`` of (tenant ID, group ID) tuples
+    :param str reason: See :func:`mark_divergent`
+    :param int chunk_size: Maximum number of flags written in a transaction
+
+    :return: Effect of ``list`` of paths of the flags
+    """
+    paths = list(unique(
+        CONVERGENCE_DIRTY_DIR + '/' + dirty_flag_of(tenant_id, group_id)
+        for tenant_id, group_id in groups))
+    return parallel(
+        [_write_divergent_flags(paths[i:i + chunk_size], reason)
+         for i in range(0, len(paths), chunk_size)]).on(lambda _: paths)
+
+
+def _write_divergent_flags(paths, reason):
+    """
+    Create divergent flags at ``paths`` in a transaction. If it fails, write
+    the flags whose creation failed one at a time and try the others again.
+    """
+    def retry_failed(exc_info):
+        results = exc_info[1].results
+        failed = [path for path, result in zip(paths, results)
+                  if not isinstance(result, RolledBackError)]
+        rolled_back = [path for path, result in zip(paths, results)
+                       if isinstance(result, RolledBackError)]
+        return msg('mark-dirty-transaction-failed',
+                   num_flags=len(paths), num_failed=len(failed)).on(
+            lambda _: parallel(
+                [Effect(CreateOrSet(path=path, content=reason))
+                 for path in failed] +
+                ([_write_divergent_flags(rolled_back, reason)]
+                 if rolled_back else [])))
+
+    return Effect(Transaction([CreateNode(path, reason)
+                               for path in paths])).on(
+        error=catch(TransactionFailed, retry_failed))
+
+
 @do
-def delete_divergent_flag(tenant_id, group_id, version):
+def delete_divergent_flag(tenant_id, group_id, version, path=None):
     """
     Delete the dirty flag, if its version hasn't changed. See note [Divergent
     flags] for more info.
 
+    :param str path: Path of the dirty flag. Defaults to where
+        :func:`mark_divergent` creates it.
+
     :return: Effect of None.
     """
-    flag = format_dirty_flag(tenant_id, group_id)
-    path = CONVERGENCE_DIRTY_DIR + '/' + flag
+    if path is None:
+        path = CONVERGENCE_DIRTY_DIR + '/' + dirty_flag_of(tenant_id, group_id)
     fields = dict(path=path, dirty_version=version)
     try:
         yield Effect(DeleteNode(path=path, version=version))
@@ -508,15 +1015,31 @@ def log_and_raise(msg, exc_info):
     return eff.on(lambda _: six.reraise(*exc_info))
 
 
-def trigger_convergence(tenant_id, group_id):
+def trigger_convergence(tenant_id, group_id, reason=DIVERGENT_DIRTY):
     """
     Trigger convergence on a scaling group
+
+    :param str reason: See :func:`mark_divergent`
     """
-    eff = mark_divergent(tenant_id, group_id)
+    eff = mark_divergent(tenant_id, group_id, reason)
     return eff.on(success=lambda _: msg("mark-dirty-success"),
                   error=log_and_raise("mark-dirty-failure"))
 
 
+def trigger_convergence_many(groups, reason=DIVERGENT_DIRTY):
+    """
+    Trigger convergence on many scaling groups
+
+    :param groups: ``list`` of (tenant ID, group ID) tuples
+    :param str reason: See :func:`mark_divergent`
+    """
+    eff = mark_divergent_many(groups, reason)
+    return eff.on(
+        success=lambda _: msg("mark-dirty-many-success",
+                              num_groups=len(groups)),
+        error=log_and_raise("mark-dirty-many-failure"))
+
+
 class ConcurrentError(Exception):
     """Tried to run an effect concurrently when it shouldn't be."""
 
@@ -559,17 +1082,17 @@ def get_my_divergent_groups(my_buckets, all_buckets, divergent_flags):
         ``group_id``, and ``dirty-flag`` keys.
     """
     def structure_info(path):
-        # Names of the dirty flags are {tenant_id}_{group_id}.
+        # Names of the dirty flags are {tenant_id}_{group_id}, optionally in
+        # a {bucket}/ directory.
         tenant, group = parse_dirty_flag(path)
         return {'tenant_id': tenant,
                 'group_id': group,
                 'dirty-flag': CONVERGENCE_DIRTY_DIR + '/' + path}
 
-    dirty_info = map(structure_info, divergent_flags)
     num_buckets = len(all_buckets)
     converging = [
-        info for info in dirty_info
-        if bucket_of_tenant(info['tenant_id'], num_buckets) in my_buckets]
+        structure_info(flag) for flag in divergent_flags
+        if bucket_of_flag(flag, num_buckets) in my_buckets]
     return converging
 
 
@@ -583,6 +1106,9 @@ def eff_finally(eff, after_eff):
 def converge_one_group(currently_converging, recently_converged, waiting,
                        tenant_id, group_id, version,
                        build_timeout, limited_retry_iterations, step_limits,
+                       snapshot=None, under_capacity=None, dirty_flag=None,
+                       backoffs=None, claimed=False,
+                       get_config_value=config_value,
                        execute_convergence=execute_convergence):
     """
     Converge one group, non-concurrently, and clean up the dirty flag when
@@ -600,6 +1126,17 @@ def converge_one_group(currently_converging, recently_converged, waiting,
         LIMITED_RETRY steps
     :param dict step_limits: Mapping of step class to number of executions
         allowed in a convergence cycle
+    :param snapshot: :obj:`GatherSnapshot` of the tenant or None
+    :param Reference under_capacity: pset of IDs of groups under capacity or
+        None to not track them
+    :param str dirty_flag: Path of the group's dirty flag. Defaults to where
+        :func:`mark_divergent` creates it.
+    :param Reference backoffs: pmap of group ID to :obj:`Backoff` or None to
+        not back off
+    :param bool claimed: Was the group already added to
+        ``currently_converging`` by the caller? It is then removed from it
+        when done. See note [Convergence priority].
+    :param get_config_value: config getter
     :param callable execute_convergence: like :func`execute_convergence`, to
         be used for test injection only
     """
@@ -607,12 +1144,18 @@ def converge_one_group(currently_converging, recently_converged, waiting,
         lambda time_done: recently_converged.modify(
             lambda rcg: rcg.set(group_id, time_done)))
     cvg = eff_finally(
-        execute_convergence(tenant_id, group_id, build_timeout, waiting,
-                            limited_retry_iterations, step_limits),
+        span('iteration',
+             execute_convergence(tenant_id, group_id, build_timeout, waiting,
+                                 limited_retry_iterations, step_limits,
+                                 snapshot=snapshot,
+                                 under_capacity=under_capacity,
+                                 backoffs=backoffs, dirty_version=version),
+             get_config_value),
         mark_recently_converged)
 
     try:
-        result = yield non_concurrently(currently_converging, group_id, cvg)
+        result = yield _converging(currently_converging, group_id, cvg,
+                                   claimed)
     except ConcurrentError:
         # We don't need to spam the logs about this, it's to be expected
         return
@@ -620,7 +1163,9 @@ def converge_one_group(currently_converging, recently_converged, waiting,
         # NoSuchEndpoint occurs on a suspended or closed account
         yield err(None, 'converge-fatal-error')
         yield _clean_waiting(waiting, group_id)
-        yield delete_divergent_flag(tenant_id, group_id, version)
+        yield delete_divergent_flag(tenant_id, group_id, version, dirty_flag)
+        if backoffs is not None:
+            yield _forget_backoff(backoffs, group_id)
         return
     except Exception:
         # We specifically don't clean up the dirty flag in the case of
@@ -633,13 +1178,30 @@ def converge_one_group(currently_converging, recently_converged, waiting,
                 return Effect(Constant(None))
 
             def Stop():
-                return delete_divergent_flag(tenant_id, group_id, version)
+                return delete_divergent_flag(tenant_id, group_id, version,
+                                             dirty_flag)
 
             def GroupDeleted():
                 # Delete the divergent flag to avoid any queued-up convergences
                 # that will imminently fail.
-                return delete_divergent_flag(tenant_id, group_id, -1)
+                return delete_divergent_flag(tenant_id, group_id, -1,
+                                             dirty_flag)
         yield clean_up(result)
+        if (backoffs is not None and
+                result != ConvergenceIterationStatus.Continue()):
+            yield _forget_backoff(backoffs, group_id)
+
+
+def _converging(currently_converging, group_id, eff, claimed):
+    """
+    Perform ``eff`` with ``group_id`` in ``currently_converging``, like
+    :func:`non_concurrently` does unless the group was ``claimed`` by adding
+    it before. It is removed when ``eff`` is done in both cases.
+    """
+    if not claimed:
+        return non_concurrently(currently_converging, group_id, eff)
+    return eff_finally(
+        eff, currently_converging.modify(lambda cc: cc.discard(group_id)))
 
 
 @do
@@ -648,6 +1210,8 @@ def converge_all_groups(
         my_buckets, all_buckets,
         divergent_flags, build_timeout, interval,
         limited_retry_iterations, step_limits,
+        slots=None, under_capacity=None,
+        backoffs=None, max_backoff_interval=None,
         converge_one_group=converge_one_group):
     """
     Check for groups that need convergence and which match up to the
@@ -672,6 +1236,15 @@ def converge_all_groups(
         LIMITED_RETRY steps
     :param dict step_limits: Mapping of step class to number of executions
         allowed in a convergence cycle
+    :param slots: :obj:`PrioritySemaphore` of the node's group slots to
+        converge the groups in order of priority holding them, or None to
+        converge all of them at once. See note [Convergence priority].
+    :param Reference under_capacity: pset of IDs of groups under capacity or
+        None to not track them
+    :param Reference backoffs: pmap of group ID to :obj:`Backoff` or None to
+        not back off. See note [Convergence backoff].
+    :param number max_backoff_interval: Maximum number of seconds a group is
+        backed off for. Needed if ``backoffs`` is given.
     :param callable converge_one_group: function to use to converge a single
         group - to be used for test injection only
     """
@@ -685,39 +1258,243 @@ def converge_all_groups(
     yield msg('converge-all-groups', group_infos=group_infos,
               currently_converging=list(cc))
 
+    def converge(info, snapshot=None, claimed=False):
+        tenant_id, group_id = info['tenant_id'], info['group_id']
+        kwargs = {'claimed': True} if claimed else {}
+        eff = converge_one_group(currently_converging, recently_converged,
+                                 waiting,
+                                 tenant_id, group_id,
+                                 info['version'], build_timeout,
+                                 limited_retry_iterations, step_limits,
+                                 snapshot=snapshot,
+                                 under_capacity=under_capacity,
+                                 dirty_flag=info['dirty-flag'],
+                                 backoffs=backoffs, **kwargs)
+        return with_log(Effect(TenantScope(eff, tenant_id)),
+                        tenant_id=tenant_id, scaling_group_id=group_id)
+
     @do
-    def converge(tenant_id, group_id, dirty_flag):
-        stat = yield Effect(GetStat(dirty_flag))
+    def converge_tenant(tenant_id, infos, limit=None, claimed=False):
+        if not claimed:
+            # Groups could have started converging while gathering data
+            cc = yield currently_converging.read()
+            infos = [info for info in infos if info['group_id'] not in cc]
+        snapshot = yield _gather_tenant_snapshot(
+            tenant_id, [info['group_id'] for info in infos])
+        results = yield bounded_parallel(
+            [converge(info, snapshot, claimed) for info in infos], limit)
+        yield do_return(results)
+
+    recent_groups = yield get_recently_converged_groups(recently_converged,
+                                                        interval)
+    # Don't converge a group if it has recently been converged.
+    group_infos = [info for info in group_infos
+                   if info['group_id'] not in recent_groups]
+    group_infos = yield _with_flag_data(group_infos, backoffs)
+    if backoffs is not None:
+        group_infos = yield _filter_backing_off(
+            group_infos, backoffs, interval, max_backoff_interval)
+    tenant_infos = _infos_by_tenant(group_infos)
+    if slots is None:
+        effs = [converge_tenant(tenant_id, infos)
+                for tenant_id, infos in tenant_infos]
+    else:
+        tenant_infos = yield _prioritize_tenants(tenant_infos, under_capacity)
+        tenant_infos = yield _claim_groups(currently_converging, tenant_infos)
+        effs = [
+            slots.run(
+                converge_tenant(tenant_id, infos,
+                                min(len(infos), slots.limit), claimed=True),
+                len(infos), priority)
+            for priority, (tenant_id, infos) in enumerate(tenant_infos)]
+    yield do_return(parallel(effs).on(compose(list, concat)))
+
+
+@do
+def _claim_groups(currently_converging, tenant_infos):
+    """
+    Add groups that are not converging yet to ``currently_converging`` when
+    queueing them for group slots. See note [Convergence priority].
+
+    :param Reference currently_converging: pset of currently converging groups
+    :param tenant_infos: ``list`` of (tenant ID, ``list`` of group info dicts)
+
+    :return: Effect of ``tenant_infos`` with only the groups that were added.
+        Tenants left without groups are left out.
+    """
+    # Groups could have started converging while getting their flags
+    cc = yield currently_converging.read()
+    claimed = []
+    for tenant_id, infos in tenant_infos:
+        infos = [info for info in infos if info['group_id'] not in cc]
+        if infos:
+            claimed.append((tenant_id, infos))
+    yield currently_converging.modify(lambda cc: cc.union(
+        info['group_id'] for _, infos in claimed for info in infos))
+    yield do_return(claimed)
+
+
+@do
+def _with_flag_data(group_infos, backoffs=None):
+    """
+    Get versions and contents of the divergent flags of groups.
+
+    :param group_infos: ``list`` of group info dicts
+    :param Reference backoffs: pmap of group ID to :obj:`Backoff` from which
+        the groups whose flag is gone are removed, or None
+
+    :return: Effect of ``list`` of group info dicts with the version of the
+        flag in ``version`` key and its content (the reason it was marked
+        divergent) in ``reason`` key. Groups whose flag is gone are left out.
+    """
+    flags = yield parallel(
+        [Effect(GetData(info['dirty-flag'])) for info in group_infos])
+    infos = []
+    for info, flag in zip(group_infos, flags):
         # If the node disappeared, ignore it. `stat` will be None here if the
         # divergent flag was discovered only after the group is removed from
         # currently_converging, but before the divergent flag is deleted, and
-        # then the deletion happens, and then our GetStat happens. This
+        # then the deletion happens, and then our GetData happens. This
         # basically means it happens when one convergence is starting as
         # another one for the same group is ending.
-        if stat is None:
-            yield msg('converge-divergent-flag-disappeared', znode=dirty_flag)
+        if flag is None:
+            yield msg('converge-divergent-flag-disappeared',
+                      znode=info['dirty-flag'])
+            if backoffs is not None:
+                yield _forget_backoff(backoffs, info['group_id'])
         else:
-            eff = converge_one_group(currently_converging, recently_converged,
-                                     waiting,
-                                     tenant_id, group_id,
-                                     stat.version, build_timeout,
-                                     limited_retry_iterations, step_limits)
-            result = yield Effect(TenantScope(eff, tenant_id))
-            yield do_return(result)
+            reason, stat = flag
+            infos.append(merge(info, {'version': stat.version,
+                                      'reason': reason}))
+    yield do_return(infos)
 
-    recent_groups = yield get_recently_converged_groups(recently_converged,
-                                                        interval)
-    effs = []
-    for info in group_infos:
-        tenant_id, group_id = info['tenant_id'], info['group_id']
-        if group_id in recent_groups:
-            # Don't converge a group if it has recently been converged.
-            continue
-        eff = converge(tenant_id, group_id, info['dirty-flag'])
-        effs.append(
-            with_log(eff, tenant_id=tenant_id, scaling_group_id=group_id))
 
-    yield do_return(parallel(effs))
+@do
+def _gather_tenant_snapshot(tenant_id, group_ids):
+    """
+    Gather :obj:`GatherSnapshot` of the tenant for its ``launch_server``
+    groups about to be converged. See note [Tenant gather snapshot].
+
+    :param str tenant_id: ID of the tenant
+    :param list group_ids: IDs of the tenant's groups about to be converged
+
+    :return: Effect of :obj:`GatherSnapshot` or None if there aren't enough
+        ``launch_server`` groups to share it or gathering it failed
+    """
+    if len(group_ids) < 2:
+        yield do_return(None)
+    # A group whose launch config can't be read will fail its iteration
+    # anyway and gathers its own data since the snapshot doesn't cover it
+    configs = yield parallel(
+        [Effect(GetLaunchConfig(tenant_id, group_id)).on(
+            error=lambda _: None)
+         for group_id in group_ids])
+    launch_server = [
+        (group_id, config) for group_id, config in zip(group_ids, configs)
+        if config is not None and config.get('type') == 'launch_server']
+    if len(launch_server) < 2:
+        yield do_return(None)
+    desired_lbs = pset(concat(
+        json_to_LBConfigs(freeze(config['args'].get('loadBalancers', [])))
+        for _, config in launch_server))
+    try:
+        snapshot = yield Effect(TenantScope(
+            get_tenant_gather_snapshot(
+                tenant_id, desired_lbs,
+                [group_id for group_id, _ in launch_server]),
+            tenant_id))
+    except Exception:
+        # Let each group gather its own data and deal with the error
+        yield err(None, 'converge-tenant-snapshot-error',
+                  tenant_id=tenant_id)
+        snapshot = None
+    yield do_return(snapshot)
+
+
+@do
+def _filter_backing_off(group_infos, backoffs, interval, max_interval):
+    """
+    Filter out groups that are backing off. See note [Convergence backoff].
+
+    :param group_infos: ``list`` of group info dicts with the version of
+        their divergent flag in ``version`` key
+    :param Reference backoffs: pmap of group ID to :obj:`Backoff`
+
+    :return: Effect of ``list`` of group info dicts to converge
+    """
+    entries = yield backoffs.read()
+    infos = [info for info in group_infos if info['group_id'] in entries]
+    if not infos:
+        yield do_return(group_infos)
+    now = yield Effect(Func(time.time))
+    backing_off = set(
+        info['group_id'] for info in infos
+        if entries[info['group_id']].backing_off(
+            info['version'], now, interval, max_interval))
+    if backing_off:
+        yield msg('converge-backing-off', group_ids=sorted(backing_off))
+    yield do_return([info for info in group_infos
+                     if info['group_id'] not in backing_off])
+
+
+def divergent_priority(reason, under_capacity):
+    """
+    Priority of converging a group. Lower is more important. See note
+    [Convergence priority].
+
+    :param reason: Content of the group's divergent flag
+    :param bool under_capacity: Is the group under capacity?
+    """
+    if reason == DIVERGENT_POLICY:
+        return 0
+    elif under_capacity:
+        return 1
+    elif reason == DIVERGENT_SELFHEAL:
+        return 3
+    return 2
+
+
+@do
+def _prioritize_tenants(tenant_infos, under_capacity):
+    """
+    Sort groups of each tenant and the tenants by priority of their groups,
+    keeping the given order on ties. A tenant's priority is that of its most
+    important group.
+
+    :param tenant_infos: ``list`` of (tenant ID, ``list`` of group info dicts
+        with ``reason`` key as returned by :func:`_with_flag_data`)
+    :param Reference under_capacity: pset of IDs of groups under capacity or
+        None
+
+    :return: Effect of sorted ``tenant_infos``
+    """
+    under = pset()
+    if under_capacity is not None:
+        under = yield under_capacity.read()
+
+    def priority(info):
+        return divergent_priority(info['reason'], info['group_id'] in under)
+
+    tenant_infos = [(tenant_id, sorted(infos, key=priority))
+                    for tenant_id, infos in tenant_infos]
+    yield do_return(
+        sorted(tenant_infos, key=lambda (_, infos): priority(infos[0])))
+
+
+def _infos_by_tenant(group_infos):
+    """
+    Group divergent group infos on tenant ID, keeping tenants in the order they
+    first appear in.
+
+    :return: ``list`` of (tenant ID, ``list`` of group info dicts) tuples
+    """
+    tenants = []
+    tenant_infos = {}
+    for info in group_infos:
+        if info['tenant_id'] not in tenant_infos:
+            tenants.append(info['tenant_id'])
+        tenant_infos.setdefault(info['tenant_id'], []).append(info)
+    return [(tenant_id, tenant_infos[tenant_id]) for tenant_id in tenants]
 
 
 @do
@@ -742,14 +1519,134 @@ def _stable_hash(s):
     return int(sha1(s).hexdigest(), 16)
 
 
-def bucket_of_tenant(tenant, num_buckets):
+def jump_hash(key, num_buckets):
+    """
+    Map ``key`` to a bucket using jump consistent hash of Lamping and Veach
+    (https://arxiv.org/abs/1406.2294). When the number of buckets grows from
+    N to N + 1, only 1 / (N + 1) of the keys move and they all move to the
+    new bucket.
+
+    :param int key: 64 bit integer key. Only its lower 64 bits are used.
+    :param int num_buckets: Number of buckets
+    :return: bucket in ``range(num_buckets)``
     """
-    Return the bucket associated with the given tenant.
+    key &= 0xffffffffffffffff
+    bucket, jump = -1, 0
+    while jump < num_buckets:
+        bucket = jump
+        key = (key * 2862933555777941757 + 1) & 0xffffffffffffffff
+        jump = int((bucket + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return bucket
+
+
+TENANT_BUCKETS_CACHE = LRUCache(100000)
+"""
+:obj:`LRUCache` of (tenant ID, number of buckets, jump hash?) -> bucket used
+by :func:`bucket_of_tenant`
+"""
+
+
+def bucket_of_tenant(tenant, num_buckets, cache=TENANT_BUCKETS_CACHE,
+                     get_config_value=config_value):
+    """
+    Return the bucket associated with the given tenant. If
+    "converger.jump_hash" is configured, the tenants are consistently hashed
+    with :func:`jump_hash` so that changing ``num_buckets`` moves as few
+    tenants as possible to different buckets. Otherwise the bucket is the
+    tenant's hash modulo ``num_buckets``. Since this decides which node
+    converges a tenant, the config must be changed on all the nodes together.
 
     :param str tenant: tenant ID
+    :param int num_buckets: global number of buckets
+    :param cache: :obj:`LRUCache` to remember buckets of tenants in
+    :param callable get_config_value: config key -> config value
+    """
+    jump = bool(get_config_value('converger.jump_hash'))
+    key = (tenant, num_buckets, jump)
+    bucket = cache.get(key)
+    if bucket is None:
+        hashed = _stable_hash(tenant)
+        bucket = (jump_hash(hashed, num_buckets) if jump
+                  else hashed % num_buckets)
+        cache.set(key, bucket)
+    return bucket
+
+
+def bucket_of_flag(flag, num_buckets):
+    """
+    Return the bucket of a dirty flag named like :func:`format_dirty_flag`.
+    A flag in a bucket's directory belongs to that bucket.
+    """
+    if '/' in flag:
+        return int(flag.split('/', 1)[0])
+    return bucket_of_tenant(parse_dirty_flag(flag)[0], num_buckets)
+
+
+class DivergentFlags(object):
+    """
+    Divergent flags last seen in ZooKeeper indexed by the bucket of their
+    tenant. Only the tenants of newly seen flags are hashed on update.
+
     :param int num_buckets: global number of buckets
     """
-    return _stable_hash(tenant) % num_buckets
+
+    def __init__(self, num_buckets):
+        self.num_buckets = num_buckets
+        self._buckets = {}  # {flag: bucket}
+        self._flags = {}  # {bucket: set of flags}
+
+    def _replace(self, old, flags, bucket_of):
+        """
+        Replace the flags ``old`` with ``flags``, indexing new flags in the
+        bucket returned by ``bucket_of``.
+        """
+        current = set(flags)
+        for flag in [f for f in old if f not in current]:
+            self._flags[self._buckets.pop(flag)].discard(flag)
+        added = [flag for flag in flags if flag not in self._buckets]
+        for flag in added:
+            bucket = bucket_of(flag)
+            self._buckets[flag] = bucket
+            self._flags.setdefault(bucket, set()).add(flag)
+        return added
+
+    def update(self, flags):
+        """
+        Replace the flags in the flat layout with ``flags``. Names that are not
+        flags, like directories of buckets in the sharded layout, are ignored.
+        See note [Sharded divergent flags].
+
+        :return: ``list`` of flags in ``flags`` that were not seen before,
+            in the given order
+        """
+        return self._replace(
+            [f for f in self._buckets if '/' not in f],
+            [f for f in flags if not f.isdigit()],
+            lambda flag: bucket_of_tenant(parse_dirty_flag(flag)[0],
+                                          self.num_buckets))
+
+    def update_bucket(self, bucket, children):
+        """
+        Replace the flags in the directory of ``bucket`` in the sharded layout
+        with ``children`` of the directory.
+
+        :return: ``list`` of new flags named like :func:`format_dirty_flag`,
+            in the given order
+        """
+        prefix = '{}/'.format(bucket)
+        return self._replace(
+            [f for f in self._flags.get(bucket, ()) if f.startswith(prefix)],
+            [prefix + child for child in children],
+            lambda flag: bucket)
+
+    def bucket_of(self, flag):
+        """Return the bucket of a flag that was seen in the last update"""
+        return self._buckets[flag]
+
+    def in_buckets(self, buckets):
+        """Return sorted ``list`` of flags in the given buckets"""
+        return sorted(
+            concat(self._flags.get(bucket, ()) for bucket in buckets))
 
 
 class Converger(MultiService):
@@ -772,7 +1669,9 @@ class Converger(MultiService):
     def __init__(self, log, dispatcher, num_buckets, partitioner_factory,
                  build_timeout, interval,
                  limited_retry_iterations, step_limits,
-                 converge_all_groups=converge_all_groups):
+                 converge_all_groups=converge_all_groups,
+                 publish_costs_interval=None, max_concurrent_groups=None,
+                 watch_children=None, max_backoff_interval=None):
         """
         :param log: a bound log
         :param dispatcher: The dispatcher to use to perform effects.
@@ -792,6 +1691,20 @@ class Converger(MultiService):
             LIMITED_RETRY steps
         :param dict step_limits: Mapping of step name to number of executions
             allowed in a convergence cycle
+        :param number publish_costs_interval: If given, the time taken to
+            converge groups of each bucket is measured and its average is
+            published to the partitioner every this many seconds. The
+            partitioner must then be a :obj:`WeightedPartitioner`.
+        :param int max_concurrent_groups: If given, at most this many groups
+            are converged at a time in order of priority. See note
+            [Convergence priority].
+        :param callable watch_children: If given, dirty flags in the
+            directories of our buckets are watched with it. It is called with
+            path and callback, like txkazoo's ``watch_children`` partialed
+            with a client. See note [Sharded divergent flags].
+        :param number max_backoff_interval: If given, groups that keep
+            waiting on the same steps are converged exponentially less often
+            up to every this many seconds. See note [Convergence backoff].
         """
         MultiService.__init__(self)
         self.log = log.bind(otter_service='converger')
@@ -808,18 +1721,92 @@ class Converger(MultiService):
         self.step_limits = get_step_limits_from_conf(step_limits)
 
         # ephemeral mutable state
+        self.divergent_flags = DivergentFlags(num_buckets)
         self.currently_converging = Reference(pset())
         self.recently_converged = Reference(pmap())
         # Groups we're waiting on temporarily, and may give up on.
         self.waiting = Reference(pmap())  # {group_id: num_iterations_waited}
+        # Seconds spent converging groups of each bucket since costs were
+        # last published
+        self.bucket_costs = Reference(pmap())  # {bucket: seconds}
+        self.average_costs = {}  # {bucket: average seconds per second}
+        # Groups whose last iteration planned to create servers
+        self.under_capacity = Reference(pset())
+        self.max_concurrent_groups = max_concurrent_groups
+        # Group slots shared by all cycles of this node
+        self.group_slots = (None if max_concurrent_groups is None
+                            else PrioritySemaphore(max_concurrent_groups))
+        self._watch_children = watch_children
+        # Buckets whose directories are watched
+        self._watched_buckets = {}  # {bucket: token of the watch}
+        self.max_backoff_interval = max_backoff_interval
+        self.backoffs = Reference(pmap())  # {group_id: Backoff}
+
+        self.publish_costs_interval = publish_costs_interval
+        if publish_costs_interval is not None:
+            timer = TimerService(publish_costs_interval, self.publish_costs)
+            timer.setServiceParent(self)
+
+    def _timed_converge_one_group(self, currently_converging,
+                                  recently_converged, waiting, tenant_id,
+                                  *args, **kwargs):
+        """
+        Call :func:`converge_one_group` and add the time it took to the cost
+        of the tenant's bucket
+        """
+        bucket = bucket_of_tenant(tenant_id, len(self._buckets))
+
+        def add_cost(start, end):
+            return self.bucket_costs.modify(
+                lambda costs: costs.set(bucket,
+                                        costs.get(bucket, 0) + end - start))
+
+        return Effect(Func(time.time)).on(
+            lambda start: eff_finally(
+                converge_one_group(currently_converging, recently_converged,
+                                   waiting, tenant_id, *args, **kwargs),
+                Effect(Func(time.time)).on(partial(add_cost, start))))
+
+    def publish_costs(self):
+        """
+        Publish average cost of converging groups of each of our buckets
+        since the last time. The averages are exponentially weighted.
+
+        :return: Deferred fired when published or None if buckets have not
+            been acquired
+        """
+        costs = sync_perform(
+            self._dispatcher,
+            self.bucket_costs.read().on(
+                lambda costs: self.bucket_costs.modify(
+                    lambda _: pmap()).on(lambda _: costs)))
+        if self.partitioner.get_current_state() != PartitionState.ACQUIRED:
+            return
+        self.average_costs = {
+            bucket: (self.average_costs.get(bucket, 0) +
+                     costs.get(bucket, 0) /
+                     float(self.publish_costs_interval)) / 2
+            for bucket in self.partitioner.get_current_buckets()}
+        return self.partitioner.publish_costs(self.average_costs).addErrback(
+            self.log.err, 'publish-costs-error')
 
     def _converge_all(self, my_buckets, divergent_flags):
         """Run :func:`converge_all_groups` and log errors."""
+        kwargs = {}
+        if self.publish_costs_interval is not None:
+            kwargs['converge_one_group'] = self._timed_converge_one_group
+        if self.group_slots is not None:
+            kwargs['slots'] = self.group_slots
+            kwargs['under_capacity'] = self.under_capacity
+        if self.max_backoff_interval is not None:
+            kwargs['backoffs'] = self.backoffs
+            kwargs['max_backoff_interval'] = self.max_backoff_interval
         eff = self._converge_all_groups(
             self.currently_converging, self.recently_converged,
             self.waiting,
             my_buckets, self._buckets, divergent_flags, self.build_timeout,
-            self.interval, self.limited_retry_iterations, self.step_limits)
+            self.interval, self.limited_retry_iterations, self.step_limits,
+            **kwargs)
         return eff.on(
             error=lambda e: err(
                 exc_info_to_failure(e), 'converge-all-groups-error'))
@@ -832,13 +1819,50 @@ class Converger(MultiService):
             lambda uid: with_log(eff, otter_service='converger',
                                  converger_run_id=uid))
 
+    def _watch_bucket(self, bucket):
+        """
+        Create the directory of ``bucket``'s dirty flags if needed and watch
+        its children with :meth:`bucket_divergent_changed`
+        """
+        path = bucket_dirty_dir(bucket)
+        token = object()
+
+        def watch(_):
+            self._watched_buckets[bucket] = token
+            self._watch_children(
+                path, partial(self.bucket_divergent_changed, bucket, token))
+
+        return Effect(CreateNode(path)).on(
+            error=catch(NodeExistsError, lambda _: None)).on(watch)
+
+    def _watch_buckets(self, my_buckets):
+        """
+        Watch directories of ``my_buckets`` that are not watched yet and
+        forget the flags of buckets that are not ours anymore. Their watches
+        stop when they are next called. See note [Sharded divergent flags].
+        """
+        for bucket in set(self._watched_buckets) - set(my_buckets):
+            del self._watched_buckets[bucket]
+            self.divergent_flags.update_bucket(bucket, [])
+        eff = parallel([self._watch_bucket(bucket) for bucket in my_buckets
+                        if bucket not in self._watched_buckets])
+        return eff.on(
+            error=lambda e: err(
+                exc_info_to_failure(e), 'watch-dirty-buckets-error'))
+
     def buckets_acquired(self, my_buckets):
         """
-        Get dirty flags from zookeeper and run convergence with them.
+        Get dirty flags from zookeeper and run convergence with the ones in
+        our buckets.
 
         This is used as the partitioner callback.
         """
         ceff = Effect(GetChildren(CONVERGENCE_DIRTY_DIR)).on(
+            self.divergent_flags.update)
+        if self._watch_children is not None:
+            ceff = ceff.on(lambda _: self._watch_buckets(my_buckets))
+        ceff = ceff.on(
+            lambda _: self.divergent_flags.in_buckets(my_buckets)).on(
             partial(self._converge_all, my_buckets))
         # Return deferred as 1-element tuple for testing only.
         # Returning deferred would block otter from shutting down until
@@ -849,19 +1873,41 @@ class Converger(MultiService):
     def divergent_changed(self, children):
         """
         ZooKeeper children-watch callback that lets this service know when the
-        divergent groups have changed. If any of the divergent flags are for
-        tenants associated with this service's buckets, a convergence will be
-        triggered.
+        divergent groups have changed. If any of the newly added divergent
+        flags are for tenants associated with this service's buckets, those
+        groups are converged. The rest are picked up when the partitioner
+        next calls :meth:`buckets_acquired`.
+        """
+        added = self.divergent_flags.update(children)
+        if self.partitioner.get_current_state() != PartitionState.ACQUIRED:
+            return
+        my_buckets = self.partitioner.get_current_buckets()
+        buckets = set(my_buckets)
+        mine = [flag for flag in added
+                if self.divergent_flags.bucket_of(flag) in buckets]
+        if mine:
+            # the return value is ignored, but we return this for testing
+            eff = self._converge_all(my_buckets, mine)
+            return perform(self._dispatcher, self._with_conv_runid(eff))
+
+    def bucket_divergent_changed(self, bucket, token, children):
+        """
+        ZooKeeper children-watch callback of the directory of ``bucket``'s
+        dirty flags. Newly added flags are converged if the bucket is ours.
+        See note [Sharded divergent flags].
+
+        :param token: Identifies the watch. If the bucket is not watched with
+            it anymore, False is returned to stop the watch.
         """
+        if self._watched_buckets.get(bucket) is not token:
+            return False
+        added = self.divergent_flags.update_bucket(bucket, children)
         if self.partitioner.get_current_state() != PartitionState.ACQUIRED:
             return
         my_buckets = self.partitioner.get_current_buckets()
-        changed_buckets = set(
-            bucket_of_tenant(parse_dirty_flag(child)[0], len(self._buckets))
-            for child in children)
-        if set(my_buckets).intersection(changed_buckets):
+        if added and bucket in my_buckets:
             # the return value is ignored, but we return this for testing
-            eff = self._converge_all(my_buckets, children)
+            eff = self._converge_all(my_buckets, added)
             return perform(self._dispatcher, self._with_conv_runid(eff))
 
 
@@ -875,17 +1921,20 @@ class ConvergenceExecutor(object):
     plan = attr.ib()
     get_desired_group_state = attr.ib()
     update_cache = attr.ib()
+    digest = attr.ib()
 
 
 launch_server_executor = ConvergenceExecutor(
     gather=get_all_launch_server_data,
     plan=plan_launch_server,
     get_desired_group_state=get_desired_server_group_state,
-    update_cache=update_servers_cache)
+    update_cache=update_servers_cache,
+    digest=converged_servers_digest)
 
 
 launch_stack_executor = ConvergenceExecutor(
     gather=get_all_launch_stack_data,
     plan=plan_launch_stack,
     get_desired_group_state=get_desired_stack_group_state,
-    update_cache=update_stacks_cache)
+    update_cache=update_stacks_cache,
+    digest=stacks_digest)
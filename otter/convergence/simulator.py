@@ -0,0 +1,1002 @@
+"""
+In-process simulator of the cloud services and storage the converger works
+against, for load testing convergence without a live cloud.
+"""
+
+# # Note [Convergence simulator]
+# :obj:`Simulator` keeps deterministic in-memory state of Nova servers, CLBs
+# and their nodes, RCv3 pools and their nodes and Heat stacks of each
+# tenant. Its :meth:`Simulator.concretize_service_request` is used in place
+# of :func:`otter.cloud_client.concretize_service_request` when performing
+# :obj:`TenantScope`, so every :obj:`ServiceRequest` made by the real
+# gathering and steps code is answered from that state after the configured
+# latency, or failed at the configured error rate. Responses go through the
+# same success predicate checking and JSON parsing as real ones and hence
+# raise the same errors.
+#
+# The scaling groups, their servers cache and ZooKeeper are simulated in
+# memory too, below the real intent performers: :obj:`SimulatedStore` is
+# given to :func:`get_model_dispatcher`, :obj:`SimulatedServersCache`
+# performs the CQL queries of :obj:`CassScalingGroupServersCache` and
+# :obj:`SimulatedZooKeeper` is given to :func:`get_zk_dispatcher` as a
+# txkazoo client. A :obj:`Converger` given the dispatcher returned by
+# :func:`get_simulator_dispatcher` and a :obj:`SimulatedPartitioner` thus
+# converges thousands of synthetic groups in one process. See
+# ``scripts/simulate_convergence.py``.
+#
+# Servers are in BUILD for ``build_time`` seconds after being created and
+# stacks are IN_PROGRESS as long after being created, updated or deleted.
+# Authentication and throttling of the cloud client are not simulated.
+
+import json
+import re
+import uuid
+from collections import Counter, defaultdict
+from functools import partial
+from random import Random
+from urllib import urlencode
+
+import attr
+
+from effect import ComposedDispatcher, Delay, Effect, Func, TypeDispatcher
+from effect import sync_performer
+
+from kazoo.exceptions import (
+    BadVersionError, NoNodeError, NodeExistsError, NotEmptyError,
+    RolledBackError)
+from kazoo.protocol.states import ZnodeStat
+from kazoo.recipe.partitioner import PartitionState
+
+from twisted.application.internet import TimerService
+from twisted.application.service import MultiService
+from twisted.internet.defer import fail, succeed
+from twisted.web.http_headers import Headers
+
+from otter.cloud_client import TenantScope, perform_tenant_scope
+from otter.constants import CONVERGENCE_DIRTY_DIR, ServiceType
+from otter.convergence.model import get_stack_tag_for_group
+from otter.convergence.tracing import get_span_dispatcher
+from otter.effect_dispatcher import get_simple_dispatcher
+from otter.log.intents import get_log_dispatcher, get_msg_time_dispatcher
+from otter.models.cass import CQLQueryExecute
+from otter.models.intents import get_model_dispatcher
+from otter.models.interface import (
+    GroupState, NoSuchScalingGroupError, ScalingGroupStatus)
+from otter.util.fp import assoc_obj
+from otter.util.pure_http import check_response
+from otter.util.timestamp import epoch_to_utctimestr, timestamp_to_epoch
+from otter.util.zk import get_zk_dispatcher
+
+
+@attr.s
+class SimulatorConfig(object):
+    """
+    Behavior of the simulated services. ``latency`` and ``error_rate`` can
+    be numbers applying to all services or ``dict`` of :obj:`ServiceType` to
+    number.
+
+    :ivar latency: Seconds taken by each request
+    :ivar number jitter: Up to this many seconds are randomly added to the
+        latency of each request
+    :ivar error_rate: Fraction of requests that fail with 500
+    :ivar number build_time: Seconds servers stay in BUILD and stacks stay
+        IN_PROGRESS
+    :ivar seed: Seed of the random numbers. Requests performed in the same
+        order get the same responses for the same seed.
+    """
+    latency = attr.ib(default=0)
+    jitter = attr.ib(default=0)
+    error_rate = attr.ib(default=0)
+    build_time = attr.ib(default=0)
+    seed = attr.ib(default=0)
+
+    def of(self, name, service_type):
+        """
+        Return value of ``name`` setting for ``service_type``
+        """
+        value = getattr(self, name)
+        if isinstance(value, dict):
+            return value.get(service_type, 0)
+        return value
+
+
+@attr.s
+class SimulatedRequest(object):
+    """
+    Request of a :obj:`SimulatedResponse` as needed by :obj:`APIError` and
+    response logging
+    """
+    method = attr.ib()
+    absoluteURI = attr.ib()
+    headers = attr.ib(default=attr.Factory(Headers))
+
+
+@attr.s
+class SimulatedResponse(object):
+    """
+    Response to a simulated :obj:`ServiceRequest`
+    """
+    code = attr.ib()
+    request = attr.ib()
+    headers = attr.ib(default=attr.Factory(Headers))
+
+
+def _param(request, name):
+    """
+    Return first value of query parameter ``name`` of ``request`` or None
+    """
+    value = (request.params or {}).get(name)
+    return value[0] if isinstance(value, list) else value
+
+
+def _not_found(message):
+    return 404, {'itemNotFound': {'message': message, 'code': 404}}
+
+
+_NO_SUCH_CLB = (404, {'message': 'Load balancer not found', 'code': 404})
+
+_FAULTS = {
+    ServiceType.CLOUD_SERVERS: {
+        'computeFault': {'message': 'Simulated fault', 'code': 500}},
+}
+
+
+def _server_address(index):
+    """ServiceNet address of ``index``th server of a tenant"""
+    return '10.{}.{}.{}'.format(index >> 16 & 255, index >> 8 & 255,
+                                index & 255)
+
+
+class SimulatedTenant(object):
+    """
+    Cloud resources of a tenant. Each request handler takes current time,
+    the :obj:`ServiceRequest` and groups matched from its URL, and returns
+    (HTTP code, JSON-able body or ``str``).
+
+    :ivar dict servers: Nova server JSON keyed on server ID. Deleted servers
+        are kept with "DELETED" status so that they are listed when asked
+        for changes.
+    :ivar dict clbs: ``dict`` of node ID to node JSON keyed on CLB ID
+    :ivar dict rcv3_pools: ``dict`` of server ID to node JSON keyed on pool ID
+    :ivar dict stacks: Heat stack JSON keyed on stack ID
+    """
+
+    def __init__(self, config, new_id):
+        self.config = config
+        self.new_id = new_id
+        self.servers = {}
+        self.clbs = {}
+        self.rcv3_pools = {}
+        self.stacks = {}
+        # {server ID: (time when server becomes ACTIVE)}
+        self._building = {}
+        # {stack ID: (time when stack settles, status or None if deleted)}
+        self._stack_changes = {}
+        # {(CLB ID, node ID): time when the node was put in DRAINING}
+        self._drained_at = {}
+        self._num_servers = 0
+        self._next_node_id = 1
+
+    def settle(self, now):
+        """Apply status changes that happened until ``now``"""
+        for server_id, active_at in self._building.items():
+            if active_at <= now:
+                del self._building[server_id]
+                server = self.servers[server_id]
+                if server['status'] == 'BUILD':
+                    server['status'] = 'ACTIVE'
+                    server['updated'] = epoch_to_utctimestr(active_at)
+        for stack_id, (at, status) in self._stack_changes.items():
+            if at <= now:
+                del self._stack_changes[stack_id]
+                if status is None:
+                    del self.stacks[stack_id]
+                else:
+                    self.stacks[stack_id]['stack_status'] = status
+
+    # Nova
+
+    def list_servers(self, now, request):
+        """``GET servers/detail`` paginated with "limit" and "marker"."""
+        self.settle(now)
+        limit = int(_param(request, 'limit') or 1000)
+        marker = _param(request, 'marker')
+        changes_since = _param(request, 'changes-since')
+        servers = sorted(self.servers.values(), key=lambda s: s['id'])
+        if changes_since is None:
+            servers = [s for s in servers if s['status'] != 'DELETED']
+        else:
+            since = timestamp_to_epoch(changes_since)
+            servers = [s for s in servers
+                       if timestamp_to_epoch(s['updated']) >= since]
+        if marker is not None:
+            servers = [s for s in servers if s['id'] > marker]
+        body = {'servers': servers[:limit]}
+        if len(servers) > limit:
+            query = dict(limit=limit, marker=servers[limit - 1]['id'])
+            if changes_since is not None:
+                query['changes-since'] = changes_since
+            body['servers_links'] = [{
+                'rel': 'next',
+                'href': 'http://nova/servers/detail?' + urlencode(query)}]
+        return 200, body
+
+    def create_server(self, now, request):
+        """``POST servers``"""
+        args = request.data['server']
+        server_id = self.new_id()
+        self._num_servers += 1
+        links = [{'href': 'http://nova/servers/' + server_id, 'rel': 'self'}]
+        timestamp = epoch_to_utctimestr(now)
+        self.servers[server_id] = {
+            'id': server_id,
+            'name': args.get('name', ''),
+            'status': 'BUILD',
+            'created': timestamp,
+            'updated': timestamp,
+            'image': {'id': args.get('imageRef')},
+            'flavor': {'id': args.get('flavorRef')},
+            'metadata': dict(args.get('metadata', {})),
+            'addresses': {'private': [
+                {'addr': _server_address(self._num_servers), 'version': 4}]},
+            'links': links}
+        self._building[server_id] = now + self.config.build_time
+        return 202, {'server': {'id': server_id, 'links': links,
+                                'adminPass': 'simulated'}}
+
+    def _existing_server(self, server_id):
+        server = self.servers.get(server_id)
+        if server is None or server['status'] == 'DELETED':
+            return None
+        return server
+
+    def get_server(self, now, request, server_id):
+        """``GET servers/<id>``"""
+        self.settle(now)
+        server = self._existing_server(server_id)
+        if server is None:
+            return _not_found('Instance could not be found')
+        return 200, {'server': server}
+
+    def delete_server(self, now, request, server_id):
+        """``DELETE servers/<id>``. The server is deleted immediately."""
+        server = self._existing_server(server_id)
+        if server is None:
+            return _not_found('Instance could not be found')
+        server['status'] = 'DELETED'
+        server['updated'] = epoch_to_utctimestr(now)
+        self._building.pop(server_id, None)
+        return 204, ''
+
+    def set_metadata_item(self, now, request, server_id, key):
+        """``PUT servers/<id>/metadata/<key>``"""
+        server = self._existing_server(server_id)
+        if server is None:
+            return _not_found('Server does not exist')
+        server['metadata'].update(request.data['meta'])
+        server['updated'] = epoch_to_utctimestr(now)
+        return 200, request.data
+
+    # CLB
+
+    def list_clbs(self, now, request):
+        """``GET loadbalancers``"""
+        return 200, {'loadBalancers': [
+            {'id': int(lb_id), 'name': 'clb' + lb_id, 'status': 'ACTIVE'}
+            for lb_id in sorted(self.clbs)]}
+
+    def list_clb_nodes(self, now, request, lb_id):
+        """``GET loadbalancers/<id>/nodes``"""
+        if lb_id not in self.clbs:
+            return _NO_SUCH_CLB
+        return 200, {'nodes': [self.clbs[lb_id][node_id]
+                               for node_id in sorted(self.clbs[lb_id])]}
+
+    def get_health_monitor(self, now, request, lb_id):
+        """``GET loadbalancers/<id>/healthmonitor``. There is none."""
+        if lb_id not in self.clbs:
+            return _NO_SUCH_CLB
+        return 200, {'healthMonitor': {}}
+
+    def get_node_feed(self, now, request, lb_id, node_id):
+        """
+        ``GET loadbalancers/<id>/nodes/<id>.atom`` with an entry of the
+        node being put in DRAINING if it is.
+        """
+        if lb_id not in self.clbs:
+            return _NO_SUCH_CLB
+        entries = ''
+        drained_at = self._drained_at.get((lb_id, int(node_id)))
+        node = self.clbs[lb_id].get(int(node_id))
+        if drained_at is not None and node is not None:
+            entries = (
+                '<entry><summary>Node successfully updated with address: '
+                "'{}', port: '{}', weight: '{}', condition: 'DRAINING'"
+                '</summary><updated>{}</updated></entry>').format(
+                    node['address'], node['port'], node['weight'],
+                    epoch_to_utctimestr(drained_at))
+        return 200, ('<feed xmlns="http://www.w3.org/2005/Atom">{}</feed>'
+                     .format(entries))
+
+    def add_clb_nodes(self, now, request, lb_id):
+        """``POST loadbalancers/<id>/nodes``"""
+        if lb_id not in self.clbs:
+            return _NO_SUCH_CLB
+        nodes = self.clbs[lb_id]
+        existing = set((n['address'], n['port']) for n in nodes.values())
+        added = request.data['nodes']
+        if any((n['address'], n['port']) in existing for n in added):
+            return 422, {
+                'message': ('Duplicate nodes detected. One or more nodes '
+                            'already configured on load balancer.'),
+                'code': 422}
+        result = []
+        for node in added:
+            node = dict(node, id=self._next_node_id, status='ONLINE')
+            node.setdefault('weight', 1)
+            node.setdefault('type', 'PRIMARY')
+            self._next_node_id += 1
+            nodes[node['id']] = node
+            if node['condition'] == 'DRAINING':
+                self._drained_at[(lb_id, node['id'])] = now
+            result.append(node)
+        return 202, {'nodes': result}
+
+    def change_clb_node(self, now, request, lb_id, node_id):
+        """``PUT loadbalancers/<id>/nodes/<id>``"""
+        if lb_id not in self.clbs:
+            return _NO_SUCH_CLB
+        node = self.clbs[lb_id].get(int(node_id))
+        if node is None:
+            return 404, {
+                'message': 'Node with id #{} not found for loadbalancer #{}'
+                           .format(node_id, lb_id),
+                'code': 404}
+        changes = request.data['node']
+        if changes['condition'] != 'DRAINING':
+            self._drained_at.pop((lb_id, node['id']), None)
+        elif node['condition'] != 'DRAINING':
+            self._drained_at[(lb_id, node['id'])] = now
+        node.update(changes)
+        return 202, ''
+
+    def remove_clb_nodes(self, now, request, lb_id):
+        """
+        ``DELETE loadbalancers/<id>/nodes?id=<id>``. Nodes that do not exist
+        are ignored.
+        """
+        if lb_id not in self.clbs:
+            return _NO_SUCH_CLB
+        for node_id in request.params['id']:
+            self.clbs[lb_id].pop(int(node_id), None)
+            self._drained_at.pop((lb_id, int(node_id)), None)
+        return 202, ''
+
+    # RCv3
+
+    def list_pools(self, now, request):
+        """``GET load_balancer_pools``"""
+        return 200, [{'id': pool_id, 'name': 'pool-' + pool_id}
+                     for pool_id in sorted(self.rcv3_pools)]
+
+    def list_pool_nodes(self, now, request, pool_id):
+        """``GET load_balancer_pools/<id>/nodes``"""
+        if pool_id not in self.rcv3_pools:
+            return 404, {'message': 'Load balancer pool not found'}
+        nodes = self.rcv3_pools[pool_id]
+        return 200, [nodes[server_id] for server_id in sorted(nodes)]
+
+    def add_pool_nodes(self, now, request):
+        """
+        ``POST load_balancer_pools/nodes``. Adding servers that are already
+        in a pool is not an error.
+        """
+        added = []
+        for pair in request.data:
+            pool_id = pair['load_balancer_pool']['id']
+            server_id = pair['cloud_server']['id']
+            nodes = self.rcv3_pools.get(pool_id)
+            if nodes is None:
+                return 409, {'errors': [
+                    'Load Balancer Pool {} does not exist'.format(pool_id)]}
+            if server_id not in nodes:
+                nodes[server_id] = {
+                    'id': self.new_id(), 'status': 'ACTIVE',
+                    'cloud_server': {'id': server_id},
+                    'load_balancer_pool': {'id': pool_id}}
+            added.append(nodes[server_id])
+        return 201, added
+
+    def remove_pool_nodes(self, now, request):
+        """
+        ``DELETE load_balancer_pools/nodes``. Removing servers that are not
+        in a pool is not an error.
+        """
+        for pair in request.data:
+            nodes = self.rcv3_pools.get(pair['load_balancer_pool']['id'], {})
+            nodes.pop(pair['cloud_server']['id'], None)
+        return 204, ''
+
+    # Heat
+
+    def _change_stack(self, now, stack_id, status, settled):
+        self.stacks[stack_id]['stack_status'] = status
+        self._stack_changes[stack_id] = (now + self.config.build_time,
+                                         settled)
+
+    def list_stacks(self, now, request):
+        """``GET stacks`` filtered on "tags"."""
+        self.settle(now)
+        tags = _param(request, 'tags')
+        return 200, {'stacks': [
+            stack for _, stack in sorted(self.stacks.items())
+            if tags is None or tags in stack['tags'].split(',')]}
+
+    def create_stack(self, now, request):
+        """``POST stacks``"""
+        stack_id = self.new_id()
+        links = [{'href': 'http://heat/stacks/{}/{}'.format(
+            request.data['stack_name'], stack_id), 'rel': 'self'}]
+        self.stacks[stack_id] = {
+            'id': stack_id, 'stack_name': request.data['stack_name'],
+            'tags': request.data.get('tags', ''), 'links': links}
+        self._change_stack(now, stack_id, 'CREATE_IN_PROGRESS',
+                           'CREATE_COMPLETE')
+        return 201, {'stack': {'id': stack_id, 'links': links}}
+
+    def check_stack(self, now, request, name, stack_id):
+        """``POST stacks/<name>/<id>/actions`` to check"""
+        self.settle(now)
+        if stack_id not in self.stacks:
+            return _not_found('The Stack could not be found')
+        self.stacks[stack_id]['stack_status'] = 'CHECK_COMPLETE'
+        return 201, ''
+
+    def update_stack(self, now, request, name, stack_id):
+        """``PUT stacks/<name>/<id>``"""
+        self.settle(now)
+        if stack_id not in self.stacks:
+            return _not_found('The Stack could not be found')
+        self._change_stack(now, stack_id, 'UPDATE_IN_PROGRESS',
+                           'UPDATE_COMPLETE')
+        return 202, ''
+
+    def delete_stack(self, now, request, name, stack_id):
+        """``DELETE stacks/<name>/<id>``"""
+        self.settle(now)
+        if stack_id not in self.stacks:
+            return _not_found('The Stack could not be found')
+        self._change_stack(now, stack_id, 'DELETE_IN_PROGRESS', None)
+        return 204, ''
+
+
+_ROUTES = [
+    (ServiceType.CLOUD_SERVERS, [
+        ('GET', r'servers/detail', 'list_servers'),
+        ('POST', r'servers', 'create_server'),
+        ('GET', r'servers/([^/]+)', 'get_server'),
+        ('DELETE', r'servers/([^/]+)', 'delete_server'),
+        ('PUT', r'servers/([^/]+)/metadata/([^/]+)', 'set_metadata_item')]),
+    (ServiceType.CLOUD_LOAD_BALANCERS, [
+        ('GET', r'loadbalancers', 'list_clbs'),
+        ('GET', r'loadbalancers/(\d+)/nodes', 'list_clb_nodes'),
+        ('GET', r'loadbalancers/(\d+)/healthmonitor', 'get_health_monitor'),
+        ('GET', r'loadbalancers/(\d+)/nodes/(\d+)\.atom', 'get_node_feed'),
+        ('POST', r'loadbalancers/(\d+)/nodes', 'add_clb_nodes'),
+        ('PUT', r'loadbalancers/(\d+)/nodes/(\d+)', 'change_clb_node'),
+        ('DELETE', r'loadbalancers/(\d+)/nodes', 'remove_clb_nodes')]),
+    (ServiceType.RACKCONNECT_V3, [
+        ('GET', r'load_balancer_pools', 'list_pools'),
+        ('POST', r'load_balancer_pools/nodes', 'add_pool_nodes'),
+        ('DELETE', r'load_balancer_pools/nodes', 'remove_pool_nodes'),
+        ('GET', r'load_balancer_pools/([^/]+)/nodes', 'list_pool_nodes')]),
+    (ServiceType.CLOUD_ORCHESTRATION, [
+        ('GET', r'stacks', 'list_stacks'),
+        ('POST', r'stacks', 'create_stack'),
+        ('POST', r'stacks/([^/]+)/([^/]+)/actions', 'check_stack'),
+        ('PUT', r'stacks/([^/]+)/([^/]+)', 'update_stack'),
+        ('DELETE', r'stacks/([^/]+)/([^/]+)', 'delete_stack')]),
+]
+ROUTES = {
+    service_type: [(method, re.compile('^{}$'.format(pattern)), handler)
+                   for method, pattern, handler in routes]
+    for service_type, routes in _ROUTES}
+"""
+Handler method of :obj:`SimulatedTenant` of each request keyed on
+:obj:`ServiceType`. The first route whose method and URL pattern match the
+request handles it.
+"""
+
+
+class SimulatedGroup(object):
+    """
+    A scaling group providing the parts of :obj:`IScalingGroup` used by the
+    converger. ``state`` is None if the group has been deleted.
+    """
+
+    def __init__(self, tenant_id, uuid, launch_config, state):
+        self.tenant_id = tenant_id
+        self.uuid = uuid
+        self.launch_config = launch_config
+        self.state = state
+
+    def _no_such_group(self):
+        return fail(NoSuchScalingGroupError(self.tenant_id, self.uuid))
+
+    def view_manifest(self, with_policies=True, with_webhooks=False,
+                      get_deleting=False):
+        """Return manifest with "launchConfiguration" and "state" in it"""
+        if self.state is None or (
+                not get_deleting and
+                self.state.status == ScalingGroupStatus.DELETING):
+            return self._no_such_group()
+        return succeed({
+            'id': self.uuid,
+            'groupConfiguration': {'name': self.state.group_name},
+            'launchConfiguration': self.launch_config,
+            'state': self.state})
+
+    def view_launch_config(self):
+        """Return the launch configuration"""
+        if self.state is None:
+            return self._no_such_group()
+        return succeed(self.launch_config)
+
+    def update_status(self, status):
+        """Update status of the group"""
+        if self.state is None:
+            return self._no_such_group()
+        self.state = assoc_obj(self.state, status=status)
+        return succeed(None)
+
+    def update_error_reasons(self, reasons):
+        """Update error reasons of the group"""
+        if self.state is None:
+            return self._no_such_group()
+        self.state = assoc_obj(self.state, error_reasons=reasons)
+        return succeed(None)
+
+    def delete_group(self):
+        """Delete the group"""
+        if self.state is None:
+            return self._no_such_group()
+        self.state = None
+        return succeed(None)
+
+
+class SimulatedStore(object):
+    """
+    Collection of :obj:`SimulatedGroup` providing the parts of
+    :obj:`IScalingGroupCollection` used by :func:`get_model_dispatcher`.
+    """
+
+    def __init__(self):
+        self.groups = {}
+
+    def get_scaling_group(self, log, tenant_id, group_id):
+        """Return the group. It need not exist."""
+        group = self.groups.get((tenant_id, group_id))
+        if group is None:
+            return SimulatedGroup(tenant_id, group_id, None, None)
+        return group
+
+
+class SimulatedServersCache(object):
+    """
+    In-memory ``servers_cache`` table performing the queries of
+    :obj:`CassScalingGroupServersCache`
+
+    :ivar dict rows: ``dict`` of last_update to ``list`` of rows keyed on
+        (tenant ID, group ID)
+    """
+
+    def __init__(self):
+        self.rows = defaultdict(dict)
+
+    @sync_performer
+    def perform_query(self, dispatcher, intent):
+        """Perform :obj:`CQLQueryExecute` on the servers cache"""
+        query, params = intent.query, intent.params
+        if 'servers_cache' not in query:
+            raise NotImplementedError(
+                'Only servers cache is simulated: {}'.format(query))
+        key = (params['tenantId'], params['groupId'])
+        if query.startswith('SELECT'):
+            by_time = self.rows.get(key, {})
+            return [row for last_update in sorted(by_time, reverse=True)
+                    for row in by_time[last_update]]
+        elif query.startswith('DELETE'):
+            self.rows[key].pop(params['last_update'], None)
+        else:
+            rows = []
+            while 'server_id{}'.format(len(rows)) in params:
+                i = len(rows)
+                rows.append({
+                    'server_blob': params['server_blob{}'.format(i)],
+                    'server_as_active': params['server_as_active{}'.format(i)],
+                    'last_update': params['last_update']})
+            self.rows[key][params['last_update']] = rows
+        return []
+
+
+class SimulatedZooKeeper(object):
+    """
+    In-memory ZooKeeper providing the parts of txkazoo's client used by
+    :func:`get_zk_dispatcher` along with :meth:`watch_children`.
+    Parents of nodes are always created.
+
+    :ivar dict nodes: (content, version) keyed on path
+    """
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.nodes = {'/': ('', 0)}
+        self._children = defaultdict(set)
+        self._watches = defaultdict(list)
+        self._changed = set()
+
+    def _stat(self, path):
+        content, version = self.nodes[path]
+        return ZnodeStat(
+            czxid=0, mzxid=0, ctime=0, mtime=0, version=version, cversion=0,
+            aversion=0, ephemeralOwner=0, dataLength=len(content),
+            numChildren=len(self._children[path]), pzxid=0)
+
+    def _split(self, path):
+        parent, _, name = path.rpartition('/')
+        return parent or '/', name
+
+    def _children_changed(self, path):
+        if path in self._watches and path not in self._changed:
+            self._changed.add(path)
+            self.clock.callLater(0, self._notify, path)
+
+    def _create(self, path, value):
+        if path in self.nodes:
+            raise NodeExistsError(path)
+        parent, name = self._split(path)
+        if parent not in self.nodes:
+            self._create(parent, '')
+        self.nodes[path] = (value, 0)
+        self._children[parent].add(name)
+        self._children_changed(parent)
+        return path
+
+    def _set(self, path, value, version):
+        if path not in self.nodes:
+            raise NoNodeError(path)
+        current = self.nodes[path][1]
+        if version != -1 and version != current:
+            raise BadVersionError(path)
+        self.nodes[path] = (value, current + 1)
+        return self._stat(path)
+
+    def create(self, path, value='', acl=None, ephemeral=False,
+               sequence=False, makepath=False):
+        """Create a node"""
+        try:
+            return succeed(self._create(path, value))
+        except NodeExistsError as e:
+            return fail(e)
+
+    def set(self, path, value, version=-1):
+        """Set content of a node"""
+        try:
+            return succeed(self._set(path, value, version))
+        except (NoNodeError, BadVersionError) as e:
+            return fail(e)
+
+    def get(self, path):
+        """Get content and stat of a node"""
+        if path not in self.nodes:
+            return fail(NoNodeError(path))
+        return succeed((self.nodes[path][0], self._stat(path)))
+
+    def exists(self, path):
+        """Get stat of a node or None if it does not exist"""
+        return succeed(self._stat(path) if path in self.nodes else None)
+
+    def get_children(self, path):
+        """Get names of children of a node"""
+        if path not in self.nodes:
+            return fail(NoNodeError(path))
+        return succeed(sorted(self._children[path]))
+
+    def delete(self, path, version=-1):
+        """Delete a node"""
+        if path not in self.nodes:
+            return fail(NoNodeError(path))
+        if version != -1 and version != self.nodes[path][1]:
+            return fail(BadVersionError(path))
+        if self._children[path]:
+            return fail(NotEmptyError(path))
+        del self.nodes[path]
+        parent, name = self._split(path)
+        self._children[parent].discard(name)
+        self._children_changed(parent)
+        return succeed(None)
+
+    def transaction(self):
+        """Return a transaction of create and set operations"""
+        return _SimulatedTransaction(self)
+
+    def watch_children(self, path, callback):
+        """
+        Call ``callback`` with children of ``path`` now and after they
+        change, like txkazoo's ``watch_children``, until it returns False
+        """
+        self._watches[path].append(callback)
+        self._notify(path)
+
+    def _notify(self, path):
+        self._changed.discard(path)
+        children = sorted(self._children[path])
+        self._watches[path] = [
+            callback for callback in self._watches[path]
+            if callback(children) is not False]
+
+
+class _SimulatedTransaction(object):
+    """
+    Transaction of a :obj:`SimulatedZooKeeper`. If any operation would fail,
+    none of them are applied.
+    """
+
+    def __init__(self, zk):
+        self.zk = zk
+        self.operations = []
+
+    def create(self, path, value='', ephemeral=False, sequence=False):
+        """Add operation to create a node"""
+        self.operations.append((True, path, value, -1))
+
+    def set_data(self, path, value, version=-1):
+        """Add operation to set content of a node"""
+        self.operations.append((False, path, value, version))
+
+    def _check(self, create, path, version, created):
+        exists = path in self.zk.nodes or path in created
+        if create and exists:
+            return NodeExistsError(path)
+        elif create:
+            created.add(path)
+        elif not exists:
+            return NoNodeError(path)
+        elif version not in (-1, self.zk.nodes.get(path, ('', 0))[1]):
+            return BadVersionError(path)
+
+    def commit(self):
+        """Apply the operations and return their results"""
+        created = set()
+        errors = [self._check(create, path, version, created)
+                  for create, path, _, version in self.operations]
+        if any(errors):
+            return succeed([error or RolledBackError() for error in errors])
+        return succeed([
+            self.zk._create(path, value) if create
+            else self.zk._set(path, value, version)
+            for create, path, value, version in self.operations])
+
+
+class Simulator(object):
+    """
+    Simulated cloud, scaling groups and ZooKeeper. See note
+    [Convergence simulator].
+
+    :ivar dict tenants: :obj:`SimulatedTenant` keyed on tenant ID
+    :ivar Counter requests: Number of requests made keyed on
+        (:obj:`ServiceType` name, method)
+    :ivar Counter errors: Number of requests failed by simulated errors,
+        keyed like ``requests``
+    """
+
+    def __init__(self, clock, config=None):
+        self.clock = clock
+        self.config = SimulatorConfig() if config is None else config
+        self.random = Random(self.config.seed)
+        self.tenants = {}
+        self.store = SimulatedStore()
+        self.servers_cache = SimulatedServersCache()
+        self.zk = SimulatedZooKeeper(clock)
+        self.zk.create(CONVERGENCE_DIRTY_DIR)
+        self.requests = Counter()
+        self.errors = Counter()
+        self._next_clb_id = 1
+
+    def new_id(self):
+        """Return a random UUID string from the simulator's random numbers"""
+        return str(uuid.UUID(int=self.random.getrandbits(128)))
+
+    def tenant(self, tenant_id):
+        """Return :obj:`SimulatedTenant` of ``tenant_id``, creating it"""
+        if tenant_id not in self.tenants:
+            self.tenants[tenant_id] = SimulatedTenant(self.config,
+                                                      self.new_id)
+        return self.tenants[tenant_id]
+
+    def add_clb(self, tenant_id):
+        """Add a CLB to the tenant and return its ID"""
+        lb_id = str(self._next_clb_id)
+        self._next_clb_id += 1
+        self.tenant(tenant_id).clbs[lb_id] = {}
+        return lb_id
+
+    def add_rcv3_pool(self, tenant_id):
+        """Add a RCv3 pool to the tenant and return its ID"""
+        pool_id = self.new_id()
+        self.tenant(tenant_id).rcv3_pools[pool_id] = {}
+        return pool_id
+
+    def add_group(self, tenant_id, desired, launch_config,
+                  status=ScalingGroupStatus.ACTIVE):
+        """
+        Add a scaling group to the tenant and return its ID
+
+        :param dict launch_config: Launch configuration of the group
+        """
+        group_id = self.new_id()
+        state = GroupState(
+            tenant_id, group_id, u'group-' + group_id, {}, {}, None, {},
+            False, status, desired=desired)
+        self.store.groups[(tenant_id, group_id)] = SimulatedGroup(
+            tenant_id, group_id, launch_config, state)
+        return group_id
+
+    def populate(self, num_tenants, groups_per_tenant, desired, clbs=0,
+                 rcv3_pools=0, stack_groups=0):
+        """
+        Add synthetic tenants with groups of ``desired`` capacity. Each
+        tenant's ``launch_server`` groups are on ``clbs`` CLBs and
+        ``rcv3_pools`` RCv3 pools of the tenant. ``stack_groups`` of each
+        tenant's groups are ``launch_stack`` groups.
+
+        :return: ``list`` of (tenant ID, group ID)
+        """
+        groups = []
+        for i in range(num_tenants):
+            tenant_id = str(100000 + i)
+            lbs = (
+                [{'loadBalancerId': int(self.add_clb(tenant_id)),
+                  'port': 80} for _ in range(clbs)] +
+                [{'loadBalancerId': self.add_rcv3_pool(tenant_id),
+                  'type': 'RackConnectV3'} for _ in range(rcv3_pools)])
+            for j in range(groups_per_tenant):
+                if j < stack_groups:
+                    launch_config = {
+                        'type': 'launch_stack',
+                        'args': {'stack': {'template': {
+                            'heat_template_version': '2015-10-15'}}}}
+                else:
+                    launch_config = {
+                        'type': 'launch_server',
+                        'args': {
+                            'server': {'name': 'sim', 'imageRef': 'image',
+                                       'flavorRef': 'flavor'},
+                            'loadBalancers': lbs}}
+                groups.append(
+                    (tenant_id,
+                     self.add_group(tenant_id, desired, launch_config)))
+        return groups
+
+    def is_converged(self, tenant_id, group_id):
+        """
+        Does the group have as many ACTIVE servers or COMPLETE stacks as
+        its desired capacity?
+        """
+        group = self.store.groups[(tenant_id, group_id)]
+        if group.state is None:
+            return True
+        tenant = self.tenant(tenant_id)
+        tenant.settle(self.clock.seconds())
+        if group.launch_config['type'] == 'launch_stack':
+            tag = get_stack_tag_for_group(group_id)
+            num = len([s for s in tenant.stacks.values()
+                       if tag in s['tags'].split(',') and
+                       s['stack_status'].endswith('_COMPLETE')])
+        else:
+            num = len([s for s in tenant.servers.values()
+                       if s['status'] == 'ACTIVE' and
+                       s['metadata'].get('rax:autoscale:group:id') ==
+                       group_id])
+        return num == group.state.desired
+
+    def respond(self, tenant_id, service_request):
+        """
+        Return (:obj:`SimulatedResponse`, body ``str``) of the request
+        """
+        service_type = service_request.service_type
+        method = service_request.method.upper()
+        key = (service_type.name, method)
+        self.requests[key] += 1
+        request = SimulatedRequest(method, 'http://{}/{}'.format(
+            service_type.name.lower(), service_request.url))
+        if self.random.random() < self.config.of('error_rate', service_type):
+            self.errors[key] += 1
+            code, body = 500, _FAULTS.get(
+                service_type, {'message': 'Simulated fault', 'code': 500})
+        else:
+            code, body = 404, {'message': 'Not simulated', 'code': 404}
+            routes = ROUTES.get(service_type, [])
+            for route_method, pattern, handler in routes:
+                match = pattern.match(service_request.url)
+                if route_method == method and match is not None:
+                    code, body = getattr(self.tenant(tenant_id), handler)(
+                        self.clock.seconds(), service_request,
+                        *match.groups())
+                    break
+        if not isinstance(body, str):
+            body = json.dumps(body)
+        return SimulatedResponse(code, request), body
+
+    def concretize_service_request(self, authenticator, log, service_configs,
+                                   throttler, tenant_id, service_request):
+        """
+        Like :func:`otter.cloud_client.concretize_service_request` but answer
+        the request from the simulated state after simulated latency. Given
+        to :func:`perform_tenant_scope` as ``_concretize``.
+        """
+        service_type = service_request.service_type
+        latency = (self.config.of('latency', service_type) +
+                   self.random.uniform(0, self.config.jitter))
+        respond = Effect(
+            Func(partial(self.respond, tenant_id, service_request)))
+        eff = (Effect(Delay(latency)).on(lambda _: respond) if latency > 0
+               else respond)
+        eff = eff.on(partial(check_response, service_request.success_pred))
+        if service_request.json_response:
+            eff = eff.on(lambda (response, body): (
+                response, json.loads(body) if body else None))
+        return eff
+
+
+class SimulatedPartitioner(MultiService, object):
+    """
+    A :obj:`Partitioner` that has acquired all the buckets and calls
+    ``got_buckets`` with them every ``interval`` seconds
+    """
+
+    def __init__(self, buckets, log, got_buckets, interval, clock=None):
+        MultiService.__init__(self)
+        self.buckets = buckets
+        self.log = log
+        self.got_buckets = got_buckets
+        timer = TimerService(interval, self.check_partition)
+        timer.setServiceParent(self)
+        timer.clock = clock
+
+    def get_current_state(self):
+        """Buckets are always acquired"""
+        return PartitionState.ACQUIRED
+
+    def get_current_buckets(self):
+        """Return all the buckets"""
+        return list(self.buckets)
+
+    def check_partition(self):
+        """Call ``got_buckets`` with all the buckets"""
+        return self.got_buckets(self.get_current_buckets())
+
+    def health_check(self):
+        """Always healthy"""
+        return succeed((True, {'buckets': self.get_current_buckets()}))
+
+
+def get_simulator_dispatcher(reactor, log, simulator):
+    """
+    Return dispatcher that performs the effects of the converger against
+    ``simulator``. See note [Convergence simulator].
+    """
+    return ComposedDispatcher([
+        TypeDispatcher({
+            TenantScope: partial(
+                perform_tenant_scope, None, log, None, None,
+                _concretize=simulator.concretize_service_request),
+            CQLQueryExecute: simulator.servers_cache.perform_query,
+        }),
+        get_zk_dispatcher(simulator.zk),
+        get_model_dispatcher(log, simulator.store),
+        get_msg_time_dispatcher(reactor),
+        get_span_dispatcher(reactor),
+        get_simple_dispatcher(reactor),
+        get_log_dispatcher(log, {})
+    ])
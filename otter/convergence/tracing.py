@@ -0,0 +1,129 @@
+"""
+Tracing of convergence iterations.
+"""
+
+# # Note [Convergence tracing]
+# When "converger.tracing" is configured, each phase of a convergence
+# iteration is performed as a :obj:`Span`: getting the group, gathering
+# servers, CLB contents and feeds and RCv3 nodes, updating servers cache,
+# planning, executing each step and writing the group status. The time each
+# span took is logged as "convergence-span" with the iteration's log fields,
+# which traces the iteration, and recorded in an in-process histogram of its
+# phase. The histograms are exposed on the admin port at
+# ``/convergence-phases/``.
+
+from bisect import bisect_left
+from functools import partial
+
+import attr
+
+from effect import Effect, TypeDispatcher, sync_performer
+
+import six
+
+from otter.log.intents import msg
+from otter.util.config import config_value
+
+
+BUCKET_BOUNDS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+"""Upper bounds in seconds of the buckets of a :obj:`Histogram`"""
+
+
+class Histogram(object):
+    """
+    Counts of observed durations in :obj:`BUCKET_BOUNDS` buckets
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        """Record a duration of ``seconds``"""
+        self.counts[bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def as_json(self):
+        """
+        Return JSON representation of the histogram with cumulative counts of
+        durations less than or equal to each bound
+        """
+        buckets, total = [], 0
+        for bound, count in zip(BUCKET_BOUNDS + ('+Inf',), self.counts):
+            total += count
+            buckets.append({'le': bound, 'count': total})
+        return {'count': self.count, 'sum': self.sum, 'buckets': buckets}
+
+
+class PhaseHistograms(object):
+    """
+    :obj:`Histogram` of each phase of convergence
+    """
+
+    def __init__(self):
+        self.histograms = {}
+
+    def observe(self, phase, seconds):
+        """Record that ``phase`` took ``seconds``"""
+        self.histograms.setdefault(phase, Histogram()).observe(seconds)
+
+    def as_json(self):
+        """Return JSON representation of the histograms keyed on phase"""
+        return {phase: histogram.as_json()
+                for phase, histogram in self.histograms.items()}
+
+
+PHASE_HISTOGRAMS = PhaseHistograms()
+"""Histograms recorded by the spans of this process"""
+
+
+@attr.s
+class Span(object):
+    """
+    Intent to perform ``effect`` and record the time it took as a span of
+    ``phase``
+    """
+    phase = attr.ib()
+    effect = attr.ib()
+
+
+def span(phase, eff, get_config_value=config_value):
+    """
+    Trace ``eff`` as a span of ``phase`` if "converger.tracing" is
+    configured. See note [Convergence tracing].
+
+    :return: Effect with the result of ``eff``
+    """
+    if not get_config_value('converger.tracing'):
+        return eff
+    return Effect(Span(phase, eff))
+
+
+@sync_performer
+def perform_span(reactor, histograms, disp, intent):
+    """
+    Perform :obj:`Span`. Must be partialed with ``reactor`` and
+    ``histograms``.
+    """
+    start = reactor.seconds()
+
+    def finish(failed):
+        seconds = reactor.seconds() - start
+        histograms.observe(intent.phase, seconds)
+        return msg('convergence-span', phase=intent.phase,
+                   seconds_taken=seconds, failed=failed)
+
+    return intent.effect.on(
+        success=lambda r: finish(False).on(lambda _: r),
+        error=lambda e: finish(True).on(lambda _: six.reraise(*e)))
+
+
+def get_span_dispatcher(reactor, histograms=PHASE_HISTOGRAMS):
+    """
+    Return dispatcher with performer of :obj:`Span` in it
+    """
+    return TypeDispatcher({
+        Span: partial(perform_span, reactor, histograms)
+    })
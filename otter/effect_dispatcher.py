@@ -15,11 +15,13 @@ from .auth import (
     perform_invalidate_token,
 )
 from .cloud_client import get_cloud_client_dispatcher
+from .convergence.tracing import get_span_dispatcher
 from .log.intents import get_log_dispatcher, get_msg_time_dispatcher
 from .models.cass import get_cql_dispatcher
 from .models.intents import get_model_dispatcher
 from .util.pure_http import Request, perform_request
 from .util.retry import Retry, perform_retry
+from .util.semaphore import Acquire, perform_acquire
 from .util.zk import get_zk_dispatcher
 from .worker_intents import get_eviction_dispatcher
 
@@ -37,6 +39,7 @@ def get_simple_dispatcher(reactor):
     return ComposedDispatcher([
         base_dispatcher,
         TypeDispatcher({
+            Acquire: perform_acquire,
             Authenticate: perform_authenticate,
             InvalidateToken: perform_invalidate_token,
             Request: perform_request,
@@ -82,5 +85,6 @@ def get_legacy_dispatcher(reactor, authenticator, log, service_configs):
         get_cloud_client_dispatcher(
             reactor, authenticator, log, service_configs),
         get_simple_dispatcher(reactor),
-        get_log_dispatcher(log, {})
+        get_log_dispatcher(log, {}),
+        get_span_dispatcher(reactor)
     ])
@@ -11,24 +11,28 @@ from itertools import cycle, takewhile
 
 from characteristic import attributes
 
-from effect import Effect, TypeDispatcher, parallel
+from effect import (
+    ComposedDispatcher, Effect, ParallelEffects, TypeDispatcher,
+    base_dispatcher, parallel)
+from effect.async import perform_parallel_async
 from effect.do import do, do_return
 
 from jsonschema import ValidationError
 
 from kazoo.protocol.states import KazooState
 
-from pyrsistent import freeze
+from pyrsistent import freeze, pset, pvector
 
 from silverberg.client import ConsistencyLevel
 
 from toolz.curried import filter, map
-from toolz.dicttoolz import assoc, keymap
+from toolz.dicttoolz import assoc, keymap, merge
 from toolz.functoolz import compose
+from toolz.itertoolz import concat, unique
 
 from twisted.internet import defer
 
-from txeffect import deferred_performer
+from txeffect import deferred_performer, perform
 
 from zope.interface import implementer
 
@@ -53,8 +57,9 @@ from otter.models.interface import (
 from otter.util import timestamp, zk
 from otter.util.config import config_value
 from otter.util.cqlbatch import Batch, batch
-from otter.util.deferredutils import with_lock
+from otter.util.deferredutils import unwrap_first_error, with_lock
 from otter.util.hashkey import generate_capability, generate_key_str
+from otter.util.lru import LRUCache
 from otter.util.retry import repeating_interval, retry, retry_times
 from otter.util.weaklocks import WeakLocks
 
@@ -74,6 +79,93 @@ ACQUIRE_TIMEOUT = 10
 # error
 RELEASE_TIMEOUT = 10
 
+# # Note [Group state versions]
+# By default modify_state holds the group's ZooKeeper lock while it reads the
+# state, calls the modifier and writes the new state. Acquiring and releasing
+# the lock takes several round trips to ZooKeeper and PollingLock polls for
+# it, which adds to the latency of every policy and webhook execution and
+# limits how often a group's policies can be executed.
+#
+# When "cassandra.state_concurrency" is "cas", modify_state of groups of
+# tenants accepted by the group's retryable_modifiers does not use the
+# ZooKeeper lock. The state is read with
+# its "stateVersion" and written with a lightweight transaction that
+# increments the version only if it is still the one that was read. If
+# another node modified the state in between, the state is read and the
+# modifier called again, up to STATE_CAS_ATTEMPTS times before failing with
+# StateConflictError. Modifications on this node are still serialized by the
+# local lock, so only those made on other nodes conflict. Since the modifier
+# may be called more than once, this is only done for tenants whose
+# modifiers just compute the new state. The API service sets
+# retryable_modifiers of the store to accept the tenants enabled for
+# convergence. Other tenants' groups always use the lock.
+#
+# Groups created before the column existed have a null version. A
+# transaction on `IF "stateVersion" = null` also applies when the row does
+# not exist, so it would resurrect a group deleted after its state was read.
+# Hence the first transaction of such a group is done holding the ZooKeeper
+# lock, which delete_group also holds, after reading the state again. A
+# transaction on a non-null version does not apply to a deleted row.
+#
+# Lightweight transactions are written with timestamps of the Cassandra
+# coordinator while other writes, including delete_group's, use the client's
+# `USING TIMESTAMP` (see get_client_ts). Only the state columns are written by
+# the transactions, and in this mode only by them, so they never race a
+# client timestamped write of the same cell. However, if the otter nodes'
+# clocks are behind Cassandra's, a transaction applied just before the group
+# is deleted can get a later timestamp than the deletion and outlive it. That
+# leaves a row without "created_at", which verified_view reports as missing
+# and deletes as a resurrected row. Keep the clocks synchronized.
+
+STATE_CAS_ATTEMPTS = 10
+"""
+Times modify_state tries to write the state with a lightweight transaction.
+See note [Group state versions].
+"""
+
+# # Note [Group configs cache]
+# Group config and launch config are read at QUORUM by every REST GET of them,
+# every policy execution and every convergence iteration, but they rarely
+# change. When "cassandra.manifest_cache_ttl" is configured, they are cached
+# in GROUP_CONFIGS_CACHE for that many seconds whenever the group's row is
+# read by view_config, view_launch_config or view_manifest, and view_config
+# and view_launch_config are served from the cache while it is fresh. While
+# both are fresh, view_manifest (and so GetScalingGroupInfo) reads only the
+# group state.
+# Updating them, deleting the group or marking it DELETING on this node
+# invalidates the cached configs, so only changes made on other nodes can be
+# missed, for at most the TTL. An entry is invalidated by storing the time of
+# invalidation without configs, so that a read started before the
+# invalidation does not cache the configs it got. Group state is never cached:
+# view_manifest and view_state still read it at QUORUM.
+# Writes that use view_config to check that the group exists (updating the
+# status, error reasons or configs and creating policies) read it uncached,
+# so that they fail with NoSuchScalingGroupError instead of recreating a
+# partial row of a group deleted on another node.
+
+GROUP_CONFIGS_CACHE = LRUCache(10000)
+"""
+:obj:`LRUCache` of (tenant ID, group ID, column) -> (time, JSON of the column
+or None if invalidated). See note [Group configs cache].
+"""
+
+CONFIG_COLUMNS = ('group_config', 'launch_config')
+
+
+class StateConflictError(Exception):
+    """
+    Error to be raised when the group's state kept being modified by other
+    nodes while it was being modified. See note [Group state versions].
+    """
+    def __init__(self, tenant_id, group_id, attempts):
+        super(StateConflictError, self).__init__(
+            "State of scaling group {g} of tenant {t} changed in all {n} "
+            "attempts to modify it".format(t=tenant_id, g=group_id,
+                                           n=attempts))
+        self.tenant_id = tenant_id
+        self.group_id = group_id
+        self.attempts = attempts
+
 
 @attributes(['query', 'params', 'consistency_level'])
 class CQLQueryExecute(object):
@@ -159,10 +251,27 @@ _cql_view_manifest = (
     '"policyTouched", paused, desired, created_at, status, error_reasons, '
     'deleting, suspended FROM {cf} '
     'WHERE "tenantId" = :tenantId AND "groupId" = :groupId')
+_cql_view_manifest_state = (
+    'SELECT "tenantId", "groupId", active, pending, "groupTouched", '
+    '"policyTouched", paused, desired, created_at, status, error_reasons, '
+    'deleting, suspended FROM {cf} '
+    'WHERE "tenantId" = :tenantId AND "groupId" = :groupId')
 _cql_insert_policy = (
     'INSERT INTO {cf}("tenantId", "groupId", "policyId", data, version) '
     'VALUES (:tenantId, :groupId, :{name}policyId, :{name}data, '
     ':{name}version)')
+_cql_view_versioned_state = (
+    'SELECT "tenantId", "groupId", group_config, active, pending, '
+    '"groupTouched", "policyTouched", paused, desired, created_at, status, '
+    'error_reasons, deleting, suspended, "stateVersion" FROM {cf} '
+    'WHERE "tenantId" = :tenantId AND "groupId" = :groupId')
+_cql_cas_group_state = (
+    'UPDATE {cf} SET active = :active, pending = :pending, '
+    '"groupTouched" = :groupTouched, "policyTouched" = :policyTouched, '
+    'paused = :paused, desired = :desired, suspended = :suspended, '
+    '"stateVersion" = :newVersion '
+    'WHERE "tenantId" = :tenantId AND "groupId" = :groupId '
+    'IF "stateVersion" = :version')
 _cql_insert_group_state = (
     'INSERT INTO {cf}("tenantId", "groupId", active, pending, "groupTouched", '
     '"policyTouched", paused, desired, suspended) '
@@ -224,6 +333,9 @@ _cql_list_states = (
     '"groupTouched", "policyTouched", paused, desired, created_at, status, '
     'error_reasons, suspended '
     'FROM {cf} WHERE "tenantId"=:tenantId AND deleting=false;')
+_cql_list_statuses = (
+    'SELECT "groupId", status, paused, suspended, deleting, created_at '
+    'FROM {cf} WHERE "tenantId"=:tenantId AND "groupId" IN ({group_ids});')
 _cql_list_policy = (
     'SELECT "policyId", data FROM {cf} WHERE '
     '"tenantId" = :tenantId AND "groupId" = :groupId;')
@@ -253,7 +365,6 @@ _cql_count_for_policy = (
 _cql_count_for_group = (
     'SELECT COUNT(*) FROM {cf} WHERE "tenantId" = :tenantId '
     'AND "groupId" = :groupId;')
-_cql_count_all = ('SELECT COUNT(*) FROM {cf};')
 
 # seems to be pretty quick no matter the consistency - unfortunately this only
 # checks we can connect to Cassandra, and not whether the otter keyspace is
@@ -605,6 +716,158 @@ def _check_deleting(group, get_deleting=False):
     return group
 
 
+MIN_TOKEN = -2 ** 63
+MAX_TOKEN = 2 ** 63 - 1
+
+
+def token_ranges(num):
+    """
+    Split the token ring of Murmur3Partitioner into ``num`` ranges of about
+    equal size.
+
+    :return: ``list`` of (low, high) tuples covering tokens low < t <= high
+    """
+    bounds = [MIN_TOKEN + i * 2 ** 64 // num for i in range(num)]
+    return zip(bounds, bounds[1:] + [MAX_TOKEN])
+
+
+# # Note [Table scans]
+# scan_table reads a whole table without one unpaged SELECT, which times out
+# and holds the whole table in memory as the table grows. The token ring is
+# split into ranges by token_ranges, the ranges are scanned concurrently and
+# each range is read a page at a time in token order. If a page ends in the
+# middle of a partition, the rest of that partition is read by its clustering
+# columns before moving on to the next token. Every page is folded into the
+# range's accumulator by a Reducer as soon as it is read and the accumulators
+# of the ranges are combined at the end, so memory used is that of the
+# accumulators and a page per range. Reducers for counting, collecting
+# (filtered) rows and collecting a set of keys are provided.
+
+SCAN_PAGE_SIZE = 1000
+
+
+@attributes(['initial', 'step', 'combine'])
+class Reducer(object):
+    """
+    Streaming reducer of rows read by :func:`scan_table`
+
+    :ivar initial: Accumulator of a token range before any row is read
+    :ivar step: Function of (accumulator, ``list`` of rows) returning new
+        accumulator. It must not mutate the accumulator.
+    :ivar combine: Function of ``list`` of accumulators of the token ranges
+        returning the result of the scan
+    """
+
+
+def count_rows():
+    """
+    Return :obj:`Reducer` counting rows
+    """
+    return Reducer(initial=0, step=lambda n, rows: n + len(rows),
+                   combine=sum)
+
+
+def collect_rows(pred=lambda row: True, key=lambda row: row):
+    """
+    Return :obj:`Reducer` collecting ``key`` of rows matching ``pred`` in a
+    ``list``
+    """
+    return Reducer(
+        initial=pvector(),
+        step=lambda acc, rows: acc.extend(key(r) for r in rows if pred(r)),
+        combine=compose(list, concat))
+
+
+def set_of(key):
+    """
+    Return :obj:`Reducer` collecting ``key`` of all rows in a ``PSet``
+    """
+    return Reducer(initial=pset(),
+                   step=lambda acc, rows: acc.union(map(key, rows)),
+                   combine=compose(pset, concat))
+
+
+def scan_table(table, partition_key, columns, reducer, clustering=(),
+               ranges=1, page_size=SCAN_PAGE_SIZE,
+               consistency=ConsistencyLevel.ONE):
+    """
+    Read all rows of ``table`` and reduce them with ``reducer``. See note
+    [Table scans].
+
+    :param str table: Table to scan
+    :param str partition_key: Partition key column of the table
+    :param list columns: Columns to read. The partition key and clustering
+        columns are always read.
+    :param Reducer reducer: Reducer of the rows
+    :param list clustering: Clustering columns of the table in order
+    :param int ranges: Number of token ranges to scan concurrently
+    :param int page_size: Number of rows to read at a time
+    :param consistency: Consistency level of the queries
+
+    :return: Effect of the result of ``reducer``
+    """
+    columns = list(unique(
+        concat([columns, [partition_key], clustering])))
+    effs = [
+        _scan_token_range(table, partition_key, columns, reducer,
+                          list(clustering), token_range, page_size,
+                          consistency)
+        for token_range in token_ranges(ranges)]
+    if len(effs) == 1:
+        return effs[0].on(lambda acc: reducer.combine([acc]))
+    return parallel(effs).on(reducer.combine)
+
+
+@do
+def _scan_token_range(table, partition_key, columns, reducer, clustering,
+                      token_range, page_size, consistency):
+    """
+    Reduce rows of ``table`` in ``token_range`` a page at a time. See
+    :func:`scan_table`.
+
+    :return: Effect of accumulator of the range
+    """
+    def quote(column):
+        return '"{}"'.format(column)
+
+    select = 'SELECT {} FROM {} WHERE '.format(
+        ', '.join(map(quote, columns)), table)
+    token = 'token({})'.format(quote(partition_key))
+    first_query = select + (
+        '{0} > :low AND {0} <= :high LIMIT :limit;'.format(token))
+    next_query = select + (
+        '{0} > token(:key) AND {0} <= :high LIMIT :limit;'.format(token))
+    names = [':c{}'.format(i) for i in range(len(clustering))]
+    rest_query = select + '{} = :key AND ({}) > ({}) LIMIT :limit;'.format(
+        quote(partition_key), ', '.join(map(quote, clustering)),
+        ', '.join(names))
+    low, high = token_range
+
+    def rest_params(row):
+        params = {'c{}'.format(i): row[column]
+                  for i, column in enumerate(clustering)}
+        return merge(params, {'key': row[partition_key], 'limit': page_size})
+
+    page = yield cql_eff(first_query,
+                         {'low': low, 'high': high, 'limit': page_size},
+                         consistency)
+    acc = reducer.step(reducer.initial, page)
+    while len(page) == page_size:
+        last = page[-1]
+        # The page may have ended in the middle of the last partition
+        rest = page
+        while clustering and len(rest) == page_size:
+            rest = yield cql_eff(rest_query, rest_params(rest[-1]),
+                                 consistency)
+            acc = reducer.step(acc, rest)
+        page = yield cql_eff(
+            next_query,
+            {'key': last[partition_key], 'high': high, 'limit': page_size},
+            consistency)
+        acc = reducer.step(acc, page)
+    yield do_return(acc)
+
+
 @implementer(IScalingGroup)
 class CassScalingGroup(object):
     """
@@ -632,6 +895,11 @@ class CassScalingGroup(object):
     :ivar local_locks: Local locks used when modifying state
     :type local_locks: :class:`WeakLocks`
 
+    :ivar retryable_modifiers: Callable taking a tenant ID and returning
+        whether ``modify_state`` modifiers of its groups can be called more
+        than once. See note [Group state versions].
+    :type retryable_modifiers: ``callable`` or ``None``
+
     IMPORTANT REMINDER: In CQL, update will create a new row if one doesn't
     exist.  Therefore, before doing an update, a read must be performed first
     else an entry is created where none should have been.
@@ -646,7 +914,7 @@ class CassScalingGroup(object):
 
     """
     def __init__(self, log, tenant_id, uuid, connection, buckets, kz_client,
-                 reactor, local_locks, dispatcher):
+                 reactor, local_locks, dispatcher, retryable_modifiers=None):
         """
         Creates a CassScalingGroup object.
         """
@@ -661,6 +929,7 @@ class CassScalingGroup(object):
         self.reactor = reactor
         self.local_locks = local_locks
         self.dispatcher = dispatcher
+        self.retryable_modifiers = retryable_modifiers
 
         self.group_table = "scaling_group"
         self.launch_table = "launch_config"
@@ -670,6 +939,7 @@ class CassScalingGroup(object):
         self.webhooks_keys_table = "webhook_keys"
         self.event_table = "scaling_schedule_v2"
         self.servers_cache_table = "servers_cache"
+        self.configs_cache = GROUP_CONFIGS_CACHE
 
     def with_timestamp(self, func):
         """
@@ -687,6 +957,52 @@ class CassScalingGroup(object):
             return func(get_client_ts(self.reactor), *args)
         return wrapper
 
+    def _cached_config(self, column):
+        """
+        Return JSON of the group's ``column`` if it is cached and fresh,
+        otherwise None. See note [Group configs cache].
+        """
+        ttl = config_value('cassandra.manifest_cache_ttl')
+        if ttl is None:
+            return None
+        cached_at, data = self.configs_cache.get(
+            (self.tenant_id, self.uuid, column), (None, None))
+        if data is None or self.reactor.seconds() - cached_at > ttl:
+            return None
+        return data
+
+    def _cache_configs(self, group, read_at):
+        """
+        Cache the configs in ``group`` row read at ``read_at`` unless they
+        have been invalidated since. Deleting groups are not cached.
+
+        :return: ``group``
+        """
+        if (config_value('cassandra.manifest_cache_ttl') is None or
+                group.get('deleting')):
+            return group
+        for column in CONFIG_COLUMNS:
+            key = (self.tenant_id, self.uuid, column)
+            cached_at, data = self.configs_cache.get(key, (None, None))
+            invalidated = (data is None and cached_at is not None and
+                           cached_at >= read_at)
+            if column in group and not invalidated:
+                self.configs_cache.set(key, (read_at, group[column]))
+        return group
+
+    def _invalidate_configs(self, result, columns=CONFIG_COLUMNS):
+        """
+        Invalidate cached ``columns`` of the group after a write to them.
+
+        :return: ``result``
+        """
+        if config_value('cassandra.manifest_cache_ttl') is not None:
+            now = self.reactor.seconds()
+            for column in columns:
+                self.configs_cache.set(
+                    (self.tenant_id, self.uuid, column), (now, None))
+        return result
+
     def view_manifest(self, with_policies=True, with_webhooks=False,
                       get_deleting=False):
         """
@@ -721,10 +1037,15 @@ class CassScalingGroup(object):
             }
             return m
 
-        view_query = _cql_view_manifest.format(
-            cf=self.group_table)
+        configs = {column: self._cached_config(column)
+                   for column in CONFIG_COLUMNS}
+        cached = None not in configs.values()
+        # Only the state needs to be read if the configs are cached
+        view_query = (_cql_view_manifest_state if cached
+                      else _cql_view_manifest).format(cf=self.group_table)
         del_query = _cql_delete_all_in_group.format(
             cf=self.group_table, name='')
+        read_at = self.reactor.seconds()
         d = verified_view(self.connection, view_query, del_query,
                           {"tenantId": self.tenant_id,
                            "groupId": self.uuid},
@@ -732,6 +1053,10 @@ class CassScalingGroup(object):
                           NoSuchScalingGroupError(self.tenant_id, self.uuid),
                           self.log)
         d.addCallback(_check_deleting, get_deleting)
+        if cached:
+            d.addCallback(merge, configs)
+        else:
+            d.addCallback(self._cache_configs, read_at)
         d.addCallback(_generate_manifest_group_part)
 
         if with_policies:
@@ -743,21 +1068,31 @@ class CassScalingGroup(object):
 
         return d
 
-    def view_config(self):
+    def view_config(self, cached=True):
         """
         see :meth:`otter.models.interface.IScalingGroup.view_config`
+
+        :param bool cached: Serve the config from the cache if it is fresh.
+            Writes that check the group exists pass False, since the group
+            may have been deleted on another node.
+            See note [Group configs cache].
         """
+        config = self._cached_config('group_config') if cached else None
+        if config is not None:
+            return defer.succeed(_jsonloads_data(config))
+
         view_query = _cql_view.format(
             cf=self.group_table, column='group_config')
         del_query = _cql_delete_all_in_group.format(
             cf=self.group_table, name='')
+        read_at = self.reactor.seconds()
         d = verified_view(self.connection, view_query, del_query,
                           {"tenantId": self.tenant_id,
                            "groupId": self.uuid},
                           DEFAULT_CONSISTENCY,
                           NoSuchScalingGroupError(self.tenant_id, self.uuid),
                           self.log)
-
+        d.addCallback(self._cache_configs, read_at)
         return d.addCallback(lambda group:
                              _jsonloads_data(group['group_config']))
 
@@ -765,17 +1100,22 @@ class CassScalingGroup(object):
         """
         see :meth:`otter.models.interface.IScalingGroup.view_launch_config`
         """
+        cached = self._cached_config('launch_config')
+        if cached is not None:
+            return defer.succeed(_jsonloads_data(cached))
+
         view_query = _cql_view.format(
             cf=self.group_table, column='launch_config')
         del_query = _cql_delete_all_in_group.format(
             cf=self.group_table, name='')
+        read_at = self.reactor.seconds()
         d = verified_view(self.connection, view_query, del_query,
                           {"tenantId": self.tenant_id,
                            "groupId": self.uuid},
                           DEFAULT_CONSISTENCY,
                           NoSuchScalingGroupError(self.tenant_id, self.uuid),
                           self.log)
-
+        d.addCallback(self._cache_configs, read_at)
         return d.addCallback(lambda group:
                              _jsonloads_data(group['launch_config']))
 
@@ -799,33 +1139,48 @@ class CassScalingGroup(object):
         d.addCallback(_check_deleting, get_deleting)
         return d.addCallback(_unmarshal_state)
 
+    def _state_params(self, new_state):
+        """
+        Return CQL params of ``new_state`` to write
+        """
+        assert (new_state.tenant_id == self.tenant_id and
+                new_state.group_id == self.uuid)
+        return {
+            'tenantId': new_state.tenant_id,
+            'groupId': new_state.group_id,
+            'active': serialize_json_data(new_state.active, 1),
+            'pending': serialize_json_data(new_state.pending, 1),
+            'paused': new_state.paused,
+            'suspended': new_state.suspended,
+            'desired': new_state.desired,
+            'groupTouched': new_state.group_touched,
+            'policyTouched': serialize_json_data(new_state.policy_touched, 1)
+        }
+
     def modify_state(self, modifier_callable, *args, **kwargs):
         """
         see :meth:`otter.models.interface.IScalingGroup.modify_state`
+
+        The group's ZooKeeper lock is held while modifying the state unless
+        "cassandra.state_concurrency" is "cas" and ``retryable_modifiers``
+        accepts the group's tenant. See note [Group state versions].
         """
         modify_state_reason = kwargs.pop('modify_state_reason', None)
         log = self.log.bind(
             system='CassScalingGroup.modify_state',
             modify_state_reason=modify_state_reason)
         consistency = DEFAULT_CONSISTENCY
+        local_lock = self.local_locks.get_lock(self.uuid)
+
+        if (config_value('cassandra.state_concurrency') == 'cas' and
+                self.retryable_modifiers is not None and
+                self.retryable_modifiers(self.tenant_id)):
+            return local_lock.run(self._modify_state_cas, log,
+                                  modifier_callable, args, kwargs)
 
         @self.with_timestamp
         def _write_state(timestamp, new_state):
-            assert (new_state.tenant_id == self.tenant_id and
-                    new_state.group_id == self.uuid)
-            params = {
-                'tenantId': new_state.tenant_id,
-                'groupId': new_state.group_id,
-                'active': serialize_json_data(new_state.active, 1),
-                'pending': serialize_json_data(new_state.pending, 1),
-                'paused': new_state.paused,
-                'suspended': new_state.suspended,
-                'desired': new_state.desired,
-                'groupTouched': new_state.group_touched,
-                'policyTouched': serialize_json_data(new_state.policy_touched,
-                                                     1),
-                'ts': timestamp
-            }
+            params = assoc(self._state_params(new_state), 'ts', timestamp)
             return self.connection.execute(
                 _cql_insert_group_state.format(cf=self.group_table),
                 params, consistency)
@@ -836,15 +1191,82 @@ class CassScalingGroup(object):
                 self, state, *args, **kwargs))
             return d.addCallback(_write_state)
 
+        return local_lock.run(self._with_modify_lock, log, _modify_state)
+
+    def _with_modify_lock(self, log, func):
+        """
+        Call ``func`` holding the group's ZooKeeper lock to modify its state.
+
+        :return: Deferred that fires with result of ``func``
+        """
         lock = zk.PollingLock(self.dispatcher, LOCK_PATH + '/' + self.uuid)
         lock.acquire = functools.partial(lock.acquire, timeout=ACQUIRE_TIMEOUT)
-        local_lock = self.local_locks.get_lock(self.uuid)
-        return local_lock.run(
-            with_lock, self.reactor, lock, _modify_state,
+        return with_lock(
+            self.reactor, lock, func,
             log.bind(category='locking', lock_reason='modify_state'),
             acquire_timeout=ACQUIRE_TIMEOUT + 5,
             release_timeout=RELEASE_TIMEOUT)
 
+    def _modify_state_cas(self, log, modifier_callable, args, kwargs):
+        """
+        Modify the state with lightweight transactions on its version. See
+        note [Group state versions].
+
+        :return: Deferred that fires with None
+        """
+        consistency = DEFAULT_CONSISTENCY
+        view_query = _cql_view_versioned_state.format(cf=self.group_table)
+        del_query = _cql_delete_all_in_group.format(
+            cf=self.group_table, name='')
+        keys = {"tenantId": self.tenant_id, "groupId": self.uuid}
+
+        def _write_state(new_state, version):
+            params = merge(
+                self._state_params(new_state),
+                {'version': version, 'newVersion': (version or 0) + 1})
+            d = self.connection.execute(
+                _cql_cas_group_state.format(cf=self.group_table),
+                params, consistency)
+            return d.addCallback(lambda rows: rows[0]['[applied]'])
+
+        def _modify_state(group):
+            version = group['stateVersion']
+            d = defer.maybeDeferred(
+                modifier_callable, self, _unmarshal_state(group),
+                *args, **kwargs)
+            return d.addCallback(_write_state, version)
+
+        def _read_and_modify():
+            d = verified_view(
+                self.connection, view_query, del_query, keys, consistency,
+                NoSuchScalingGroupError(self.tenant_id, self.uuid), self.log)
+            d.addCallback(_check_deleting)
+            return d.addCallback(_modify_state)
+
+        def _modify_versioned(group):
+            if group['stateVersion'] is None:
+                # Can't be deleted in between while holding the lock
+                return self._with_modify_lock(log, _read_and_modify)
+            return _modify_state(group)
+
+        def _attempt(attempt):
+            d = verified_view(
+                self.connection, view_query, del_query, keys, consistency,
+                NoSuchScalingGroupError(self.tenant_id, self.uuid), self.log)
+            d.addCallback(_check_deleting)
+            d.addCallback(_modify_versioned)
+            return d.addCallback(_check_applied, attempt)
+
+        def _check_applied(applied, attempt):
+            if applied:
+                return None
+            log.msg('State changed while modifying it', attempt=attempt)
+            if attempt >= STATE_CAS_ATTEMPTS:
+                raise StateConflictError(self.tenant_id, self.uuid, attempt)
+            return _attempt(attempt + 1)
+
+        return _attempt(1)
+
     def update_status(self, status):
         """
         see :meth:`otter.models.interface.IScalingGroup.update_status`
@@ -875,9 +1297,10 @@ class CassScalingGroup(object):
                  'deleting': True},
                 DEFAULT_CONSISTENCY)
 
-        d = self.view_config()
+        d = self.view_config(cached=False)
         if status == ScalingGroupStatus.DELETING:
             d.addCallback(set_deleting)
+            d.addBoth(self._invalidate_configs)
         else:
             d.addCallback(_do_update)
         return d
@@ -898,7 +1321,7 @@ class CassScalingGroup(object):
                  "reasons": reasons, "ts": ts},
                 DEFAULT_CONSISTENCY)
 
-        d = self.view_config()
+        d = self.view_config(cached=False)
         d.addCallback(_do_update)
         return d
 
@@ -920,8 +1343,9 @@ class CassScalingGroup(object):
                       consistency=DEFAULT_CONSISTENCY)
             return b.execute(self.connection)
 
-        d = self.view_config()
+        d = self.view_config(cached=False)
         d.addCallback(_do_update_config)
+        d.addBoth(self._invalidate_configs, ('group_config',))
         return d
 
     def update_launch_config(self, data):
@@ -943,8 +1367,9 @@ class CassScalingGroup(object):
             d = b.execute(self.connection)
             return d
 
-        d = self.view_config()
+        d = self.view_config(cached=False)
         d.addCallback(_do_update_launch)
+        d.addBoth(self._invalidate_configs, ('launch_config',))
         return d
 
     def _naive_list_policies(self, limit=None, marker=None):
@@ -1045,7 +1470,7 @@ class CassScalingGroup(object):
             d = b.execute(self.connection)
             return d.addCallback(lambda _: outpolicies)
 
-        d = self.view_config()
+        d = self.view_config(cached=False)
         d.addCallback(_do_limits_check)
         d.addCallback(_do_create_pol)
         return d
@@ -1338,6 +1763,7 @@ class CassScalingGroup(object):
                       log.bind(category='locking', lock_reason='delete_group'),
                       acquire_timeout=ACQUIRE_TIMEOUT + 5,
                       release_timeout=RELEASE_TIMEOUT)
+        d.addBoth(self._invalidate_configs)
         # Cleanup /locks/<groupID> znode as it will not be required anymore
         d.addCallback(_delete_lock_znode)
         d.addCallback(lambda _: None)
@@ -1402,6 +1828,7 @@ class CassScalingGroupCollection:
         self.buckets = None
         self.kz_client = None
         self.dispatcher = None
+        self.retryable_modifiers = None
 
     def set_scheduler_buckets(self, buckets):
         """
@@ -1527,6 +1954,32 @@ class CassScalingGroupCollection:
         d.addCallback(_build_states)
         return d
 
+    def get_scaling_group_statuses(self, tenant_id, group_ids):
+        """
+        Get status of given groups of a tenant in one query
+
+        :param list group_ids: IDs of the groups. Should not be empty.
+
+        :return: `Deferred` fired with ``dict`` of group ID to ``dict`` with
+            "status", "paused" and "suspended" keys. Groups that do not exist
+            are not in it.
+        """
+        params = {'groupId{}'.format(i): group_id
+                  for i, group_id in enumerate(group_ids)}
+        params['tenantId'] = tenant_id
+        query = _cql_list_statuses.format(
+            cf=self.group_table,
+            group_ids=', '.join(':groupId{}'.format(i)
+                                for i in range(len(group_ids))))
+        d = self.connection.execute(query, params, DEFAULT_CONSISTENCY)
+        return d.addCallback(
+            lambda rows: {
+                row['groupId']: {
+                    'status': _group_status(row['status'], row['deleting']),
+                    'paused': bool(row['paused']),
+                    'suspended': bool(row['suspended'])}
+                for row in rows if row['created_at'] is not None})
+
     def get_scaling_group(self, log, tenant_id, scaling_group_id):
         """
         see :meth:`IScalingGroupCollection.get_scaling_group`
@@ -1534,7 +1987,7 @@ class CassScalingGroupCollection:
         return CassScalingGroup(log, tenant_id, scaling_group_id,
                                 self.connection, self.buckets, self.kz_client,
                                 self.reactor, self.local_locks,
-                                self.dispatcher)
+                                self.dispatcher, self.retryable_modifiers)
 
     def fetch_and_delete(self, bucket, now, size=100):
         """
@@ -1602,27 +2055,31 @@ class CassScalingGroupCollection:
         d.addCallback(extract_info)
         return d
 
+    @do
     def get_webhook_index_only(self):
         """
         Get webhook info that is there in webhook index but is not there in
-        webhook_keys table
+        webhook_keys table. Both tables are scanned in "cassandra.scan_ranges"
+        token ranges at a time, if configured, keeping only the webhook keys
+        in memory.
 
-        :return: Effect of list of pmap. The pmap contains tenantId, groupId,
+        :return: Effect of set of pmap. The pmap contains tenantId, groupId,
             policyId and webhookKey
         """
-        query = ('SELECT "tenantId", "groupId", "policyId", "webhookKey" '
-                 'FROM {cf}')
-        eff = parallel(
-            [Effect(
-                CQLQueryExecute(query=query.format(cf=self.webhooks_table),
-                                params={},
-                                consistency_level=ConsistencyLevel.ONE)),
-             Effect(
-                CQLQueryExecute(query=query.format(cf=self.webhook_keys_table),
-                                params={},
-                                consistency_level=ConsistencyLevel.ONE))])
-        return eff.on(
-            lambda (whooks, wkeys): set(freeze(whooks)) - set(freeze(wkeys)))
+        columns = ['tenantId', 'groupId', 'policyId', 'webhookKey']
+        ranges = config_value('cassandra.scan_ranges') or 1
+
+        def info(row):
+            return freeze({column: row[column] for column in columns})
+
+        keys = yield scan_table(
+            self.webhook_keys_table, 'webhookKey', columns, set_of(info),
+            ranges=ranges)
+        index_only = yield scan_table(
+            self.webhooks_table, 'tenantId', columns,
+            collect_rows(lambda row: info(row) not in keys, info),
+            clustering=['groupId', 'policyId', 'webhookId'], ranges=ranges)
+        yield do_return(set(index_only))
 
     def add_webhook_keys(self, webhook_keys):
         """
@@ -1728,7 +2185,8 @@ class CassScalingGroupCollection:
 
     def get_all_valid_groups(self):
         """
-        Get all *valid* scaling groups
+        Get all *valid* scaling groups. Groups are scanned in
+        "cassandra.scan_ranges" token ranges at a time, if configured.
 
         :return: `Deferred` fired with ``list`` of group ``dict``
         """
@@ -1737,22 +2195,78 @@ class CassScalingGroupCollection:
                     row.get('desired') is not None and
                     not row.get('deleting', False))
 
-        d = self.get_scaling_group_rows()
-        return d.addCallback(lambda gs: list(filter(_valid_group_row, gs)))
+        groups = []
+        d = self.each_scaling_group_page(
+            lambda rows: groups.extend(filter(_valid_group_row, rows)),
+            ranges=config_value('cassandra.scan_ranges') or 1)
+        return d.addCallback(lambda _: groups)
 
-    @defer.inlineCallbacks
-    def get_scaling_group_rows(self, props=None, batch_size=100):
+    def get_scaling_group_rows(self, props=None, batch_size=100, ranges=1):
         """
         Return scaling group rows from Cassandra as a list of ``dict`` where
         each dict has all columns in table if `props` is None. Otherwise
-        only columns given in `props` are retreived
+        only columns given in `props` are retreived. Prefer
+        :meth:`each_scaling_group_page` to go through all the groups without
+        keeping them all in memory.
 
         :param ``list`` props: List of extra properties to extract
         :param int batch_size: Number of groups to fetch at a time
+        :param int ranges: Number of token ranges to scan concurrently
         :return: `Deferred` fired with ``list`` of ``dict``
         """
-        # TODO: Currently returning all groups as one giant list for now.
-        # Will try to use Twisted tubes to do streaming later
+        if ranges == 1:
+            groups = []
+            d = self.each_scaling_group_page(groups.extend, props, batch_size)
+            return d.addCallback(lambda _: groups)
+
+        pages = [[] for _ in range(ranges)]
+        d = defer.gatherResults(
+            [self._each_group_page_in_range(page.extend, props, batch_size,
+                                            token_range)
+             for page, token_range in zip(pages, token_ranges(ranges))],
+            consumeErrors=True)
+        d.addErrback(unwrap_first_error)
+        return d.addCallback(lambda _: list(concat(pages)))
+
+    def each_scaling_group_page(self, handler, props=None, batch_size=100,
+                                ranges=1):
+        """
+        Go through all the scaling group rows in Cassandra a page at a time.
+
+        ``handler`` is called with each page as a ``list`` of row ``dict``.
+        Each row has all columns in table if `props` is None, otherwise only
+        columns given in `props`. The next page of a token range is fetched
+        only after the Deferred returned by ``handler``, if any, fires, so
+        only a page per range is held in memory unless ``handler`` keeps the
+        rows. With more than one range, the ranges are scanned concurrently
+        and ``handler`` is called with their pages as they are fetched.
+
+        :param callable handler: Called with each page
+        :param ``list`` props: List of extra properties to extract
+        :param int batch_size: Number of groups to fetch at a time
+        :param int ranges: Number of token ranges to scan concurrently
+        :return: `Deferred` fired with None after all pages are handled
+        """
+        if ranges == 1:
+            return self._each_group_page_in_range(handler, props, batch_size)
+        d = defer.gatherResults(
+            [self._each_group_page_in_range(handler, props, batch_size,
+                                            token_range)
+             for token_range in token_ranges(ranges)],
+            consumeErrors=True)
+        return d.addCallbacks(lambda _: None, unwrap_first_error)
+
+    @defer.inlineCallbacks
+    def _each_group_page_in_range(self, handler, props, batch_size,
+                                  token_range=None):
+        """
+        Call ``handler`` with each page of scaling group rows whose tenant
+        ID's token is in ``token_range``, or with all rows if it is None.
+        See :meth:`each_scaling_group_page`.
+
+        :param tuple token_range: (low, high] tokens as returned by
+            :func:`token_ranges`
+        """
         if props is None:
             cols = "*"
         else:
@@ -1761,40 +2275,51 @@ class CassScalingGroupCollection:
                  ' FROM scaling_group {where} LIMIT :limit;')
         where_key = 'WHERE "tenantId"=:tenantId AND "groupId">:groupId'
         where_token = 'WHERE token("tenantId") > token(:tenantId)'
+        if token_range is None:
+            where_first, low, high = '', {}, {}
+        else:
+            where_first = ('WHERE token("tenantId") > :low '
+                           'AND token("tenantId") <= :high')
+            where_token += ' AND token("tenantId") <= :high'
+            low, high = {'low': token_range[0]}, {'high': token_range[1]}
+
+        def get_page(where, params):
+            d = self.connection.execute(
+                query.format(where=where), params, ConsistencyLevel.ONE)
+            return d.addCallback(handle_page)
+
+        @defer.inlineCallbacks
+        def handle_page(page):
+            if page:
+                yield handler(page)
+            defer.returnValue(page)
 
-        # We first start by getting all groups limited on batch size
+        # We first start by getting groups limited on batch size
         # It will return groups sorted first based on hash of tenant id
         # and then based group id. Note that only tenant id is sorted
         # based on hash; group id is sorted normally
-        batch = yield self.connection.execute(
-            query.format(where=''),
-            {'limit': batch_size}, ConsistencyLevel.ONE)
+        batch = yield get_page(where_first,
+                               merge(low, high, {'limit': batch_size}))
         if len(batch) < batch_size:
-            defer.returnValue(batch)
+            defer.returnValue(None)
 
         # We got batch size response. That means there are probably more groups
-        groups = batch
         while batch != []:
             # We start by getting all the groups of last tenant ID we received
             # except the ones we already got. We do that by asking
             # groups > last group id since groups are sorted
             tenant_id = batch[-1]['tenantId']
             while len(batch) == batch_size:
-                batch = yield self.connection.execute(
-                    query.format(where=where_key),
+                batch = yield get_page(
+                    where_key,
                     {'limit': batch_size,
                      'tenantId': tenant_id,
-                     'groupId': batch[-1]['groupId']},
-                    ConsistencyLevel.ONE)
-                groups.extend(batch)
+                     'groupId': batch[-1]['groupId']})
             # We then get next tenant's groups by using there hash value. i.e
             # tenants whose hash > last tenant id we just fetched
-            batch = yield self.connection.execute(
-                query.format(where=where_token),
-                {'limit': batch_size, 'tenantId': tenant_id},
-                ConsistencyLevel.ONE)
-            groups.extend(batch)
-        defer.returnValue(groups)
+            batch = yield get_page(
+                where_token,
+                merge(high, {'limit': batch_size, 'tenantId': tenant_id}))
 
 
 @implementer(IScalingGroupServersCache)
@@ -1889,35 +2414,40 @@ class CassAdmin(object):
 
     def __init__(self, connection):
         self.connection = connection
+        self.dispatcher = ComposedDispatcher([
+            base_dispatcher,
+            TypeDispatcher({ParallelEffects: perform_parallel_async}),
+            get_cql_dispatcher(connection)])
 
     def get_metrics(self, log):
         """
         see :meth:`otter.models.interface.IAdmin.get_metrics`
+
+        Rows are counted by scanning the tables in "cassandra.scan_ranges"
+        token ranges at a time, if configured. See note [Table scans].
         """
-        def _get_metric(table, label):
+        tables = [('scaling_group', 'groups', ['groupId']),
+                  ('scaling_policies', 'policies', ['groupId', 'policyId']),
+                  ('policy_webhooks', 'webhooks',
+                   ['groupId', 'policyId', 'webhookId'])]
+        ranges = config_value('cassandra.scan_ranges') or 1
+
+        def _format_result(count, label):
             """
-            Execute a CQL statement and return a formatted result
+            :param count: Number of rows counted
+            :param label: Label for the metric
+
+            :return: dict of metric label, value and time
             """
-            def _format_result(result, label):
-                """
-                :param result: Result from metric collection
-                :param label: Label for the metric
-
-                :return: dict of metric label, value and time
-                """
-                return dict(
-                    id="otter.metrics.{0}".format(label),
-                    value=result[0]['count'],
-                    time=int(time.time()))
-
-            dc = self.connection.execute(_cql_count_all.format(cf=table), {},
-                                         ConsistencyLevel.QUORUM)
-            dc.addCallback(_format_result, label)
-            return dc
-
-        tables = ['scaling_group', 'scaling_policies', 'policy_webhooks']
-        labels = ['groups', 'policies', 'webhooks']
-        mapping = zip(tables, labels)
-
-        deferreds = [_get_metric(table, label) for table, label in mapping]
-        return defer.gatherResults(deferreds, consumeErrors=True)
+            return dict(
+                id="otter.metrics.{0}".format(label),
+                value=count,
+                time=int(time.time()))
+
+        eff = parallel([
+            scan_table(table, 'tenantId', [], count_rows(),
+                       clustering=clustering, ranges=ranges,
+                       consistency=ConsistencyLevel.QUORUM).on(
+                functools.partial(_format_result, label=label))
+            for table, label, clustering in tables])
+        return perform(self.dispatcher, eff)
@@ -25,6 +25,23 @@ def perform_get_all_valid_groups(store, dispatcher, intent):
     return store.get_all_valid_groups()
 
 
+@attr.s
+class GetScalingGroupStatuses(object):
+    """
+    Intent to get status of many groups of a tenant. See
+    :meth:`CassScalingGroupCollection.get_scaling_group_statuses`.
+    """
+    tenant_id = attr.ib()
+    group_ids = attr.ib()
+
+
+@deferred_performer
+def perform_get_scaling_group_statuses(store, dispatcher, intent):
+    """Perform :obj:`GetScalingGroupStatuses`."""
+    return store.get_scaling_group_statuses(intent.tenant_id,
+                                            intent.group_ids)
+
+
 @attributes(['tenant_id', 'group_id'])
 class GetScalingGroupInfo(object):
     """Get a scaling group and its manifest."""
@@ -49,6 +66,24 @@ def perform_get_scaling_group_info(log, store, dispatcher, intent):
     returnValue((group, manifest))
 
 
+@attr.s
+class GetLaunchConfig(object):
+    """
+    Intent to get the launch configuration of a scaling group. See
+    :meth:`IScalingGroup.view_launch_config`.
+    """
+    tenant_id = attr.ib()
+    group_id = attr.ib()
+
+
+@deferred_performer
+def perform_get_launch_config(log, store, dispatcher, intent):
+    """Perform :obj:`GetLaunchConfig`."""
+    log = merge_effectful_fields(dispatcher, log)
+    group = store.get_scaling_group(log, intent.tenant_id, intent.group_id)
+    return group.view_launch_config()
+
+
 @attributes(['tenant_id', 'group_id'])
 class DeleteGroup(object):
     """
@@ -154,6 +189,7 @@ def get_model_dispatcher(log, store):
     return TypeDispatcher({
         GetScalingGroupInfo:
             partial(perform_get_scaling_group_info, log, store),
+        GetLaunchConfig: partial(perform_get_launch_config, log, store),
         DeleteGroup: partial(perform_delete_group, log, store),
         UpdateGroupStatus: perform_update_group_status,
         LoadAndUpdateGroupStatus:
@@ -163,4 +199,6 @@ def get_model_dispatcher(log, store):
             partial(perform_update_error_reasons, log, store),
         ModifyGroupStatePaused: perform_modify_group_state_paused,
         GetAllValidGroups: partial(perform_get_all_valid_groups, store),
+        GetScalingGroupStatuses:
+            partial(perform_get_scaling_group_statuses, store),
     })
@@ -1,6 +1,13 @@
 """
 Autoscale REST endpoints having to do with administration of Otter.
 """
+import json
+
+from otter.convergence.tracing import PHASE_HISTOGRAMS
+from otter.log import log
+from otter.rest.decorators import (fails_with, succeeds_with,
+                                   with_transaction_id)
+from otter.rest.errors import exception_codes
 from otter.rest.metrics import OtterMetrics
 from otter.rest.otterapp import OtterApp
 
@@ -11,11 +18,16 @@ class OtterAdmin(object):
     """
     app = OtterApp()
 
-    def __init__(self, store):
+    def __init__(self, store, phase_histograms=PHASE_HISTOGRAMS):
         """
         Initialize OtterAdmin.
+
+        :param phase_histograms: :obj:`PhaseHistograms` of convergence spans
+            of this process
         """
+        self.log = log.bind(system='otter.rest.admin')
         self.store = store
+        self.phase_histograms = phase_histograms
 
     @app.route('/', methods=['GET'])
     def root(self, request):
@@ -30,3 +42,32 @@ class OtterAdmin(object):
         Routes related to metrics are delegated to OtterMetrics.
         """
         return OtterMetrics(self.store).app.resource()
+
+    @app.route('/convergence-phases/', methods=['GET'])
+    @with_transaction_id()
+    @fails_with(exception_codes)
+    @succeeds_with(200)
+    def convergence_phases(self, request):
+        """
+        Histograms of time taken by each phase of convergence iterations on
+        this node. They are recorded only if "converger.tracing" is
+        configured.
+
+        Example response::
+
+            {
+                "gather-servers": {
+                    "count": 2,
+                    "sum": 3.5,
+                    "buckets": [
+                        {"le": 0.01, "count": 0},
+                        ...
+                        {"le": 5, "count": 2},
+                        ...
+                        {"le": "+Inf", "count": 2}
+                    ]
+                }
+            }
+        """
+        request.setHeader('Content-Type', 'application/json')
+        return json.dumps(self.phase_histograms.as_json())
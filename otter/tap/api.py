@@ -35,7 +35,9 @@ from otter.bobby import BobbyClient
 from otter.constants import (
     CONVERGENCE_DIRTY_DIR,
     CONVERGENCE_PARTITIONER_PATH,
+    CONVERGENCE_WEIGHTS_PATH,
     get_service_configs)
+from otter.convergence.composition import tenant_is_enabled
 from otter.convergence.selfheal import SelfHeal
 from otter.convergence.service import Converger
 from otter.effect_dispatcher import get_full_dispatcher
@@ -50,9 +52,9 @@ from otter.scheduler import SchedulerService
 from otter.supervisor import SupervisorService, set_supervisor
 from otter.util import zk
 from otter.util.config import config_value, set_config_data
-from otter.util.cqlbatch import TimingOutCQLClient
+from otter.util.cqlbatch import PreparingCassandraCluster, TimingOutCQLClient
 from otter.util.deferredutils import timeout_deferred
-from otter.util.zkpartitioner import Partitioner
+from otter.util.zkpartitioner import Partitioner, WeightedPartitioner
 
 assert os.environ.get("PYRSISTENT_NO_C_EXTENSION"), (
     "The environment variable PYRSISTENT_NO_C_EXTENSION must be set to "
@@ -196,10 +198,15 @@ def makeService(config):
         clientFromString(reactor, str(host))
         for host in config_value('cassandra.seed_hosts')]
 
+    if config_value('cassandra.prepared_statements'):
+        cluster_class = PreparingCassandraCluster
+    else:
+        cluster_class = RoundRobinCassandraCluster
+
     cassandra_cluster = LoggingCQLClient(
         TimingOutCQLClient(
             reactor,
-            RoundRobinCassandraCluster(
+            cluster_class(
                 seed_endpoints,
                 config_value('cassandra.keyspace'),
                 disconnect_on_cancel=True),
@@ -208,6 +215,9 @@ def makeService(config):
 
     store = CassScalingGroupCollection(
         cassandra_cluster, reactor, config_value('limits.absolute.maxGroups'))
+    # Modifiers of convergence tenants' groups just compute the new state
+    store.retryable_modifiers = partial(
+        tenant_is_enabled, get_config_value=config_value)
     admin_store = CassAdmin(cassandra_cluster)
 
     bobby_url = config_value('bobby_url')
@@ -310,7 +320,12 @@ def makeService(config):
                 config_value('converger.interval') or 10,
                 config_value('converger.build_timeout') or 3600,
                 config_value('converger.limited_retry_iterations') or 10,
-                config_value('converger.step_limits') or {})
+                config_value('converger.step_limits') or {},
+                config_value('converger.buckets') or 10,
+                config_value('converger.weighted_partitioning'),
+                config_value('converger.max_concurrent_groups'),
+                config_value('converger.sharded_dirty_flags'),
+                config_value('converger.max_backoff_interval'))
 
             # Setup selfheal service
             sh_svc = setup_selfheal_service(
@@ -341,7 +356,8 @@ def setup_selfheal_service(clock, config, dispatcher, health_checker, log):
     if "selfheal" not in config:
         return None
     interval = get_in(["selfheal", "interval"], config, no_default=True)
-    selfheal = SelfHeal(clock, dispatcher, config_value, interval, log)
+    selfheal = SelfHeal(clock, dispatcher, config_value, interval, log,
+                        get_in(["selfheal", "batch_size"], config))
     func, lock = zk.locked_logged_func(
         dispatcher, "/selfheallock", log, "selfheal-lock-acquired",
         selfheal.setup)
@@ -352,10 +368,25 @@ def setup_selfheal_service(clock, config, dispatcher, health_checker, log):
 
 
 def setup_converger(parent, kz_client, dispatcher, interval, build_timeout,
-                    limited_retry_iterations, step_limits):
+                    limited_retry_iterations, step_limits, num_buckets=10,
+                    weighted=None, max_concurrent_groups=None,
+                    sharded_dirty_flags=False, max_backoff_interval=None):
     """
     Create a Converger service, which has a Partitioner as a child service, so
     that if the Converger is stopped, the partitioner is also stopped.
+
+    :param int num_buckets: Number of buckets the groups are partitioned in.
+        It limits the number of nodes convergence can be spread on and must
+        be same on all the nodes.
+    :param dict weighted: If given, buckets are partitioned by their cost
+        with :obj:`WeightedPartitioner`. It can have "publish_interval",
+        "rebalance_interval" and "threshold" keys.
+    :param int max_concurrent_groups: If given, at most this many groups
+        are converged at a time in order of priority.
+    :param bool sharded_dirty_flags: Should dirty flags be watched in the
+        directories of the converger's buckets?
+    :param number max_backoff_interval: If given, groups waiting on the same
+        steps are backed off up to this many seconds.
     """
     partitioner_factory = partial(
         Partitioner,
@@ -364,8 +395,25 @@ def setup_converger(parent, kz_client, dispatcher, interval, build_timeout,
         partitioner_path=CONVERGENCE_PARTITIONER_PATH,
         time_boundary=15,  # time boundary
     )
-    cvg = Converger(log, dispatcher, 10, partitioner_factory, build_timeout,
-                    interval / 2, limited_retry_iterations, step_limits)
+    publish_costs_interval = None
+    if weighted is not None:
+        partitioner_factory = partial(
+            WeightedPartitioner,
+            kz_client=kz_client,
+            interval=interval,
+            partitioner_path=CONVERGENCE_PARTITIONER_PATH,
+            time_boundary=15,
+            weights_path=CONVERGENCE_WEIGHTS_PATH,
+            rebalance_interval=weighted.get('rebalance_interval', 600),
+            threshold=weighted.get('threshold', 1.25))
+        publish_costs_interval = weighted.get('publish_interval', 60)
+    cvg = Converger(log, dispatcher, num_buckets, partitioner_factory,
+                    build_timeout, interval / 2, limited_retry_iterations,
+                    step_limits, publish_costs_interval=publish_costs_interval,
+                    max_concurrent_groups=max_concurrent_groups,
+                    watch_children=(partial(watch_children, kz_client)
+                                    if sharded_dirty_flags else None),
+                    max_backoff_interval=max_backoff_interval)
     cvg.setServiceParent(parent)
     watch_children(kz_client, CONVERGENCE_DIRTY_DIR, cvg.divergent_changed)
 
@@ -44,6 +44,7 @@ from otter.cloud_client import (
     create_server,
     create_stack,
     delete_stack,
+    fold_servers_details_pages,
     get_cloud_client_dispatcher,
     get_server_details,
     list_servers_details_all,
@@ -977,6 +978,33 @@ class NovaClientTests(SynchronousTestCase):
         result = perform_sequence(seq, eff)
         self.assertEqual(result, ['1', '2', '3', '4', '5', '6'])
 
+    def test_fold_servers_details_pages(self):
+        """
+        :func:`fold_servers_details_pages` calls the given function with the
+        servers of each page as they are received and returns the final
+        accumulated value.
+        """
+        bodies = [
+            {'servers': ['1', '2'],
+             'servers_links': [{'href': 'doesnt_matter_url?marker=3',
+                                'rel': 'next'}]},
+            {'servers': ['3']}
+        ]
+        resps = [json.dumps(d) for d in bodies]
+
+        eff = fold_servers_details_pages(
+            lambda acc, servers: acc + (tuple(servers),), (),
+            {'marker': ['1']})
+        seq = [
+            (self._list_server_details_intent({'marker': ['1']}),
+             service_request_eqf(stub_pure_response(resps[0], 200))),
+            (self._list_server_details_log_intent(bodies[0]), lambda _: None),
+            (self._list_server_details_intent({'marker': ['3']}),
+             service_request_eqf(stub_pure_response(resps[1], 200))),
+            (self._list_server_details_log_intent(bodies[1]), lambda _: None)
+        ]
+        self.assertEqual(perform_sequence(seq, eff), (('1', '2'), ('3',)))
+
     def test_list_servers_details_all_blows_up_if_got_same_link_twice(self):
         """
         :func:`list_servers_details_all` raises an exception if Nova returns
@@ -1,14 +1,34 @@
 """Tests for convergence effecting."""
 
-from effect import Constant, Effect, Error, ParallelEffects, sync_perform
+from effect import (
+    ComposedDispatcher, Constant, Delay, Effect, Error, FirstError,
+    ParallelEffects, TypeDispatcher, sync_perform)
+from effect.ref import reference_dispatcher
+from effect.testing import nested_sequence, perform_sequence
+
+from pyrsistent import pset
 
 from testtools.matchers import MatchesException
 
+from twisted.internet.defer import Deferred
 from twisted.trial.unittest import SynchronousTestCase
 
-from otter.convergence.effecting import steps_to_effect
-from otter.convergence.model import ErrorReason, StepResult
+from txeffect import deferred_performer, perform
+
+from otter.constants import ServiceType
+from otter.convergence import effecting
+from otter.convergence.effecting import (
+    StepLimiter,
+    bounded_parallel,
+    steps_to_effect)
+from otter.convergence.model import (
+    CLBDescription, CLBNodeCondition, CLBNodeType, ErrorReason, StepResult)
+from otter.convergence.steps import (
+    AddNodesToCLB, ChangeCLBNode, RemoveNodesFromCLB)
+from otter.convergence.tracing import Span
 from otter.test.utils import TestStep, matches, test_dispatcher
+from otter.util.config import set_config_data
+from otter.util.semaphore import Acquire, perform_acquire
 
 
 class StepsToEffectTests(SynchronousTestCase):
@@ -25,3 +45,275 @@ class StepsToEffectTests(SynchronousTestCase):
             [(StepResult.SUCCESS, 'foo'),
              (StepResult.RETRY,
               [ErrorReason.Exception(expected_exc_info)])])
+
+    def test_tracing(self):
+        """
+        With tracing configured, each step is executed in a span of its type
+        """
+        set_config_data({'converger': {'tracing': True}})
+        self.addCleanup(set_config_data, {})
+        steps = [TestStep(Effect('step'))]
+        seq = [
+            (Span('step-TestStep', Effect('step')),
+             nested_sequence([('step', lambda i: (StepResult.SUCCESS, []))]))
+        ]
+        self.assertEqual(
+            perform_sequence(seq, steps_to_effect(steps), test_dispatcher()),
+            [(StepResult.SUCCESS, [])])
+
+    def test_clb_steps_invalidate_clb_contents(self):
+        """
+        Steps changing a CLB invalidate cached contents of the tenant's CLB.
+        """
+        invalidated = []
+
+        def invalidate(tenant_id, lb_id, eff, get_config_value):
+            invalidated.append((tenant_id, lb_id))
+            return eff
+
+        self.patch(effecting, 'invalidate_clb_contents', invalidate)
+        steps = [
+            AddNodesToCLB(lb_id='1', address_configs=pset(
+                [('1.2.3.4', CLBDescription(lb_id='1', port=80))])),
+            RemoveNodesFromCLB(lb_id='2', node_ids=pset(['n1'])),
+            ChangeCLBNode(lb_id='3', node_id='n1', weight=50,
+                          condition=CLBNodeCondition.DRAINING,
+                          type=CLBNodeType.PRIMARY),
+            TestStep(Effect(Constant((StepResult.SUCCESS, []))))]
+        steps_to_effect(steps, 'tid', lambda k: None)
+        self.assertEqual(invalidated, [('tid', '1'), ('tid', '2'),
+                                       ('tid', '3')])
+
+
+class PriorStep(TestStep):
+    """A fake step started before :obj:`TestStep` when throttled."""
+
+
+class FreeStep(TestStep):
+    """A fake step that does not call any service."""
+
+
+class ThrottledStepsToEffectTests(SynchronousTestCase):
+    """
+    Tests for :func:`steps_to_effect` with "converger.step_throttling"
+    configured
+    """
+
+    def setUp(self):
+        self.deferreds = {}
+        self.delays = []
+
+        @deferred_performer
+        def perform_job(dispatcher, intent):
+            self.deferreds[intent[1]] = Deferred()
+            return self.deferreds[intent[1]]
+
+        @deferred_performer
+        def perform_delay(dispatcher, intent):
+            self.delays.append((intent.delay, Deferred()))
+            return self.delays[-1][1]
+
+        self.dispatcher = test_dispatcher(ComposedDispatcher([
+            lambda i: (perform_job if isinstance(i, tuple) and i[0] == 'job'
+                       else None),
+            TypeDispatcher({Acquire: perform_acquire, Delay: perform_delay}),
+            reference_dispatcher]))
+        self.patch(effecting, 'STEP_SERVICES',
+                   {TestStep: ServiceType.CLOUD_SERVERS,
+                    PriorStep: ServiceType.CLOUD_SERVERS})
+        self.patch(effecting, 'STEP_PRIORITY', [PriorStep, TestStep])
+        self.limiter = StepLimiter()
+        self.config = {
+            'converger.step_throttling': {
+                'CLOUD_SERVERS': {'concurrency': 1}}}.get
+
+    def _steps_to_effect(self, steps, tenant_id='t1'):
+        return steps_to_effect(steps, tenant_id, self.config, self.limiter)
+
+    def test_window(self):
+        """
+        Steps of a throttled service are executed in a window in the order of
+        ``STEP_PRIORITY`` while other steps are executed at once, and the
+        results are in the order of steps
+        """
+        d = perform(self.dispatcher, self._steps_to_effect(
+            [TestStep(Effect(('job', 'create'))),
+             PriorStep(Effect(('job', 'remove'))),
+             FreeStep(Effect(('job', 'free')))]))
+        self.assertEqual(sorted(self.deferreds), ['free', 'remove'])
+        self.deferreds['remove'].callback('r')
+        self.assertEqual(sorted(self.deferreds), ['create', 'free', 'remove'])
+        self.deferreds['create'].callback('c')
+        self.deferreds['free'].callback('f')
+        self.assertEqual(self.successResultOf(d), ['c', 'r', 'f'])
+        self.assertEqual(self.limiter.windows, {})
+
+    def test_window_shared_by_tenant(self):
+        """
+        A step waits while its tenant's window of the service is full and
+        starts as soon as a step of the window finishes. Windows of other
+        tenants are separate.
+        """
+        d1 = perform(self.dispatcher, self._steps_to_effect(
+            [TestStep(Effect(('job', 'a')))]))
+        d2 = perform(self.dispatcher, self._steps_to_effect(
+            [TestStep(Effect(('job', 'b')))]))
+        d3 = perform(self.dispatcher, self._steps_to_effect(
+            [TestStep(Effect(('job', 'c')))], 't2'))
+        self.assertEqual(sorted(self.deferreds), ['a', 'c'])
+        self.deferreds['a'].callback('a')
+        self.assertEqual(sorted(self.deferreds), ['a', 'b', 'c'])
+        self.deferreds['b'].callback('b')
+        self.deferreds['c'].callback('c')
+        self.assertEqual(self.successResultOf(d1), ['a'])
+        self.assertEqual(self.successResultOf(d2), ['b'])
+        self.assertEqual(self.successResultOf(d3), ['c'])
+        self.assertEqual(self.delays, [])
+        self.assertEqual(self.limiter.windows, {})
+
+    def test_window_priority_across_groups(self):
+        """
+        Steps of a tenant's groups waiting for the window are started in the
+        order of ``STEP_PRIORITY``, not in the order they started waiting
+        """
+        d1 = perform(self.dispatcher, self._steps_to_effect(
+            [TestStep(Effect(('job', 'create1'))),
+             TestStep(Effect(('job', 'create2')))]))
+        d2 = perform(self.dispatcher, self._steps_to_effect(
+            [PriorStep(Effect(('job', 'remove')))]))
+        self.assertEqual(sorted(self.deferreds), ['create1'])
+        self.deferreds['create1'].callback('c1')
+        self.assertEqual(sorted(self.deferreds), ['create1', 'remove'])
+        self.deferreds['remove'].callback('r')
+        self.deferreds['create2'].callback('c2')
+        self.assertEqual(self.successResultOf(d1), ['c1', 'c2'])
+        self.assertEqual(self.successResultOf(d2), ['r'])
+        self.assertEqual(self.limiter.windows, {})
+
+    def test_window_released_on_error(self):
+        """
+        A step that fails frees its place in the window
+        """
+        d = perform(self.dispatcher, self._steps_to_effect(
+            [TestStep(Effect(('job', 'a'))), TestStep(Effect(('job', 'b')))]))
+        self.deferreds['a'].errback(ZeroDivisionError())
+        self.deferreds['b'].callback('b')
+        result = self.successResultOf(d)
+        self.assertEqual(result[0][0], StepResult.RETRY)
+        self.assertEqual(result[1], 'b')
+        self.assertEqual(self.limiter.windows, {})
+
+    def test_rate(self):
+        """
+        A step that gets no token is delayed until its token is refilled
+        """
+        self.config = {
+            'converger.step_throttling': {
+                'CLOUD_SERVERS': {'rate': 2}}}.get
+        self.patch(effecting.time, 'time', lambda: 0)
+        d = perform(self.dispatcher, self._steps_to_effect(
+            [TestStep(Effect(('job', 'a'))), TestStep(Effect(('job', 'b')))]))
+        self.assertEqual(sorted(self.deferreds), ['a'])
+        self.assertEqual([delay for delay, _ in self.delays], [0.5])
+        self.delays[0][1].callback(None)
+        self.assertEqual(sorted(self.deferreds), ['a', 'b'])
+        self.deferreds['a'].callback('a')
+        self.deferreds['b'].callback('b')
+        self.assertEqual(self.successResultOf(d), ['a', 'b'])
+
+
+class StepLimiterTests(SynchronousTestCase):
+    """Tests for :obj:`StepLimiter`."""
+
+    def setUp(self):
+        self.limiter = StepLimiter()
+
+    def test_window(self):
+        """
+        The window of a key is kept until it is idle, and replaced when its
+        concurrency changes
+        """
+        window = self.limiter.window('k', 2)
+        self.assertIs(self.limiter.window('k', 2), window)
+        self.assertIsNot(self.limiter.window('k2', 2), window)
+        window.held = 1
+        self.limiter.forget_idle('k')
+        self.assertIs(self.limiter.window('k', 2), window)
+        window.held = 0
+        self.limiter.forget_idle('k')
+        self.assertIsNot(self.limiter.window('k', 2), window)
+        self.assertEqual(self.limiter.window('k', 3).limit, 3)
+
+    def test_rate(self):
+        """
+        Steps start at "rate" per second after a burst of "burst" steps, and
+        a step that gets no token borrows it and waits until it is refilled
+        """
+        limits = {'rate': 2, 'burst': 2}
+        self.assertEqual(
+            [self.limiter.take_token('k', limits, 0) for _ in range(4)],
+            [0, 0, 0.5, 1])
+        self.assertEqual(self.limiter.take_token('k', limits, 0.5), 1)
+        self.assertEqual(self.limiter.take_token('k2', limits, 0.5), 0)
+
+    def test_no_rate(self):
+        """
+        Steps start at once without "rate"
+        """
+        self.assertEqual(
+            self.limiter.take_token('k', {'concurrency': 1}, 0), 0)
+        self.assertEqual(self.limiter.buckets, {})
+
+
+class BoundedParallelTests(SynchronousTestCase):
+    """Tests for :func:`bounded_parallel`."""
+
+    def setUp(self):
+        self.deferreds = {}
+
+        @deferred_performer
+        def perform_job(dispatcher, intent):
+            self.deferreds[intent[1]] = Deferred()
+            return self.deferreds[intent[1]]
+
+        self.dispatcher = test_dispatcher(ComposedDispatcher([
+            lambda i: (perform_job if isinstance(i, tuple) and i[0] == 'job'
+                       else None),
+            reference_dispatcher]))
+
+    def _jobs(self, num):
+        return [Effect(('job', i)) for i in range(num)]
+
+    def test_limit(self):
+        """
+        At most ``limit`` effects are performed at a time, in given order, and
+        the results are in the order of effects
+        """
+        d = perform(self.dispatcher, bounded_parallel(self._jobs(4), 2))
+        self.assertEqual(sorted(self.deferreds), [0, 1])
+        self.deferreds[1].callback('r1')
+        self.assertEqual(sorted(self.deferreds), [0, 1, 2])
+        self.deferreds[2].callback('r2')
+        self.deferreds[0].callback('r0')
+        self.assertNoResult(d)
+        self.deferreds[3].callback('r3')
+        self.assertEqual(self.successResultOf(d), ['r0', 'r1', 'r2', 'r3'])
+
+    def test_fewer_effects(self):
+        """
+        Works when there are fewer effects than the limit, including none
+        """
+        self.assertEqual(
+            sync_perform(self.dispatcher,
+                         bounded_parallel([Effect(Constant(1))], 5)),
+            [1])
+        self.assertEqual(
+            sync_perform(self.dispatcher, bounded_parallel([], 5)), [])
+
+    def test_error(self):
+        """
+        Error from an effect fails the result with :obj:`FirstError`
+        """
+        d = perform(self.dispatcher, bounded_parallel(self._jobs(2), 1))
+        self.deferreds[0].errback(ValueError('bad'))
+        self.failureResultOf(d, FirstError)
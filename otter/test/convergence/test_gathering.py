@@ -1,5 +1,7 @@
 """Tests for convergence gathering."""
 
+import json
+import time
 from copy import deepcopy
 from datetime import datetime
 from functools import partial
@@ -10,18 +12,22 @@ from effect import (
     ComposedDispatcher,
     Constant,
     Effect,
+    Error,
+    Func,
     ParallelEffects,
     TypeDispatcher,
+    base_dispatcher,
     sync_perform)
 
 from effect.async import perform_parallel_async
+from effect.ref import Reference, reference_dispatcher
 from effect.testing import (
     EQDispatcher, EQFDispatcher, Stub, intent_func, nested_sequence,
     parallel_sequence, perform_sequence)
 
 import mock
 
-from pyrsistent import freeze
+from pyrsistent import freeze, pmap, pset
 
 from toolz.curried import map
 from toolz.functoolz import compose
@@ -29,11 +35,14 @@ from toolz.functoolz import compose
 from twisted.trial.unittest import SynchronousTestCase
 
 from otter.auth import NoSuchEndpoint
-from otter.cloud_client import service_request
+from otter.cloud_client import has_code, service_request
 from otter.cloud_client.clb import CLBNotFoundError
 
 from otter.constants import ServiceType
 from otter.convergence.gathering import (
+    CLBCacheEntry,
+    GatherSnapshot,
+    apply_server_changes,
     extract_clb_drained_at,
     get_all_launch_server_data,
     get_all_launch_stack_data,
@@ -44,6 +53,8 @@ from otter.convergence.gathering import (
     get_rcv3_contents,
     get_scaling_group_servers,
     get_scaling_group_stacks,
+    get_tenant_gather_snapshot,
+    invalidate_clb_contents,
     mark_deleted_servers)
 from otter.convergence.model import (
     CLB,
@@ -51,6 +62,7 @@ from otter.convergence.model import (
     CLBNode,
     CLBNodeCondition,
     CLBNodeType,
+    DesiredServerGroupState,
     RCv3Description,
     RCv3Node,
     ServerState)
@@ -202,6 +214,34 @@ class GetAllScalingGroupServersTests(SynchronousTestCase):
             result,
             {'a': as_servers[:5] + [as_servers[-1]], 'b': as_servers[5:8]})
 
+    def test_groups_across_pages(self):
+        """
+        Servers of a group spread across pages are returned together
+        """
+        as_servers = [
+            {'metadata': {'rax:auto_scaling_group_id': gid}, 'id': i}
+            for i, gid in enumerate('abab')]
+        bodies = [
+            {'servers': as_servers[:2] + [{'id': 'x'}],
+             'servers_links': [{'href': 'url?marker=x', 'rel': 'next'}]},
+            {'servers': as_servers[2:]}]
+        eff = get_all_scaling_group_servers()
+        sequence = [
+            (service_request(*self.req).intent,
+             lambda i: (StubResponse(200, None), bodies[0])),
+            (Log(mock.ANY, mock.ANY), lambda i: None),
+            (service_request(
+                ServiceType.CLOUD_SERVERS, 'GET', 'servers/detail',
+                None, None, {'marker': ['x']}).intent,
+             lambda i: (StubResponse(200, None), bodies[1])),
+            (Log(mock.ANY, mock.ANY), lambda i: None)
+        ]
+        result = perform_sequence(sequence, eff)
+        self.assertEqual(
+            result,
+            {'a': [as_servers[0], as_servers[2]],
+             'b': [as_servers[1], as_servers[3]]})
+
     def test_filters_on_user_criteria(self):
         """
         Considers user provided filter if provided
@@ -235,11 +275,13 @@ class GetScalingGroupServersTests(SynchronousTestCase):
         self.now = datetime(2010, 5, 31)
         self.freeze = compose(set, map(freeze))
 
-    def _invoke(self):
+    def _invoke(self, config=None, incremental=True):
         return get_scaling_group_servers(
             'tid', 'gid', self.now, cache_class=EffectServersCache,
             all_as_servers=intent_func("all-as"),
-            all_servers=intent_func("alls"))
+            all_servers=intent_func("alls"),
+            incremental=incremental,
+            get_config_value={'converger.incremental_gather': config}.get)
 
     def _test_no_cache(self, empty):
         current = [] if empty else [{'id': 'a', 'a': 'b'},
@@ -282,6 +324,69 @@ class GetScalingGroupServersTests(SynchronousTestCase):
             self.freeze(perform_sequence(sequence, self._invoke())),
             self.freeze([del_cache_server, cache[-1]] + current[0:2]))
 
+    def test_incremental(self):
+        """
+        If incremental gathering is configured, only servers changed since
+        cache's last update minus the overlap are fetched and applied to
+        cached servers
+        """
+        asmetakey = "rax:autoscale:group:id"
+        cache = [
+            {'id': 'a', 'metadata': {asmetakey: "gid"}},  # gets updated
+            {'id': 'b', 'metadata': {asmetakey: "gid"}},  # deleted
+            {'id': 'd', 'metadata': {asmetakey: "gid"}},  # meta removed
+            {'id': 'c', 'metadata': {asmetakey: "gid"}}]  # same
+        changed = [
+            {'id': 'a', 'b': 'c', 'metadata': {asmetakey: "gid"}},
+            {'id': 'b', 'status': 'DELETED', 'metadata': {asmetakey: "gid"}},
+            {'id': 'z', 'z': 'w', 'metadata': {asmetakey: "gid"}},  # new
+            {'id': 'd', 'metadata': {"changed": "yes"}}]
+        self.now = datetime(2010, 5, 31, 0, 30)
+        last_update = datetime(2010, 5, 31, 0, 20)
+        sequence = [
+            (("cachegstidgid", False), lambda i: (cache, last_update)),
+            (("alls", datetime(2010, 5, 31, 0, 19)), lambda i: changed)]
+        eff = self._invoke({'resync_interval': 3600, 'overlap': 60})
+        self.assertEqual(
+            self.freeze(perform_sequence(sequence, eff)),
+            self.freeze([changed[0], changed[1], cache[-1], changed[2]]))
+
+    def test_incremental_resync(self):
+        """
+        If incremental gathering is configured, but cache was last updated in
+        an earlier resync interval, all servers are fetched
+        """
+        last_update = datetime(2010, 5, 30, 23, 0)
+        sequence = [
+            (("cachegstidgid", False), lambda i: ([], last_update)),
+            (("alls",), lambda i: [])]
+        eff = self._invoke({'resync_interval': 3600})
+        self.assertEqual(perform_sequence(sequence, eff), [])
+
+    def test_incremental_disabled(self):
+        """
+        If ``incremental`` is False, all servers are fetched even if
+        incremental gathering is configured
+        """
+        self.now = datetime(2010, 5, 31, 0, 30)
+        last_update = datetime(2010, 5, 31, 0, 20)
+        sequence = [
+            (("cachegstidgid", False), lambda i: ([], last_update)),
+            (("alls",), lambda i: [])]
+        eff = self._invoke({'resync_interval': 3600}, incremental=False)
+        self.assertEqual(perform_sequence(sequence, eff), [])
+
+    def test_apply_server_changes(self):
+        """
+        :func:`apply_server_changes` updates old servers with changed servers
+        and adds new ones
+        """
+        old = [{'id': 'a', 'a': 1}, {'id': 'b', 'b': 2}]
+        changed = [{'id': 'd', 'd': 3}, {'id': 'b', 'status': 'DELETED'}]
+        self.assertEqual(
+            self.freeze(apply_server_changes(old, changed)),
+            self.freeze([old[0]] + changed))
+
     def test_mark_deleted_servers_precedence(self):
         """
         In :func:`mark_deleted_servers`, if old list has common servers with
@@ -579,6 +684,22 @@ class GetCLBContentsTests(SynchronousTestCase):
                       description=make_desc(lb_id='1'))],
              {'1': CLB(True)}))
 
+    def test_lb_ids(self):
+        """
+        If ``lb_ids`` is given, only contents of those CLBs are fetched
+        without listing the CLBs.
+        """
+        node11 = node('11', 'a11')
+        seq = [
+            parallel_sequence([[nodes_req(1, [node11])],
+                               [lb_hm_req(1, {"type": "CONNECT"})]]),
+            parallel_sequence([]),
+        ]
+        eff = get_clb_contents(lb_ids=[1])
+        self.assertEqual(
+            perform_sequence(seq, eff),
+            ([CLBNode.from_node_json(1, node11)], {'1': CLB(True)}))
+
     def test_lb_disappeared_during_feed_fetch(self):
         """
         If a load balancer gets deleted while fetching feeds, no nodes will be
@@ -606,6 +727,259 @@ class GetCLBContentsTests(SynchronousTestCase):
              {'2': CLB(True)}))
 
 
+class CLBContentsCacheTests(SynchronousTestCase):
+    """
+    Tests for caching of CLB contents by :func:`get_clb_contents` and
+    :func:`invalidate_clb_contents`
+    """
+
+    def setUp(self):
+        """mock `extract_clb_drained_at` and setup cache"""
+        self.feeds = {'11feed': 1.0, '22feed': 2.0}
+        patch(self, 'otter.convergence.gathering.extract_clb_drained_at',
+              side_effect=lambda f: self.feeds[f])
+        patch(self, "otter.convergence.gathering.get_clb_node_feed",
+              side_effect=intent_func("gcnf"))
+        self.cache = Reference(pmap())
+        self.get_config_value = {'converger.clb_cache_ttl': 30}.get
+        self.dispatcher = ComposedDispatcher(
+            [reference_dispatcher, base_dispatcher])
+        self.node11 = node('11', 'a11', condition='DRAINING')
+        self.node21 = node('21', 'a21')
+
+    def _get(self, seq, tenant_id='tid', lb_ids=None):
+        eff = get_clb_contents(lb_ids=lb_ids, tenant_id=tenant_id,
+                               cache=self.cache,
+                               get_config_value=self.get_config_value)
+        return perform_sequence(seq, eff, self.dispatcher)
+
+    def _entries(self):
+        return sync_perform(self.dispatcher, self.cache.read())
+
+    def _set_entries(self, entries):
+        sync_perform(self.dispatcher, self.cache.modify(lambda _: entries))
+
+    def test_caches_contents(self):
+        """
+        Fetched nodes, health monitors and drained times are stored in the
+        cache.
+        """
+        seq = [
+            lb_req('loadbalancers', True,
+                   {'loadBalancers': [{'id': 1}, {'id': 2}]}),
+            (Func(time.time), lambda i: 100.0),
+            parallel_sequence([[nodes_req(1, [self.node11])],
+                               [nodes_req(2, [self.node21])],
+                               [lb_hm_req(1, {"type": "CONNECT"})],
+                               [lb_hm_req(2, {})]]),
+            parallel_sequence([[node_feed_req('1', '11', '11feed')]]),
+        ]
+        self.assertEqual(
+            self._get(seq),
+            ([attr.assoc(CLBNode.from_node_json(1, self.node11),
+                         _drained_at=1.0),
+              CLBNode.from_node_json(2, self.node21)],
+             {'1': CLB(True), '2': CLB(False)}))
+        self.assertEqual(
+            self._entries(),
+            {('tid', '1'): CLBCacheEntry(
+                fetched_at=100.0, nodes=[self.node11],
+                health_monitor={"type": "CONNECT"},
+                drained_at=pmap({'11': 1.0})),
+             ('tid', '2'): CLBCacheEntry(
+                 fetched_at=100.0, nodes=[self.node21], health_monitor={})})
+
+    def test_no_tenant_not_cached(self):
+        """
+        Contents are not cached or taken from cache if tenant is not given.
+        """
+        self._set_entries(pmap({
+            ('tid', '1'): CLBCacheEntry(fetched_at=80.0, nodes=[],
+                                        health_monitor={})}))
+        seq = [
+            parallel_sequence([[nodes_req(1, [self.node21])],
+                               [lb_hm_req(1, {})]]),
+            parallel_sequence([]),
+        ]
+        self.assertEqual(
+            self._get(seq, tenant_id=None, lb_ids=['1']),
+            ([CLBNode.from_node_json(1, self.node21)], {'1': CLB(False)}))
+        self.assertEqual(list(self._entries().keys()), [('tid', '1')])
+
+    def test_tenants_do_not_share(self):
+        """
+        Contents of a CLB cached for one tenant are not given to another
+        tenant requesting the same CLB, which fetches and caches its own.
+        """
+        self._set_entries(pmap({
+            ('t1', '1'): CLBCacheEntry(fetched_at=80.0, nodes=[self.node11],
+                                       health_monitor={"type": "CONNECT"},
+                                       drained_at=pmap({'11': 1.0}))}))
+        seq = [
+            (Func(time.time), lambda i: 100.0),
+            parallel_sequence([[nodes_req(1, [self.node21])],
+                               [lb_hm_req(1, {})]]),
+            parallel_sequence([]),
+        ]
+        self.assertEqual(
+            self._get(seq, tenant_id='t2', lb_ids=['1']),
+            ([CLBNode.from_node_json(1, self.node21)], {'1': CLB(False)}))
+        seq = [
+            (Func(time.time), lambda i: 101.0),
+            parallel_sequence([]),
+            parallel_sequence([]),
+        ]
+        self.assertEqual(
+            self._get(seq, tenant_id='t1', lb_ids=['1']),
+            ([attr.assoc(CLBNode.from_node_json(1, self.node11),
+                         _drained_at=1.0)],
+             {'1': CLB(True)}))
+        self.assertEqual(
+            self._entries(),
+            {('t1', '1'): CLBCacheEntry(fetched_at=80.0, nodes=[self.node11],
+                                        health_monitor={"type": "CONNECT"},
+                                        drained_at=pmap({'11': 1.0})),
+             ('t2', '1'): CLBCacheEntry(fetched_at=100.0, nodes=[self.node21],
+                                        health_monitor={})})
+
+    def test_uses_fresh_entries(self):
+        """
+        Nodes and health monitors of CLBs in cache that have not expired are
+        not fetched and the drained time of nodes still DRAINING is reused.
+        Expired entries are refetched.
+        """
+        self._set_entries(pmap({
+            ('tid', '1'): CLBCacheEntry(fetched_at=80.0, nodes=[self.node11],
+                                        health_monitor={"type": "CONNECT"},
+                                        drained_at=pmap({'11': 1.0})),
+            ('tid', '2'): CLBCacheEntry(fetched_at=60.0, nodes=[],
+                                        health_monitor={})}))
+        seq = [
+            lb_req('loadbalancers', True,
+                   {'loadBalancers': [{'id': 1}, {'id': 2}]}),
+            (Func(time.time), lambda i: 100.0),
+            parallel_sequence([[nodes_req(2, [self.node21])],
+                               [lb_hm_req(2, {})]]),
+            parallel_sequence([]),
+        ]
+        self.assertEqual(
+            self._get(seq),
+            ([attr.assoc(CLBNode.from_node_json(1, self.node11),
+                         _drained_at=1.0),
+              CLBNode.from_node_json(2, self.node21)],
+             {'1': CLB(True), '2': CLB(False)}))
+        self.assertEqual(self._entries()[('tid', '1')].fetched_at, 80.0)
+        self.assertEqual(self._entries()[('tid', '2')].fetched_at, 100.0)
+
+    def test_drained_at_refetched_after_expiry(self):
+        """
+        Drained time of a node still DRAINING is fetched again when its CLB's
+        entry expires, since the node could have been enabled and drained
+        again since.
+        """
+        self._set_entries(pmap({
+            ('tid', '1'): CLBCacheEntry(
+                fetched_at=60.0, nodes=[self.node11], health_monitor={},
+                drained_at=pmap({'11': 5.0}))}))
+        seq = [
+            lb_req('loadbalancers', True, {'loadBalancers': [{'id': 1}]}),
+            (Func(time.time), lambda i: 100.0),
+            parallel_sequence([[nodes_req(1, [self.node11])],
+                               [lb_hm_req(1, {})]]),
+            parallel_sequence([[node_feed_req('1', '11', '11feed')]]),
+        ]
+        self.assertEqual(
+            self._get(seq)[0],
+            [attr.assoc(CLBNode.from_node_json(1, self.node11),
+                        _drained_at=1.0)])
+        self.assertEqual(self._entries()[('tid', '1')].drained_at,
+                         {'11': 1.0})
+
+    def test_deleted_lb_removed(self):
+        """
+        CLBs found to be deleted are removed from the cache and other expired
+        entries are pruned.
+        """
+        self._set_entries(pmap({
+            ('tid', '1'): CLBCacheEntry(fetched_at=60.0, nodes=[],
+                                        health_monitor={}),
+            ('t2', '3'): CLBCacheEntry(fetched_at=60.0, nodes=[],
+                                       health_monitor={})
+        }))
+        seq = [
+            lb_req('loadbalancers', True, {'loadBalancers': [{'id': 1}]}),
+            (Func(time.time), lambda i: 100.0),
+            parallel_sequence([
+                [lb_req('loadbalancers/1/nodes', True,
+                        CLBNotFoundError(lb_id=u'1'))],
+                [lb_req('loadbalancers/1/healthmonitor', True,
+                        CLBNotFoundError(lb_id=u'1'))]]),
+            parallel_sequence([]),
+        ]
+        self.assertEqual(self._get(seq), ([], {}))
+        self.assertEqual(self._entries(), {})
+
+    def test_invalidated_while_fetching(self):
+        """
+        Contents of a CLB invalidated while it was getting fetched are not
+        cached.
+        """
+        intent, performer = nodes_req(1, [self.node21])
+
+        def invalidate(intent):
+            sync_perform(
+                self.dispatcher,
+                invalidate_clb_contents('tid', '1', Effect(Constant(None)),
+                                        self.cache, self.get_config_value))
+            return performer(intent)
+
+        seq = [
+            lb_req('loadbalancers', True, {'loadBalancers': [{'id': 1}]}),
+            (Func(time.time), lambda i: 100.0),
+            parallel_sequence([
+                [(intent, invalidate)],
+                [lb_hm_req(1, {})]]),
+            parallel_sequence([]),
+        ]
+        self._get(seq)
+        self.assertEqual(self._entries(),
+                         {('tid', '1'): CLBCacheEntry(generation=1)})
+
+    def test_invalidate(self):
+        """
+        :func:`invalidate_clb_contents` removes cached contents of the
+        tenant's CLB after the effect succeeds or fails and returns the
+        effect's result. Contents of the same CLB cached for other tenants
+        are left alone.
+        """
+        entry = CLBCacheEntry(fetched_at=60.0, nodes=[], health_monitor={})
+        self._set_entries(pmap({('tid', '1'): entry, ('tid', '2'): entry,
+                                ('t2', '1'): entry}))
+        eff = invalidate_clb_contents('tid', '1', Effect(Constant('r')),
+                                      self.cache, self.get_config_value)
+        self.assertEqual(sync_perform(self.dispatcher, eff), 'r')
+        eff = invalidate_clb_contents('tid', '2',
+                                      Effect(Error(ValueError('e'))),
+                                      self.cache, self.get_config_value)
+        self.assertRaises(ValueError, sync_perform, self.dispatcher, eff)
+        self.assertEqual(
+            self._entries(),
+            {('tid', '1'): CLBCacheEntry(generation=1),
+             ('tid', '2'): CLBCacheEntry(generation=1),
+             ('t2', '1'): entry})
+
+    def test_invalidate_disabled(self):
+        """
+        :func:`invalidate_clb_contents` returns the effect as is if caching
+        is not configured.
+        """
+        eff = Effect(Constant('r'))
+        self.assertIs(
+            invalidate_clb_contents('tid', '1', eff, self.cache,
+                                    lambda k: None),
+            eff)
+
+
 class GetRCv3ContentsTests(SynchronousTestCase):
     """
     Tests for :func:`otter.convergence.get_rcv3_contents`
@@ -696,6 +1070,27 @@ class GetRCv3ContentsTests(SynchronousTestCase):
         self.assertEqual(
             sync_perform(dispatcher, get_rcv3_contents()), [])
 
+    def test_lb_ids(self):
+        """
+        If ``lb_ids`` is given, only the nodes of those pools are fetched
+        without listing the pools. Pools that are not found have no nodes.
+        """
+        dispatcher = self.get_dispatcher([
+            (service_request(ServiceType.RACKCONNECT_V3, 'GET',
+                             'load_balancer_pools/0/nodes',
+                             success_pred=has_code(200, 404)).intent,
+             (StubResponse(200, {}),
+              [{'id': "0node0", 'cloud_server': {'id': '0server0'}}])),
+            (service_request(ServiceType.RACKCONNECT_V3, 'GET',
+                             'load_balancer_pools/1/nodes',
+                             success_pred=has_code(200, 404)).intent,
+             (StubResponse(404, {}), {'message': 'not found'}))
+        ])
+        self.assertEqual(
+            sync_perform(dispatcher, get_rcv3_contents(lb_ids=['0', '1'])),
+            [RCv3Node(node_id='0node0', cloud_server_id='0server0',
+                      description=RCv3Description(lb_id='0'))])
+
     def test_rackconnect_not_supported_on_tenant(self):
         """
         If RackConnectV3 is not supported, return no nodes.
@@ -712,8 +1107,10 @@ class GetRCv3ContentsTests(SynchronousTestCase):
             sync_perform(dispatcher, get_rcv3_contents()), [])
 
 
-def _constant_as_eff(args, retval):
-    return lambda *a: Effect(Stub(Constant(retval))) if a == args else (1 / 0)
+def _constant_as_eff(args, retval, **kwargs):
+    return lambda *a, **kw: (
+        Effect(Stub(Constant(retval))) if (a, kw) == (args, kwargs)
+        else (1 / 0))
 
 
 class GetAllLaunchServerDataTests(SynchronousTestCase):
@@ -757,7 +1154,8 @@ class GetAllLaunchServerDataTests(SynchronousTestCase):
             get_scaling_group_servers=_constant_as_eff(
                 ('tid', 'gid', self.now), self.servers),
             get_clb_contents=_constant_as_eff(
-                (), (clb_nodes, {'lb1': CLB(True), 'lb2': CLB(False)})),
+                (), (clb_nodes, {'lb1': CLB(True), 'lb2': CLB(False)}),
+                tenant_id='tid'),
             get_rcv3_contents=_constant_as_eff((), rcv3_nodes))
 
         expected_servers = [
@@ -785,13 +1183,244 @@ class GetAllLaunchServerDataTests(SynchronousTestCase):
             self.now,
             get_scaling_group_servers=_constant_as_eff(
                 ('tid', 'gid', self.now), []),
-            get_clb_contents=_constant_as_eff((), ([], {'a': CLB(False)})),
+            get_clb_contents=_constant_as_eff((), ([], {'a': CLB(False)}),
+                                              tenant_id='tid'),
             get_rcv3_contents=_constant_as_eff((), []))
 
         self.assertEqual(
             resolve_stubs(eff),
             {'servers': [], 'lb_nodes': [], 'lbs': {'a': CLB(False)}})
 
+    def test_tracing(self):
+        """
+        With tracing configured, servers, CLB contents and RCv3 nodes are each
+        gathered in a span.
+        """
+        eff = get_all_launch_server_data(
+            'tid',
+            'gid',
+            self.now,
+            get_scaling_group_servers=_constant_as_eff(
+                ('tid', 'gid', self.now), []),
+            get_clb_contents=_constant_as_eff((), ([], {}), tenant_id='tid'),
+            get_rcv3_contents=_constant_as_eff((), []),
+            get_config_value={'converger.tracing': True}.get)
+        self.assertEqual(
+            [e.intent.phase for e in eff.intent.effects],
+            ['gather-servers', 'gather-clb', 'gather-rcv3'])
+
+    def test_with_snapshot(self):
+        """
+        If snapshot is given, the group's servers are taken from snapshot's
+        servers and LB contents are taken from snapshot without fetching
+        anything.
+        """
+        clb_nodes = [CLBNode(node_id='node1', address='ip1',
+                             description=CLBDescription(lb_id='lb1', port=80))]
+        rcv3_nodes = [RCv3Node(node_id='node2', cloud_server_id='a',
+                               description=RCv3Description(lb_id='lb2'))]
+        snapshot = GatherSnapshot(
+            servers=['all'], group_servers={'gid': ['as']},
+            clb_nodes=clb_nodes, clbs={'lb1': CLB(True)},
+            rcv3_nodes=rcv3_nodes)
+
+        def get_scaling_group_servers(tenant_id, group_id, now,
+                                      all_as_servers, all_servers,
+                                      incremental):
+            self.assertEqual((tenant_id, group_id, now, incremental),
+                             ('tid', 'gid', self.now, False))
+            self.assertEqual(all_as_servers().intent,
+                             Constant({'gid': ['as']}))
+            self.assertEqual(all_servers().intent, Constant(['all']))
+            return Effect(Constant(self.servers[:1]))
+
+        eff = get_all_launch_server_data(
+            'tid', 'gid', self.now, snapshot,
+            get_scaling_group_servers=get_scaling_group_servers,
+            get_clb_contents=lambda: 1 / 0,
+            get_rcv3_contents=lambda: 1 / 0)
+
+        dispatcher = ComposedDispatcher([
+            TypeDispatcher({ParallelEffects: perform_parallel_async}),
+            base_dispatcher])
+        self.assertEqual(
+            sync_perform(dispatcher, eff),
+            {'servers': [
+                server('a', ServerState.ACTIVE, servicenet_address='10.0.0.1',
+                       links=freeze([{'href': 'link1', 'rel': 'self'}]),
+                       json=freeze(self.servers[0]))],
+             'lb_nodes': clb_nodes + rcv3_nodes,
+             'lbs': {'lb1': CLB(True)}})
+
+    def test_with_partial_snapshot(self):
+        """
+        If snapshot doesn't have the CLBs or RCv3 nodes, they are fetched.
+        """
+        rcv3_nodes = [RCv3Node(node_id='node2', cloud_server_id='a',
+                               description=RCv3Description(lb_id='lb2'))]
+        snapshot = GatherSnapshot(
+            servers=['all'], group_servers={'gid': ['as']},
+            clb_nodes=None, clbs=None, rcv3_nodes=rcv3_nodes)
+        eff = get_all_launch_server_data(
+            'tid', 'gid', self.now, snapshot,
+            get_scaling_group_servers=lambda *a, **kw: Effect(
+                Constant(self.servers[:1])),
+            get_clb_contents=lambda tenant_id: Effect(
+                Constant(([], {'lb1': CLB(True)}))),
+            get_rcv3_contents=lambda: 1 / 0)
+        dispatcher = ComposedDispatcher([
+            TypeDispatcher({ParallelEffects: perform_parallel_async}),
+            base_dispatcher])
+        result = sync_perform(dispatcher, eff)
+        self.assertEqual(result['lb_nodes'], rcv3_nodes)
+        self.assertEqual(result['lbs'], {'lb1': CLB(True)})
+
+    def test_scoped_lbs(self):
+        """
+        If ``converger.scoped_lb_gather`` is configured, only the load
+        balancers in the desired state and in the servers' metadata are
+        fetched, after getting the servers.
+        """
+        self.servers[0]['metadata'] = {
+            'rax:autoscale:lb:CloudLoadBalancer:lb2': json.dumps(
+                [{'port': 80}]),
+            'rax:autoscale:lb:RackConnectV3:pool2': ''}
+        desired = DesiredServerGroupState(
+            server_config={}, capacity=2,
+            desired_lbs=pset([CLBDescription(lb_id='lb1', port=80),
+                              CLBDescription(lb_id='lb1', port=8080),
+                              RCv3Description(lb_id='pool1')]))
+        clb_nodes = [CLBNode(node_id='node1', address='ip1',
+                             description=CLBDescription(lb_id='lb1', port=80))]
+
+        def get_clb_contents(lb_ids, tenant_id):
+            self.assertEqual((lb_ids, tenant_id), (['lb1', 'lb2'], 'tid'))
+            return Effect(Constant((clb_nodes, {'lb1': CLB(True)})))
+
+        def get_rcv3_contents(lb_ids):
+            self.assertEqual(lb_ids, ['pool1', 'pool2'])
+            return Effect(Constant([]))
+
+        eff = get_all_launch_server_data(
+            'tid', 'gid', self.now, None, desired,
+            get_scaling_group_servers=lambda *a: Effect(
+                Constant(self.servers)),
+            get_clb_contents=get_clb_contents,
+            get_rcv3_contents=get_rcv3_contents,
+            get_config_value={'converger.scoped_lb_gather': True}.get)
+        dispatcher = ComposedDispatcher([
+            TypeDispatcher({ParallelEffects: perform_parallel_async}),
+            base_dispatcher])
+        result = sync_perform(dispatcher, eff)
+        self.assertEqual([srv.id for srv in result['servers']], ['a', 'b'])
+        self.assertEqual(result['lb_nodes'], clb_nodes)
+        self.assertEqual(result['lbs'], {'lb1': CLB(True)})
+
+
+class GetTenantGatherSnapshotTests(SynchronousTestCase):
+    """Tests for :func:`get_tenant_gather_snapshot`."""
+
+    def test_tracing(self):
+        """
+        With tracing configured, servers, CLB contents and RCv3 nodes are each
+        gathered in a span.
+        """
+        eff = get_tenant_gather_snapshot(
+            'tid',
+            get_all_server_details=_constant_as_eff((), []),
+            get_clb_contents=_constant_as_eff((), ([], {}), tenant_id='tid'),
+            get_rcv3_contents=_constant_as_eff((), []),
+            get_config_value={'converger.tracing': True}.get)
+        self.assertEqual(
+            [e.intent.phase for e in eff.intent.effects],
+            ['gather-servers', 'gather-clb', 'gather-rcv3'])
+
+    def test_success(self):
+        """
+        Tenant's servers, CLB contents and RCv3 nodes are gathered in
+        :obj:`GatherSnapshot` with servers also grouped on their group ID.
+        """
+        asmeta = "rax:autoscale:group:id"
+        servers = [{'id': 'a', 'metadata': {asmeta: 'g1'}},
+                   {'id': 'b', 'metadata': {}},
+                   {'id': 'c', 'metadata': {asmeta: 'g1'}},
+                   {'id': 'd', 'metadata': {asmeta: 'g2'}}]
+        eff = get_tenant_gather_snapshot(
+            'tid',
+            get_all_server_details=_constant_as_eff((), servers),
+            get_clb_contents=_constant_as_eff((), (['clbn'], {'1': 'clb'}),
+                                              tenant_id='tid'),
+            get_rcv3_contents=_constant_as_eff((), ['rcv3n']))
+        self.assertEqual(
+            resolve_stubs(eff),
+            GatherSnapshot(
+                servers=servers,
+                group_servers={'g1': [servers[0], servers[2]],
+                               'g2': [servers[3]]},
+                clb_nodes=['clbn'], clbs={'1': 'clb'},
+                rcv3_nodes=['rcv3n']))
+
+    def _server(self, server_id, group_id, lb_metadata):
+        metadata = {"rax:autoscale:group:id": group_id}
+        metadata.update(lb_metadata)
+        return {'id': server_id,
+                'status': 'ACTIVE',
+                'image': {'id': 'image'},
+                'flavor': {'id': 'flavor'},
+                'created': '1970-01-01T00:00:00Z',
+                'addresses': {},
+                'links': [],
+                'metadata': metadata}
+
+    def _perform(self, eff):
+        dispatcher = ComposedDispatcher([
+            TypeDispatcher({ParallelEffects: perform_parallel_async}),
+            base_dispatcher])
+        return sync_perform(dispatcher, eff)
+
+    def test_only_used_services(self):
+        """
+        If ``desired_lbs`` and ``group_ids`` are given, only CLBs or RCv3
+        nodes referred to by ``desired_lbs`` are gathered. The snapshot has
+        None in place of the rest.
+        """
+        servers = [self._server('a', 'g1', {})]
+        eff = get_tenant_gather_snapshot(
+            'tid', pset([CLBDescription(lb_id='lb1', port=80)]), ['g1'],
+            get_all_server_details=lambda: Effect(Constant(servers)),
+            get_clb_contents=lambda tenant_id: Effect(
+                Constant((['clbn'], {}))),
+            get_rcv3_contents=lambda: 1 / 0)
+        self.assertEqual(
+            self._perform(eff),
+            GatherSnapshot(
+                servers=servers, group_servers={'g1': servers},
+                clb_nodes=['clbn'], clbs={}, rcv3_nodes=None))
+
+    def test_services_of_servers_metadata(self):
+        """
+        If ``desired_lbs`` and ``group_ids`` are given, load balancers in the
+        metadata of the groups' servers are also considered used. Servers of
+        other groups are not considered.
+        """
+        servers = [
+            self._server('a', 'g1',
+                         {'rax:autoscale:lb:RackConnectV3:pool': ''}),
+            self._server('b', 'g2',
+                         {'rax:autoscale:lb:CloudLoadBalancer:lb1':
+                          json.dumps([{'port': 80}])})]
+        eff = get_tenant_gather_snapshot(
+            'tid', pset(), ['g1'],
+            get_all_server_details=lambda: Effect(Constant(servers)),
+            get_clb_contents=lambda: 1 / 0,
+            get_rcv3_contents=lambda: Effect(Constant(['rcv3n'])))
+        self.assertEqual(
+            self._perform(eff),
+            GatherSnapshot(
+                servers=servers,
+                group_servers={'g1': servers[:1], 'g2': servers[1:]},
+                clb_nodes=None, clbs=None, rcv3_nodes=['rcv3n']))
+
 
 class GetAllStacksTests(SynchronousTestCase):
     """Tests for :func:`get_all_stacks`."""
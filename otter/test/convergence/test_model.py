@@ -23,14 +23,19 @@ from otter.convergence.model import (
     ILBNode,
     NovaServer,
     RCv3Description,
+    RCv3Node,
     ServerState,
     StackState,
     _private_ipv4_addresses,
+    _server_cache_key,
     _servicenet_address,
-    get_service_metadata,
     generate_metadata,
-    group_id_from_metadata
+    get_service_metadata,
+    group_id_from_metadata,
+    index_lb_nodes,
+    server_from_details_json
 )
+from otter.util.lru import LRUCache
 
 
 @implementer(ILBDescription)
@@ -286,6 +291,54 @@ class CLBNodeTests(SynchronousTestCase):
                         type=CLBNodeType.SECONDARY)))
 
 
+class IndexLBNodesTests(SynchronousTestCase):
+    """
+    Tests for :func:`index_lb_nodes`.
+    """
+    def _server(self, server_id, address):
+        return NovaServer(id=server_id, state=ServerState.ACTIVE, created=0.0,
+                          servicenet_address=address, image_id='image',
+                          flavor_id='flavor')
+
+    def test_matching_nodes(self):
+        """
+        The returned function returns the CLB and RCv3 nodes matching the
+        server in the order they were given, same as filtering them with
+        :func:`ILBNode.matches`.
+        """
+        clb = CLBDescription(lb_id='12345', port=80)
+        rcv3 = RCv3Description(lb_id='pool')
+        nodes = [
+            CLBNode(node_id='1', description=clb, address='10.1.1.1'),
+            RCv3Node(node_id='2', description=rcv3, cloud_server_id='s1'),
+            CLBNode(node_id='3', description=clb, address='10.1.1.2'),
+            CLBNode(node_id='4', description=clb, address='10.1.1.1'),
+            RCv3Node(node_id='5', description=rcv3, cloud_server_id='s2')]
+        lb_nodes_of = index_lb_nodes(nodes)
+        for server in [self._server('s1', '10.1.1.1'),
+                       self._server('s2', '10.1.1.2'),
+                       self._server('s3', '10.1.1.3'),
+                       self._server('10.1.1.1', '')]:
+            self.assertEqual(
+                lb_nodes_of(server),
+                [node for node in nodes if node.matches(server)])
+        self.assertEqual(
+            [node.node_id for node in lb_nodes_of(
+                self._server('s1', '10.1.1.1'))],
+            ['1', '2', '4'])
+
+    def test_only_nova_servers(self):
+        """
+        The returned function returns no nodes for objects that are not
+        :class:`NovaServer`.
+        """
+        node = CLBNode(node_id='1234', address='10.1.1.1',
+                       description=CLBDescription(lb_id='12345', port=80))
+        self.assertEqual(
+            index_lb_nodes([node])(DummyServer(servicenet_address="10.1.1.1")),
+            [])
+
+
 class ServiceMetadataTests(SynchronousTestCase):
     """
     Tests for :func:`get_service_metadata`.
@@ -456,6 +509,29 @@ class NovaServerTests(SynchronousTestCase):
                        links=freeze(self.servers[0]['links']),
                        json=freeze(self.servers[0])))
 
+    def test_links_shared_with_json(self):
+        """
+        Links of the server are the ones in its frozen JSON rather than
+        another copy of them.
+        """
+        server = NovaServer.from_server_details_json(self.servers[0])
+        self.assertIs(server.links, server.json['links'])
+        self.assertEqual(server.links, freeze(self.servers[0]['links']))
+
+    def test_slotted(self):
+        """
+        Servers, LB nodes and their descriptions do not have an instance
+        ``__dict__``.
+        """
+        clb = CLBDescription(lb_id='1', port=80)
+        rcv3 = RCv3Description(lb_id='2')
+        for obj in [NovaServer.from_server_details_json(self.servers[0]),
+                    clb, CLBNode(node_id='1', address='a', description=clb),
+                    rcv3,
+                    RCv3Node(node_id='2', description=rcv3,
+                             cloud_server_id='s')]:
+            self.assertFalse(hasattr(obj, '__dict__'))
+
     def test_without_private(self):
         """
         Creates server that does not have private/servicenet IP in it.
@@ -636,6 +712,96 @@ class NovaServerTests(SynchronousTestCase):
         self.assertEqual(server.json['status'], 'ablrduelh')
 
 
+class ServerFromDetailsJSONTests(SynchronousTestCase):
+    """
+    Tests for :func:`server_from_details_json`
+    """
+
+    def setUp(self):
+        """
+        Sample server JSON with "updated" and empty cache
+        """
+        self.server_json = dict(sample_servers()[0],
+                                updated='2020-10-10T10:00:00Z')
+        self.cache = LRUCache(10)
+
+    def test_builds_server(self):
+        """
+        Returns same server as :meth:`NovaServer.from_server_details_json`
+        """
+        self.assertEqual(
+            server_from_details_json(self.server_json, self.cache),
+            NovaServer.from_server_details_json(self.server_json))
+
+    def test_same_json(self):
+        """
+        Returns the cached server when the same JSON is given again, even if
+        it is a different object
+        """
+        server = server_from_details_json(self.server_json, self.cache)
+        self.assertIs(
+            server_from_details_json(dict(self.server_json), self.cache),
+            server)
+
+    def test_updated_changed(self):
+        """
+        Builds a new server when "updated" of the server changes
+        """
+        server = server_from_details_json(self.server_json, self.cache)
+        server_json = dict(self.server_json, status='ERROR',
+                           updated='2020-10-10T11:00:00Z')
+        new_server = server_from_details_json(server_json, self.cache)
+        self.assertEqual(new_server.state, ServerState.ERROR)
+        self.assertIsNot(new_server, server)
+
+    def test_json_changed_without_updated(self):
+        """
+        Builds a new server when the JSON changes but "updated" does not, like
+        when otter marks the server deleted
+        """
+        server_from_details_json(self.server_json, self.cache)
+        server_json = dict(self.server_json, status='DELETED')
+        server = server_from_details_json(server_json, self.cache)
+        self.assertEqual(server.state, ServerState.DELETED)
+        self.assertIs(server_from_details_json(server_json, self.cache),
+                      server)
+
+    def test_without_updated(self):
+        """
+        Servers without "updated" are not cached
+        """
+        server_json = sample_servers()[0]
+        server = server_from_details_json(server_json, self.cache)
+        self.assertEqual(
+            server, NovaServer.from_server_details_json(server_json))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_metadata_changed_without_updated(self):
+        """
+        Builds a new server when the metadata changes but "updated" does not,
+        like when otter marks the server draining
+        """
+        server = server_from_details_json(self.server_json, self.cache)
+        server_json = dict(
+            self.server_json,
+            metadata=dict(self.server_json.get('metadata', {}),
+                          **{'rax:autoscale:server:state': 'DRAINING'}))
+        new_server = server_from_details_json(server_json, self.cache)
+        self.assertIsNot(new_server, server)
+        self.assertEqual(
+            new_server,
+            NovaServer.from_server_details_json(server_json))
+
+    def test_stores_server(self):
+        """
+        The cache stores the server without the JSON it was built from
+        """
+        server = server_from_details_json(self.server_json, self.cache)
+        self.assertEqual(len(self.cache), 1)
+        self.assertIs(
+            self.cache.get(_server_cache_key(self.server_json)), server)
+
+
 class IPAddressTests(SynchronousTestCase):
     """
     Tests for utility functions that extract IP addresses from server
@@ -5,7 +5,7 @@ Tests for :mod:`otter.convergence.selfheal`
 from effect import base_dispatcher, raise_
 from effect.testing import (
     SequenceDispatcher, const, conste, intent_func, nested_sequence, noop,
-    perform_sequence)
+    parallel_sequence, perform_sequence)
 
 import mock
 
@@ -15,8 +15,9 @@ from twisted.internet.task import Clock
 from twisted.trial.unittest import SynchronousTestCase
 
 from otter.convergence import selfheal as sh
-from otter.log.intents import BoundFields, Log
-from otter.models.intents import GetAllValidGroups, GetScalingGroupInfo
+from otter.log.intents import BoundFields, Log, LogErr
+from otter.models.intents import (
+    GetAllValidGroups, GetScalingGroupInfo, GetScalingGroupStatuses)
 from otter.models.interface import (
     GroupState, NoSuchScalingGroupError, ScalingGroupStatus)
 from otter.test.utils import CheckFailure, matches, mock_log
@@ -55,6 +56,25 @@ class SelfHealTests(SynchronousTestCase):
             self.assertEqual(c.args,
                              (self.s.dispatcher, "t{}g{}".format(i, i)))
 
+    def test_setup_batches(self):
+        """
+        With ``batch_size``, convergences are triggered on batches of groups
+        over specified time range
+        """
+        self.patch(sh, "check_and_trigger_groups",
+                   lambda groups: [g["groupId"] for g in groups])
+        self.s.batch_size = 2
+        self.s.dispatcher = SequenceDispatcher(
+            [(("ggtc", "cf"), const(self.groups))])
+        self.successResultOf(self.s.setup())
+        calls = self.clock.getDelayedCalls()
+        self.assertEqual(self.s._calls, calls)
+        self.assertEqual(
+            [(c.getTime(), c.args) for c in calls],
+            [(0, (self.s.dispatcher, ["g0", "g1"])),
+             (100, (self.s.dispatcher, ["g2", "g3"])),
+             (200, (self.s.dispatcher, ["g4"]))])
+
     def test_setup_err(self):
         """
         ``self.s.setup()`` will log any error and return success
@@ -138,7 +158,7 @@ class CheckTriggerTests(SynchronousTestCase):
              const(("group", self.manifest))),
             (BoundFields(effect=mock.ANY,
                          fields=dict(tenant_id="tid", scaling_group_id="gid")),
-             nested_sequence([(("tg", "tid", "gid"), noop)]))
+             nested_sequence([(("tg", "tid", "gid", "selfheal"), noop)]))
         ]
         self.assertIsNone(
             perform_sequence(seq, sh.check_and_trigger("tid", "gid")))
@@ -192,3 +212,74 @@ class CheckTriggerTests(SynchronousTestCase):
         ]
         self.assertIsNone(
             perform_sequence(seq, sh.check_and_trigger("tid", "gid")))
+
+
+class CheckTriggerGroupsTests(SynchronousTestCase):
+    """
+    Tests for :func:`check_and_trigger_groups`
+    """
+
+    def setUp(self):
+        self.patch(sh, "trigger_convergence_many", intent_func("tgm"))
+
+    def _status(self, status=ScalingGroupStatus.ACTIVE, paused=False,
+                suspended=False):
+        return {"status": status, "paused": paused, "suspended": suspended}
+
+    def test_triggers_active_resumed(self):
+        """
+        Statuses of each tenant's groups are fetched together and
+        convergence is triggered on ACTIVE resumed groups in bulk
+        """
+        groups = [{"tenantId": "t1", "groupId": "g{}".format(i)}
+                  for i in range(4)] + [{"tenantId": "t2", "groupId": "g4"}]
+        seq = [
+            parallel_sequence([
+                [(GetScalingGroupStatuses("t1", ["g0", "g1", "g2", "g3"]),
+                  const({"g0": self._status(),
+                         "g1": self._status(paused=True),
+                         "g2": self._status(suspended=True),
+                         "g3": self._status(ScalingGroupStatus.ERROR)}))],
+                [(GetScalingGroupStatuses("t2", ["g4"]),
+                  const({"g4": self._status()}))]]),
+            (("tgm", [("t1", "g0"), ("t2", "g4")], "selfheal"), noop)
+        ]
+        self.assertIsNone(
+            perform_sequence(seq, sh.check_and_trigger_groups(groups)))
+
+    def test_group_deleted(self):
+        """
+        Deleted groups are logged and not triggered
+        """
+        groups = [{"tenantId": "t1", "groupId": "g1"}]
+        seq = [
+            parallel_sequence([
+                [(GetScalingGroupStatuses("t1", ["g1"]), const({}))]]),
+            (Log("selfheal-group-deleted",
+                 dict(tenant_id="t1", scaling_group_id="g1")),
+             noop)
+        ]
+        self.assertIsNone(
+            perform_sequence(seq, sh.check_and_trigger_groups(groups)))
+
+    def test_tenant_statuses_failed(self):
+        """
+        If getting statuses of a tenant's groups fails, the error is logged
+        and other tenants' groups are still triggered
+        """
+        groups = [{"tenantId": "t1", "groupId": "g1"},
+                  {"tenantId": "t2", "groupId": "g2"}]
+        seq = [
+            parallel_sequence([
+                [(GetScalingGroupStatuses("t1", ["g1"]),
+                  conste(ValueError("oops"))),
+                 (LogErr(CheckFailure(ValueError),
+                         "selfheal-group-statuses-err",
+                         dict(tenant_id="t1")),
+                  noop)],
+                [(GetScalingGroupStatuses("t2", ["g2"]),
+                  const({"g2": self._status()}))]]),
+            (("tgm", [("t2", "g2")], "selfheal"), noop)
+        ]
+        self.assertIsNone(
+            perform_sequence(seq, sh.check_and_trigger_groups(groups)))
@@ -7,55 +7,70 @@ from datetime import datetime, timedelta
 import attr
 
 from effect import (
-    ComposedDispatcher, Effect, Error, FirstError, Func, base_dispatcher,
-    raise_, sync_perform)
+    ComposedDispatcher, Constant, Effect, Error, FirstError, Func,
+    TypeDispatcher, base_dispatcher, raise_, sync_perform)
 from effect.ref import (
     ModifyReference, ReadReference, Reference, reference_dispatcher)
 from effect.testing import (
     SequenceDispatcher, const, conste, intent_func, nested_sequence, noop,
     parallel_sequence, perform_sequence)
 
-from kazoo.exceptions import BadVersionError, NoNodeError
+from kazoo.exceptions import (
+    BadVersionError, NoNodeError, NodeExistsError, RolledBackError)
 from kazoo.recipe.partitioner import PartitionState
 
 import mock
 
 from pyrsistent import freeze, pbag, pmap, pset, s, thaw
 
+from twisted.internet.defer import succeed
 from twisted.trial.unittest import SynchronousTestCase
 
 from otter.auth import NoSuchEndpoint
 from otter.cloud_client import TenantScope
 from otter.cloud_client.clb import NoSuchCLBError
 from otter.constants import CONVERGENCE_DIRTY_DIR
+from otter.convergence import service
 from otter.convergence.composition import (get_desired_server_group_state,
                                            get_desired_stack_group_state)
 from otter.convergence.gathering import (get_all_launch_server_data,
                                          get_all_launch_stack_data)
 from otter.convergence.model import (
-    CLBDescription, CLBNode, ConvergenceIterationStatus, ErrorReason,
-    ServerState, StepResult)
-from otter.convergence.planning import plan_launch_server, plan_launch_stack
+    CLB, CLBDescription, CLBNode, CLBNodeCondition,
+    ConvergenceIterationStatus, ErrorReason, ServerState, StepResult)
+from otter.convergence.planning import (
+    DRAINING_METADATA, plan_launch_server, plan_launch_stack)
 from otter.convergence.service import (
+    Backoff,
     ConcurrentError,
     ConvergenceExecutor,
     Converger,
+    DivergentFlags,
+    bucket_of_tenant,
     converge_all_groups,
     converge_one_group,
+    converged_servers_digest,
+    divergent_priority,
     execute_convergence,
     get_executor,
     get_my_divergent_groups,
     is_autoscale_active,
+    jump_hash,
     launch_server_executor,
     launch_stack_executor,
+    mark_divergent_many,
     non_concurrently,
+    stacks_digest,
     trigger_convergence,
+    trigger_convergence_many,
     update_servers_cache,
     update_stacks_cache)
 from otter.convergence.steps import ConvergeLater, CreateServer
+from otter.convergence.tracing import Span
 from otter.log.intents import BoundFields, Log, LogErr, MsgWithTime
 from otter.models.intents import (
     DeleteGroup,
+    GetLaunchConfig,
     GetScalingGroupInfo,
     UpdateGroupErrorReasons,
     UpdateGroupStatus,
@@ -66,6 +81,7 @@ from otter.models.interface import (
 from otter.test.convergence.test_planning import server
 from otter.test.util.test_zk import ZNodeStatStub
 from otter.test.utils import (
+    CheckFailure,
     CheckFailureValue,
     FakePartitioner,
     TestStep,
@@ -74,8 +90,15 @@ from otter.test.utils import (
     mock_group,
     mock_log,
     raise_to_exc_info,
+    test_dispatcher,
     transform_eq)
-from otter.util.zk import CreateOrSet, DeleteNode, GetChildren, GetStat
+from otter.util.config import set_config_data
+from otter.util.lru import LRUCache
+from otter.util.semaphore import (
+    Acquire, PrioritySemaphore, perform_acquire)
+from otter.util.zk import (
+    CreateNode, CreateOrSet, DeleteNode, GetChildren, GetData, Transaction,
+    TransactionFailed)
 
 
 class TriggerConvergenceTests(SynchronousTestCase):
@@ -95,6 +118,19 @@ class TriggerConvergenceTests(SynchronousTestCase):
             perform_sequence(seq, trigger_convergence("t", "g")),
             None)
 
+    def test_reason(self):
+        """
+        Reason for triggering convergence is set as content of the flag
+        """
+        seq = [
+            (CreateOrSet(path="/groups/divergent/t_g", content="policy"),
+             noop),
+            (Log("mark-dirty-success", {}), noop)
+        ]
+        self.assertEqual(
+            perform_sequence(seq, trigger_convergence("t", "g", "policy")),
+            None)
+
     def test_failure(self):
         """
         If setting divergent flag errors, then error is logged and raised
@@ -109,6 +145,152 @@ class TriggerConvergenceTests(SynchronousTestCase):
         self.assertRaises(
             ValueError, perform_sequence, seq, trigger_convergence("t", "g"))
 
+    def test_sharded(self):
+        """
+        With sharded dirty flags configured, the flag is set in the directory
+        of the tenant's bucket
+        """
+        set_config_data(
+            {'converger': {'sharded_dirty_flags': True, 'buckets': 10}})
+        self.addCleanup(set_config_data, {})
+        # bucket_of_tenant('00', 10) is 6
+        seq = [
+            (CreateOrSet(path="/groups/divergent/6/00_g", content="dirty"),
+             noop),
+            (Log("mark-dirty-success", {}), noop)
+        ]
+        self.assertEqual(
+            perform_sequence(seq, trigger_convergence("00", "g")), None)
+
+
+class MarkDivergentManyTests(SynchronousTestCase):
+    """
+    Tests for :func:`mark_divergent_many` and :func:`trigger_convergence_many`
+    """
+
+    def test_transactions(self):
+        """
+        Flags are created in transactions of at most ``chunk_size`` flags
+        without listing the existing ones. Duplicate groups are marked once.
+        """
+        eff = mark_divergent_many(
+            [('t', 'g1'), ('t', 'g2'), ('t', 'g1'), ('t', 'g3')], 'selfheal',
+            chunk_size=2)
+        seq = [
+            parallel_sequence([
+                [(Transaction([CreateNode('/groups/divergent/t_g1',
+                                          'selfheal'),
+                               CreateNode('/groups/divergent/t_g2',
+                                          'selfheal')]),
+                  noop)],
+                [(Transaction([CreateNode('/groups/divergent/t_g3',
+                                          'selfheal')]),
+                  noop)]])
+        ]
+        self.assertEqual(
+            perform_sequence(seq, eff),
+            ['/groups/divergent/t_g1', '/groups/divergent/t_g2',
+             '/groups/divergent/t_g3'])
+
+    def test_transaction_failed(self):
+        """
+        If a transaction fails, the flags that failed are written one at a
+        time and the ones that were rolled back are created in another
+        transaction
+        """
+        eff = mark_divergent_many([('t', 'g1'), ('t', 'g2'), ('t', 'g3')])
+        seq = [
+            parallel_sequence([
+                [(Transaction([CreateNode('/groups/divergent/t_g1', 'dirty'),
+                               CreateNode('/groups/divergent/t_g2', 'dirty'),
+                               CreateNode('/groups/divergent/t_g3',
+                                          'dirty')]),
+                  conste(TransactionFailed(
+                      [RolledBackError(), NodeExistsError(),
+                       RolledBackError()]))),
+                 (Log('mark-dirty-transaction-failed',
+                      {'num_flags': 3, 'num_failed': 1}),
+                  noop),
+                 parallel_sequence([
+                     [(CreateOrSet(path='/groups/divergent/t_g2',
+                                   content='dirty'), noop)],
+                     [(Transaction(
+                         [CreateNode('/groups/divergent/t_g1', 'dirty'),
+                          CreateNode('/groups/divergent/t_g3', 'dirty')]),
+                       noop)]])]])
+        ]
+        perform_sequence(seq, eff)
+
+    def test_transaction_failed_none_rolled_back(self):
+        """
+        If all the operations of a failed transaction failed, the flags are
+        only written one at a time
+        """
+        eff = mark_divergent_many([('t', 'g1')])
+        seq = [
+            parallel_sequence([
+                [(Transaction([CreateNode('/groups/divergent/t_g1',
+                                          'dirty')]),
+                  conste(TransactionFailed([NodeExistsError()]))),
+                 (Log('mark-dirty-transaction-failed',
+                      {'num_flags': 1, 'num_failed': 1}),
+                  noop),
+                 parallel_sequence([
+                     [(CreateOrSet(path='/groups/divergent/t_g1',
+                                   content='dirty'), noop)]])]])
+        ]
+        perform_sequence(seq, eff)
+
+    def test_sharded(self):
+        """
+        With sharded dirty flags configured, flags are created in the
+        directories of their buckets
+        """
+        set_config_data(
+            {'converger': {'sharded_dirty_flags': True, 'buckets': 10}})
+        self.addCleanup(set_config_data, {})
+        # bucket_of_tenant('00', 10) is 6
+        eff = mark_divergent_many([('00', 'g1')])
+        seq = [
+            parallel_sequence([
+                [(Transaction([CreateNode('/groups/divergent/6/00_g1',
+                                          'dirty')]),
+                  noop)]])
+        ]
+        self.assertEqual(perform_sequence(seq, eff),
+                         ['/groups/divergent/6/00_g1'])
+
+    def test_trigger_convergence_many(self):
+        """
+        :func:`trigger_convergence_many` marks the groups divergent with the
+        reason and logs
+        """
+        seq = [
+            parallel_sequence([
+                [(Transaction([CreateNode('/groups/divergent/t_g1',
+                                          'selfheal')]),
+                  noop)]]),
+            (Log('mark-dirty-many-success', {'num_groups': 1}), noop)
+        ]
+        perform_sequence(seq, trigger_convergence_many([('t', 'g1')],
+                                                       'selfheal'))
+
+    def test_trigger_convergence_many_failure(self):
+        """
+        If marking the groups divergent fails, the error is logged and raised
+        """
+        seq = [
+            parallel_sequence([
+                [(Transaction([CreateNode('/groups/divergent/t_g1',
+                                          'dirty')]),
+                  conste(ValueError('oops')))]]),
+            (LogErr(CheckFailure(ValueError), 'mark-dirty-many-failure', {}),
+             noop)
+        ]
+        self.assertRaises(
+            ValueError, perform_sequence, seq,
+            trigger_convergence_many([('t', 'g1')]))
+
 
 class ConvergerTests(SynchronousTestCase):
     """Tests for :obj:`Converger`."""
@@ -117,7 +299,7 @@ class ConvergerTests(SynchronousTestCase):
         self.log = mock_log()
         self.num_buckets = 10
 
-    def _converger(self, converge_all_groups, dispatcher=None):
+    def _converger(self, converge_all_groups, dispatcher=None, **kwargs):
         if dispatcher is None:
             dispatcher = _get_dispatcher()
         # patch global default step limits to have empty {} step_limits
@@ -129,7 +311,7 @@ class ConvergerTests(SynchronousTestCase):
             self._pfactory, build_timeout=3600,
             interval=15,
             limited_retry_iterations=23, step_limits={},
-            converge_all_groups=converge_all_groups)
+            converge_all_groups=converge_all_groups, **kwargs)
 
     def _pfactory(self, buckets, log, got_buckets):
         self.assertEqual(buckets, range(self.num_buckets))
@@ -150,7 +332,7 @@ class ConvergerTests(SynchronousTestCase):
     def test_buckets_acquired(self):
         """
         When buckets are allocated, the result of converge_all_groups is
-        performed.
+        performed with the divergent flags in our buckets.
         """
         def converge_all_groups(currently_converging, recent, waiting,
                                 _my_buckets, all_buckets,
@@ -161,10 +343,12 @@ class ConvergerTests(SynchronousTestCase):
                  all_buckets, divergent_flags, build_timeout, interval,
                  limited_retry_iterations, step_limits))
 
-        my_buckets = [0, 5]
+        # bucket_of_tenant of 'flag1', 'flag2' and 'group1' with 10 buckets
+        # are 9, 6 and 3
+        my_buckets = [6, 9]
         bound_sequence = [
             (GetChildren(CONVERGENCE_DIRTY_DIR),
-                lambda i: ['flag1', 'flag2']),
+                lambda i: ['flag2', 'group1', 'flag1']),
             (('converge-all',
                 transform_eq(lambda cc: cc is converger.currently_converging,
                              True),
@@ -185,6 +369,39 @@ class ConvergerTests(SynchronousTestCase):
             result, = self.fake_partitioner.got_buckets(my_buckets)
         self.assertEqual(self.successResultOf(result), 'foo')
 
+    def test_max_concurrent_groups(self):
+        """
+        When ``max_concurrent_groups`` is given, a semaphore of that many
+        group slots is passed to every converge_all_groups call along with
+        groups under capacity.
+        """
+        def converge_all_groups(*args, **kwargs):
+            return Effect(Constant(kwargs))
+
+        converger = self._converger(converge_all_groups,
+                                    max_concurrent_groups=3)
+        self.assertEqual(converger.group_slots.limit, 3)
+        for _ in range(2):
+            self.assertEqual(
+                sync_perform(_get_dispatcher(),
+                             converger._converge_all([0], [])),
+                {'slots': converger.group_slots,
+                 'under_capacity': converger.under_capacity})
+
+    def test_max_backoff_interval(self):
+        """
+        When ``max_backoff_interval`` is given, it is passed to
+        converge_all_groups along with backoffs of groups.
+        """
+        def converge_all_groups(*args, **kwargs):
+            return Effect(Constant(kwargs))
+
+        converger = self._converger(converge_all_groups,
+                                    max_backoff_interval=600)
+        self.assertEqual(
+            sync_perform(_get_dispatcher(), converger._converge_all([0], [])),
+            {'backoffs': converger.backoffs, 'max_backoff_interval': 600})
+
     def test_buckets_acquired_errors(self):
         """
         Errors raised from performing the converge_all_groups effect are
@@ -240,7 +457,7 @@ class ConvergerTests(SynchronousTestCase):
         """
         When notified that divergent groups have changed, and one of the groups
         is associated with a bucket assigned to us, convergence is triggered,
-        and the list of child nodes is passed on to
+        and the new child nodes in our buckets are passed on to
         :func:`converge_all_groups`.
         """
         def converge_all_groups(currently_converging, recent, waiting,
@@ -250,19 +467,259 @@ class ConvergerTests(SynchronousTestCase):
             return Effect(('converge-all-groups', divergent_flags))
 
         intents = [
-            (('converge-all-groups', ['group1', 'group2']),
+            (('converge-all-groups', ['group1']),
              noop)
         ]
         sequence = self._log_sequence(intents)
 
         converger = self._converger(converge_all_groups, dispatcher=sequence)
 
-        # sha1('group1') % 10 == 3
+        # bucket_of_tenant('group1', 10) == 3
         self.fake_partitioner.current_state = PartitionState.ACQUIRED
         self.fake_partitioner.my_buckets = [3]
         with sequence.consume():
             converger.divergent_changed(['group1', 'group2'])
 
+    def test_divergent_changed_only_new(self):
+        """
+        Only the flags that were not seen before are converged when notified
+        of changed divergent groups. Flags seen when not acquired count.
+        """
+        def converge_all_groups(currently_converging, recent, waiting,
+                                _my_buckets, all_buckets,
+                                divergent_flags, build_timeout, interval,
+                                limited_retry_iterations, step_limits):
+            return Effect(('converge-all-groups', divergent_flags))
+
+        sequence = self._log_sequence(
+            [(('converge-all-groups', ['00_g2']), noop)])
+        converger = self._converger(converge_all_groups, dispatcher=sequence)
+        converger.divergent_changed(['group1', '00_g1'])
+
+        # bucket_of_tenant('00', 10) == 6
+        self.fake_partitioner.current_state = PartitionState.ACQUIRED
+        self.fake_partitioner.my_buckets = [3, 6]
+        self.assertIsNone(converger.divergent_changed(['group1', '00_g1']))
+        with sequence.consume():
+            converger.divergent_changed(['group1', '00_g2'])
+        self.assertIsNone(converger.divergent_changed(['group1']))
+
+    def test_sharded_buckets_acquired(self):
+        """
+        With ``watch_children``, directories of acquired buckets are created
+        and watched once, and flags found in them and in the flat directory
+        are converged. Flags of lost buckets are forgotten and their watches
+        are stopped.
+        """
+        def converge_all_groups(currently_converging, recent, waiting,
+                                _my_buckets, all_buckets,
+                                divergent_flags, build_timeout, interval,
+                                limited_retry_iterations, step_limits):
+            return Effect(('converge-all-groups', _my_buckets,
+                           divergent_flags))
+
+        watches = []
+        # bucket_of_tenant('00', 10) == 6
+        sequences = [self._log_sequence([
+            (GetChildren(CONVERGENCE_DIRTY_DIR), const(['6', '00_g1'])),
+            parallel_sequence([
+                [(CreateNode('/groups/divergent/6'), noop)],
+                [(CreateNode('/groups/divergent/9'),
+                  conste(NodeExistsError()))]]),
+            (('converge-all-groups', [6, 9], ['00_g1']), noop)])]
+        converger = self._converger(
+            converge_all_groups, dispatcher=lambda i: sequences[-1](i),
+            watch_children=lambda path, cb: watches.append((path, cb)))
+        self.fake_partitioner.current_state = PartitionState.ACQUIRED
+        self.fake_partitioner.my_buckets = [6, 9]
+        with sequences[-1].consume():
+            self.fake_partitioner.got_buckets([6, 9])
+        [(path6, changed6), (path9, changed9)] = watches
+        self.assertEqual((path6, path9),
+                         ('/groups/divergent/6', '/groups/divergent/9'))
+
+        sequences.append(self._log_sequence(
+            [(('converge-all-groups', [6, 9], ['9/01_g2']), noop)]))
+        with sequences[-1].consume():
+            changed9(['01_g2'])
+        self.assertIsNone(changed9(['01_g2']))
+
+        self.fake_partitioner.my_buckets = [6]
+        sequences.append(self._log_sequence([
+            (GetChildren(CONVERGENCE_DIRTY_DIR), const(['6'])),
+            parallel_sequence([]),
+            (('converge-all-groups', [6], []), noop)]))
+        with sequences[-1].consume():
+            self.fake_partitioner.got_buckets([6])
+        self.assertEqual(len(watches), 2)
+        self.assertIs(changed9(['01_g2', '01_g3']), False)
+        self.assertEqual(converger.divergent_flags.in_buckets([9]), [])
+
+    def test_sharded_changed_not_acquired(self):
+        """
+        Flags of a watched bucket are remembered but not converged when
+        buckets are not acquired.
+        """
+        watches = []
+        converger = self._converger(
+            lambda *a, **kw: 1 / 0,
+            watch_children=lambda path, cb: watches.append(cb))
+        perform_sequence(
+            [parallel_sequence([[(CreateNode('/groups/divergent/3'), noop)]])],
+            converger._watch_buckets([3]))
+        [changed] = watches
+        self.assertIsNone(changed(['00_g1']))
+        self.assertEqual(converger.divergent_flags.in_buckets([3]),
+                         ['3/00_g1'])
+
+
+class DivergentFlagsTests(SynchronousTestCase):
+    """Tests for :obj:`DivergentFlags`."""
+
+    def setUp(self):
+        self.flags = DivergentFlags(10)
+
+    def test_update(self):
+        """
+        Updating returns new flags in given order and the flags are indexed by
+        their tenant's bucket
+        """
+        # buckets of tenants '00', '01', 'group1' are 6, 1, 3
+        self.assertEqual(self.flags.update(['01_g2', '00_g1', 'group1']),
+                         ['01_g2', '00_g1', 'group1'])
+        self.assertEqual(self.flags.bucket_of('00_g1'), 6)
+        self.assertEqual(self.flags.in_buckets([6, 1, 7]), ['00_g1', '01_g2'])
+        self.assertEqual(
+            self.flags.update(['00_g3', 'group1', '00_g1']), ['00_g3'])
+        self.assertEqual(self.flags.in_buckets([6, 1]), ['00_g1', '00_g3'])
+        self.assertEqual(self.flags.in_buckets([3]), ['group1'])
+
+    def test_update_hashes_new_only(self):
+        """
+        Tenants are hashed only for flags that were not seen before
+        """
+        calls = []
+
+        def bucket_of_tenant(tenant, num_buckets):
+            calls.append((tenant, num_buckets))
+            return 1
+
+        self.patch(service, 'bucket_of_tenant', bucket_of_tenant)
+        self.flags.update(['00_g1', '01_g2'])
+        self.flags.update(['00_g1', '01_g2', '02_g3'])
+        self.assertEqual(calls, [('00', 10), ('01', 10), ('02', 10)])
+
+    def test_update_bucket(self):
+        """
+        Flags of a bucket's directory are indexed in the bucket and are kept
+        when the flat flags are updated. Bucket directories are not flags.
+        """
+        self.assertEqual(self.flags.update_bucket(3, ['00_g1', '01_g2']),
+                         ['3/00_g1', '3/01_g2'])
+        self.assertEqual(self.flags.update(['3', '00_g3']), ['00_g3'])
+        self.assertEqual(self.flags.in_buckets([3, 6]),
+                         ['00_g3', '3/00_g1', '3/01_g2'])
+        self.assertEqual(self.flags.update_bucket(3, ['01_g2', '02_g4']),
+                         ['3/02_g4'])
+        self.assertEqual(self.flags.update([]), [])
+        self.assertEqual(self.flags.in_buckets([3, 6]),
+                         ['3/01_g2', '3/02_g4'])
+        self.assertEqual(self.flags.bucket_of('3/01_g2'), 3)
+
+
+class ConvergerCostsTests(SynchronousTestCase):
+    """
+    Tests for measuring and publishing convergence costs of buckets in
+    :obj:`Converger`.
+    """
+
+    def setUp(self):
+        self.published = []
+        self.converger = Converger(
+            mock_log(), _get_dispatcher(), 10, self._pfactory,
+            build_timeout=3600, interval=15, limited_retry_iterations=23,
+            step_limits={}, converge_all_groups=self._converge_all_groups,
+            publish_costs_interval=10)
+
+    def _pfactory(self, buckets, log, got_buckets):
+        self.partitioner = FakePartitioner(log, got_buckets)
+        self.partitioner.publish_costs = lambda costs: succeed(
+            self.published.append(costs))
+        return self.partitioner
+
+    def _converge_all_groups(self, *args, **kwargs):
+        return Effect(Constant(kwargs))
+
+    def _add_costs(self, costs):
+        sync_perform(
+            _get_dispatcher(),
+            self.converger.bucket_costs.modify(lambda _: pmap(costs)))
+
+    def _costs(self):
+        return sync_perform(_get_dispatcher(),
+                            self.converger.bucket_costs.read())
+
+    def test_publishes_on_interval(self):
+        """
+        Costs are published every ``publish_costs_interval`` seconds
+        """
+        [timer] = [svc for svc in self.converger
+                   if svc is not self.partitioner]
+        self.assertEqual(timer.step, 10)
+        self.assertEqual(timer.call[0], self.converger.publish_costs)
+
+    def test_publish_costs(self):
+        """
+        Average cost per second of our buckets since last publish are
+        exponentially averaged and published. The costs are reset.
+        """
+        self.partitioner.current_state = PartitionState.ACQUIRED
+        self.partitioner.my_buckets = [2, 3]
+        self._add_costs({2: 5.0, 7: 1.0})
+        self.successResultOf(self.converger.publish_costs())
+        self.assertEqual(self._costs(), pmap())
+        self.successResultOf(self.converger.publish_costs())
+        self.assertEqual(self.published,
+                         [{2: 0.25, 3: 0.0}, {2: 0.125, 3: 0.0}])
+
+    def test_publish_costs_not_acquired(self):
+        """
+        Costs are reset but not published if buckets are not acquired
+        """
+        self._add_costs({2: 5.0})
+        self.assertIsNone(self.converger.publish_costs())
+        self.assertEqual(self._costs(), pmap())
+        self.assertEqual(self.published, [])
+
+    def test_converge_one_group_timed(self):
+        """
+        Time taken to converge a group is added to its tenant's bucket cost,
+        even if it fails.
+        """
+        self.assertEqual(
+            sync_perform(_get_dispatcher(), self.converger._converge_all(
+                [], [])),
+            {'converge_one_group': self.converger._timed_converge_one_group})
+        calls = []
+
+        def converge_one_group(*args, **kwargs):
+            calls.append((args, kwargs))
+            return Effect(Error(ValueError('bad')))
+
+        self.patch(service, 'converge_one_group', converge_one_group)
+        self._add_costs({6: 1.0})
+        # bucket_of_tenant('00', 10) is 6
+        eff = self.converger._timed_converge_one_group(
+            'cc', 'rc', 'w', '00', 'g1', 5, snapshot='s')
+        seq = [(Func(time.time), const(100)),
+               (Func(time.time), const(103.5))]
+        self.assertRaises(ValueError, perform_sequence, seq, eff,
+                          _get_dispatcher())
+        self.assertEqual(calls,
+                         [(('cc', 'rc', 'w', '00', 'g1', 5),
+                           {'snapshot': 's'})])
+        self.assertEqual(self._costs(), pmap({6: 4.5}))
+
 
 def add_to_recently(recently, group_id, cvg_time):
     """
@@ -321,7 +778,10 @@ class ConvergeOneGroupTests(SynchronousTestCase):
             'ec', self.tenant_id, self.group_id, 3600, self.waiting, 43, {})
 
     def _execute_convergence(self, tenant_id, group_id, build_timeout, waiting,
-                             limited_retry_iterations, step_limits):
+                             limited_retry_iterations, step_limits,
+                             snapshot=None, under_capacity=None,
+                             backoffs=None, dirty_version=None):
+        self.assertEqual(dirty_version, self.version)
         return Effect(('ec', tenant_id, group_id, build_timeout, waiting,
                        limited_retry_iterations, step_limits))
 
@@ -387,6 +847,26 @@ class ConvergeOneGroupTests(SynchronousTestCase):
             3600, 43, {}, execute_convergence=self._execute_convergence)
         perform_sequence(sequence, eff)
 
+    def test_claimed(self):
+        """
+        A group already added to ``currently_converging`` by the caller is
+        converged and removed from it when done.
+        """
+        currently = Reference(pset([self.group_id]))
+        recently = Reference(pmap())
+        sequence = [
+            self._expect_exec(ConvergenceIterationStatus.Stop()),
+            (Func(time.time), lambda i: 100),
+            add_to_recently(recently, self.group_id, 100),
+            remove_from_currently(currently, self.group_id),
+        ] + self._clean_divergent()
+        eff = converge_one_group(
+            currently, recently, self.waiting,
+            self.tenant_id, self.group_id, self.version,
+            3600, 43, {}, claimed=True,
+            execute_convergence=self._execute_convergence)
+        perform_sequence(sequence, eff)
+
     def test_non_concurrent(self):
         """
         Won't run execute_convergence if it's already running for the same
@@ -508,6 +988,78 @@ class ConvergeOneGroupTests(SynchronousTestCase):
         ]
         self._verify_sequence(sequence)
 
+    def test_dirty_flag(self):
+        """
+        When given, the dirty flag is deleted from the given path
+        """
+        sequence = [
+            self._expect_exec(ConvergenceIterationStatus.Stop()),
+            (DeleteNode(path='/groups/divergent/3/tenant-id_g1',
+                        version=self.version), noop),
+            (Log('mark-clean-success', {}), noop)
+        ]
+        eff = converge_one_group(
+            Reference(pset()), Reference(pmap()), self.waiting,
+            self.tenant_id, self.group_id, self.version,
+            3600, 43, {}, dirty_flag='/groups/divergent/3/tenant-id_g1',
+            execute_convergence=self._execute_convergence)
+        perform_sequence(sequence, eff, fallback_dispatcher=_get_dispatcher())
+
+    def _backoffs_after(self, exec_handler, clean_up):
+        """
+        Return backoffs left after converging with backoffs of this and
+        another group, where execute_convergence is performed with
+        ``exec_handler`` and ``clean_up`` is the sequence that follows it.
+        """
+        backoffs = Reference(pmap({'g1': Backoff(5, 'd', 0, 100),
+                                   'g2': Backoff(3, 'd', 0, 100)}))
+        eff = converge_one_group(
+            Reference(pset()), Reference(pmap()), self.waiting,
+            self.tenant_id, self.group_id, self.version,
+            3600, 43, {}, backoffs=backoffs,
+            execute_convergence=self._execute_convergence)
+        perform_sequence([(self._exec_intent, exec_handler)] + clean_up, eff,
+                         fallback_dispatcher=_get_dispatcher())
+        return sync_perform(_get_dispatcher(), backoffs.read())
+
+    def test_forget_backoff_when_flag_deleted(self):
+        """
+        The group's backoff is forgotten when its divergent flag is deleted
+        """
+        self.assertEqual(
+            self._backoffs_after(const(ConvergenceIterationStatus.Stop()),
+                                 self._clean_divergent()),
+            pmap({'g2': Backoff(3, 'd', 0, 100)}))
+
+    def test_forget_backoff_when_group_deleted(self):
+        """
+        The group's backoff is forgotten when the group is deleted or found
+        to be gone
+        """
+        expected = pmap({'g2': Backoff(3, 'd', 0, 100)})
+        self.assertEqual(
+            self._backoffs_after(
+                const(ConvergenceIterationStatus.GroupDeleted()),
+                self._clean_divergent(version=-1)),
+            expected)
+        error = NoSuchScalingGroupError(self.tenant_id, self.group_id)
+        self.assertEqual(
+            self._backoffs_after(
+                conste(error),
+                [(LogErr(CheckFailureValue(error), 'converge-fatal-error',
+                         {}), noop)] + self._clean_divergent()),
+            expected)
+
+    def test_keep_backoff_on_continue(self):
+        """
+        The group's backoff is kept when it continues converging
+        """
+        self.assertEqual(
+            self._backoffs_after(
+                const(ConvergenceIterationStatus.Continue()), []),
+            pmap({'g1': Backoff(5, 'd', 0, 100),
+                  'g2': Backoff(3, 'd', 0, 100)}))
+
 
 def dispatch(dispatcher):
     """
@@ -524,6 +1076,8 @@ class ConvergeAllGroupsTests(SynchronousTestCase):
         self.currently_converging = Reference(pset())
         self.recently_converged = Reference(pmap())
         self.waiting = Reference(pmap())
+        self.backoffs = None
+        self.claimed = False
         self.my_buckets = [1, 6]
         self.all_buckets = range(10)
         self.group_infos = [
@@ -533,7 +1087,7 @@ class ConvergeAllGroupsTests(SynchronousTestCase):
              'dirty-flag': '/groups/divergent/01_g2'}
         ]
 
-    def _converge_all_groups(self, flags):
+    def _converge_all_groups(self, flags, **kwargs):
         return converge_all_groups(
             self.currently_converging, self.recently_converged, self.waiting,
             self.my_buckets, self.all_buckets,
@@ -542,36 +1096,66 @@ class ConvergeAllGroupsTests(SynchronousTestCase):
             15,
             23,
             {},
-            converge_one_group=self._converge_one_group)
+            converge_one_group=self._converge_one_group,
+            **kwargs)
 
     def _converge_one_group(self,
                             currently_converging, recently_converged, waiting,
                             tenant_id, group_id, version, build_timeout,
-                            limited_retry_iterations, step_limits):
+                            limited_retry_iterations, step_limits,
+                            snapshot=None, under_capacity=None,
+                            dirty_flag=None, backoffs=None, claimed=False):
+        self.assertEqual(
+            dirty_flag, '/groups/divergent/{}_{}'.format(tenant_id, group_id))
+        self.assertIs(backoffs, self.backoffs)
+        self.assertEqual(claimed, self.claimed)
         return Effect(
             ('converge', tenant_id, group_id, version, build_timeout,
-             limited_retry_iterations, step_limits))
+             limited_retry_iterations, step_limits, snapshot))
 
-    def _expect_group_converged(self, tenant_id, group_id):
+    def _expect_group_converged(self, tenant_id, group_id, snapshot=None,
+                                version=5):
         """
         Return a SequenceDispatcher two-tuple that matches the usual sequence
-        of intents for converging a single group.
+        of intents for converging a single group with divergent flag of
+        ``version``.
         """
         return (
             BoundFields(mock.ANY,
                         dict(tenant_id=tenant_id, scaling_group_id=group_id)),
             nested_sequence([
-                (GetStat(
-                    path='/groups/divergent/{tenant_id}_{group_id}'.format(
-                        tenant_id=tenant_id, group_id=group_id)),
-                 lambda i: ZNodeStatStub(version=5)),
                 (TenantScope(mock.ANY, tenant_id),
                  nested_sequence([
-                     (('converge', tenant_id, group_id, 5, 3600, 23, {}),
+                     (('converge', tenant_id, group_id, version, 3600, 23,
+                       {}, snapshot),
                       lambda i: 'converged {}!'.format(group_id)),
                  ])),
             ]))
 
+    def _expect_stats(self, *flags):
+        """
+        Return a SequenceDispatcher two-tuple that matches getting version 5
+        of the given divergent flags in parallel. A flag is given as its name
+        or as a (name, reason) tuple and its reason defaults to "dirty".
+        """
+        flags = [(flag, 'dirty') if isinstance(flag, str) else flag
+                 for flag in flags]
+        return parallel_sequence(
+            [[(GetData('/groups/divergent/' + flag),
+               const((reason, ZNodeStatStub(version=5))))]
+             for flag, reason in flags])
+
+    def _expect_tenant_converged(self, tenant_id, *group_ids):
+        """
+        Return a sequence of converging a tenant's groups that do not share
+        a snapshot.
+        """
+        return [
+            (ReadReference(ref=self.currently_converging), const(pset())),
+            parallel_sequence(
+                [[self._expect_group_converged(tenant_id, group_id)]
+                 for group_id in group_ids])]
+
     def test_converge_all_groups(self):
         """
         Fetches divergent groups and runs converge_one_group for each one
@@ -586,8 +1170,9 @@ class ConvergeAllGroupsTests(SynchronousTestCase):
              noop),
             (ReadReference(self.recently_converged), lambda i: pmap()),
             (Func(time.time), lambda i: 100),
-            parallel_sequence([[self._expect_group_converged('00', 'g1')],
-                               [self._expect_group_converged('01', 'g2')]])
+            self._expect_stats('00_g1', '01_g2'),
+            parallel_sequence([self._expect_tenant_converged('00', 'g1'),
+                               self._expect_tenant_converged('01', 'g2')])
         ]
         self.assertEqual(perform_sequence(sequence, eff),
                          ['converged g1!', 'converged g2!'])
@@ -607,7 +1192,8 @@ class ConvergeAllGroupsTests(SynchronousTestCase):
              noop),
             (ReadReference(ref=self.recently_converged), lambda i: pmap()),
             (Func(time.time), lambda i: 100),
-            parallel_sequence([[self._expect_group_converged('01', 'g2')]])
+            self._expect_stats('01_g2'),
+            parallel_sequence([self._expect_tenant_converged('01', 'g2')])
         ]
         self.assertEqual(perform_sequence(sequence, eff), ['converged g2!'])
 
@@ -625,6 +1211,7 @@ class ConvergeAllGroupsTests(SynchronousTestCase):
             (ReadReference(ref=self.recently_converged),
              lambda i: pmap({'g1': 5})),
             (Func(time.time), lambda i: 14),
+            parallel_sequence([]),  # No flags to get
             parallel_sequence([])  # No groups to converge
         ]
         self.assertEqual(perform_sequence(sequence, eff), [])
@@ -651,7 +1238,8 @@ class ConvergeAllGroupsTests(SynchronousTestCase):
                              match_func("literally anything",
                                         pmap({'g2': 10}))),
              noop),
-            parallel_sequence([[self._expect_group_converged('00', 'g1')]])
+            self._expect_stats('00_g1'),
+            parallel_sequence([self._expect_tenant_converged('00', 'g1')])
         ]
         self.assertEqual(perform_sequence(sequence, eff), ['converged g1!'])
 
@@ -668,39 +1256,456 @@ class ConvergeAllGroupsTests(SynchronousTestCase):
 
     def test_ignore_disappearing_divergent_flag(self):
         """
-        When the divergent flag disappears just as we're starting to converge,
-        the group does not get converged and None is returned as its result.
+        When the divergent flag disappears just as we're starting to converge,
+        the group does not get converged.
+
+        This happens when a concurrent convergence iteration is just finishing
+        up.
+        """
+        eff = self._converge_all_groups(['00_g1', '01_g2'])
+        sequence = [
+            (ReadReference(ref=self.currently_converging), lambda i: pset()),
+            (Log('converge-all-groups',
+                 dict(group_infos=self.group_infos, currently_converging=[])),
+             noop),
+            (ReadReference(ref=self.recently_converged), lambda i: pmap()),
+            (Func(time.time), lambda i: 100),
+            parallel_sequence([
+                [(GetData('/groups/divergent/00_g1'), noop)],
+                [(GetData('/groups/divergent/01_g2'),
+                  const(('dirty', ZNodeStatStub(version=5))))]]),
+            (Log('converge-divergent-flag-disappeared',
+                 fields={'znode': '/groups/divergent/00_g1'}),
+             noop),
+            parallel_sequence([self._expect_tenant_converged('01', 'g2')])
+        ]
+        self.assertEqual(perform_sequence(sequence, eff), ['converged g2!'])
+
+    def _tenant_groups_sequence(self, snapshot_handler, snapshot):
+        """
+        Return sequence of converging g1 and g3 of tenant 00 and g2 of tenant
+        01, where tenant 00's snapshot is gathered with ``snapshot_handler``
+        and ``snapshot`` is expected to be passed to g1 and g3 convergence.
+        """
+        infos = [self.group_infos[0], self.group_infos[1],
+                 {'tenant_id': '00', 'group_id': 'g3',
+                  'dirty-flag': '/groups/divergent/00_g3'}]
+        return [
+            (ReadReference(ref=self.currently_converging), lambda i: pset()),
+            (Log('converge-all-groups',
+                 dict(group_infos=infos, currently_converging=[])),
+             noop),
+            (ReadReference(self.recently_converged), lambda i: pmap()),
+            (Func(time.time), lambda i: 100),
+            self._expect_stats('00_g1', '01_g2', '00_g3'),
+            parallel_sequence([
+                [(ReadReference(ref=self.currently_converging),
+                  const(pset()))] +
+                self._launch_configs_sequence() +
+                [(TenantScope(mock.ANY, '00'),
+                  nested_sequence([
+                      (("snapshot", '00',
+                        pset([CLBDescription(lb_id='lb1', port=80)]),
+                        ['g1', 'g3']),
+                       snapshot_handler)]))] +
+                self._snapshot_err_seq(snapshot) +
+                [parallel_sequence([
+                    [self._expect_group_converged('00', 'g1', snapshot)],
+                    [self._expect_group_converged('00', 'g3', snapshot)]])],
+                self._expect_tenant_converged('01', 'g2')])
+        ]
+
+    def _launch_configs_sequence(self, group_ids=('g1', 'g3'),
+                                 types=('launch_server', 'launch_server')):
+        lcs = {
+            'launch_server': {
+                'type': 'launch_server',
+                'args': {'server': {},
+                         'loadBalancers': [
+                             {'loadBalancerId': 'lb1', 'port': 80}]}},
+            'launch_stack': {'type': 'launch_stack', 'args': {}}}
+        return [parallel_sequence(
+            [[(GetLaunchConfig('00', group_id), const(lcs[lc_type]))]
+             for group_id, lc_type in zip(group_ids, types)])]
+
+    def _snapshot_err_seq(self, snapshot):
+        if snapshot is not None:
+            return []
+        return [(LogErr(CheckFailureValue(ValueError('no snapshot')),
+                        'converge-tenant-snapshot-error',
+                        {'tenant_id': '00'}),
+                 noop)]
+
+    def test_tenant_snapshot_shared(self):
+        """
+        When more than one launch_server group of a tenant is to be
+        converged, the tenant's gather snapshot is fetched once for the load
+        balancers of the groups and passed to each of its groups'
+        convergence. Tenants with one group do not get a snapshot.
+        """
+        self.patch(service, 'get_tenant_gather_snapshot',
+                   intent_func("snapshot"))
+        eff = self._converge_all_groups(['00_g1', '01_g2', '00_g3'])
+        sequence = self._tenant_groups_sequence(lambda i: 'snap', 'snap')
+        self.assertEqual(
+            perform_sequence(sequence, eff),
+            ['converged g1!', 'converged g3!', 'converged g2!'])
+
+    def test_tenant_snapshot_error(self):
+        """
+        If the tenant's gather snapshot cannot be fetched, the error is logged
+        and the tenant's groups are converged without a snapshot.
+        """
+        self.patch(service, 'get_tenant_gather_snapshot',
+                   intent_func("snapshot"))
+        eff = self._converge_all_groups(['00_g1', '01_g2', '00_g3'])
+        sequence = self._tenant_groups_sequence(
+            conste(ValueError('no snapshot')), None)
+        self.assertEqual(
+            perform_sequence(sequence, eff),
+            ['converged g1!', 'converged g3!', 'converged g2!'])
+
+    def _tenant_no_snapshot_sequence(self, cc, launch_configs):
+        """
+        Return sequence of converging g1 and g3 of tenant 00 where only g1
+        converges without snapshot.
+        """
+        infos = [self.group_infos[0],
+                 {'tenant_id': '00', 'group_id': 'g3',
+                  'dirty-flag': '/groups/divergent/00_g3'}]
+        return [
+            (ReadReference(ref=self.currently_converging), lambda i: pset()),
+            (Log('converge-all-groups',
+                 dict(group_infos=infos, currently_converging=[])),
+             noop),
+            (ReadReference(self.recently_converged), lambda i: pmap()),
+            (Func(time.time), lambda i: 100),
+            self._expect_stats('00_g1', '00_g3'),
+            parallel_sequence([
+                [(ReadReference(ref=self.currently_converging),
+                  const(pset(cc)))] +
+                launch_configs +
+                [parallel_sequence(
+                    [[self._expect_group_converged('00', 'g1')]] +
+                    ([] if cc else
+                     [[self._expect_group_converged('00', 'g3')]]))]])
+        ]
+
+    def test_tenant_snapshot_not_for_converging(self):
+        """
+        Groups that have started converging while waiting are not converged
+        and not counted towards sharing the snapshot.
+        """
+        self.patch(service, 'get_tenant_gather_snapshot', lambda *a: 1 / 0)
+        eff = self._converge_all_groups(['00_g1', '00_g3'])
+        sequence = self._tenant_no_snapshot_sequence(['g3'], [])
+        self.assertEqual(perform_sequence(sequence, eff), ['converged g1!'])
+
+    def test_tenant_snapshot_not_for_launch_stack(self):
+        """
+        launch_stack groups are not counted towards sharing the snapshot.
+        """
+        self.patch(service, 'get_tenant_gather_snapshot', lambda *a: 1 / 0)
+        eff = self._converge_all_groups(['00_g1', '00_g3'])
+        sequence = self._tenant_no_snapshot_sequence(
+            [], self._launch_configs_sequence(
+                types=('launch_server', 'launch_stack')))
+        self.assertEqual(perform_sequence(sequence, eff),
+                         ['converged g1!', 'converged g3!'])
+
+    def test_tenant_snapshot_launch_config_error(self):
+        """
+        Groups whose launch config can't be read are not counted towards
+        sharing the snapshot.
+        """
+        self.patch(service, 'get_tenant_gather_snapshot', lambda *a: 1 / 0)
+        eff = self._converge_all_groups(['00_g1', '00_g3'])
+        launch_configs = [parallel_sequence([
+            [(GetLaunchConfig('00', 'g1'),
+              const({'type': 'launch_server', 'args': {}}))],
+            [(GetLaunchConfig('00', 'g3'), conste(ValueError('no')))]])]
+        sequence = self._tenant_no_snapshot_sequence([], launch_configs)
+        self.assertEqual(perform_sequence(sequence, eff),
+                         ['converged g1!', 'converged g3!'])
+
+    def _expect_limited_tenant(self, tenant_id, permits, priority, workers,
+                               snapshot=()):
+        """
+        Return a sequence of converging a tenant's groups holding ``permits``
+        of the group slots acquired with ``priority``. ``snapshot`` is the
+        sequence of gathering the tenant's snapshot and ``workers`` is a list
+        of sequences performed by each worker of ``bounded_parallel``.
+        """
+        return [
+            (Acquire(mock.ANY, permits, priority),
+             dispatch(TypeDispatcher({Acquire: perform_acquire})))
+        ] + list(snapshot) + [
+            parallel_sequence(
+                workers,
+                fallback_dispatcher=test_dispatcher(reference_dispatcher))]
+
+    def test_slots_priority(self):
+        """
+        With ``slots``, tenants are converged in order of priority
+        of their flags
+        """
+        self.claimed = True
+        eff = self._converge_all_groups(['00_g1', '01_g2'],
+                                        slots=PrioritySemaphore(1))
+        sequence = [
+            (ReadReference(ref=self.currently_converging), const(pset())),
+            (Log('converge-all-groups',
+                 dict(group_infos=self.group_infos, currently_converging=[])),
+             noop),
+            (ReadReference(self.recently_converged), const(pmap())),
+            (Func(time.time), const(100)),
+            self._expect_stats('00_g1', ('01_g2', 'policy')),
+            parallel_sequence(
+                [self._expect_limited_tenant(
+                    '01', 1, 0, [[self._expect_group_converged('01', 'g2')]]),
+                 self._expect_limited_tenant(
+                     '00', 1, 1,
+                     [[self._expect_group_converged('00', 'g1')]])],
+                fallback_dispatcher=test_dispatcher(reference_dispatcher))
+        ]
+        self.assertEqual(
+            perform_sequence(sequence, eff,
+                             test_dispatcher(reference_dispatcher)),
+            ['converged g2!', 'converged g1!'])
+
+    def test_slots_under_capacity(self):
+        """
+        With ``slots``, groups under capacity are converged before
+        other groups and a tenant's priority is that of its most important
+        group
+        """
+        self.patch(service, 'get_tenant_gather_snapshot',
+                   intent_func("snapshot"))
+        self.claimed = True
+        eff = self._converge_all_groups(
+            ['00_g1', '01_g2', '00_g3'], slots=PrioritySemaphore(1),
+            under_capacity=Reference(pset(['g3'])))
+        sequence = [
+            (ReadReference(ref=self.currently_converging), const(pset())),
+            (Log('converge-all-groups', mock.ANY), noop),
+            (ReadReference(self.recently_converged), const(pmap())),
+            (Func(time.time), const(100)),
+            self._expect_stats(('00_g1', 'selfheal'), '01_g2', '00_g3'),
+            parallel_sequence(
+                [self._expect_limited_tenant(
+                    '00', 1, 0,
+                    [[self._expect_group_converged('00', 'g3', 'snap'),
+                      self._expect_group_converged('00', 'g1', 'snap')]],
+                    self._launch_configs_sequence(('g3', 'g1')) + [
+                        (TenantScope(mock.ANY, '00'),
+                         nested_sequence([(("snapshot", '00', mock.ANY,
+                                            ['g3', 'g1']),
+                                           const('snap'))]))]),
+                 self._expect_limited_tenant(
+                     '01', 1, 1,
+                     [[self._expect_group_converged('01', 'g2')]])],
+                fallback_dispatcher=test_dispatcher(reference_dispatcher))
+        ]
+        self.assertEqual(
+            perform_sequence(sequence, eff,
+                             test_dispatcher(reference_dispatcher)),
+            ['converged g3!', 'converged g1!', 'converged g2!'])
+
+    def test_slots_bounds_groups(self):
+        """
+        With ``slots``, a tenant holds a group slot for each of its
+        groups up to the number of slots and converges at most that many of
+        its groups at a time
+        """
+        self.patch(service, '_gather_tenant_snapshot', lambda *a: Effect(
+            Constant(None)))
+        self.claimed = True
+        eff = self._converge_all_groups(
+            ['00_g1', '00_g3', '00_g4'], slots=PrioritySemaphore(2))
+        sequence = [
+            (ReadReference(ref=self.currently_converging), const(pset())),
+            (Log('converge-all-groups', mock.ANY), noop),
+            (ReadReference(self.recently_converged), const(pmap())),
+            (Func(time.time), const(100)),
+            self._expect_stats('00_g1', '00_g3', '00_g4'),
+            parallel_sequence(
+                [self._expect_limited_tenant('00', 2, 0, [
+                    [self._expect_group_converged('00', 'g1'),
+                     self._expect_group_converged('00', 'g3'),
+                     self._expect_group_converged('00', 'g4')],
+                    []])],
+                fallback_dispatcher=test_dispatcher(reference_dispatcher))
+        ]
+        self.assertEqual(
+            perform_sequence(sequence, eff,
+                             test_dispatcher(reference_dispatcher)),
+            ['converged g1!', 'converged g3!', 'converged g4!'])
+
+    def test_slots_claim_queued_groups(self):
+        """
+        With ``slots``, groups are added to currently converging groups when
+        they are queued for slots. Groups that started converging since the
+        divergent flags were read are not queued.
+        """
+        self.claimed = True
+        # Another cycle queued g1 while this one got the flags
+        self.currently_converging = Reference(pset(['g1']))
+        eff = self._converge_all_groups(['00_g1', '01_g2'],
+                                        slots=PrioritySemaphore(1))
+        sequence = [
+            (ReadReference(ref=self.currently_converging), const(pset())),
+            (Log('converge-all-groups', mock.ANY), noop),
+            (ReadReference(self.recently_converged), const(pmap())),
+            (Func(time.time), const(100)),
+            self._expect_stats('00_g1', '01_g2'),
+            parallel_sequence(
+                [self._expect_limited_tenant(
+                    '01', 1, 0, [[self._expect_group_converged('01', 'g2')]])],
+                fallback_dispatcher=test_dispatcher(reference_dispatcher))
+        ]
+        self.assertEqual(
+            perform_sequence(sequence, eff,
+                             test_dispatcher(reference_dispatcher)),
+            ['converged g2!'])
+        self.assertEqual(
+            sync_perform(_get_dispatcher(), self.currently_converging.read()),
+            pset(['g1', 'g2']))
+
+    def _backoff_sequence(self, version):
+        """
+        Return sequence of converging g1 and g2 where g1 has backed off with
+        flag version 5 and its flag now has ``version``
+        """
+        return [
+            (ReadReference(ref=self.currently_converging), lambda i: pset()),
+            (Log('converge-all-groups',
+                 dict(group_infos=self.group_infos, currently_converging=[])),
+             noop),
+            (ReadReference(self.recently_converged), lambda i: pmap()),
+            (Func(time.time), lambda i: 100),
+            parallel_sequence([
+                [(GetData('/groups/divergent/00_g1'),
+                  const(('dirty', ZNodeStatStub(version=version))))],
+                [(GetData('/groups/divergent/01_g2'),
+                  const(('dirty', ZNodeStatStub(version=5))))]]),
+            (ReadReference(self.backoffs),
+             lambda i: pmap({'g1': Backoff(5, 'digest', 2, 50)})),
+            (Func(time.time), lambda i: 100)
+        ]
+
+    def test_backing_off(self):
+        """
+        A group that is backing off is not converged if its divergent flag
+        has not changed
+        """
+        self.backoffs = Reference(pmap())
+        eff = self._converge_all_groups(
+            ['00_g1', '01_g2'], backoffs=self.backoffs,
+            max_backoff_interval=600)
+        sequence = self._backoff_sequence(5) + [
+            (Log('converge-backing-off', dict(group_ids=['g1'])), noop),
+            parallel_sequence([self._expect_tenant_converged('01', 'g2')])
+        ]
+        self.assertEqual(perform_sequence(sequence, eff), ['converged g2!'])
+
+    def test_backing_off_triggered(self):
+        """
+        A group that is backing off is converged if its divergent flag has
+        changed since
+        """
+        self.backoffs = Reference(pmap())
+        eff = self._converge_all_groups(
+            ['00_g1', '01_g2'], backoffs=self.backoffs,
+            max_backoff_interval=600)
+        sequence = self._backoff_sequence(6) + [
+            parallel_sequence([
+                [(ReadReference(ref=self.currently_converging),
+                  const(pset())),
+                 parallel_sequence(
+                     [[self._expect_group_converged('00', 'g1', version=6)]])],
+                self._expect_tenant_converged('01', 'g2')])
+        ]
+        self.assertEqual(perform_sequence(sequence, eff),
+                         ['converged g1!', 'converged g2!'])
+
+    def test_forget_backoff_of_disappeared_flag(self):
+        """
+        The backoff of a group whose divergent flag has disappeared is
+        forgotten
+        """
+        self.backoffs = Reference(
+            pmap({'g1': Backoff(5, 'digest', 2, 50),
+                  'g3': Backoff(5, 'digest', 2, 50)}))
+        eff = self._converge_all_groups(
+            ['00_g1', '01_g2'], backoffs=self.backoffs,
+            max_backoff_interval=600)
+        sequence = [
+            (ReadReference(ref=self.currently_converging), const(pset())),
+            (Log('converge-all-groups', mock.ANY), noop),
+            (ReadReference(self.recently_converged), const(pmap())),
+            (Func(time.time), const(100)),
+            parallel_sequence([
+                [(GetData('/groups/divergent/00_g1'), noop)],
+                [(GetData('/groups/divergent/01_g2'),
+                  const(('dirty', ZNodeStatStub(version=5))))]]),
+            (Log('converge-divergent-flag-disappeared',
+                 fields={'znode': '/groups/divergent/00_g1'}),
+             noop),
+            parallel_sequence([self._expect_tenant_converged('01', 'g2')])
+        ]
+        self.assertEqual(
+            perform_sequence(sequence, eff,
+                             test_dispatcher(reference_dispatcher)),
+            ['converged g2!'])
+        self.assertEqual(
+            sync_perform(reference_dispatcher, self.backoffs.read()),
+            pmap({'g3': Backoff(5, 'digest', 2, 50)}))
+
+
+class BackoffTests(SynchronousTestCase):
+    """Tests for :obj:`Backoff`."""
+
+    def test_doubles_interval(self):
+        """
+        The group backs off for interval doubled with each repetition
+        """
+        self.assertTrue(Backoff(5, 'd', 0, 100).backing_off(5, 114, 15, 600))
+        self.assertFalse(Backoff(5, 'd', 0, 100).backing_off(5, 115, 15, 600))
+        self.assertTrue(Backoff(5, 'd', 2, 100).backing_off(5, 159, 15, 600))
+        self.assertFalse(Backoff(5, 'd', 2, 100).backing_off(5, 160, 15, 600))
+
+    def test_max_interval(self):
+        """
+        The group does not back off for more than the maximum interval
+        """
+        backoff = Backoff(5, 'd', 10, 100)
+        self.assertTrue(backoff.backing_off(5, 699, 15, 600))
+        self.assertFalse(backoff.backing_off(5, 700, 15, 600))
 
-        This happens when a concurrent convergence iteration is just finishing
-        up.
+    def test_version_changed(self):
         """
-        eff = self._converge_all_groups(['00_g1'])
+        The group does not back off if its divergent flag has changed
+        """
+        self.assertFalse(Backoff(5, 'd', 0, 100).backing_off(6, 101, 15, 600))
 
-        def get_bound_sequence(tid, gid):
-            # since this GetStat is going to return None, no more effects will
-            # be run. This is the crux of what we're testing.
-            znode = '/groups/divergent/{}_{}'.format(tid, gid)
-            return [
-                (GetStat(path=znode), noop),
-                (Log('converge-divergent-flag-disappeared',
-                     fields={'znode': znode}),
-                 noop)]
 
-        sequence = [
-            (ReadReference(ref=self.currently_converging), lambda i: pset()),
-            (Log('converge-all-groups',
-                 dict(group_infos=[self.group_infos[0]],
-                      currently_converging=[])),
-             noop),
-            (ReadReference(ref=self.recently_converged), lambda i: pmap()),
-            (Func(time.time), lambda i: 100),
-            parallel_sequence([
-                [(BoundFields(mock.ANY, fields={'tenant_id': '00',
-                                                'scaling_group_id': 'g1'}),
-                  nested_sequence(get_bound_sequence('00', 'g1')))],
-             ]),
-        ]
-        self.assertEqual(perform_sequence(sequence, eff), [None])
+class DivergentPriorityTests(SynchronousTestCase):
+    """Tests for :func:`divergent_priority`."""
+
+    def test_priorities(self):
+        """
+        Policy executions come first, then groups under capacity, then
+        anything else and then selfheal
+        """
+        self.assertEqual(
+            [divergent_priority('policy', True),
+             divergent_priority('policy', False),
+             divergent_priority('selfheal', True),
+             divergent_priority('dirty', True),
+             divergent_priority('dirty', False),
+             divergent_priority(None, False),
+             divergent_priority('selfheal', False)],
+            [0, 0, 1, 1, 2, 2, 3])
 
 
 class GetMyDivergentGroupsTests(SynchronousTestCase):
@@ -720,6 +1725,84 @@ class GetMyDivergentGroupsTests(SynchronousTestCase):
              {'tenant_id': '00', 'group_id': 'gr2',
               'dirty-flag': '/groups/divergent/00_gr2'}])
 
+    def test_sharded_flags(self):
+        """
+        Flags in a bucket's directory belong to that bucket
+        """
+        result = get_my_divergent_groups(
+            [6], range(10), ['3/00_gr1', '6/01_gr2', '00_gr3'])
+        self.assertEqual(
+            result,
+            [{'tenant_id': '01', 'group_id': 'gr2',
+              'dirty-flag': '/groups/divergent/6/01_gr2'},
+             {'tenant_id': '00', 'group_id': 'gr3',
+              'dirty-flag': '/groups/divergent/00_gr3'}])
+
+
+class BucketOfTenantTests(SynchronousTestCase):
+    """Tests for :func:`bucket_of_tenant` and :func:`jump_hash`."""
+
+    def setUp(self):
+        self.tenants = [str(i) for i in range(1000)]
+        self.jump = {'converger.jump_hash': True}.get
+
+    def _bucket(self, tenant, num_buckets):
+        return bucket_of_tenant(tenant, num_buckets, LRUCache(10), self.jump)
+
+    def test_sha1_mod_by_default(self):
+        """
+        Without "converger.jump_hash", the bucket is sha1 of the tenant modulo
+        the number of buckets
+        """
+        self.assertEqual(
+            [bucket_of_tenant(t, 10, LRUCache(10), lambda k: None)
+             for t in ['00', '01']],
+            [6, 1])
+
+    def test_in_range(self):
+        """
+        With jump hash, tenants are mapped to all the buckets and only to them
+        """
+        self.assertEqual(
+            set(self._bucket(t, 10) for t in self.tenants), set(range(10)))
+
+    def test_consistent(self):
+        """
+        With jump hash, when the number of buckets grows, the tenants that
+        move all move to the new bucket and they are around 1 / (number of
+        buckets) of them.
+        """
+        moved = [t for t in self.tenants
+                 if self._bucket(t, 10) != self._bucket(t, 11)]
+        self.assertEqual(set(self._bucket(t, 11) for t in moved), set([10]))
+        self.assertTrue(50 < len(moved) < 130, len(moved))
+
+    def test_jump_hash_known_values(self):
+        """
+        :func:`jump_hash` gives same buckets as the reference implementation
+        """
+        self.assertEqual(
+            [jump_hash(k, 1) for k in [0, 1, 2 ** 64 - 1]], [0, 0, 0])
+        self.assertEqual(jump_hash(2 ** 64 + 5, 100), jump_hash(5, 100))
+        self.assertEqual(
+            [jump_hash(k, 100) for k in [1, 2, 3, 4, 5]],
+            [55, 62, 8, 45, 59])
+
+    def test_cached(self):
+        """
+        Buckets of tenants are remembered in the given cache separately for
+        each hashing
+        """
+        cache = LRUCache(10)
+        self.assertEqual(bucket_of_tenant('00', 10, cache, self.jump), 7)
+        self.assertEqual(cache.get(('00', 10, True)), 7)
+        cache.set(('00', 10, True), 3)
+        self.assertEqual(bucket_of_tenant('00', 10, cache, self.jump), 3)
+        self.assertEqual(bucket_of_tenant('00', 11, cache, self.jump), 7)
+        self.assertEqual(
+            bucket_of_tenant('00', 10, cache, lambda k: None), 6)
+        self.assertEqual(cache.get(('00', 10, False)), 6)
+
 
 def _get_dispatcher():
     return ComposedDispatcher([
@@ -843,7 +1926,8 @@ class ExecuteConvergenceTests(SynchronousTestCase):
         """
         exec_seq = [
             (self.gsgi, lambda i: self.gsgi_result),
-            (("gacd", self.tenant_id, self.group_id, self.now),
+            (("gacd", self.tenant_id, self.group_id, self.now, None,
+              mock.ANY),
              self.gacd_runner)
         ]
         if with_cache:
@@ -867,15 +1951,31 @@ class ExecuteConvergenceTests(SynchronousTestCase):
              nested_sequence(exec_seq))
         ]
 
-    def _invoke(self, plan=None, executor_base=launch_server_executor):
-        kwargs = {'plan': plan} if plan is not None else {}
+    def _invoke(self, plan=None, executor_base=launch_server_executor,
+                **kwargs):
+        plan_kwargs = {'plan': plan} if plan is not None else {}
         executor = attr.assoc(executor_base,
-                              gather=intent_func("gacd"), **kwargs)
+                              gather=intent_func("gacd"), **plan_kwargs)
         return execute_convergence(
             self.tenant_id, self.group_id, build_timeout=3600,
             waiting=self.waiting,
             limited_retry_iterations=43, step_limits={},
-            get_executor=lambda _: executor)
+            get_executor=lambda _: executor, **kwargs)
+
+    def _invoke_fast_path(self, digests, plan=None):
+        """
+        Invoke with "converger.converged_fast_path" configured and
+        ``digests`` as converged digests
+        """
+        return self._invoke(
+            plan, converged_digests=digests,
+            get_config_value={'converger.converged_fast_path': True}.get)
+
+    def _digest(self):
+        """Digest of the group's desired state and gathered resources"""
+        return converged_servers_digest(
+            get_desired_server_group_state(self.group_id, self.lc, 2),
+            self.servers, self.lb_nodes, {})
 
     def test_no_steps(self):
         """
@@ -909,6 +2009,303 @@ class ExecuteConvergenceTests(SynchronousTestCase):
             perform_sequence(self.get_seq() + sequence, self._invoke()),
             ConvergenceIterationStatus.Stop())
 
+    def test_tracing(self):
+        """
+        With tracing configured, getting the group, gathering, updating the
+        cache, planning and writing the group status are performed in spans.
+        """
+        def in_span(phase, seq):
+            return (Span(phase, mock.ANY), nested_sequence(seq))
+
+        sequence = [
+            (Log("begin-convergence", {}), noop),
+            in_span('update-status', [
+                (LoadAndUpdateGroupStatus(self.tenant_id, self.group_id,
+                                          ScalingGroupStatus.ACTIVE),
+                 noop)]),
+            (Func(datetime.utcnow), const(self.now)),
+            (MsgWithTime("gather-convergence-data", mock.ANY),
+             nested_sequence([
+                 in_span('get-scaling-group-info',
+                         [(self.gsgi, const(self.gsgi_result))]),
+                 in_span('gather',
+                         [(("gacd", self.tenant_id, self.group_id, self.now,
+                            None, mock.ANY), self.gacd_runner)]),
+                 in_span('update-cache',
+                         [(UpdateServersCache(self.tenant_id, self.group_id,
+                                              self.now, mock.ANY), noop)])])),
+            in_span('plan', [(Func(mock.ANY), lambda i: i.func())]),
+            parallel_sequence([]),
+            (Log('execute-convergence', mock.ANY), noop),
+            (Log('execute-convergence-results', mock.ANY), noop),
+            clean_waiting(self.waiting, self.group_id),
+            (Func(datetime.utcnow), const(self.now)),
+            in_span('update-cache',
+                    [(UpdateServersCache(self.tenant_id, self.group_id,
+                                         self.now, mock.ANY), noop)])
+        ]
+        self.assertEqual(
+            perform_sequence(
+                sequence,
+                self._invoke(
+                    plan=lambda *a, **kw: [],
+                    get_config_value={'converger.tracing': True}.get)),
+            ConvergenceIterationStatus.Stop())
+
+    def test_gather_gets_desired_group_state(self):
+        """
+        Gathering is given the group's desired state so that it can scope
+        what is fetched.
+        """
+        gathered = []
+        runner = self.gacd_runner
+
+        def gacd_runner(intent):
+            gathered.append(intent[-1])
+            return runner(intent)
+
+        self.gacd_runner = gacd_runner
+        self.test_no_steps()
+        self.assertEqual(
+            gathered,
+            [get_desired_server_group_state(self.group_id, self.lc, 2)])
+
+    def test_fast_path_remembers_converged_digest(self):
+        """
+        With converged fast path configured, the digest of gathered data is
+        remembered when there are no steps to execute.
+        """
+        for serv in self.servers:
+            serv.desired_lbs = pset()
+        digests = Reference(pmap({'other': 1}))
+        sequence = [
+            parallel_sequence([]),
+            (Log('execute-convergence', mock.ANY), noop),
+            (Log('execute-convergence-results', mock.ANY), noop),
+            clean_waiting(self.waiting, self.group_id),
+            (Func(datetime.utcnow), const(self.now)),
+            (UpdateServersCache("tenant-id", "group-id", self.now, mock.ANY),
+             noop)
+        ]
+        self.assertEqual(
+            perform_sequence(
+                self.get_seq() + sequence, self._invoke_fast_path(digests),
+                _get_dispatcher()),
+            ConvergenceIterationStatus.Stop())
+        self.assertEqual(sync_perform(_get_dispatcher(), digests.read()),
+                         pmap({'other': 1, self.group_id: self._digest()}))
+
+    def test_fast_path_digest_unchanged(self):
+        """
+        With converged fast path configured, if the digest of gathered data
+        is same as the one remembered then the group is not planned, the
+        servers cache is updated once and the group is considered converged.
+        """
+        digests = Reference(pmap({self.group_id: self._digest()}))
+
+        def plan(*args, **kwargs):
+            self.fail("Should not plan")
+
+        sequence = [
+            (Log('converge-digest-unchanged', {}), noop),
+            clean_waiting(self.waiting, self.group_id)
+        ]
+        self.assertEqual(
+            perform_sequence(
+                self.get_seq() + sequence,
+                self._invoke_fast_path(digests, plan),
+                _get_dispatcher()),
+            ConvergenceIterationStatus.Stop())
+
+    def test_fast_path_metadata_changed(self):
+        """
+        With converged fast path configured, a group is planned if only the
+        metadata of its servers changed since it converged, like when a
+        server is marked draining to be replaced.
+        """
+        digests = Reference(pmap({self.group_id: self._digest()}))
+        self.servers = (
+            self.servers[0],
+            attr.assoc(self.servers[1], json=self.servers[1].json.set(
+                'metadata', pmap([DRAINING_METADATA]))))
+        self.cache = [thaw(serv.json.set('_is_as_active', True))
+                      for serv in self.servers]
+        step = TestStep(Effect("step_intent"))
+        planned = []
+
+        def plan(*args, **kwargs):
+            planned.append(args)
+            return pbag([step])
+
+        sequence = [
+            parallel_sequence([]),
+            (Log('execute-convergence', mock.ANY), noop),
+            parallel_sequence([
+                [("step_intent", lambda i: (StepResult.RETRY, []))]]),
+            (Log('execute-convergence-results', mock.ANY), noop),
+            clean_waiting(self.waiting, self.group_id)
+        ]
+        self.assertEqual(
+            perform_sequence(
+                self.get_seq() + sequence,
+                self._invoke_fast_path(digests, plan),
+                _get_dispatcher()),
+            ConvergenceIterationStatus.Continue())
+        self.assertEqual(len(planned), 1)
+
+    def test_fast_path_forgets_digest(self):
+        """
+        With converged fast path configured, the group's digest is forgotten
+        when there are steps to execute.
+        """
+        digests = Reference(pmap({self.group_id: 1}))
+        step = TestStep(Effect("step_intent"))
+
+        def plan(*args, **kwargs):
+            return pbag([step])
+
+        sequence = [
+            parallel_sequence([]),
+            (Log('execute-convergence', mock.ANY), noop),
+            parallel_sequence([
+                [("step_intent", lambda i: (StepResult.RETRY, []))]]),
+            (Log('execute-convergence-results', mock.ANY), noop),
+            clean_waiting(self.waiting, self.group_id)
+        ]
+        self.assertEqual(
+            perform_sequence(
+                self.get_seq() + sequence,
+                self._invoke_fast_path(digests, plan),
+                _get_dispatcher()),
+            ConvergenceIterationStatus.Continue())
+        self.assertEqual(
+            sync_perform(_get_dispatcher(), digests.read()), pmap())
+
+    def test_fast_path_group_not_active(self):
+        """
+        With converged fast path configured, a group that is not ACTIVE is
+        always planned and its digest is forgotten.
+        """
+        for serv in self.servers:
+            serv.desired_lbs = pset()
+        self.state.status = ScalingGroupStatus.ERROR
+        digests = Reference(pmap({self.group_id: self._digest()}))
+        sequence = [
+            parallel_sequence([]),
+            (Log('execute-convergence', mock.ANY), noop),
+            (Log('execute-convergence-results', mock.ANY), noop),
+            clean_waiting(self.waiting, self.group_id),
+            (UpdateGroupStatus(scaling_group=self.group,
+                               status=ScalingGroupStatus.ACTIVE),
+             noop),
+            (Log('group-status-active', mock.ANY), noop),
+            (Func(datetime.utcnow), const(self.now)),
+            (UpdateServersCache("tenant-id", "group-id", self.now, mock.ANY),
+             noop)
+        ]
+        self.assertEqual(
+            perform_sequence(
+                self.get_seq() + sequence, self._invoke_fast_path(digests),
+                _get_dispatcher()),
+            ConvergenceIterationStatus.Stop())
+        self.assertEqual(sync_perform(_get_dispatcher(), digests.read()),
+                         pmap())
+
+    def test_fast_path_group_deleted(self):
+        """
+        With converged fast path configured, the digest of a group that is
+        found deleted is forgotten.
+        """
+        digests = Reference(pmap({self.group_id: self._digest(), 'other': 1}))
+
+        def gsgi(_):
+            raise NoSuchScalingGroupError(self.tenant_id, self.group_id)
+
+        sequence = [
+            (Log("begin-convergence", {}), noop),
+            (LoadAndUpdateGroupStatus(
+                self.tenant_id, self.group_id, ScalingGroupStatus.ACTIVE),
+             noop),
+            (Func(datetime.utcnow), lambda i: self.now),
+            (MsgWithTime("gather-convergence-data", mock.ANY),
+             nested_sequence([(self.gsgi, gsgi)]))
+        ]
+        self.assertRaises(
+            NoSuchScalingGroupError, perform_sequence, sequence,
+            self._invoke_fast_path(digests), _get_dispatcher())
+        self.assertEqual(sync_perform(_get_dispatcher(), digests.read()),
+                         pmap({'other': 1}))
+
+    def _invoke_backoff(self, backoffs, plan):
+        """
+        Invoke with ``backoffs`` and ``plan``, expecting the steps to be
+        retried
+        """
+        sequence = [
+            parallel_sequence([]),
+            (Log('execute-convergence', mock.ANY), noop),
+            parallel_sequence([[]]),
+            (Log('execute-convergence-results', mock.ANY), noop),
+            clean_waiting(self.waiting, self.group_id)
+        ]
+        self.assertEqual(
+            perform_sequence(
+                self.get_seq() + sequence,
+                self._invoke(plan, backoffs=backoffs, dirty_version=5),
+                _get_dispatcher()),
+            ConvergenceIterationStatus.Continue())
+        return sync_perform(_get_dispatcher(), backoffs.read())
+
+    def test_backoff_repeated(self):
+        """
+        With backoffs, when only `ConvergeLater` steps are planned with the
+        same flag version and digest as before, the backoff is repeated.
+        """
+        backoffs = Reference(
+            pmap({self.group_id: Backoff(5, self._digest(), 1, -30)}))
+        self.assertEqual(
+            self._invoke_backoff(
+                backoffs, lambda *a, **kw: [ConvergeLater([])]),
+            pmap({self.group_id: Backoff(5, self._digest(), 2, 0)}))
+
+    def test_backoff_started(self):
+        """
+        With backoffs, when only `ConvergeLater` steps are planned with a
+        different flag version than before, the backoff starts again.
+        """
+        backoffs = Reference(
+            pmap({self.group_id: Backoff(4, self._digest(), 3, -30)}))
+        self.assertEqual(
+            self._invoke_backoff(
+                backoffs, lambda *a, **kw: [ConvergeLater([])]),
+            pmap({self.group_id: Backoff(5, self._digest(), 0, 0)}))
+
+    def test_backoff_forgotten(self):
+        """
+        With backoffs, the group's backoff is forgotten when steps other than
+        `ConvergeLater` are planned.
+        """
+        backoffs = Reference(
+            pmap({self.group_id: Backoff(5, self._digest(), 1, -30)}))
+        step = TestStep(Effect("step_intent"))
+        sequence = [
+            parallel_sequence([]),
+            (Log('execute-convergence', mock.ANY), noop),
+            parallel_sequence([
+                [("step_intent", lambda i: (StepResult.RETRY, []))]]),
+            (Log('execute-convergence-results', mock.ANY), noop),
+            clean_waiting(self.waiting, self.group_id)
+        ]
+        self.assertEqual(
+            perform_sequence(
+                self.get_seq() + sequence,
+                self._invoke(lambda *a, **kw: pbag([step]),
+                             backoffs=backoffs, dirty_version=5),
+                _get_dispatcher()),
+            ConvergenceIterationStatus.Continue())
+        self.assertEqual(
+            sync_perform(_get_dispatcher(), backoffs.read()), pmap())
+
     def test_success(self):
         """
         Executes the plan and returns SUCCESS when that's the most severe
@@ -1042,6 +2439,70 @@ class ExecuteConvergenceTests(SynchronousTestCase):
             perform_sequence(self.get_seq() + sequence, self._invoke(plan)),
             ConvergenceIterationStatus.Continue())
 
+    def test_remembers_under_capacity(self):
+        """
+        The group is remembered as under capacity when its plan creates
+        servers
+        """
+        under_capacity = Reference(pset(['other']))
+        step = CreateServer(server_config=pmap({"foo": "bar"}))
+        step.as_effect = lambda: Effect("create-server")
+
+        def plan(*args, **kwargs):
+            return pbag([step])
+
+        sequence = [
+            parallel_sequence([
+                [parallel_sequence([
+                    [(Log('convergence-create-servers', mock.ANY), noop)]
+                ])]
+            ]),
+            (Log(msg='execute-convergence', fields=mock.ANY), noop),
+            parallel_sequence([
+                [("create-server", lambda i: (StepResult.RETRY, []))]
+            ]),
+            (Log(msg='execute-convergence-results', fields=mock.ANY), noop),
+            clean_waiting(self.waiting, self.group_id),
+        ]
+        self.assertEqual(
+            perform_sequence(
+                self.get_seq() + sequence,
+                self._invoke(plan, under_capacity=under_capacity),
+                _get_dispatcher()),
+            ConvergenceIterationStatus.Continue())
+        self.assertEqual(
+            sync_perform(_get_dispatcher(), under_capacity.read()),
+            pset(['other', self.group_id]))
+
+    def test_forgets_under_capacity(self):
+        """
+        The group is forgotten as under capacity when its plan does not create
+        servers
+        """
+        under_capacity = Reference(pset(['other', self.group_id]))
+        step = TestStep(Effect("step_intent"))
+
+        def plan(*args, **kwargs):
+            return pbag([step])
+
+        sequence = [
+            parallel_sequence([]),
+            (Log('execute-convergence', mock.ANY), noop),
+            parallel_sequence([
+                [("step_intent", lambda i: (StepResult.RETRY, []))]]),
+            (Log('execute-convergence-results', mock.ANY), noop),
+            clean_waiting(self.waiting, self.group_id)
+        ]
+        self.assertEqual(
+            perform_sequence(
+                self.get_seq() + sequence,
+                self._invoke(plan, under_capacity=under_capacity),
+                _get_dispatcher()),
+            ConvergenceIterationStatus.Continue())
+        self.assertEqual(
+            sync_perform(_get_dispatcher(), under_capacity.read()),
+            pset(['other']))
+
     def _test_deleting_group(self, step_result, with_delete, exec_result):
 
         def _plan(dsg, *a, **kwargs):
@@ -1453,6 +2914,80 @@ class ExecuteConvergenceTests(SynchronousTestCase):
         self.assertEqual(result, ConvergenceIterationStatus.Stop())
 
 
+class ConvergedServersDigestTests(SynchronousTestCase):
+    """Tests for :func:`converged_servers_digest`."""
+
+    def setUp(self):
+        self.clb_desc = CLBDescription(lb_id='23', port=80)
+        self.dgs = get_desired_server_group_state(
+            'gid', {'args': {'server': {'name': 'foo'}, 'loadBalancers': []},
+                    'type': 'launch_server'}, 2)
+        self.servers = [
+            server('a', ServerState.ACTIVE, servicenet_address='10.0.0.1',
+                   desired_lbs=s(self.clb_desc)),
+            server('b', ServerState.ACTIVE, servicenet_address='10.0.0.2',
+                   desired_lbs=s(self.clb_desc))]
+        self.lb_nodes = [CLBNode(node_id='1', address='10.0.0.1',
+                                 description=self.clb_desc),
+                         CLBNode(node_id='2', address='10.0.0.2',
+                                 description=self.clb_desc)]
+        self.digest = converged_servers_digest(
+            self.dgs, self.servers, self.lb_nodes, {})
+
+    def test_sha1(self):
+        """
+        Digest is SHA-1 hex digest that is same when computed again
+        """
+        self.assertEqual(len(self.digest), 40)
+        self.assertEqual(
+            converged_servers_digest(
+                self.dgs, list(self.servers), list(self.lb_nodes), {}),
+            self.digest)
+
+    def test_same_data(self):
+        """
+        Digest is same for same data irrespective of order of servers and
+        nodes and nodes of other servers.
+        """
+        other = CLBNode(node_id='3', address='10.0.0.3',
+                        description=self.clb_desc)
+        self.assertEqual(
+            converged_servers_digest(
+                self.dgs, self.servers[::-1], [other] + self.lb_nodes[::-1],
+                pmap()),
+            self.digest)
+
+    def test_changes(self):
+        """
+        Digest changes when desired state, server, its metadata, its nodes or
+        LBs change
+        """
+        changed = [
+            (get_desired_server_group_state(
+                'gid', {'args': {'server': {'name': 'foo'},
+                                 'loadBalancers': []},
+                        'type': 'launch_server'}, 3),
+             self.servers, self.lb_nodes, {}),
+            (self.dgs,
+             [self.servers[0],
+              attr.assoc(self.servers[1], state=ServerState.ERROR)],
+             self.lb_nodes, {}),
+            (self.dgs,
+             [self.servers[0],
+              attr.assoc(self.servers[1], json=self.servers[1].json.set(
+                  'metadata', pmap([DRAINING_METADATA])))],
+             self.lb_nodes, {}),
+            (self.dgs, self.servers, self.lb_nodes[:1], {}),
+            (self.dgs, self.servers,
+             [self.lb_nodes[0],
+              attr.assoc(self.lb_nodes[1], description=attr.assoc(
+                  self.clb_desc, condition=CLBNodeCondition.DRAINING))],
+             {}),
+            (self.dgs, self.servers, self.lb_nodes, {'23': CLB(True)})]
+        for args in changed:
+            self.assertNotEqual(converged_servers_digest(*args), self.digest)
+
+
 class IsAutoscaleActiveTests(SynchronousTestCase):
     """Tests for :func:`is_autoscale_active`."""
 
@@ -1543,6 +3078,7 @@ class ConvergenceExecutorTests(SynchronousTestCase):
             'plan': 'p',
             'get_desired_group_state': 'gdgs',
             'update_cache': 'uc',
+            'digest': 'd',
         }
         self.lse = launch_server_executor
         self.stack_exec = launch_stack_executor
@@ -1556,6 +3092,7 @@ class ConvergenceExecutorTests(SynchronousTestCase):
             'plan': plan_launch_server,
             'get_desired_group_state': get_desired_server_group_state,
             'update_cache': update_servers_cache,
+            'digest': converged_servers_digest,
         }
         self.assertTrue(isinstance(self.lse, ConvergenceExecutor))
         self.assertEqual(attr.asdict(self.lse), attrs)
@@ -1576,6 +3113,7 @@ class ConvergenceExecutorTests(SynchronousTestCase):
             'plan': plan_launch_stack,
             'get_desired_group_state': get_desired_stack_group_state,
             'update_cache': update_stacks_cache,
+            'digest': stacks_digest,
         }
         self.assertTrue(isinstance(self.stack_exec, ConvergenceExecutor))
         self.assertEqual(attr.asdict(self.stack_exec), attrs)
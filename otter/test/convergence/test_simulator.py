@@ -0,0 +1,178 @@
+"""
+Tests for :mod:`otter.convergence.simulator`
+"""
+
+import time
+
+from effect import Effect, sync_perform
+from effect.ref import Reference
+
+from kazoo.exceptions import BadVersionError, NoNodeError
+
+from pyrsistent import pmap
+
+from twisted.internet.task import Clock
+from twisted.trial.unittest import SynchronousTestCase
+
+from otter.cloud_client import (
+    NoSuchServerError, TenantScope, create_server, get_server_details,
+    list_servers_details_all)
+from otter.cloud_client.clb import get_clb_nodes
+from otter.constants import CONVERGENCE_DIRTY_DIR, ServiceType
+from otter.convergence.model import ConvergenceIterationStatus
+from otter.convergence.service import (
+    execute_convergence, format_dirty_flag, mark_divergent_many)
+from otter.convergence.simulator import (
+    SimulatedPartitioner,
+    Simulator,
+    SimulatorConfig,
+    get_simulator_dispatcher)
+from otter.models.cass import CassScalingGroupServersCache
+from otter.models.interface import ScalingGroupStatus
+from otter.test.utils import mock_log
+from otter.util.http import APIError
+from otter.util.zk import (
+    CreateNode, DeleteNode, GetChildren, GetStat, SetData, Transaction,
+    TransactionFailed)
+
+
+class SimulatorTests(SynchronousTestCase):
+    """Tests for :obj:`Simulator` performed with its dispatcher."""
+
+    def setUp(self):
+        self.clock = Clock()
+        self.clock.advance(time.time())
+        self.log = mock_log()
+        self.sim = Simulator(self.clock, SimulatorConfig(build_time=10))
+        self.disp = get_simulator_dispatcher(self.clock, self.log, self.sim)
+
+    def perform(self, eff, tenant_id='t1'):
+        return sync_perform(self.disp, Effect(TenantScope(eff, tenant_id)))
+
+    def test_servers(self):
+        """
+        Created servers are in BUILD for ``build_time`` seconds and are
+        listed in pages
+        """
+        for _ in range(3):
+            self.perform(create_server({'server': {'name': 'a'}}))
+        servers = self.perform(list_servers_details_all({'limit': ['2']}))
+        self.assertEqual([s['status'] for s in servers], ['BUILD'] * 3)
+        self.clock.advance(10)
+        server_id = servers[0]['id']
+        _, body = self.perform(get_server_details(server_id))
+        self.assertEqual(body['server']['status'], 'ACTIVE')
+        self.assertRaises(NoSuchServerError, self.perform,
+                          get_server_details(server_id), 't2')
+        self.assertEqual(self.sim.requests[('CLOUD_SERVERS', 'GET')], 4)
+
+    def test_errors(self):
+        """
+        Requests fail with 500 at the configured error rate of the service
+        """
+        sim = Simulator(self.clock, SimulatorConfig(
+            error_rate={ServiceType.CLOUD_LOAD_BALANCERS: 1}))
+        lb_id = sim.add_clb('t1')
+        self.disp = get_simulator_dispatcher(self.clock, self.log, sim)
+        self.assertEqual(
+            self.perform(list_servers_details_all()), [])
+        e = self.assertRaises(APIError, self.perform, get_clb_nodes(lb_id))
+        self.assertEqual(e.code, 500)
+        self.assertEqual(sim.errors, {('CLOUD_LOAD_BALANCERS', 'GET'): 1})
+
+    def test_servers_cache(self):
+        """
+        Servers cache queries of :obj:`CassScalingGroupServersCache` are
+        performed in memory
+        """
+        cache = CassScalingGroupServersCache('t1', 'g1')
+        self.assertEqual(sync_perform(self.disp, cache.get_servers(False)),
+                         ([], None))
+        sync_perform(self.disp, cache.update_servers(
+            1, [{'id': 'a', '_is_as_active': True}, {'id': 'b'}]))
+        sync_perform(self.disp, cache.update_servers(2, [{'id': 'c'}]))
+        self.assertEqual(sync_perform(self.disp, cache.get_servers(False)),
+                         ([{'id': 'c'}], 2))
+
+    def test_zookeeper(self):
+        """
+        ZooKeeper intents are performed in memory with version checks, and
+        failed transactions are not applied
+        """
+        path = CONVERGENCE_DIRTY_DIR + '/flag'
+        sync_perform(self.disp, Effect(CreateNode(path)))
+        sync_perform(self.disp, Effect(SetData(path, 'x')))
+        stat = sync_perform(self.disp, Effect(GetStat(path)))
+        self.assertEqual(stat.version, 1)
+        self.assertRaises(
+            TransactionFailed, sync_perform, self.disp,
+            Effect(Transaction([CreateNode(path + '2'), CreateNode(path)])))
+        children = sync_perform(self.disp,
+                                Effect(GetChildren(CONVERGENCE_DIRTY_DIR)))
+        self.assertEqual(children, ['flag'])
+        self.assertRaises(BadVersionError, sync_perform, self.disp,
+                          Effect(DeleteNode(path=path, version=0)))
+        sync_perform(self.disp, Effect(DeleteNode(path=path, version=1)))
+        self.assertRaises(NoNodeError, sync_perform, self.disp,
+                          Effect(DeleteNode(path=path, version=-1)))
+
+    def test_watch_children(self):
+        """
+        Callbacks watching children are called with the children initially
+        and after they change until they return False
+        """
+        calls = []
+        self.sim.zk.watch_children(
+            CONVERGENCE_DIRTY_DIR, lambda c: calls.append(c) or False)
+        self.assertEqual(calls, [[]])
+        self.sim.zk.watch_children(CONVERGENCE_DIRTY_DIR, calls.append)
+        sync_perform(self.disp, mark_divergent_many([('t1', 'g1')]))
+        self.clock.advance(0)
+        self.assertEqual(calls, [[], [], [format_dirty_flag('t1', 'g1')]])
+
+    def test_converges_group(self):
+        """
+        The real convergence creates servers of a group and adds them to its
+        load balancers until the group is converged
+        """
+        self.sim.populate(1, 1, 2, clbs=1, rcv3_pools=1)
+        (tenant_id, group_id), = self.sim.store.groups
+        statuses = []
+        for _ in range(5):
+            statuses.append(self.perform(
+                execute_convergence(
+                    tenant_id, group_id, 3600, Reference(pmap()), 10, {}),
+                tenant_id))
+            self.clock.advance(10)
+            if statuses[-1] == ConvergenceIterationStatus.Stop():
+                break
+        self.assertEqual(statuses, [ConvergenceIterationStatus.Continue(),
+                                    ConvergenceIterationStatus.Continue(),
+                                    ConvergenceIterationStatus.Stop()])
+        self.assertTrue(self.sim.is_converged(tenant_id, group_id))
+        tenant = self.sim.tenants[tenant_id]
+        self.assertEqual([len(nodes) for nodes in tenant.clbs.values()], [2])
+        self.assertEqual(
+            [len(nodes) for nodes in tenant.rcv3_pools.values()], [2])
+        self.assertEqual(
+            self.sim.store.groups[(tenant_id, group_id)].state.status,
+            ScalingGroupStatus.ACTIVE)
+
+
+class SimulatedPartitionerTests(SynchronousTestCase):
+    """Tests for :obj:`SimulatedPartitioner`."""
+
+    def test_got_buckets(self):
+        """
+        All buckets are given to ``got_buckets`` every interval
+        """
+        clock = Clock()
+        calls = []
+        partitioner = SimulatedPartitioner(
+            buckets=range(3), log=None, got_buckets=calls.append,
+            interval=5, clock=clock)
+        partitioner.startService()
+        clock.advance(5)
+        self.assertEqual(calls, [[0, 1, 2], [0, 1, 2]])
+        self.assertEqual(self.successResultOf(partitioner.health_check()),
+                         (True, {'buckets': [0, 1, 2]}))
@@ -0,0 +1,113 @@
+"""
+Tests for :mod:`otter.convergence.tracing`
+"""
+
+from effect import ComposedDispatcher, Effect, raise_
+from effect.testing import perform_sequence
+
+from twisted.internet.task import Clock
+from twisted.trial.unittest import SynchronousTestCase
+
+from otter.convergence.tracing import (
+    BUCKET_BOUNDS,
+    Histogram,
+    PhaseHistograms,
+    Span,
+    get_span_dispatcher,
+    span)
+from otter.log.intents import get_log_dispatcher
+from otter.test.utils import mock_log
+
+
+class HistogramTests(SynchronousTestCase):
+    """Tests for :obj:`Histogram` and :obj:`PhaseHistograms`."""
+
+    def test_as_json(self):
+        """
+        Observed durations are counted cumulatively in buckets of their upper
+        bounds
+        """
+        histogram = Histogram()
+        for seconds in [0.005, 0.01, 0.3, 400]:
+            histogram.observe(seconds)
+        json = histogram.as_json()
+        self.assertEqual(json['count'], 4)
+        self.assertAlmostEqual(json['sum'], 400.315)
+        counts = [(b['le'], b['count']) for b in json['buckets']]
+        self.assertEqual(counts[:5],
+                         [(0.01, 2), (0.05, 2), (0.1, 2), (0.25, 2), (0.5, 3)])
+        self.assertEqual(counts[-2:], [(300, 3), ('+Inf', 4)])
+        self.assertEqual(len(counts), len(BUCKET_BOUNDS) + 1)
+
+    def test_phases(self):
+        """
+        :obj:`PhaseHistograms` keeps a histogram for each phase
+        """
+        histograms = PhaseHistograms()
+        histograms.observe('plan', 0.2)
+        histograms.observe('gather', 1)
+        histograms.observe('plan', 0.02)
+        json = histograms.as_json()
+        self.assertEqual(sorted(json), ['gather', 'plan'])
+        self.assertEqual(json['plan']['count'], 2)
+        self.assertEqual(json['gather']['count'], 1)
+
+
+class SpanTests(SynchronousTestCase):
+    """Tests for :func:`span` and :obj:`Span`."""
+
+    def setUp(self):
+        self.clock = Clock()
+        self.log = mock_log()
+        self.histograms = PhaseHistograms()
+        self.disp = ComposedDispatcher([
+            get_span_dispatcher(self.clock, self.histograms),
+            get_log_dispatcher(self.log, {})
+        ])
+
+    def test_not_configured(self):
+        """
+        The effect is returned as is if tracing is not configured
+        """
+        eff = Effect('internal')
+        self.assertIs(span('phase', eff, {}.get), eff)
+
+    def test_configured(self):
+        """
+        The effect is wrapped in :obj:`Span` if tracing is configured
+        """
+        eff = Effect('internal')
+        self.assertEqual(
+            span('phase', eff, {'converger.tracing': True}.get).intent,
+            Span('phase', eff))
+
+    def test_records_span(self):
+        """
+        Time taken by the effect is logged and recorded in the histogram of
+        the phase, and the effect's result is returned
+        """
+        seq = [("internal", lambda i: self.clock.advance(3) or "result")]
+        self.assertEqual(
+            perform_sequence(
+                seq, Effect(Span('gather', Effect("internal"))), self.disp),
+            "result")
+        self.log.msg.assert_called_once_with(
+            'convergence-span', phase='gather', seconds_taken=3.0,
+            failed=False)
+        self.assertEqual(self.histograms.as_json()['gather']['sum'], 3.0)
+
+    def test_records_failed_span(self):
+        """
+        Time taken by a failing effect is recorded too and the error is
+        propagated
+        """
+        def fail(i):
+            self.clock.advance(2)
+            raise_(ValueError("oops"))
+
+        self.assertRaises(
+            ValueError, perform_sequence, [("internal", fail)],
+            Effect(Span('plan', Effect("internal"))), self.disp)
+        self.log.msg.assert_called_once_with(
+            'convergence-span', phase='plan', seconds_taken=2.0, failed=True)
+        self.assertEqual(self.histograms.as_json()['plan']['count'], 1)
@@ -9,9 +9,9 @@ from datetime import datetime, timedelta
 from functools import partial
 
 from effect import (
-    Effect, ParallelEffects, TypeDispatcher, sync_perform)
+    Effect, TypeDispatcher, sync_perform, sync_performer)
 from effect.testing import (
-    const, intent_func, noop, perform_sequence, resolve_effect)
+    const, intent_func, noop, perform_sequence)
 
 from jsonschema import ValidationError
 
@@ -26,7 +26,7 @@ from silverberg.client import CQLClient, ConsistencyLevel
 
 from testtools.matchers import IsInstance
 
-from toolz.dicttoolz import assoc, merge
+from toolz.dicttoolz import assoc, dissoc, merge
 
 from twisted.internet import defer
 from twisted.internet.task import Clock
@@ -43,13 +43,21 @@ from otter.models.cass import (
     CassScalingGroup,
     CassScalingGroupCollection,
     CassScalingGroupServersCache,
+    MAX_TOKEN,
+    MIN_TOKEN,
+    StateConflictError,
     WeakLocks,
     _assemble_webhook_from_row,
     assemble_webhooks_in_policies,
+    collect_rows,
+    count_rows,
     cql_eff,
     get_cql_dispatcher,
     perform_cql_query,
+    scan_table,
     serialize_json_data,
+    set_of,
+    token_ranges,
     verified_view
 )
 from otter.models.interface import (
@@ -78,6 +86,7 @@ from otter.test.utils import (
     patch,
     test_dispatcher)
 from otter.util.config import set_config_data
+from otter.util.lru import LRUCache
 from otter.util.timestamp import from_timestamp
 
 
@@ -1006,6 +1015,187 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
         self.assertEqual(self.connection.execute.call_count, 0)
         self.assertFalse(self.lb.acquired)
 
+    def _cas_state_row(self, version):
+        return merge(scaling_group_entry,
+                     {'tenantId': self.tenant_id, 'groupId': self.group_id,
+                      'stateVersion': version})
+
+    def _cas_write_call(self, version, desired):
+        query = (
+            'UPDATE scaling_group SET active = :active, pending = :pending, '
+            '"groupTouched" = :groupTouched, '
+            '"policyTouched" = :policyTouched, paused = :paused, '
+            'desired = :desired, suspended = :suspended, '
+            '"stateVersion" = :newVersion '
+            'WHERE "tenantId" = :tenantId AND "groupId" = :groupId '
+            'IF "stateVersion" = :version')
+        data = {"tenantId": self.tenant_id, "groupId": self.group_id,
+                "active": _S({'A': 'R'}), "pending": _S({'P': 'R'}),
+                "groupTouched": '2014-01-01T00:00:05Z.1234',
+                "policyTouched": _S({'PT': 'R'}), "paused": False,
+                "desired": desired, "suspended": False, "version": version,
+                "newVersion": (version or 0) + 1}
+        return mock.call(query, data, ConsistencyLevel.QUORUM)
+
+    def _cas_modifier(self, states):
+        def modifier(_group, state, change):
+            states.append(state.desired)
+            state.desired += change
+            return state
+        return modifier
+
+    def _use_cas(self):
+        set_config_data({'cassandra': {'state_concurrency': 'cas'}})
+        self.group.retryable_modifiers = mock.Mock(return_value=True)
+
+    def _cas_read_call(self):
+        return mock.call(
+            'SELECT "tenantId", "groupId", group_config, active, '
+            'pending, "groupTouched", "policyTouched", paused, desired, '
+            'created_at, status, error_reasons, deleting, suspended, '
+            '"stateVersion" FROM scaling_group '
+            'WHERE "tenantId" = :tenantId AND "groupId" = :groupId',
+            {'tenantId': self.tenant_id, 'groupId': self.group_id},
+            ConsistencyLevel.QUORUM)
+
+    @mock.patch('otter.models.cass.serialize_json_data',
+                side_effect=lambda *args: _S(args[0]))
+    def test_modify_state_cas(self, mock_serial):
+        """
+        With "cassandra.state_concurrency" as "cas", ``modify_state`` does not
+        take the ZooKeeper lock. It writes the state the modifier returns if
+        the state's version is still the one read, incrementing it.
+        """
+        self._use_cas()
+        self.returns = [[self._cas_state_row(3)], [{'[applied]': True}]]
+        states = []
+        d = self.group.modify_state(self._cas_modifier(states), 2,
+                                    modify_state_reason='test')
+        self.assertIsNone(self.successResultOf(d))
+        self.assertEqual(states, [0])
+        self.assertEqual(
+            self.connection.execute.mock_calls,
+            [self._cas_read_call(), self._cas_write_call(3, 2)])
+        self.assertFalse(hasattr(self, 'lb'))
+        self.group.retryable_modifiers.assert_called_once_with(self.tenant_id)
+
+    @mock.patch('otter.models.cass.serialize_json_data',
+                side_effect=lambda *args: _S(args[0]))
+    def test_modify_state_cas_null_version(self, mock_serial):
+        """
+        With "cassandra.state_concurrency" as "cas", ``modify_state`` of a
+        group whose state has no version reads and writes it again holding
+        the ZooKeeper lock, so that the group is not resurrected if it gets
+        deleted in between.
+        """
+        self._use_cas()
+        self.returns = [[self._cas_state_row(None)],
+                        [self._cas_state_row(None)], [{'[applied]': True}]]
+        states = []
+        d = self.group.modify_state(self._cas_modifier(states), 2)
+        self.assertIsNone(self.successResultOf(d))
+        self.assertEqual(states, [0])
+        self.assertEqual(
+            self.connection.execute.mock_calls,
+            [self._cas_read_call(), self._cas_read_call(),
+             self._cas_write_call(None, 2)])
+        self.assertFalse(self.lb.acquired)
+
+    @mock.patch('otter.models.cass.serialize_json_data',
+                side_effect=lambda *args: _S(args[0]))
+    def test_modify_state_cas_null_version_deleted(self, mock_serial):
+        """
+        With "cassandra.state_concurrency" as "cas", ``modify_state`` of a
+        group whose state has no version fails with
+        :obj:`NoSuchScalingGroupError` without writing if the group is
+        deleted before the ZooKeeper lock is acquired
+        """
+        self._use_cas()
+        self.returns = [[self._cas_state_row(None)], []]
+        d = self.group.modify_state(self._cas_modifier([]), 2)
+        self.failureResultOf(d, NoSuchScalingGroupError)
+        self.assertEqual(
+            self.connection.execute.mock_calls,
+            [self._cas_read_call(), self._cas_read_call()])
+        self.assertFalse(self.lb.acquired)
+
+    def test_modify_state_cas_not_retryable(self):
+        """
+        With "cassandra.state_concurrency" as "cas", ``modify_state`` of a
+        group of a tenant whose modifiers are not retryable, or if no tenant's
+        are, still takes the ZooKeeper lock
+        """
+        self._use_cas()
+
+        def modifier(group, state):
+            raise NoSuchScalingGroupError(self.tenant_id, self.group_id)
+
+        for retryable_modifiers in [lambda tenant_id: False, None]:
+            self.group.retryable_modifiers = retryable_modifiers
+            self.group.view_state = mock.Mock(
+                return_value=defer.succeed('state'))
+            d = self.group.modify_state(modifier)
+            self.failureResultOf(d, NoSuchScalingGroupError)
+            self.group.view_state.assert_called_once_with(
+                ConsistencyLevel.QUORUM)
+            self.assertEqual(self.connection.execute.call_count, 0)
+            self.assertFalse(self.lb.acquired)
+
+    @mock.patch('otter.models.cass.serialize_json_data',
+                side_effect=lambda *args: _S(args[0]))
+    def test_modify_state_cas_retries(self, mock_serial):
+        """
+        When the state's version changed since it was read, ``modify_state``
+        reads the state again and calls the modifier on it
+        """
+        self._use_cas()
+        self.returns = [
+            [self._cas_state_row(3)],
+            [{'[applied]': False, 'stateVersion': 4}],
+            [merge(self._cas_state_row(4), {'desired': 1})],
+            [{'[applied]': True}]]
+        states = []
+        d = self.group.modify_state(self._cas_modifier(states), 2)
+        self.assertIsNone(self.successResultOf(d))
+        self.assertEqual(states, [0, 1])
+        calls = self.connection.execute.mock_calls
+        self.assertEqual([calls[1], calls[3]],
+                         [self._cas_write_call(3, 2),
+                          self._cas_write_call(4, 3)])
+
+    @mock.patch('otter.models.cass.serialize_json_data',
+                side_effect=lambda *args: _S(args[0]))
+    def test_modify_state_cas_gives_up(self, mock_serial):
+        """
+        ``modify_state`` fails with :obj:`StateConflictError` if the state's
+        version changed in all ``STATE_CAS_ATTEMPTS`` attempts
+        """
+        self._use_cas()
+        patch(self, 'otter.models.cass.STATE_CAS_ATTEMPTS', new=2)
+        self.returns = [[self._cas_state_row(3)], [{'[applied]': False}],
+                        [self._cas_state_row(4)], [{'[applied]': False}]]
+        d = self.group.modify_state(self._cas_modifier([]), 2)
+        f = self.failureResultOf(d, StateConflictError)
+        self.assertEqual(
+            (f.value.tenant_id, f.value.group_id, f.value.attempts),
+            (self.tenant_id, self.group_id, 2))
+        self.assertEqual(self.connection.execute.call_count, 4)
+
+    def test_modify_state_cas_modifier_error(self):
+        """
+        With "cassandra.state_concurrency" as "cas", ``modify_state`` does not
+        write anything if the modifier raises an exception
+        """
+        self._use_cas()
+        self.returns = [[self._cas_state_row(3)]]
+
+        def modifier(group, state):
+            raise NoSuchScalingGroupError(self.tenant_id, self.group_id)
+
+        d = self.group.modify_state(modifier)
+        self.failureResultOf(d, NoSuchScalingGroupError)
+        self.assertEqual(self.connection.execute.call_count, 1)
+
     @mock.patch('otter.models.cass.CassScalingGroup.view_config',
                 return_value=defer.succeed({}))
     def test_update_status(self, mock_vc):
@@ -2177,6 +2367,160 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
             otter_msg_type="ignore-delete-lock-error")
 
 
+class GroupConfigsCacheTests(CassScalingGroupTestCase):
+    """
+    Tests for caching group configs in :obj:`CassScalingGroup`. See note
+    [Group configs cache].
+    """
+
+    def setUp(self):
+        """
+        Configure the cache's TTL and use a fresh cache
+        """
+        super(GroupConfigsCacheTests, self).setUp()
+        set_config_data({'cassandra': {'manifest_cache_ttl': 10}})
+        self.group.configs_cache = LRUCache(10)
+        self.clock.advance(100)
+
+    def test_view_config_cached(self):
+        """
+        Config read by `view_config` is returned from the cache until the TTL
+        passes
+        """
+        self.returns = [[{'group_config': '{"a": 1}', 'created_at': 24}],
+                        [{'group_config': '{"a": 2}', 'created_at': 24}]]
+        self.assertEqual(self.successResultOf(self.group.view_config()),
+                         {'a': 1})
+        self.clock.advance(10)
+        self.assertEqual(self.successResultOf(self.group.view_config()),
+                         {'a': 1})
+        self.assertEqual(self.connection.execute.call_count, 1)
+        self.clock.advance(1)
+        self.assertEqual(self.successResultOf(self.group.view_config()),
+                         {'a': 2})
+        self.assertEqual(self.connection.execute.call_count, 2)
+
+    def test_view_manifest_caches_configs(self):
+        """
+        `view_manifest` caches both configs and then reads only the state,
+        taking the configs from the cache
+        """
+        row = merge(scaling_group_entry,
+                    {'tenantId': self.tenant_id, 'groupId': self.group_id})
+        state_row = dissoc(row, 'group_config', 'launch_config')
+        self.returns = [[row], [state_row]]
+        manifests = [
+            self.successResultOf(
+                self.group.view_manifest(with_policies=False))
+            for _ in range(2)]
+        self.assertEqual(manifests[0], manifests[1])
+        self.assertEqual(manifests[1]['groupConfiguration'], {'name': 'a'})
+        self.assertEqual(
+            self.successResultOf(self.group.view_launch_config()), {})
+        self.assertEqual(
+            self.successResultOf(self.group.view_config()), {'name': 'a'})
+        self.assertEqual(self.connection.execute.call_count, 2)
+        query, params, consistency = self.connection.execute.call_args[0]
+        self.assertEqual(
+            query,
+            'SELECT "tenantId", "groupId", active, pending, "groupTouched", '
+            '"policyTouched", paused, desired, created_at, status, '
+            'error_reasons, deleting, suspended FROM scaling_group '
+            'WHERE "tenantId" = :tenantId AND "groupId" = :groupId')
+        self.assertEqual(consistency, ConsistencyLevel.QUORUM)
+
+    def test_view_manifest_one_config_cached(self):
+        """
+        `view_manifest` reads the configs along with the state if either of
+        them is not cached
+        """
+        row = merge(scaling_group_entry,
+                    {'tenantId': self.tenant_id, 'groupId': self.group_id})
+        self.returns = [[row], [row]]
+        self.successResultOf(self.group.view_manifest(with_policies=False))
+        self.group._invalidate_configs(None, ('launch_config',))
+        self.successResultOf(self.group.view_manifest(with_policies=False))
+        self.assertIn('launch_config',
+                      self.connection.execute.call_args[0][0])
+
+    @mock.patch('otter.models.cass.CassScalingGroup._naive_list_all_webhooks',
+                return_value=defer.succeed([]))
+    @mock.patch('otter.models.cass.CassScalingGroup.view_state')
+    def test_delete_group_invalidates(self, mock_view_state, mock_naive):
+        """
+        Deleting the group invalidates its cached configs
+        """
+        mock_view_state.return_value = defer.succeed(GroupState(
+            self.tenant_id, self.group_id, '', {}, {}, None, {}, False,
+            ScalingGroupStatus.ACTIVE))
+        self.returns = [[{'group_config': '{"a": 1}', 'created_at': 24}],
+                        None]
+        self.successResultOf(self.group.view_config())
+        self.assertIsNot(self.group._cached_config('group_config'), None)
+        self.successResultOf(self.group.delete_group())
+        self.assertIs(self.group._cached_config('group_config'), None)
+
+    def test_deleting_not_cached(self):
+        """
+        Configs of a deleting group are not cached
+        """
+        row = merge(scaling_group_entry,
+                    {'tenantId': self.tenant_id, 'groupId': self.group_id,
+                     'deleting': True})
+        self.returns = [[row]]
+        self.successResultOf(self.group.view_manifest(with_policies=False,
+                                                      get_deleting=True))
+        self.assertEqual(len(self.group.configs_cache), 0)
+
+    def test_update_config_invalidates(self):
+        """
+        Updating the config invalidates it in the cache
+        """
+        self.returns = [[{'group_config': '{"a": 1}', 'created_at': 24}],
+                        [{'group_config': '{"a": 1}', 'created_at': 24}],
+                        None,
+                        [{'group_config': '{"a": 2}', 'created_at': 24}]]
+        self.successResultOf(self.group.view_config())
+        self.successResultOf(self.group.update_config({'a': 2}))
+        self.assertEqual(self.successResultOf(self.group.view_config()),
+                         {'a': 2})
+        self.assertEqual(self.connection.execute.call_count, 4)
+
+    def test_updates_deleted_group(self):
+        """
+        Updates check that the group exists without the cache, so they fail
+        with NoSuchScalingGroupError if the group got deleted on another node
+        even though its config is cached, and write nothing
+        """
+        updates = [
+            lambda: self.group.update_status(ScalingGroupStatus.ERROR),
+            lambda: self.group.update_error_reasons(['a']),
+            lambda: self.group.update_config({'a': 2}),
+            lambda: self.group.update_launch_config({'b': 2}),
+            lambda: self.group.create_policies([{'a': 1}])]
+        self.returns = [[{'group_config': '{"a": 1}', 'created_at': 24}]]
+        self.returns.extend([[] for _ in updates])
+        self.successResultOf(self.group.view_config())
+        for update in updates:
+            self.failureResultOf(update(), NoSuchScalingGroupError)
+        self.assertEqual(self.connection.execute.call_count,
+                         1 + len(updates))
+        for call in self.connection.execute.call_args_list:
+            self.assertTrue(call[0][0].startswith('SELECT'))
+
+    def test_read_before_invalidation_not_cached(self):
+        """
+        Config read before it got invalidated is not cached
+        """
+        read = defer.Deferred()
+        self.connection.execute.side_effect = [read]
+        d = self.group.view_config()
+        self.group._invalidate_configs(None)
+        read.callback([{'group_config': '{"a": 1}', 'created_at': 24}])
+        self.assertEqual(self.successResultOf(d), {'a': 1})
+        self.assertIs(self.group._cached_config('group_config'), None)
+
+
 class GetPolicyTests(CassScalingGroupTestCase):
     """
     Tests for :func:`CassScalingGroup.get_policy`
@@ -2726,7 +3070,7 @@ class ScalingGroupAddPoliciesTests(CassScalingGroupTestCase):
         self.returns = [[{'count': 0}], None]
         d = self.group.create_policies([{"b": "lah"}])
         self.successResultOf(d)
-        self.group.view_config.assert_called_once_with()
+        self.group.view_config.assert_called_once_with(cached=False)
 
     def test_add_scaling_policy(self):
         """
@@ -2863,27 +3207,56 @@ class ScalingGroupWebhookMigrateTests(SynchronousTestCase):
 
     def test_webhook_index_only(self):
         """
-        `get_webhook_index_only` gets webhook info from policy_webhooks table
-        and webhook_keys in parallel and returns those webhook info that is
+        `get_webhook_index_only` scans webhook_keys table for the webhook keys
+        and then policy_webhooks table and returns those webhook info that is
         there in policy_webhooks table but NOT in webhook_keys table
         """
-        eff = self.store.get_webhook_index_only()
+        def info(tenant_id, key):
+            return {'tenantId': tenant_id, 'groupId': 'g', 'policyId': 'p',
+                    'webhookKey': key}
+
+        params = {'low': MIN_TOKEN, 'high': MAX_TOKEN, 'limit': 1000}
+        seq = [
+            (CQLQueryExecute(
+                query=('SELECT "tenantId", "groupId", "policyId", '
+                       '"webhookKey" FROM webhook_keys WHERE '
+                       'token("webhookKey") > :low AND '
+                       'token("webhookKey") <= :high LIMIT :limit;'),
+                params=params, consistency_level=ConsistencyLevel.ONE),
+             const([info('t1', 'w1')])),
+            (CQLQueryExecute(
+                query=('SELECT "tenantId", "groupId", "policyId", '
+                       '"webhookKey", "webhookId" FROM policy_webhooks WHERE '
+                       'token("tenantId") > :low AND '
+                       'token("tenantId") <= :high LIMIT :limit;'),
+                params=params, consistency_level=ConsistencyLevel.ONE),
+             const([assoc(info('t1', 'w1'), 'webhookId', 'i1'),
+                    assoc(info('t2', 'w2'), 'webhookId', 'i2')]))]
+        r = perform_sequence(seq, self.store.get_webhook_index_only())
+        self.assertEqual(r, set([freeze(info('t2', 'w2'))]))
+
+    def test_webhook_index_only_scan_ranges(self):
+        """
+        `get_webhook_index_only` scans the tables in configured number of
+        token ranges
+        """
+        set_config_data({'cassandra': {'scan_ranges': 2}})
+        self.addCleanup(set_config_data, {})
+        queries = []
+
+        @sync_performer
+        def execute(dispatcher, intent):
+            table = intent.query.split(' FROM ')[1].split()[0]
+            queries.append((table, intent.params['low']))
+            return []
+
+        disp = test_dispatcher(TypeDispatcher({CQLQueryExecute: execute}))
+        r = sync_perform(disp, self.store.get_webhook_index_only())
+        self.assertEqual(r, set())
         self.assertEqual(
-            eff.intent,
-            ParallelEffects([
-                Effect(
-                    CQLQueryExecute(
-                        query=('SELECT "tenantId", "groupId", "policyId", '
-                               '"webhookKey" FROM policy_webhooks'),
-                        params={}, consistency_level=ConsistencyLevel.ONE)),
-                Effect(
-                    CQLQueryExecute(
-                        query=('SELECT "tenantId", "groupId", "policyId", '
-                               '"webhookKey" FROM webhook_keys'),
-                        params={}, consistency_level=ConsistencyLevel.ONE))]))
-        r = resolve_effect(
-            eff, [[{'w1': '1'}, {'w2': '2'}], [{'w1': '1'}]])
-        self.assertEqual(r, set(freeze([{'w2': '2'}])))
+            sorted(queries),
+            [('policy_webhooks', MIN_TOKEN), ('policy_webhooks', 0),
+             ('webhook_keys', MIN_TOKEN), ('webhook_keys', 0)])
 
     def test_add_webhook_keys(self):
         """
@@ -3589,6 +3962,11 @@ class CassScalingGroupsCollectionTestCase(IScalingGroupCollectionProviderMixin,
         self.assertEqual(g.uuid, '12345678')
         self.assertEqual(g.tenant_id, '123')
         self.assertIs(g.local_locks, self.collection.local_locks)
+        self.assertIsNone(g.retryable_modifiers)
+        self.collection.retryable_modifiers = lambda tenant_id: True
+        g = self.collection.get_scaling_group(self.mock_log, '123', '12345678')
+        self.assertIs(g.retryable_modifiers,
+                      self.collection.retryable_modifiers)
 
     def test_webhook_info_by_hash(self):
         """
@@ -3960,36 +4338,46 @@ class CassAdminTestCase(SynchronousTestCase):
         time.time.return_value = 1234567890
 
         self.returns = [
-            [{'count': 190}],
-            [{'count': 191}],
-            [{'count': 192}],
+            [{'tenantId': 't1', 'groupId': 'g1'}],
+            [{'tenantId': 't1', 'groupId': 'g1', 'policyId': 'p1'},
+             {'tenantId': 't1', 'groupId': 'g1', 'policyId': 'p2'}],
+            [],
         ]
 
-        # These are now reversed for an unknown reason.
         expectedResults = [
             {
                 'id': 'otter.metrics.groups',
-                'value': 190,
+                'value': 1,
                 'time': 1234567890
             },
             {
                 'id': 'otter.metrics.policies',
-                'value': 191,
+                'value': 2,
                 'time': 1234567890
             },
             {
                 'id': 'otter.metrics.webhooks',
-                'value': 192,
+                'value': 0,
                 'time': 1234567890
             }
         ]
-        config_query = ('SELECT COUNT(*) FROM scaling_group;')
-        policy_query = ('SELECT COUNT(*) FROM scaling_policies;')
-        webhook_query = ('SELECT COUNT(*) FROM policy_webhooks;')
+        config_query = (
+            'SELECT "tenantId", "groupId" FROM scaling_group WHERE '
+            'token("tenantId") > :low AND token("tenantId") <= :high '
+            'LIMIT :limit;')
+        policy_query = (
+            'SELECT "tenantId", "groupId", "policyId" FROM scaling_policies '
+            'WHERE token("tenantId") > :low AND token("tenantId") <= :high '
+            'LIMIT :limit;')
+        webhook_query = (
+            'SELECT "tenantId", "groupId", "policyId", "webhookId" FROM '
+            'policy_webhooks WHERE token("tenantId") > :low AND '
+            'token("tenantId") <= :high LIMIT :limit;')
+        params = {'low': MIN_TOKEN, 'high': MAX_TOKEN, 'limit': 1000}
 
-        calls = [mock.call(config_query, {}, ConsistencyLevel.QUORUM),
-                 mock.call(policy_query, {}, ConsistencyLevel.QUORUM),
-                 mock.call(webhook_query, {},  ConsistencyLevel.QUORUM)]
+        calls = [mock.call(config_query, params, ConsistencyLevel.QUORUM),
+                 mock.call(policy_query, params, ConsistencyLevel.QUORUM),
+                 mock.call(webhook_query, params, ConsistencyLevel.QUORUM)]
 
         d = self.collection.get_metrics(self.mock_log)
         result = self.successResultOf(d)
@@ -4001,8 +4389,8 @@ class GetScalingGroupsTests(SynchronousTestCase):
     """Tests for ``get_all_valid_groups``."""
 
     @mock.patch("otter.models.cass.CassScalingGroupCollection"
-                ".get_scaling_group_rows")
-    def test_success(self, mock_gsgr):
+                ".each_scaling_group_page")
+    def test_success(self, mock_each_page):
         clock = Clock()
         client = mock.Mock(spec=CQLClient)
         collection = CassScalingGroupCollection(client, clock, 1)
@@ -4015,10 +4403,176 @@ class GetScalingGroupsTests(SynchronousTestCase):
             {'created_at': '0', 'desired': 'some', 'deleting': 'True', },
             {'created_at': '0', 'desired': 'some', 'status': 'ERROR'}]
         rows = [assoc(row, "tenantId", "t1") for row in rows]
-        mock_gsgr.return_value = defer.succeed(rows)
+
+        def each_page(handler, ranges):
+            handler(rows[:3])
+            handler(rows[3:])
+            return defer.succeed(None)
+
+        mock_each_page.side_effect = each_page
         results = self.successResultOf(collection.get_all_valid_groups())
         self.assertEqual(results, [rows[0], rows[3], rows[4], rows[6]])
-        mock_gsgr.assert_called_once_with()
+        self.assertEqual(mock_each_page.call_args[1], {'ranges': 1})
+
+    @mock.patch("otter.models.cass.CassScalingGroupCollection"
+                ".each_scaling_group_page")
+    def test_scan_ranges(self, mock_each_page):
+        """
+        Groups are scanned in configured number of token ranges
+        """
+        set_config_data({'cassandra': {'scan_ranges': 4}})
+        self.addCleanup(set_config_data, {})
+        collection = CassScalingGroupCollection(
+            mock.Mock(spec=CQLClient), Clock(), 1)
+        mock_each_page.return_value = defer.succeed(None)
+        self.assertEqual(
+            self.successResultOf(collection.get_all_valid_groups()), [])
+        self.assertEqual(mock_each_page.call_args[1], {'ranges': 4})
+
+
+class TokenRangesTests(SynchronousTestCase):
+    """Tests for :func:`token_ranges`."""
+
+    def test_ranges(self):
+        """
+        The token ring is split into contiguous ranges of equal size
+        """
+        self.assertEqual(token_ranges(1), [(-2 ** 63, 2 ** 63 - 1)])
+        self.assertEqual(
+            token_ranges(4),
+            [(-2 ** 63, -2 ** 62), (-2 ** 62, 0), (0, 2 ** 62),
+             (2 ** 62, 2 ** 63 - 1)])
+
+
+class ScanTableTests(SynchronousTestCase):
+    """Tests for :func:`scan_table`."""
+
+    select = 'SELECT "v", "k", "c" FROM t WHERE '
+    first_query = (select + 'token("k") > :low AND token("k") <= :high '
+                   'LIMIT :limit;')
+    rest_query = select + '"k" = :key AND ("c") > (:c0) LIMIT :limit;'
+    next_query = (select + 'token("k") > token(:key) AND '
+                  'token("k") <= :high LIMIT :limit;')
+
+    def row(self, k, c, v='v'):
+        return {'k': k, 'c': c, 'v': v}
+
+    def test_pages(self):
+        """
+        Rows are read a page at a time. The rest of the partition the page
+        ended in is read by its clustering columns before the next token.
+        Rows are reduced as they are read.
+        """
+        seq = [
+            (CQLQueryExecute(
+                query=self.first_query,
+                params={'low': MIN_TOKEN, 'high': MAX_TOKEN, 'limit': 2},
+                consistency_level=ConsistencyLevel.ONE),
+             const([self.row(1, 1), self.row(1, 2, 'x')])),
+            (CQLQueryExecute(
+                query=self.rest_query,
+                params={'key': 1, 'c0': 2, 'limit': 2},
+                consistency_level=ConsistencyLevel.ONE),
+             const([self.row(1, 3), self.row(1, 4)])),
+            (CQLQueryExecute(
+                query=self.rest_query,
+                params={'key': 1, 'c0': 4, 'limit': 2},
+                consistency_level=ConsistencyLevel.ONE),
+             const([])),
+            (CQLQueryExecute(
+                query=self.next_query,
+                params={'key': 1, 'high': MAX_TOKEN, 'limit': 2},
+                consistency_level=ConsistencyLevel.ONE),
+             const([self.row(2, 1)]))]
+        eff = scan_table(
+            't', 'k', ['v'],
+            collect_rows(lambda r: r['v'] != 'x', lambda r: (r['k'], r['c'])),
+            clustering=['c'], page_size=2)
+        self.assertEqual(perform_sequence(seq, eff),
+                         [(1, 1), (1, 3), (1, 4), (2, 1)])
+
+    def test_no_clustering(self):
+        """
+        Without clustering columns, a full page is followed by the next token
+        """
+        query = 'SELECT "k" FROM t WHERE '
+        seq = [
+            (CQLQueryExecute(
+                query=query + ('token("k") > :low AND token("k") <= :high '
+                               'LIMIT :limit;'),
+                params={'low': MIN_TOKEN, 'high': MAX_TOKEN, 'limit': 1},
+                consistency_level=ConsistencyLevel.QUORUM),
+             const([{'k': 1}])),
+            (CQLQueryExecute(
+                query=query + ('token("k") > token(:key) AND '
+                               'token("k") <= :high LIMIT :limit;'),
+                params={'key': 1, 'high': MAX_TOKEN, 'limit': 1},
+                consistency_level=ConsistencyLevel.QUORUM),
+             const([]))]
+        eff = scan_table('t', 'k', [], count_rows(), page_size=1,
+                         consistency=ConsistencyLevel.QUORUM)
+        self.assertEqual(perform_sequence(seq, eff), 1)
+
+    def test_ranges(self):
+        """
+        Token ranges are scanned in parallel and their results combined
+        """
+        rows = {MIN_TOKEN: [self.row(1, 1), self.row(2, 1)],
+                -2 ** 62: [self.row(3, 1)], 0: [], 2 ** 62: [self.row(2, 1)]}
+        ranges = []
+
+        @sync_performer
+        def execute(dispatcher, intent):
+            self.assertEqual(intent.query, self.first_query)
+            ranges.append((intent.params['low'], intent.params['high']))
+            return rows[intent.params['low']]
+
+        disp = test_dispatcher(TypeDispatcher({CQLQueryExecute: execute}))
+        eff = scan_table('t', 'k', ['v'], set_of(lambda r: r['k']),
+                         clustering=['c'], ranges=4)
+        self.assertEqual(sync_perform(disp, eff), set([1, 2, 3]))
+        self.assertEqual(sorted(ranges), token_ranges(4))
+        eff = scan_table('t', 'k', ['v'], count_rows(), clustering=['c'],
+                         ranges=4)
+        self.assertEqual(sync_perform(disp, eff), 4)
+
+
+class GetScalingGroupStatusesTests(SynchronousTestCase):
+    """Tests for ``get_scaling_group_statuses``."""
+
+    def test_statuses(self):
+        """
+        Statuses of the tenant's groups are fetched in one query. Groups
+        without ``created_at`` are left out.
+        """
+        client = mock.Mock(spec=CQLClient)
+        collection = CassScalingGroupCollection(client, Clock(), 1)
+        client.execute.return_value = defer.succeed([
+            {'groupId': 'g1', 'status': 'ACTIVE', 'paused': False,
+             'suspended': None, 'deleting': False, 'created_at': 'c'},
+            {'groupId': 'g2', 'status': 'ERROR', 'paused': True,
+             'suspended': True, 'deleting': False, 'created_at': 'c'},
+            {'groupId': 'g3', 'status': 'ACTIVE', 'paused': False,
+             'suspended': False, 'deleting': True, 'created_at': 'c'},
+            {'groupId': 'g4', 'status': None, 'paused': None,
+             'suspended': None, 'deleting': None, 'created_at': None}])
+        d = collection.get_scaling_group_statuses(
+            't1', ['g1', 'g2', 'g3', 'g4'])
+        self.assertEqual(
+            self.successResultOf(d),
+            {'g1': {'status': ScalingGroupStatus.ACTIVE, 'paused': False,
+                    'suspended': False},
+             'g2': {'status': ScalingGroupStatus.ERROR, 'paused': True,
+                    'suspended': True},
+             'g3': {'status': ScalingGroupStatus.DELETING, 'paused': False,
+                    'suspended': False}})
+        client.execute.assert_called_once_with(
+            'SELECT "groupId", status, paused, suspended, deleting, '
+            'created_at FROM scaling_group WHERE "tenantId"=:tenantId AND '
+            '"groupId" IN (:groupId0, :groupId1, :groupId2, :groupId3);',
+            {'tenantId': 't1', 'groupId0': 'g1', 'groupId1': 'g2',
+             'groupId2': 'g3', 'groupId3': 'g4'},
+            ConsistencyLevel.QUORUM)
 
 
 class GetScalingGroupRowsTests(SynchronousTestCase):
@@ -4121,3 +4675,66 @@ class GetScalingGroupRowsTests(SynchronousTestCase):
             {'limit': 5, 'tenantId': 2}, [])
         d = self.collection.get_scaling_group_rows(batch_size=5)
         self.assertEqual(list(self.successResultOf(d)), groups1 + groups2)
+
+    def test_token_ranges(self):
+        """
+        With more than one range, the token ranges are scanned concurrently
+        and rows are returned in the order of ranges
+        """
+        groups = [{'tenantId': i, 'groupId': 1} for i in range(4)]
+        where_range = ('WHERE token("tenantId") > :low '
+                       'AND token("tenantId") <= :high LIMIT :limit;')
+        where_token = ('WHERE token("tenantId") > token(:tenantId) '
+                       'AND token("tenantId") <= :high LIMIT :limit;')
+        (low1, high1), (low2, high2) = token_ranges(2)
+        self._add_exec_args(
+            self.select + where_range,
+            {'limit': 2, 'low': low1, 'high': high1}, groups[:2])
+        self._add_exec_args(
+            self.select + ('WHERE "tenantId"=:tenantId AND '
+                           '"groupId">:groupId LIMIT :limit;'),
+            {'limit': 2, 'tenantId': 1, 'groupId': 1}, [])
+        self._add_exec_args(
+            self.select + where_token,
+            {'limit': 2, 'tenantId': 1, 'high': high1}, [groups[2]])
+        self._add_exec_args(
+            self.select + where_token,
+            {'limit': 2, 'tenantId': 2, 'high': high1}, [])
+        self._add_exec_args(
+            self.select + where_range,
+            {'limit': 2, 'low': low2, 'high': high2}, [groups[3]])
+        d = self.collection.get_scaling_group_rows(batch_size=2, ranges=2)
+        self.assertEqual(self.successResultOf(d), groups)
+
+    def test_each_page_waits_for_handler(self):
+        """
+        `each_scaling_group_page` calls the handler with each page and fetches
+        the next page only after the handler's deferred fires
+        """
+        groups = [{'tenantId': 1, 'groupId': i} for i in range(3)]
+        self._add_exec_args(
+            self.select + ' LIMIT :limit;', {'limit': 2}, groups[:2])
+        self._add_exec_args(
+            self.select + ('WHERE "tenantId"=:tenantId AND '
+                           '"groupId">:groupId LIMIT :limit;'),
+            {'limit': 2, 'tenantId': 1, 'groupId': 1}, groups[2:])
+        self._add_exec_args(
+            self.select + ('WHERE token("tenantId") > token(:tenantId)'
+                           ' LIMIT :limit;'),
+            {'limit': 2, 'tenantId': 1}, [])
+        pages = []
+
+        def handler(page):
+            pages.append((page, defer.Deferred()))
+            return pages[-1][1]
+
+        d = self.collection.each_scaling_group_page(handler, batch_size=2)
+        self.assertEqual([page for page, _ in pages], [groups[:2]])
+        self.assertEqual(self.client.execute.call_count, 1)
+        pages[0][1].callback(None)
+        self.assertEqual([page for page, _ in pages],
+                         [groups[:2], groups[2:]])
+        self.assertNoResult(d)
+        pages[1][1].callback(None)
+        self.assertIsNone(self.successResultOf(d))
+        self.assertEqual(self.client.execute.call_count, 3)
@@ -10,7 +10,9 @@ from twisted.trial.unittest import SynchronousTestCase
 
 from otter.log.intents import get_log_dispatcher
 from otter.models.intents import (
-    DeleteGroup, GetScalingGroupInfo, LoadAndUpdateGroupStatus,
+    DeleteGroup, GetLaunchConfig, GetScalingGroupInfo,
+    GetScalingGroupStatuses,
+    LoadAndUpdateGroupStatus,
     ModifyGroupStatePaused, UpdateGroupErrorReasons, UpdateGroupStatus,
     UpdateServersCache, get_model_dispatcher)
 from otter.models.interface import (
@@ -90,6 +92,16 @@ class ScalingGroupIntentsTests(SynchronousTestCase):
                                                    {'effectful': True}))
         self.assertEqual(result, (self.group, manifest))
 
+    def test_get_launch_config(self):
+        """
+        Performing `GetLaunchConfig` returns the group's launch config.
+        """
+        self.group.view_launch_config.return_value = succeed({'type': 'l'})
+        result = self.perform_with_group(
+            Effect(GetLaunchConfig(tenant_id='00', group_id='g1')),
+            (self.log, '00', 'g1'), self.group)
+        self.assertEqual(result, {'type': 'l'})
+
     def test_delete_group(self):
         """
         Performing `DeleteGroup` calls group.delete_group
@@ -184,3 +196,16 @@ class ScalingGroupIntentsTests(SynchronousTestCase):
         self.assertEqual(modified_state.paused, False)
         modified_state.paused = True
         self.assertEqual(self.state, modified_state)
+
+    def test_get_scaling_group_statuses(self):
+        """
+        Performing `GetScalingGroupStatuses` gets statuses of the groups from
+        the store.
+        """
+        store = mock.Mock(spec=['get_scaling_group_statuses'])
+        store.get_scaling_group_statuses.return_value = succeed('statuses')
+        eff = Effect(GetScalingGroupStatuses('00', ['g1', 'g2']))
+        self.assertEqual(sync_perform(self.get_dispatcher(store), eff),
+                         'statuses')
+        store.get_scaling_group_statuses.assert_called_once_with(
+            '00', ['g1', 'g2'])
@@ -6,6 +6,8 @@ import json
 from twisted.internet import defer
 from twisted.trial.unittest import SynchronousTestCase
 
+from otter.convergence.tracing import PhaseHistograms
+from otter.rest.admin import OtterAdmin
 from otter.test.rest.request import AdminRestAPITestMixin
 
 
@@ -26,3 +28,14 @@ class AdminEndpointsTestCase(AdminRestAPITestMixin, SynchronousTestCase):
 
         response_body = json.loads(self.assert_status_code(200))
         self.assertEqual(metrics, response_body)
+
+    def test_convergence_phases(self):
+        """
+        '/convergence-phases/' returns histograms of convergence phases
+        """
+        histograms = PhaseHistograms()
+        histograms.observe('plan', 0.2)
+        root = OtterAdmin(self.mock_store, histograms).app.resource()
+        response_body = json.loads(self.assert_status_code(
+            200, endpoint='/convergence-phases/', root=root))
+        self.assertEqual(response_body, histograms.as_json())
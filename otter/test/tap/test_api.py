@@ -19,7 +19,8 @@ from twisted.trial.unittest import SynchronousTestCase
 
 from otter.auth import CachingAuthenticator, SingleTenantAuthenticator
 from otter.constants import (
-    CONVERGENCE_DIRTY_DIR, ServiceType, get_service_configs)
+    CONVERGENCE_DIRTY_DIR, CONVERGENCE_PARTITIONER_PATH,
+    CONVERGENCE_WEIGHTS_PATH, ServiceType, get_service_configs)
 from otter.convergence.selfheal import SelfHeal
 from otter.convergence.service import Converger
 from otter.log.cloudfeeds import CloudFeedsObserver
@@ -41,7 +42,7 @@ from otter.test.utils import (
     CheckFailure, exp_func, matches, mock_log, patch)
 from otter.util.config import set_config_data
 from otter.util.deferredutils import DeferredPool
-from otter.util.zkpartitioner import Partitioner
+from otter.util.zkpartitioner import Partitioner, WeightedPartitioner
 
 
 test_config = {
@@ -284,6 +285,8 @@ class APIMakeServiceTests(SynchronousTestCase):
 
         self.RoundRobinCassandraCluster = patch(
             self, 'otter.tap.api.RoundRobinCassandraCluster')
+        self.PreparingCassandraCluster = patch(
+            self, 'otter.tap.api.PreparingCassandraCluster')
         self.LoggingCQLClient = patch(
             self, 'otter.tap.api.LoggingCQLClient')
         self.TimingOutCQLClient = patch(
@@ -395,6 +398,21 @@ class APIMakeServiceTests(SynchronousTestCase):
             [self.clientFromString.return_value],
             'otter_test', disconnect_on_cancel=True)
 
+    def test_cassandra_cluster_prepared_statements(self):
+        """
+        makeService configures a PreparingCassandraCluster if
+        ``cassandra.prepared_statements`` is set in the config.
+        """
+        config = deepcopy(test_config)
+        config['cassandra']['prepared_statements'] = True
+        makeService(config)
+        self.PreparingCassandraCluster.assert_called_once_with(
+            [self.clientFromString.return_value],
+            'otter_test', disconnect_on_cancel=True)
+        self.assertFalse(self.RoundRobinCassandraCluster.called)
+        self.TimingOutCQLClient.assert_called_once_with(
+            self.reactor, self.PreparingCassandraCluster.return_value, 10)
+
     def test_cassandra_scaling_group_collection_with_cluster(self):
         """
         makeService configures a CassScalingGroupCollection with the
@@ -441,6 +459,17 @@ class APIMakeServiceTests(SynchronousTestCase):
         makeService(test_config)
         self.assertEqual(self.store.max_groups, 100)
 
+    def test_retryable_modifiers(self):
+        """
+        CassScalingGroupCollection is configured to treat modifiers of groups
+        of tenants enabled for convergence as retryable
+        """
+        config = deepcopy(test_config)
+        config['non-convergence-tenants'] = ['t1']
+        makeService(config)
+        self.assertFalse(self.store.retryable_modifiers('t1'))
+        self.assertTrue(self.store.retryable_modifiers('t2'))
+
     @mock.patch('otter.tap.api.reactor')
     @mock.patch('otter.tap.api.generate_authenticator')
     @mock.patch('otter.tap.api.SupervisorService', wraps=SupervisorService)
@@ -547,7 +576,9 @@ class APIMakeServiceTests(SynchronousTestCase):
         config["selfheal"] = {"interval": 200}
         config["converger"] = {
             "interval": 20, "build_timeout": 300,
-            "limited_retry_iterations": 15, "step_limits": {"s": "l"}}
+            "limited_retry_iterations": 15, "step_limits": {"s": "l"},
+            "buckets": 40, "max_concurrent_groups": 25,
+            "sharded_dirty_flags": True, "max_backoff_interval": 600}
 
         kz_client = mock.Mock(spec=['start', 'stop'])
         start_d = defer.Deferred()
@@ -591,7 +622,8 @@ class APIMakeServiceTests(SynchronousTestCase):
                          sch.health_check)
         self.assertEqual(self.Otter.return_value.scheduler, sch)
         mock_cvg.assert_called_once_with(
-            parent, kz_client, "disp", 20, 300, 15, {"s": "l"})
+            parent, kz_client, "disp", 20, 300, 15, {"s": "l"}, 40, None,
+            25, True, 600)
         mock_shsvc.assert_called_once_with(
             self.reactor, config, "disp", self.health_checker, self.log)
         self.assertTrue(mock_shsvc.return_value in list(parent))
@@ -730,7 +762,8 @@ class APIMakeServiceTests(SynchronousTestCase):
         parent = makeService(config)
 
         mock_setup_converger.assert_called_once_with(
-            parent, kz_client, mock.ANY, 10, 3600, 10, {"step": 10})
+            parent, kz_client, mock.ANY, 10, 3600, 10, {"step": 10}, 10, None,
+            None, None, None)
 
         dispatcher = mock_setup_converger.call_args[0][2]
 
@@ -746,7 +779,7 @@ class SetupSelfhealTests(SynchronousTestCase):
     Test for :func:`setup_selfheal_service`
     """
 
-    def _test_setup(self, config, interval):
+    def _test_setup(self, config, interval, batch_size=None):
         """
         SelfHeal function wrapped with locking and logging is setup to call
         again using TimerService. It is setup on given interval based on
@@ -758,7 +791,7 @@ class SetupSelfhealTests(SynchronousTestCase):
         from otter.tap.api import zk
         from otter.util.config import config_value
         selfheal = SelfHeal(clock, base_dispatcher, config_value, interval,
-                            log)
+                            log, batch_size)
         self.patch(
             zk, "locked_logged_func",
             exp_func(self, ("func", "lock"), base_dispatcher, "/selfheallock",
@@ -784,6 +817,13 @@ class SetupSelfhealTests(SynchronousTestCase):
         """
         self._test_setup({"selfheal": {"interval": 30.0}}, 30.0)
 
+    def test_setup_batch_size(self):
+        """
+        SelfHeal service is configured with batch size taken from config
+        """
+        self._test_setup({"selfheal": {"interval": 30.0, "batch_size": 50}},
+                         30.0, 50)
+
     def test_no_config(self):
         """
         returns None if "selfheal" config is not there
@@ -836,6 +876,85 @@ class ConvergerSetupTests(SynchronousTestCase):
         self.assertEqual(timer.step, interval)
         mock_watch_children.assert_called_once_with(
             kz_client, CONVERGENCE_DIRTY_DIR, converger.divergent_changed)
+        self.assertEqual(partitioner.buckets, range(10))
+
+    @mock.patch('otter.tap.api.watch_children')
+    def test_setup_converger_buckets(self, mock_watch_children):
+        """
+        The converger partitions given number of buckets
+        """
+        ms = MultiService()
+        setup_converger(ms, object(), object(), 50, 35, 52, {}, 64)
+        [converger] = ms.services
+        self.assertEqual(converger.partitioner.buckets, range(64))
+
+    @mock.patch('otter.tap.api.watch_children')
+    def test_setup_converger_weighted(self, mock_watch_children):
+        """
+        With weighted partitioning config, the converger has a
+        :obj:`WeightedPartitioner` and publishes costs on configured interval
+        """
+        ms = MultiService()
+        setup_converger(ms, object(), object(), 50, 35, 52, {}, 64,
+                        {'publish_interval': 30, 'threshold': 1.5})
+        [converger] = ms.services
+        partitioner = converger.partitioner
+        self.assertIs(partitioner.__class__, WeightedPartitioner)
+        self.assertEqual(partitioner.partitioner_path,
+                         CONVERGENCE_PARTITIONER_PATH)
+        self.assertEqual(partitioner.weights_path, CONVERGENCE_WEIGHTS_PATH)
+        self.assertEqual(partitioner.rebalance_interval, 600)
+        self.assertEqual(partitioner.threshold, 1.5)
+        self.assertEqual(converger.publish_costs_interval, 30)
+
+    @mock.patch('otter.tap.api.watch_children')
+    def test_setup_converger_max_concurrent_groups(self, mock_watch_children):
+        """
+        The converger limits concurrent convergences if configured
+        """
+        ms = MultiService()
+        setup_converger(ms, object(), object(), 50, 35, 52, {}, 64, None, 20)
+        [converger] = ms.services
+        self.assertEqual(converger.max_concurrent_groups, 20)
+
+    @mock.patch('otter.tap.api.watch_children')
+    def test_setup_converger_sharded_dirty_flags(self, mock_watch_children):
+        """
+        With sharded dirty flags, the converger watches its buckets with the
+        kazoo client. The flat directory is still watched.
+        """
+        ms = MultiService()
+        kz_client = object()
+        setup_converger(ms, kz_client, object(), 50, 35, 52, {}, 64, None,
+                        None, True)
+        [converger] = ms.services
+        converger._watch_children('/path', 'callback')
+        self.assertEqual(
+            mock_watch_children.mock_calls,
+            [mock.call(kz_client, CONVERGENCE_DIRTY_DIR,
+                       converger.divergent_changed),
+             mock.call(kz_client, '/path', 'callback')])
+
+    @mock.patch('otter.tap.api.watch_children')
+    def test_setup_converger_flat_dirty_flags(self, mock_watch_children):
+        """
+        By default the converger does not watch directories of its buckets
+        """
+        ms = MultiService()
+        setup_converger(ms, object(), object(), 50, 35, 52, {})
+        [converger] = ms.services
+        self.assertIsNone(converger._watch_children)
+
+    @mock.patch('otter.tap.api.watch_children')
+    def test_setup_converger_max_backoff_interval(self, mock_watch_children):
+        """
+        The converger backs off groups up to configured interval
+        """
+        ms = MultiService()
+        setup_converger(ms, object(), object(), 50, 35, 52, {}, 64, None,
+                        None, False, 600)
+        [converger] = ms.services
+        self.assertEqual(converger.max_backoff_interval, 600)
 
 
 class SchedulerSetupTests(SynchronousTestCase):
@@ -1511,7 +1511,7 @@ class ModifyAndTriggerTests(SynchronousTestCase):
         self.logargs = {"a": "b"}
         self.disp = SequenceDispatcher([
             (BoundFields(mock.ANY, self.logargs),
-             nested_sequence([(("tg", "tid", "gid"), noop)]))
+             nested_sequence([(("tg", "tid", "gid", "dirty"), noop)]))
         ])
 
     def modify(self, group, state):
@@ -1548,6 +1548,22 @@ class ModifyAndTriggerTests(SynchronousTestCase):
         self.assertIsNone(self.successResultOf(d))
         self.assertTrue(self.disp.consumed())
 
+    def test_policy_execution(self):
+        """
+        Convergence is triggered with policy reason when modifying state for
+        user initiated policy execution
+        """
+        for reason in ["execute_policy", "execute_webhook"]:
+            disp = SequenceDispatcher([
+                (BoundFields(mock.ANY, self.logargs),
+                 nested_sequence([(("tg", "tid", "gid", "policy"), noop)]))
+            ])
+            d = controller.modify_and_trigger(
+                disp, self.group, self.logargs, self.modify,
+                modify_state_reason=reason)
+            self.assertIsNone(self.successResultOf(d))
+            self.assertTrue(disp.consumed())
+
     def test_worker_tenant(self):
         """
         Only calls group.modify_state() for worker tenants. Does not trigger
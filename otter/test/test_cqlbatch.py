@@ -1,12 +1,19 @@
 """ CQL Batch wrapper test """
+from datetime import datetime
+from uuid import UUID
+
 from twisted.trial.unittest import SynchronousTestCase
 import mock
 from twisted.internet import defer
 from twisted.internet.task import Clock
 
+from silverberg import marshal
+from silverberg.cassandra import ttypes
 from silverberg.client import ConsistencyLevel
 
-from otter.util.cqlbatch import Batch, TimingOutCQLClient
+from otter.util.cqlbatch import (
+    Batch, PreparingCassandraCluster, PreparingCQLClient, TimingOutCQLClient,
+    _Unbindable, _encode)
 from otter.util.deferredutils import TimedOutError
 
 
@@ -114,3 +121,286 @@ class TimingOutCQLClientTests(SynchronousTestCase):
         self.assertNoResult(d)
         self.clock.advance(10)
         self.failureResultOf(d, TimedOutError)
+
+
+def prepared(item_id, *types):
+    """
+    Return CqlPreparedResult with given id and variable types
+    """
+    return ttypes.CqlPreparedResult(
+        itemId=item_id, count=len(types), variable_types=list(types),
+        variable_names=['v{}'.format(i) for i in range(len(types))])
+
+
+class PreparingCQLClientTests(SynchronousTestCase):
+    """
+    Tests for :class:`PreparingCQLClient`
+    """
+
+    def setUp(self):
+        """
+        Sample client connected to a mock Thrift client
+        """
+        self.client = PreparingCQLClient(mock.Mock(), 'ks')
+        self.thrift = self.connect()
+        self.query = 'SELECT * FROM t WHERE a = :a AND b = :b AND c = :a;'
+        self.bound = 'SELECT * FROM t WHERE a = ? AND b = ? AND c = ?;'
+        self.args = {'a': u'x', 'b': 5}
+
+    def connect(self):
+        """
+        Make the client use a new mock Thrift connection that prepares
+        statements with the types of `self.query` and returns 4 rows
+        """
+        thrift = mock.Mock()
+        thrift.prepare_cql3_query.side_effect = \
+            lambda q, c: defer.succeed(prepared(
+                len(thrift.prepare_cql3_query.mock_calls), marshal.UTF8_TYPE,
+                marshal.INTEGER32_TYPE, marshal.UTF8_TYPE))
+        thrift.execute_prepared_cql3_query.side_effect = \
+            lambda *a: defer.succeed(
+                ttypes.CqlResult(type=ttypes.CqlResultType.INT, num=4))
+        thrift.execute_cql3_query.side_effect = \
+            lambda *a: defer.succeed(
+                ttypes.CqlResult(type=ttypes.CqlResultType.INT, num=4))
+        self.client._connection = lambda: defer.succeed(thrift)
+        return thrift
+
+    def execute(self, query=None, args=None):
+        """
+        Execute query and return its result
+        """
+        return self.successResultOf(self.client.execute(
+            query or self.query, args or self.args, ConsistencyLevel.ONE))
+
+    def test_prepares_once(self):
+        """
+        Each distinct query is prepared once and executed with params bound
+        in the order of the markers
+        """
+        self.assertEqual(self.execute(), 4)
+        self.assertEqual(self.execute(args={'a': 'y', 'b': 6}), 4)
+        self.thrift.prepare_cql3_query.assert_called_once_with(
+            self.bound, ttypes.Compression.NONE)
+        self.assertEqual(
+            self.thrift.execute_prepared_cql3_query.mock_calls,
+            [mock.call(1, ['x', '\x00\x00\x00\x05', 'x'],
+                       ConsistencyLevel.ONE),
+             mock.call(1, ['y', '\x00\x00\x00\x06', 'y'],
+                       ConsistencyLevel.ONE)])
+        self.assertFalse(self.thrift.execute_cql3_query.called)
+
+    def test_rows(self):
+        """
+        Rows returned are unmarshalled like :class:`CQLClient` does
+        """
+        self.thrift.execute_prepared_cql3_query.side_effect = None
+        self.thrift.execute_prepared_cql3_query.return_value = defer.succeed(
+            ttypes.CqlResult(
+                type=ttypes.CqlResultType.ROWS,
+                schema=ttypes.CqlMetadata(
+                    value_types={'a': marshal.UTF8_TYPE}),
+                rows=[ttypes.CqlRow(columns=[ttypes.Column('a', 'x')])]))
+        self.assertEqual(self.execute(), [{'a': u'x'}])
+
+    def test_new_connection(self):
+        """
+        Statements are prepared again on a new connection
+        """
+        self.execute()
+        thrift = self.connect()
+        self.execute()
+        thrift.prepare_cql3_query.assert_called_once_with(
+            self.bound, ttypes.Compression.NONE)
+        self.assertEqual(thrift.execute_prepared_cql3_query.call_count, 1)
+
+    def test_failure_forgets_statement(self):
+        """
+        A statement whose execution fails is prepared again next time
+        """
+        self.thrift.execute_prepared_cql3_query.side_effect = [
+            defer.fail(ttypes.InvalidRequestException('unknown')),
+            defer.succeed(ttypes.CqlResult(type=ttypes.CqlResultType.VOID))]
+        self.failureResultOf(
+            self.client.execute(self.query, self.args, ConsistencyLevel.ONE),
+            ttypes.InvalidRequestException)
+        self.assertIsNone(self.execute())
+        self.assertEqual(self.thrift.prepare_cql3_query.call_count, 2)
+        self.assertEqual(
+            [c[1][0] for c in
+             self.thrift.execute_prepared_cql3_query.mock_calls], [1, 2])
+
+    def test_prepare_rejected(self):
+        """
+        A query Cassandra does not prepare is executed as text, and is not
+        prepared again
+        """
+        self.thrift.prepare_cql3_query.side_effect = \
+            lambda q, c: defer.fail(ttypes.InvalidRequestException('no'))
+        self.assertEqual(self.execute(), 4)
+        self.assertEqual(self.execute(), 4)
+        self.assertEqual(self.thrift.prepare_cql3_query.call_count, 1)
+        self.thrift.execute_cql3_query.assert_called_with(
+            "SELECT * FROM t WHERE a = 'x' AND b = 5 AND c = 'x';",
+            ttypes.Compression.NONE, ConsistencyLevel.ONE)
+        self.assertFalse(self.thrift.execute_prepared_cql3_query.called)
+
+    def test_prepare_failed(self):
+        """
+        Other errors preparing a statement are returned
+        """
+        self.thrift.prepare_cql3_query.side_effect = \
+            lambda q, c: defer.fail(ValueError('conn'))
+        self.failureResultOf(
+            self.client.execute(self.query, self.args, ConsistencyLevel.ONE),
+            ValueError)
+        self.assertFalse(self.thrift.execute_cql3_query.called)
+
+    def test_missing_param(self):
+        """
+        A query with a param missing is executed as text without preparing
+        """
+        self.assertEqual(self.execute(args={'a': 'x'}), 4)
+        self.assertFalse(self.thrift.prepare_cql3_query.called)
+        self.thrift.execute_cql3_query.assert_called_once_with(
+            "SELECT * FROM t WHERE a = 'x' AND b = :b AND c = 'x';",
+            ttypes.Compression.NONE, ConsistencyLevel.ONE)
+
+    def test_unbindable(self):
+        """
+        A query with a value that cannot be bound is executed as text
+        """
+        self.assertEqual(self.execute(args={'a': 'x', 'b': None}), 4)
+        self.thrift.execute_cql3_query.assert_called_once_with(
+            "SELECT * FROM t WHERE a = 'x' AND b = null AND c = 'x';",
+            ttypes.Compression.NONE, ConsistencyLevel.ONE)
+        self.assertFalse(self.thrift.execute_prepared_cql3_query.called)
+
+    def test_disconnect_on_cancel(self):
+        """
+        Cancelling a query disconnects if the client is created with
+        ``disconnect_on_cancel``
+        """
+        self.client = PreparingCQLClient(
+            mock.Mock(), 'ks', disconnect_on_cancel=True)
+        thrift = self.connect()
+        thrift.execute_prepared_cql3_query.side_effect = None
+        thrift.execute_prepared_cql3_query.return_value = defer.Deferred()
+        self.client.disconnect = mock.Mock()
+        d = self.client.execute(self.query, self.args, ConsistencyLevel.ONE)
+        d.cancel()
+        self.client.disconnect.assert_called_once_with()
+        self.failureResultOf(d, defer.CancelledError)
+
+    def test_max_statements(self):
+        """
+        Only ``max_statements`` recently used statements are kept
+        """
+        self.client = PreparingCQLClient(mock.Mock(), 'ks', max_statements=1)
+        thrift = self.connect()
+        other = self.query.replace('t ', 'u ')
+        for query in [self.query, other, self.query]:
+            self.execute(query)
+        self.assertEqual(thrift.prepare_cql3_query.call_count, 3)
+
+
+class PreparingCassandraClusterTests(SynchronousTestCase):
+    """
+    Tests for :class:`PreparingCassandraCluster`
+    """
+
+    def test_clients(self):
+        """
+        A client is created per endpoint with the given args
+        """
+        cluster = PreparingCassandraCluster(
+            [mock.Mock(), mock.Mock()], 'ks', disconnect_on_cancel=True)
+        self.assertEqual(len(cluster._seed_clients), 2)
+        for client in cluster._seed_clients:
+            self.assertIsInstance(client, PreparingCQLClient)
+            self.assertEqual(client._keyspace, 'ks')
+            self.assertTrue(client._disconnect_on_cancel)
+
+
+class EncodeTests(SynchronousTestCase):
+    """
+    Tests for :func:`_encode`
+    """
+
+    def test_inverse_of_unmarshal(self):
+        """
+        Encoded values are decoded back by silverberg's unmarshallers
+        """
+        uuid = UUID('0123456789abcdef0123456789abcdef')
+        for vtype, value in [
+                (marshal.ASCII_TYPE, 'abc'),
+                (marshal.UTF8_TYPE, u'\u00e9t\u00e9'),
+                (marshal.BOOLEAN_TYPE, True),
+                (marshal.BOOLEAN_TYPE, False),
+                (marshal.INTEGER32_TYPE, -3),
+                (marshal.LONG_TYPE, 1 << 40),
+                (marshal.DOUBLE_TYPE, 2.5),
+                (marshal.INTEGER_TYPE, 0),
+                (marshal.INTEGER_TYPE, 127),
+                (marshal.INTEGER_TYPE, 128),
+                (marshal.INTEGER_TYPE, -129),
+                (marshal.INTEGER_TYPE, 1 << 70),
+                (marshal.TIME_UUID_TYPE, uuid),
+                (marshal.TIMESTAMP_TYPE, datetime(2015, 1, 2, 3, 4, 5))]:
+            self.assertEqual(
+                marshal.unmarshallers[vtype](_encode(vtype, value)), value)
+
+    def test_uuid_string(self):
+        """
+        UUIDs can be given as strings
+        """
+        uuid = '01234567-89ab-cdef-0123-456789abcdef'
+        self.assertEqual(_encode(marshal.UUID_TYPE, uuid), UUID(uuid).bytes)
+
+    def test_timestamp_millis(self):
+        """
+        Timestamps can be given as milliseconds since epoch
+        """
+        self.assertEqual(_encode(marshal.TIMESTAMP_TYPE, 1000),
+                         '\x00\x00\x00\x00\x00\x00\x03\xe8')
+
+    def test_collections(self):
+        """
+        Lists, sets and maps are encoded with their elements' types
+        """
+        ltype = '{}({})'.format(marshal.LIST_TYPE, marshal.UTF8_TYPE)
+        self.assertEqual(
+            marshal.unmarshal_list(marshal.UTF8_TYPE,
+                                   _encode(ltype, [u'a', u'bc'])),
+            [u'a', u'bc'])
+        mtype = '{}({},{})'.format(
+            marshal.MAP_TYPE, marshal.ASCII_TYPE, marshal.INTEGER32_TYPE)
+        self.assertEqual(
+            marshal.unmarshal_map(marshal.ASCII_TYPE, marshal.INTEGER32_TYPE,
+                                  _encode(mtype, {'a': 1, 'b': 2})),
+            {'a': 1, 'b': 2})
+
+    def test_reversed(self):
+        """
+        Values of reversed types are encoded with the type they reverse
+        """
+        rtype = 'org.apache.cassandra.db.marshal.ReversedType({})'.format(
+            marshal.LONG_TYPE)
+        self.assertEqual(_encode(rtype, 5), _encode(marshal.LONG_TYPE, 5))
+
+    def test_unbindable(self):
+        """
+        `_Unbindable` is raised for None, values not of the type and unknown
+        types
+        """
+        ltype = '{}({})'.format(marshal.LIST_TYPE, marshal.UTF8_TYPE)
+        for vtype, value in [(marshal.UTF8_TYPE, None),
+                             (marshal.ASCII_TYPE, 5),
+                             (marshal.INTEGER32_TYPE, 'a'),
+                             (marshal.INTEGER_TYPE, 2.5),
+                             (marshal.BOOLEAN_TYPE, 'a'),
+                             (marshal.UUID_TYPE, 'a'),
+                             (ltype, 'ab'),
+                             (ltype, [None]),
+                             ('org.apache.cassandra.db.marshal.Unknown', 1)]:
+            self.assertRaises(_Unbindable, _encode, vtype, value)
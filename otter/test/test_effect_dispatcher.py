@@ -7,16 +7,18 @@ from twisted.trial.unittest import SynchronousTestCase
 
 from otter.auth import Authenticate, InvalidateToken
 from otter.cloud_client import TenantScope
+from otter.convergence.tracing import Span
 from otter.effect_dispatcher import (
     get_full_dispatcher,
     get_legacy_dispatcher,
     get_simple_dispatcher)
 from otter.log.intents import BoundFields, Log, LogErr, MsgWithTime
 from otter.models.cass import CQLQueryExecute
-from otter.models.intents import GetScalingGroupInfo
+from otter.models.intents import GetScalingGroupInfo, GetScalingGroupStatuses
 from otter.util.pure_http import Request
 from otter.util.retry import Retry
-from otter.util.zk import CreateOrSet
+from otter.util.semaphore import PrioritySemaphore
+from otter.util.zk import CreateOrSet, Transaction
 from otter.worker_intents import EvictServerFromScalingGroup
 
 
@@ -28,21 +30,25 @@ def simple_intents():
         Retry(effect=Effect(Constant(None)), should_retry=lambda e: False),
         Delay(0),
         Constant(None),
-        ReadReference(ref=Reference(None))
+        ReadReference(ref=Reference(None)),
+        PrioritySemaphore(1).acquire().intent
     ]
 
 
 def legacy_intents():
     return simple_intents() + [
         TenantScope(Effect(Constant(None)), 1),
-        Log('msg', {}), LogErr('f', 'msg', {}), BoundFields(Effect(None), {})
+        Log('msg', {}), LogErr('f', 'msg', {}), BoundFields(Effect(None), {}),
+        Span('phase', Effect(None))
     ]
 
 
 def full_intents():
     return legacy_intents() + [
         CreateOrSet(path='foo', content='bar'),
+        Transaction([]),
         GetScalingGroupInfo(tenant_id='foo', group_id='bar'),
+        GetScalingGroupStatuses(tenant_id='foo', group_ids=['bar']),
         EvictServerFromScalingGroup(log='log', transaction_id='transaction_id',
                                     scaling_group='scaling_group',
                                     server_id='server_id'),
@@ -0,0 +1,82 @@
+from twisted.trial.unittest import SynchronousTestCase
+
+from otter.util.lru import LRUCache
+
+
+class LRUCacheTests(SynchronousTestCase):
+    """
+    Tests for `LRUCache`
+    """
+
+    def setUp(self):
+        """
+        Sample `LRUCache` object
+        """
+        self.cache = LRUCache(2)
+
+    def test_get_set(self):
+        """
+        `get` returns value stored by `set` and default if key is not there
+        """
+        self.cache.set('a', 1)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('b', 3), 3)
+
+    def test_evicts_least_recently_set(self):
+        """
+        Storing a new key when full evicts the least recently stored key
+        """
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.set('c', 3)
+        self.assertNotIn('a', self.cache)
+        self.assertEqual(len(self.cache), 2)
+        self.assertEqual((self.cache.get('b'), self.cache.get('c')), (2, 3))
+
+    def test_get_refreshes(self):
+        """
+        Looking up a key makes it most recently used
+        """
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a')
+        self.cache.set('c', 3)
+        self.assertNotIn('b', self.cache)
+        self.assertIn('a', self.cache)
+
+    def test_set_existing(self):
+        """
+        Storing an existing key replaces its value without evicting others
+        """
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.set('a', 3)
+        self.assertEqual(len(self.cache), 2)
+        self.assertEqual(self.cache.get('a'), 3)
+        self.assertEqual(self.cache.get('b'), 2)
+
+    def test_pop(self):
+        """
+        `pop` removes the key and returns its value, or the default if it is
+        not in the cache
+        """
+        self.cache.set('a', 1)
+        self.assertEqual(self.cache.pop('a'), 1)
+        self.assertNotIn('a', self.cache)
+        self.assertIs(self.cache.pop('a'), None)
+        self.assertEqual(self.cache.pop('a', 5), 5)
+
+    def test_clear(self):
+        """
+        `clear` removes all items
+        """
+        self.cache.set('a', 1)
+        self.cache.clear()
+        self.assertEqual(len(self.cache), 0)
+
+    def test_invalid_maxsize(self):
+        """
+        `ValueError` is raised if maxsize is not positive
+        """
+        self.assertRaises(ValueError, LRUCache, 0)
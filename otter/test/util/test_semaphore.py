@@ -0,0 +1,103 @@
+"""Tests for otter.util.semaphore"""
+
+from effect import (
+    ComposedDispatcher, Effect, Error, Func, TypeDispatcher, base_dispatcher,
+    perform)
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from otter.util.semaphore import Acquire, PrioritySemaphore, perform_acquire
+
+
+class PrioritySemaphoreTests(SynchronousTestCase):
+    """Tests for :obj:`PrioritySemaphore`."""
+
+    def setUp(self):
+        self.sem = PrioritySemaphore(2)
+        self.dispatcher = ComposedDispatcher([
+            TypeDispatcher({Acquire: perform_acquire}), base_dispatcher])
+        self.acquired = []
+
+    def acquire(self, name, permits=1, priority=0):
+        """Acquire permits and remember ``name`` when acquired"""
+        perform(self.dispatcher,
+                self.sem.acquire(permits, priority).on(
+                    lambda _: self.acquired.append(name)))
+
+    def release(self, permits=1):
+        perform(self.dispatcher, self.sem.release(permits))
+
+    def test_acquire_within_limit(self):
+        """
+        Permits are acquired right away while they are available
+        """
+        self.acquire('a')
+        self.acquire('b')
+        self.assertEqual(self.acquired, ['a', 'b'])
+        self.assertEqual(self.sem.held, 2)
+
+    def test_waiters_in_priority_order(self):
+        """
+        Waiters get released permits in order of priority and then in the
+        order they asked for them
+        """
+        self.acquire('a', 2)
+        self.acquire('b', priority=3)
+        self.acquire('c', priority=1)
+        self.acquire('d', priority=1)
+        self.assertEqual(self.acquired, ['a'])
+        self.release()
+        self.assertEqual(self.acquired, ['a', 'c'])
+        self.release()
+        self.assertEqual(self.acquired, ['a', 'c', 'd'])
+        self.release()
+        self.assertEqual(self.acquired, ['a', 'c', 'd', 'b'])
+
+    def test_not_overtaken(self):
+        """
+        A waiter for many permits is not overtaken by a later waiter for
+        fewer permits
+        """
+        self.acquire('a')
+        self.acquire('b', 2)
+        self.acquire('c')
+        self.assertEqual(self.acquired, ['a'])
+        self.release()
+        self.assertEqual(self.acquired, ['a', 'b'])
+        self.release(2)
+        self.assertEqual(self.acquired, ['a', 'b', 'c'])
+
+    def test_more_than_limit(self):
+        """
+        Asking for more permits than the limit acquires all of them
+        """
+        self.acquire('a', 5)
+        self.assertEqual((self.acquired, self.sem.held), (['a'], 2))
+        self.release(5)
+        self.assertEqual(self.sem.held, 0)
+
+    def test_run(self):
+        """
+        :meth:`PrioritySemaphore.run` performs the effect holding the permits
+        and releases them after it succeeds or fails
+        """
+        results = []
+        perform(self.dispatcher, self.sem.run(Effect(Func(
+            lambda: self.sem.held)), 2).on(results.append))
+        self.assertEqual((results, self.sem.held), ([2], 0))
+        perform(self.dispatcher, self.sem.run(Effect(Error(ValueError()))).on(
+            error=lambda e: results.append(e[0])))
+        self.assertEqual((results, self.sem.held), ([2, ValueError], 0))
+
+    def test_idle(self):
+        """
+        The semaphore is idle when no permits are held or waited for
+        """
+        self.assertTrue(self.sem.idle)
+        self.acquire('a', 2)
+        self.acquire('b')
+        self.assertFalse(self.sem.idle)
+        self.release(2)
+        self.assertFalse(self.sem.idle)
+        self.release()
+        self.assertTrue(self.sem.idle)
@@ -17,7 +17,7 @@ from effect.testing import (
 
 from kazoo.exceptions import (
     BadVersionError, LockTimeout, NoNodeError, NodeExistsError,
-    SessionExpiredError)
+    RolledBackError, SessionExpiredError)
 
 from twisted.internet.defer import fail, maybeDeferred, succeed
 from twisted.trial.unittest import SynchronousTestCase
@@ -25,9 +25,9 @@ from twisted.trial.unittest import SynchronousTestCase
 from otter.test.utils import exp_func, mock_log, test_dispatcher
 from otter.util import zk
 from otter.util.zk import (
-    CreateOrSet, CreateOrSetLoopLimitReachedError,
-    DeleteNode, GetChildren, GetChildrenWithStats,
-    GetStat,
+    CreateNode, CreateOrSet, CreateOrSetLoopLimitReachedError,
+    DeleteNode, GetChildren, GetChildrenWithStats, GetData,
+    GetStat, SetData, Transaction, TransactionFailed,
     get_zk_dispatcher,
     perform_create_or_set, perform_delete_node)
 
@@ -102,6 +102,50 @@ class ZKCrudModel(object):
         else:
             return None
 
+    def transaction(self):
+        """Return a transaction of create and set operations."""
+        return ZKTransactionModel(self)
+
+
+class ZKTransactionModel(object):
+    """
+    A simplified model of Kazoo's ``TransactionRequest`` on a
+    :obj:`ZKCrudModel`, supporting create and set operations.
+    """
+    def __init__(self, model):
+        self.model = model
+        self.operations = []
+
+    def create(self, path, value="", ephemeral=False, sequence=False):
+        """Add operation to create a node."""
+        self.operations.append((True, path, value))
+
+    def set_data(self, path, value, version=-1):
+        """Add operation to set the content of a node."""
+        self.operations.append((False, path, value))
+
+    def commit(self):
+        """Apply all the operations if all of them succeed."""
+        nodes = self.model.nodes.copy()
+        results = []
+        for create, path, value in self.operations:
+            if create and path in nodes:
+                results.append(NodeExistsError(path))
+            elif create:
+                nodes[path] = (value, 0)
+                results.append(path)
+            elif path not in nodes:
+                results.append(NoNodeError(path))
+            else:
+                nodes[path] = (value, nodes[path][1] + 1)
+                results.append(ZNodeStatStub(version=nodes[path][1]))
+        if any(isinstance(result, Exception) for result in results):
+            return succeed(
+                [result if isinstance(result, Exception)
+                 else RolledBackError() for result in results])
+        self.model.nodes = nodes
+        return succeed(results)
+
 
 class _ZKLock(object):
     """
@@ -317,6 +361,29 @@ class GetStatTests(SynchronousTestCase):
         self.assertEqual(result, None)
 
 
+class GetDataTests(SynchronousTestCase):
+    """Tests for :obj:`GetData`."""
+
+    def setUp(self):
+        self.model = ZKCrudModel()
+
+    def _gd(self, path):
+        eff = Effect(GetData(path))
+        dispatcher = get_zk_dispatcher(self.model)
+        return sync_perform(dispatcher, eff)
+
+    def test_get_data(self):
+        """Returns the content and ZnodeStat when the node exists."""
+        self.model.create('/foo/bar', value='foo', makepath=True)
+        result = self._gd('/foo/bar')
+        self.assertEqual(result, ('foo', ZNodeStatStub(version=0)))
+
+    def test_get_data_not_exists(self):
+        """Returns None when no node exists."""
+        result = self._gd('/foo/bar')
+        self.assertEqual(result, None)
+
+
 class DeleteTests(SynchronousTestCase):
     """Tests for :obj:`DeleteNode`."""
     def test_delete(self):
@@ -343,6 +410,49 @@ class CreateTests(SynchronousTestCase):
         self.assertEqual(result, '/foo')
 
 
+class SetDataTests(SynchronousTestCase):
+    """Tests for :obj:`SetData`."""
+    def test_set_data(self):
+        model = ZKCrudModel()
+        model.create('/foo', 'initial', makepath=True)
+        eff = Effect(SetData(path='/foo', value="v"))
+        result = sync_perform(get_zk_dispatcher(model), eff)
+        self.assertEqual(model.nodes, {"/foo": ("v", 1)})
+        self.assertEqual(result, ZNodeStatStub(version=1))
+
+
+class TransactionTests(SynchronousTestCase):
+    """Tests for :obj:`Transaction`."""
+    def setUp(self):
+        self.model = ZKCrudModel()
+        self.model.create('/foo', 'initial', makepath=True)
+        self.dispatcher = get_zk_dispatcher(self.model)
+
+    def test_commit(self):
+        """
+        All the operations are applied and their results are returned
+        """
+        eff = Effect(Transaction([CreateNode('/bar', 'b'),
+                                  SetData('/foo', 'f')]))
+        result = sync_perform(self.dispatcher, eff)
+        self.assertEqual(result, ['/bar', ZNodeStatStub(version=1)])
+        self.assertEqual(self.model.nodes,
+                         {'/foo': ('f', 1), '/bar': ('b', 0)})
+
+    def test_failed(self):
+        """
+        If any operation fails, :obj:`TransactionFailed` is raised with the
+        results and none of the operations are applied
+        """
+        eff = Effect(Transaction([CreateNode('/bar', 'b'),
+                                  CreateNode('/foo', 'f')]))
+        exc = self.assertRaises(
+            TransactionFailed, sync_perform, self.dispatcher, eff)
+        self.assertIsInstance(exc.results[0], RolledBackError)
+        self.assertIsInstance(exc.results[1], NodeExistsError)
+        self.assertEqual(self.model.nodes, {'/foo': ('initial', 0)})
+
+
 class PollingLockTests(SynchronousTestCase):
 
     def setUp(self):
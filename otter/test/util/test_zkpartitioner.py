@@ -1,15 +1,23 @@
 """Tests for otter.util.zkpartitioner"""
 
+import json
+
+from kazoo.exceptions import BadVersionError, NoNodeError, NodeExistsError
 from kazoo.recipe.partitioner import PartitionState
 
 import mock
 
-from twisted.internet.defer import Deferred
+from twisted.internet.defer import Deferred, fail, succeed
 from twisted.internet.task import Clock
 from twisted.trial.unittest import SynchronousTestCase
 
 from otter.test.utils import mock_log
-from otter.util.zkpartitioner import Partitioner
+from otter.util.zkpartitioner import (
+    Partitioner,
+    WeightedPartitioner,
+    balance_buckets,
+    imbalance,
+    weighted_partition)
 
 
 class PartitionerTests(SynchronousTestCase):
@@ -274,3 +282,329 @@ class PartitionerTests(SynchronousTestCase):
         self.partitioner.startService()
         self.assertEqual(self.partitioner.get_current_state(),
                          PartitionState.ACQUIRED)
+
+
+class BalanceBucketsTests(SynchronousTestCase):
+    """
+    Tests for :func:`balance_buckets`, :func:`weighted_partition` and
+    :func:`imbalance`
+    """
+
+    def test_balances_weights(self):
+        """
+        Heavy buckets are spread and light buckets fill up the rest
+        """
+        weights = {'0': 10, '1': 10, '2': 5, '3': 5, '4': 5, '5': 5}
+        self.assertEqual(
+            balance_buckets(weights, ['b', 'a'], range(6)),
+            {'a': [0, 2, 4], 'b': [1, 3, 5]})
+        self.assertEqual(
+            balance_buckets({'0': 30, '1': 5, '2': 5}, ['a', 'b'], range(3)),
+            {'a': [0], 'b': [1, 2]})
+
+    def test_no_weights(self):
+        """
+        Buckets without weights are spread evenly
+        """
+        self.assertEqual(
+            balance_buckets({}, ['a', 'b', 'c'], range(7)),
+            {'a': [0, 3, 6], 'b': [1, 4], 'c': [2, 5]})
+        self.assertEqual(
+            balance_buckets({'0': 100}, ['a', 'b', 'c'], range(5)),
+            {'a': [0], 'b': [1, 3], 'c': [2, 4]})
+
+    def test_weighted_partition(self):
+        """
+        :func:`weighted_partition` returns buckets of the given member and
+        all members get disjoint buckets covering all of them
+        """
+        weights = {'0': 3, '4': 8}
+        parts = [weighted_partition(weights, m, ['c', 'a', 'b'], range(10))
+                 for m in ['a', 'b', 'c']]
+        self.assertEqual(sorted(sum(parts, [])), range(10))
+        self.assertEqual(parts[0], [4])
+
+    def test_imbalance(self):
+        """
+        Imbalance is ratio of maximum to mean and 1 if there is no load
+        """
+        self.assertEqual(imbalance([1, 2, 3]), 1.5)
+        self.assertEqual(imbalance([0, 0]), 1.0)
+        self.assertEqual(imbalance([]), 1.0)
+
+
+class FakeZK(object):
+    """
+    Fake txkazoo client storing nodes as path -> (content, version, mtime)
+    """
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.nodes = {}
+        self.ephemerals = set()
+
+    def get(self, path):
+        if path not in self.nodes:
+            return fail(NoNodeError(path))
+        content, version, mtime = self.nodes[path]
+        return succeed(
+            (content, mock.Mock(version=version, mtime=mtime * 1000)))
+
+    def create(self, path, value, ephemeral=False, makepath=False):
+        assert makepath
+        if path in self.nodes:
+            return fail(NodeExistsError(path))
+        self.nodes[path] = (value, 0, self.clock.seconds())
+        if ephemeral:
+            self.ephemerals.add(path)
+        return succeed(path)
+
+    def set(self, path, value, version=-1):
+        if path not in self.nodes:
+            return fail(NoNodeError(path))
+        current = self.nodes[path][1]
+        if version != -1 and version != current:
+            return fail(BadVersionError(path))
+        self.nodes[path] = (value, current + 1, self.clock.seconds())
+        return succeed(None)
+
+    def get_children(self, path):
+        children = set(p[len(path) + 1:].split('/')[0] for p in self.nodes
+                       if p.startswith(path + '/'))
+        if not children:
+            return fail(NoNodeError(path))
+        return succeed(sorted(children))
+
+    def delete(self, path, recursive=False):
+        assert recursive
+        deleted = [p for p in self.nodes
+                   if p == path or p.startswith(path + '/')]
+        if not deleted:
+            return fail(NoNodeError(path))
+        for p in deleted:
+            del self.nodes[p]
+        return succeed(None)
+
+
+class WeightedPartitionerTests(SynchronousTestCase):
+    """Tests for :obj:`WeightedPartitioner`."""
+
+    def setUp(self):
+        self.clock = Clock()
+        self.clock.advance(10000)
+        self.zk = self.kz_client = FakeZK(self.clock)
+        self.kz_partitioner = mock.MagicMock(
+            allocating=False, release=False, failed=False, acquired=True)
+        self.kz_client.SetPartitioner = mock.Mock(
+            return_value=self.kz_partitioner)
+        self.log = mock_log()
+        self.buckets_received = []
+        self.partitioner = WeightedPartitioner(
+            self.kz_client, 10, '/part', range(4), 15, self.log,
+            self.buckets_received.append, '/weights',
+            rebalance_interval=600, threshold=1.25, clock=self.clock)
+        self.partitioner.identifier = 'me'
+
+    def set_weights(self, weights, version):
+        """Store weights node of given version modified now"""
+        self.zk.nodes['/weights/weights'] = (
+            json.dumps(weights), version, self.clock.seconds())
+
+    def test_partitioner_created_after_weights(self):
+        """
+        The kazoo partitioner is created on the partitioner path, with
+        weighted partition function, after the weights are read
+        """
+        self.set_weights({'1': 5}, 3)
+        self.partitioner.startService()
+        self.assertEqual(self.buckets_received, [])
+        [call] = self.kz_client.SetPartitioner.call_args_list
+        args, kwargs = call
+        self.assertEqual(args, ('/part',))
+        self.assertEqual(
+            kwargs['partition_func']('me', ['me', 'you'], range(4)), [1])
+        self.assertEqual(kwargs['set'], range(4))
+        self.assertEqual(kwargs['identifier'], 'me')
+        self.assertEqual(self.partitioner.partitioner, self.kz_partitioner)
+        self.kz_partitioner.__iter__.return_value = [1]
+        self.clock.advance(10)
+        self.assertEqual(self.buckets_received, [[1]])
+
+    def test_no_weights(self):
+        """
+        Without weights node, the partitioner is created with empty weights
+        """
+        self.partitioner.startService()
+        self.assertEqual(
+            self.kz_client.SetPartitioner.call_args[0], ('/part',))
+        self.assertEqual(self.partitioner.weights, {})
+        self.assertEqual(self.partitioner.weights_version, -1)
+
+    def test_deletes_versioned_paths(self):
+        """
+        Directories of weights versions under the partitioner path are
+        deleted on start
+        """
+        for path in ['/part/3/party/a', '/part/-1/locks/2', '/part/party/b',
+                     '/part/locks/1']:
+            self.zk.nodes[path] = ('', 0, 0)
+        self.partitioner.startService()
+        self.assertEqual(sorted(self.zk.nodes),
+                         ['/part/locks/1', '/part/party/b'])
+
+    def test_not_started(self):
+        """
+        Until the weights are read, it is allocating and is not healthy
+        """
+        self.kz_client.get = lambda path: Deferred()
+        self.partitioner.startService()
+        self.assertEqual(self.partitioner.get_current_state(),
+                         PartitionState.ALLOCATING)
+        self.assertEqual(
+            self.successResultOf(self.partitioner.health_check()),
+            (False, {'reason': 'Not acquired'}))
+
+    def test_weights_changed(self):
+        """
+        The kazoo partitioner is finished and created again when weights
+        version changes
+        """
+        self.set_weights({}, 0)
+        self.partitioner.startService()
+        old = self.kz_partitioner
+        new = self.kz_client.SetPartitioner.return_value = mock.Mock()
+        self.set_weights({'0': 2}, 1)
+        self.clock.advance(10)
+        old.finish.assert_called_once_with()
+        self.assertIs(self.partitioner.partitioner, new)
+        self.assertEqual(self.partitioner.weights, {'0': 2})
+        self.assertEqual(
+            self.kz_client.SetPartitioner.call_args[0], ('/part',))
+        self.log.msg.assert_called_with(
+            'Got weights version {version}', version=1, old_version=0,
+            otter_msg_type='partition-weights-changed')
+
+    def test_weights_changed_while_allocating(self):
+        """
+        The kazoo partitioner is finished when weights version changes even
+        if it has not acquired the buckets yet
+        """
+        self.set_weights({}, 0)
+        self.partitioner.startService()
+        self.kz_partitioner.acquired = False
+        self.kz_partitioner.allocating = True
+        self.set_weights({'0': 2}, 1)
+        self.clock.advance(10)
+        self.kz_partitioner.finish.assert_called_once_with()
+
+    def test_publish_costs(self):
+        """
+        Costs are published to an ephemeral node and then updated
+        """
+        self.set_weights({}, 0)
+        self.successResultOf(self.partitioner.publish_costs({1: 2.5}))
+        self.assertEqual(json.loads(self.zk.nodes['/weights/costs/me'][0]),
+                         {'1': 2.5})
+        self.assertEqual(self.zk.ephemerals, set(['/weights/costs/me']))
+        self.successResultOf(self.partitioner.publish_costs({1: 3}))
+        self.assertEqual(self.zk.nodes['/weights/costs/me'][:2],
+                         (json.dumps({'1': 3}), 1))
+
+    def publish(self, identifier, costs):
+        """Store published costs of a node"""
+        self.zk.nodes['/weights/costs/' + identifier] = (
+            json.dumps(costs), 0, self.clock.seconds())
+
+    def test_rebalance(self):
+        """
+        Costs of all nodes are merged into weights when loads are
+        imbalanced, taking highest of a bucket's costs
+        """
+        self.set_weights({}, 0)
+        self.assertFalse(self.successResultOf(self.partitioner.rebalance()))
+        self.clock.advance(600)
+        self.publish('me', {'0': 10, '1': 8})
+        self.publish('you', {'2': 1, '3': 1, '1': 2})
+        self.assertTrue(self.successResultOf(self.partitioner.rebalance()))
+        self.assertEqual(self.zk.nodes['/weights/weights'][:2],
+                         (json.dumps({'0': 10, '1': 8, '2': 1, '3': 1}), 1))
+        self.log.msg.assert_called_with(
+            'Rebalanced buckets', imbalance=18 / 11.0, new_imbalance=1.0,
+            otter_msg_type='partition-rebalanced')
+
+    def test_rebalance_creates_weights(self):
+        """
+        Weights node is created if it does not exist
+        """
+        self.publish('me', {'0': 10, '1': 8})
+        self.publish('you', {'2': 1, '3': 1})
+        self.assertTrue(self.successResultOf(self.partitioner.rebalance()))
+        self.assertEqual(self.zk.nodes['/weights/weights'][:2],
+                         (json.dumps({'0': 10, '1': 8, '2': 1, '3': 1}), 0))
+
+    def test_rebalance_not_due(self):
+        """
+        Weights are not changed within rebalance interval of this node first
+        seeing their version, irrespective of their modification time
+        """
+        self.set_weights({}, 0)
+        self.zk.nodes['/weights/weights'] = ('{}', 0, 0)
+        self.publish('me', {'0': 10, '1': 8})
+        self.publish('you', {'2': 1, '3': 1})
+        self.assertFalse(self.successResultOf(self.partitioner.rebalance()))
+        self.clock.advance(599)
+        self.assertFalse(self.successResultOf(self.partitioner.rebalance()))
+        self.assertEqual(self.zk.nodes['/weights/weights'][:2], ('{}', 0))
+
+    def test_rebalance_version_changed(self):
+        """
+        A new version of weights is waited for the rebalance interval again
+        """
+        self.set_weights({}, 0)
+        self.publish('me', {'0': 10, '1': 8})
+        self.publish('you', {'2': 1, '3': 1})
+        self.assertFalse(self.successResultOf(self.partitioner.rebalance()))
+        self.clock.advance(600)
+        self.set_weights({'0': 1}, 1)
+        self.assertFalse(self.successResultOf(self.partitioner.rebalance()))
+        self.clock.advance(600)
+        self.assertTrue(self.successResultOf(self.partitioner.rebalance()))
+
+    def test_rebalance_balanced(self):
+        """
+        Weights are not changed if loads are within threshold or if the
+        merged costs do not balance better
+        """
+        self.publish('me', {'0': 10, '1': 1})
+        self.publish('you', {'2': 9, '3': 1})
+        self.assertFalse(self.successResultOf(self.partitioner.rebalance()))
+        self.publish('me', {'0': 10})
+        self.publish('you', {'1': 1, '2': 1, '3': 1})
+        self.assertFalse(self.successResultOf(self.partitioner.rebalance()))
+        self.assertNotIn('/weights/weights', self.zk.nodes)
+
+    def test_rebalance_no_costs(self):
+        """
+        Weights are not changed if no costs are published
+        """
+        self.assertFalse(self.successResultOf(self.partitioner.rebalance()))
+
+    def test_rebalance_conflict(self):
+        """
+        Weights are not changed if another node changes them in between
+        """
+        self.set_weights({}, 0)
+        self.assertFalse(self.successResultOf(self.partitioner.rebalance()))
+        self.clock.advance(600)
+        self.publish('me', {'0': 10, '1': 8})
+        self.publish('you', {'2': 1, '3': 1})
+        get_children = self.zk.get_children
+
+        def rebalanced_by_other(path):
+            self.set_weights({'0': 1}, 1)
+            return get_children(path)
+
+        self.kz_client.get_children = rebalanced_by_other
+        self.assertFalse(self.successResultOf(self.partitioner.rebalance()))
+        self.assertEqual(self.zk.nodes['/weights/weights'][:2],
+                         (json.dumps({'0': 1}), 1))
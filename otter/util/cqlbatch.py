@@ -1,8 +1,20 @@
 """ CQL Batch wrapper"""
 
-from silverberg.client import ConsistencyLevel
+import calendar
+import re
+import struct
+from datetime import datetime
+from uuid import UUID
+
+from silverberg import marshal
+from silverberg.cassandra import ttypes
+from silverberg.client import CQLClient, ConsistencyLevel
+from silverberg.cluster import RoundRobinCassandraCluster
+
+from twisted.internet.defer import Deferred, succeed
 
 from otter.util.deferredutils import timeout_deferred
+from otter.util.lru import LRUCache
 
 
 class Batch(object):
@@ -69,3 +81,243 @@ class TimingOutCQLClient(object):
         See :py:func:`silverberg.client.CQLClient.disconnect`
         """
         return self._client.disconnect()
+
+
+class PreparingCQLClient(CQLClient):
+    """
+    A CQLClient that prepares each distinct query once per connection with
+    Cassandra's ``prepare_cql3_query`` and then executes it with
+    ``execute_prepared_cql3_query``, sending the params as bound values
+    instead of interpolating them into the query text.
+
+    Prepared statements live on the Thrift connection they were prepared on,
+    so the registry is cleared whenever the connection changes. A statement
+    whose execution fails is dropped and prepared again on next use, in case
+    Cassandra no longer knows it (e.g. after a schema change).
+
+    A query is executed as text, like :class:`CQLClient` does, if it cannot be
+    prepared, if one of its params is missing or if a value cannot be bound
+    to its column type (e.g. None).
+
+    Takes the same arguments as :class:`CQLClient` and
+
+    :param int max_statements: Number of prepared statements to keep
+    """
+
+    def __init__(self, *args, **kwargs):
+        max_statements = kwargs.pop('max_statements', 1000)
+        super(PreparingCQLClient, self).__init__(*args, **kwargs)
+        self._statements = LRUCache(max_statements)
+        self._prepared_on = None
+
+    def _statements_on(self, client):
+        """
+        Return registry of statements prepared on the given Thrift client
+        """
+        if client is not self._prepared_on:
+            self._statements.clear()
+            self._prepared_on = client
+        return self._statements
+
+    def _prepare(self, client, query):
+        """
+        Return Deferred of statement of given query prepared on ``client`` or
+        ``None`` if Cassandra rejects preparing it
+        """
+        statements = self._statements_on(client)
+        if query in statements:
+            return succeed(statements.get(query))
+
+        def prepared(statement):
+            statements.set(query, statement)
+            return statement
+
+        def rejected(f):
+            f.trap(ttypes.InvalidRequestException)
+            return None
+
+        d = client.prepare_cql3_query(query, ttypes.Compression.NONE)
+        return d.addErrback(rejected).addCallback(prepared)
+
+    def execute(self, query, args, consistency):
+        """
+        See :py:func:`silverberg.client.CQLClient.execute`
+        """
+        names = [m[1:] for m in marshal._param_re.findall(query)]
+        if not all(name in args for name in names):
+            return super(PreparingCQLClient, self).execute(
+                query, args, consistency)
+        bound_query = marshal._param_re.sub('?', query)
+
+        def execute_statement(statement, client):
+            try:
+                values = _bind_values(statement, names, args)
+            except _Unbindable:
+                return super(PreparingCQLClient, self).execute(
+                    query, args, consistency)
+            d = client.execute_prepared_cql3_query(
+                statement.itemId, values, consistency)
+            d.addErrback(forget, client)
+            if self._disconnect_on_cancel:
+                cancellable_d = Deferred(lambda _: self.disconnect())
+                d.chainDeferred(cancellable_d)
+                d = cancellable_d
+            return d.addCallback(self._process_result)
+
+        def forget(f, client):
+            self._statements_on(client).pop(bound_query)
+            return f
+
+        def prepare(client):
+            d = self._prepare(client, bound_query)
+            return d.addCallback(execute_statement, client)
+
+        return self._connection().addCallback(prepare)
+
+    def _process_result(self, result):
+        """
+        Convert result like :func:`silverberg.client.CQLClient.execute` does
+        """
+        if result.type == ttypes.CqlResultType.ROWS:
+            return self._unmarshal_result(result.schema, result.rows,
+                                          marshal.unmarshallers)
+        elif result.type == ttypes.CqlResultType.INT:
+            return result.num
+        return None
+
+
+class PreparingCassandraCluster(RoundRobinCassandraCluster):
+    """
+    A :class:`RoundRobinCassandraCluster` whose clients are
+    :class:`PreparingCQLClient`
+    """
+
+    def __init__(self, seed_endpoints, keyspace, user=None, password=None,
+                 disconnect_on_cancel=False):
+        super(PreparingCassandraCluster, self).__init__(
+            seed_endpoints, keyspace, user, password, disconnect_on_cancel)
+        self._seed_clients = [
+            PreparingCQLClient(endpoint, keyspace, user, password,
+                               disconnect_on_cancel)
+            for endpoint in seed_endpoints]
+
+
+class _Unbindable(Exception):
+    """
+    A value cannot be bound to its column type
+    """
+
+
+def _bind_values(statement, names, args):
+    """
+    Return list of binary values of ``args`` to execute the prepared statement
+    with. ``names`` are the param names in the order of the bind markers.
+
+    :raises: :class:`_Unbindable` if the statement is ``None`` or a value
+        cannot be encoded
+    """
+    if statement is None or statement.count != len(names):
+        raise _Unbindable()
+    return [_encode(vtype, args[name])
+            for vtype, name in zip(statement.variable_types, names)]
+
+
+def _encode_text(value):
+    """
+    Encode ascii, text or blob value
+    """
+    if not isinstance(value, basestring):
+        raise TypeError(value)
+    return value.encode('utf8') if isinstance(value, unicode) else value
+
+
+def _encode_uuid(value):
+    """
+    Encode UUID given as :class:`UUID` or string
+    """
+    return (value if isinstance(value, UUID) else UUID(value)).bytes
+
+
+def _encode_timestamp(value):
+    """
+    Encode datetime or milliseconds since epoch
+    """
+    if isinstance(value, datetime):
+        value = (calendar.timegm(value.utctimetuple()) * 1000 +
+                 value.microsecond // 1000)
+    return struct.pack('>q', value)
+
+
+def _encode_varint(value):
+    """
+    Encode integer in big-endian two's complement form of minimum length
+    """
+    if not isinstance(value, (int, long)):
+        raise TypeError(value)
+    length = (value if value >= 0 else ~value).bit_length() // 8 + 1
+    return '{:0{}x}'.format(
+        value % (1 << length * 8), length * 2).decode('hex')
+
+
+_encoders = {
+    marshal.BYTES_TYPE: _encode_text,
+    marshal.ASCII_TYPE: _encode_text,
+    marshal.UTF8_TYPE: _encode_text,
+    marshal.BOOLEAN_TYPE: lambda v: {True: '\x01', False: '\x00'}[v],
+    marshal.INTEGER32_TYPE: struct.Struct('>i').pack,
+    marshal.LONG_TYPE: struct.Struct('>q').pack,
+    marshal.COUNTER_TYPE: struct.Struct('>q').pack,
+    marshal.DOUBLE_TYPE: struct.Struct('>d').pack,
+    marshal.INTEGER_TYPE: _encode_varint,
+    marshal.UUID_TYPE: _encode_uuid,
+    marshal.LEXICAL_UUID_TYPE: _encode_uuid,
+    marshal.TIME_UUID_TYPE: _encode_uuid,
+    marshal.TIMESTAMP_TYPE: _encode_timestamp,
+    marshal.NEW_TIMESTAMP_TYPE: _encode_timestamp,
+}
+
+_collection_re = re.compile(r'^([\w.]+)\((.*)\)$')
+
+_reversed_type = 'org.apache.cassandra.db.marshal.ReversedType'
+
+
+def _encode(vtype, value):
+    """
+    Encode ``value`` in binary form of Cassandra type ``vtype``. This is the
+    inverse of :data:`silverberg.marshal.unmarshallers`.
+
+    :raises: :class:`_Unbindable` if value cannot be encoded
+    """
+    if value is None:
+        raise _Unbindable()
+    match = _collection_re.match(vtype)
+    try:
+        if match is not None:
+            return _encode_collection(
+                match.group(1), match.group(2).split(','), value)
+        return _encoders[vtype](value)
+    except (TypeError, ValueError, AttributeError, KeyError, struct.error):
+        raise _Unbindable()
+
+
+def _encode_collection(ctype, etypes, value):
+    """
+    Encode collection ``value`` of type ``ctype`` with element types
+    ``etypes``
+    """
+    if ctype == _reversed_type:
+        return _encode(','.join(etypes), value)
+    if isinstance(value, basestring):
+        raise _Unbindable()
+    if ctype in (marshal.LIST_TYPE, marshal.SET_TYPE) and len(etypes) == 1:
+        elements = [_encode(etypes[0], v) for v in value]
+    elif ctype == marshal.MAP_TYPE and len(etypes) == 2:
+        elements = []
+        for k, v in value.items():
+            elements.extend([_encode(etypes[0], k), _encode(etypes[1], v)])
+        value = value.items()
+    else:
+        raise _Unbindable()
+    return ''.join(
+        [struct.pack('>H', len(value))] +
+        [struct.pack('>H', len(e)) + e for e in elements])
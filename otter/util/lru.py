@@ -0,0 +1,61 @@
+"""
+A small bounded least-recently-used cache
+"""
+
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    A mapping of at most ``maxsize`` items. When full, storing a new key
+    evicts the key that was least recently stored or looked up.
+
+    :param int maxsize: Maximum number of items to keep
+    """
+
+    def __init__(self, maxsize):
+        if maxsize < 1:
+            raise ValueError("maxsize must be positive: {}".format(maxsize))
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+
+    def get(self, key, default=None):
+        """
+        Return value of ``key`` and mark it as most recently used. Return
+        ``default`` if ``key`` is not in the cache.
+        """
+        try:
+            value = self._items.pop(key)
+        except KeyError:
+            return default
+        self._items[key] = value
+        return value
+
+    def set(self, key, value):
+        """
+        Store ``value`` against ``key``, evicting the least recently used
+        item if the cache is full
+        """
+        self._items.pop(key, None)
+        self._items[key] = value
+        if len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """
+        Remove ``key`` and return its value. Return ``default`` if ``key`` is
+        not in the cache.
+        """
+        return self._items.pop(key, default)
+
+    def clear(self):
+        """
+        Remove all items
+        """
+        self._items.clear()
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
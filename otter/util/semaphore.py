@@ -0,0 +1,93 @@
+"""
+A semaphore for effects that wakes its waiters in order of priority.
+"""
+
+import heapq
+from itertools import count
+
+import attr
+
+from effect import Effect, Func
+
+import six
+
+
+class PrioritySemaphore(object):
+    """
+    Limits the number of permits held by effects at a time. Effects waiting
+    for permits get them in order of priority (lower first) and then in the
+    order they asked for them. A waiter is not overtaken by a later one that
+    asks for fewer permits, so it is never starved.
+
+    :ivar int limit: Number of permits
+    :ivar int held: Number of permits currently held
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.held = 0
+        # heap of (priority, sequence, permits, box)
+        self._waiters = []
+        self._sequence = count()
+
+    @property
+    def idle(self):
+        """Are no permits held or waited for?"""
+        return self.held == 0 and not self._waiters
+
+    def acquire(self, permits=1, priority=0):
+        """
+        Return Effect of None fired when ``permits`` are acquired. Asking for
+        more than ``limit`` permits acquires all of them.
+        """
+        return Effect(Acquire(self, min(permits, self.limit), priority))
+
+    def release(self, permits=1):
+        """
+        Return Effect of releasing ``permits`` acquired by :meth:`acquire`.
+        """
+        return Effect(Func(self._release, min(permits, self.limit)))
+
+    def run(self, eff, permits=1, priority=0):
+        """
+        Perform ``eff`` holding ``permits`` and release them once it is done,
+        even if it fails.
+
+        :return: Effect of result of ``eff``
+        """
+        release = self.release(permits)
+        return self.acquire(permits, priority).on(lambda _: eff).on(
+            success=lambda r: release.on(lambda _: r),
+            error=lambda e: release.on(lambda _: six.reraise(*e)))
+
+    def _wait(self, permits, priority, box):
+        heapq.heappush(self._waiters,
+                       (priority, next(self._sequence), permits, box))
+        self._wake()
+
+    def _release(self, permits):
+        self.held -= permits
+        self._wake()
+
+    def _wake(self):
+        while (self._waiters and
+               self.held + self._waiters[0][2] <= self.limit):
+            _, _, permits, box = heapq.heappop(self._waiters)
+            self.held += permits
+            box.succeed(None)
+
+
+@attr.s
+class Acquire(object):
+    """
+    Intent to acquire permits of a :obj:`PrioritySemaphore`. Use
+    :meth:`PrioritySemaphore.acquire` to create it.
+    """
+    semaphore = attr.ib()
+    permits = attr.ib()
+    priority = attr.ib()
+
+
+def perform_acquire(dispatcher, intent, box):
+    """Perform :obj:`Acquire` by waiting for the permits."""
+    intent.semaphore._wait(intent.permits, intent.priority, box)
@@ -52,6 +52,66 @@ def perform_create(kz_client, dispatcher, intent):
         sequence=intent.sequence)
 
 
+@attr.s
+class SetData(object):
+    """
+    Intent to set content of znode
+    """
+    path = attr.ib()
+    value = attr.ib()
+    version = attr.ib(default=-1)
+
+
+@deferred_performer
+def perform_set_data(kz_client, dispatcher, intent):
+    """Perform :obj:`SetData`."""
+    return kz_client.set(intent.path, intent.value, version=intent.version)
+
+
+@attr.s
+class Transaction(object):
+    """
+    Intent to perform :obj:`CreateNode` and :obj:`SetData` operations
+    atomically in one ZooKeeper multi operation. Results in list of results
+    of the operations.
+    """
+    operations = attr.ib()
+
+
+class TransactionFailed(Exception):
+    """
+    Raised when performing :obj:`Transaction` fails. None of its operations
+    are applied.
+
+    :ivar list results: Result of each operation. Operations that failed
+        have their exception and others have :obj:`RolledBackError`.
+    """
+    def __init__(self, results):
+        super(TransactionFailed, self).__init__(results)
+        self.results = results
+
+
+@deferred_performer
+def perform_transaction(kz_client, dispatcher, intent):
+    """
+    Perform :obj:`Transaction`. Must be partialed with ``kz_client``.
+    """
+    transaction = kz_client.transaction()
+    for op in intent.operations:
+        if isinstance(op, CreateNode):
+            transaction.create(op.path, op.value, ephemeral=op.ephemeral,
+                               sequence=op.sequence)
+        else:
+            transaction.set_data(op.path, op.value, version=op.version)
+
+    def check_results(results):
+        if any(isinstance(result, Exception) for result in results):
+            raise TransactionFailed(results)
+        return results
+
+    return transaction.commit().addCallback(check_results)
+
+
 @attributes(['path', 'content'])
 class CreateOrSet(object):
     """
@@ -152,6 +212,23 @@ def perform_get_stat(kz_client, dispatcher, intent):
     return kz_client.exists(intent.path)
 
 
+@attributes(['path'], apply_with_init=False)
+class GetData(object):
+    """
+    Get the content and :obj:`ZnodeStat` of a ZK node as a tuple, or None if
+    the node does not exist.
+    """
+    def __init__(self, path):
+        self.path = path
+
+
+@deferred_performer
+def perform_get_data(kz_client, dispatcher, intent):
+    """Perform a :obj:`GetData`."""
+    d = kz_client.get(intent.path)
+    return d.addErrback(catch_failure(NoNodeError, lambda f: None))
+
+
 @attributes(['path', 'version'])
 class DeleteNode(object):
     """Delete a node."""
@@ -180,8 +257,12 @@ def get_zk_dispatcher(kz_client):
             partial(perform_get_children_with_stats, kz_client),
         GetChildren:
             partial(perform_get_children, kz_client),
+        GetData:
+            partial(perform_get_data, kz_client),
         GetStat:
-            partial(perform_get_stat, kz_client)
+            partial(perform_get_stat, kz_client),
+        SetData: partial(perform_set_data, kz_client),
+        Transaction: partial(perform_transaction, kz_client)
     })
 
 
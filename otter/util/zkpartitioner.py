@@ -2,9 +2,21 @@
 ZooKeeper set-partitioning stuff.
 """
 
+import heapq
+import json
+import os
+import socket
+from functools import partial
+
+from kazoo.exceptions import BadVersionError, NoNodeError, NodeExistsError
+from kazoo.recipe.partitioner import PartitionState
+
 from twisted.application.internet import TimerService
 from twisted.application.service import MultiService
-from twisted.internet.defer import succeed
+from twisted.internet.defer import (
+    gatherResults, inlineCallbacks, returnValue, succeed)
+
+from otter.util.deferredutils import catch_failure
 
 
 class Partitioner(MultiService, object):
@@ -143,3 +155,286 @@ class Partitioner(MultiService, object):
         ``ACQUIRED``.
         """
         return list(self.partitioner)
+
+
+def balance_buckets(weights, members, buckets):
+    """
+    Assign buckets to members so that the total weight of each member's
+    buckets is balanced. Heaviest buckets are assigned first, each to the
+    member with least total weight so far. Ties are broken by order of
+    members and buckets, so the assignment only depends on the arguments.
+
+    Every bucket weighs at least 1% of the average weight so that buckets
+    without any cost are spread between members too.
+
+    :param dict weights: ``str`` of bucket -> weight. Buckets not in it
+        weigh the minimum.
+    :param members: iterable of member identifiers
+    :param buckets: iterable of buckets
+
+    :return: ``dict`` of member -> list of its buckets
+    """
+    buckets = sorted(buckets)
+    members = sorted(members)
+    floor = (sum(weights.values()) / len(buckets) / 100.0
+             if buckets else 0) or 1.0
+
+    def weight(bucket):
+        return max(weights.get(str(bucket), 0), floor)
+
+    assigned = {member: [] for member in members}
+    loads = [(0, i) for i in range(len(members))]
+    for bucket in sorted(buckets, key=lambda b: -weight(b)):
+        load, i = heapq.heappop(loads)
+        assigned[members[i]].append(bucket)
+        heapq.heappush(loads, (load + weight(bucket), i))
+    return assigned
+
+
+def weighted_partition(weights, identifier, members, buckets):
+    """
+    Partition function for kazoo's :obj:`SetPartitioner` that balances
+    weights of buckets. See :func:`balance_buckets`.
+
+    :return: list of buckets of ``identifier``
+    """
+    return balance_buckets(weights, members, buckets)[identifier]
+
+
+def imbalance(loads):
+    """
+    How imbalanced are the loads? Ratio of maximum load to mean load.
+
+    :param list loads: list of numbers
+    """
+    mean = sum(loads) / float(len(loads)) if loads else 0
+    return max(loads) / mean if mean else 1.0
+
+
+class WeightedPartitioner(Partitioner):
+    """
+    A :obj:`Partitioner` that balances the cost of buckets between the nodes
+    instead of their number.
+
+    Each node publishes the cost of its buckets with :meth:`publish_costs` in
+    an ephemeral node under ``<weights_path>/costs``. When the weights have
+    not changed for ``rebalance_interval`` seconds, a node merges the
+    published costs into the ``<weights_path>/weights`` node if the nodes'
+    loads are more imbalanced than ``threshold`` and the merged costs balance
+    them better.
+
+    All nodes partition on the same ``partitioner_path``. When a node sees a
+    new version of the weights node, it finishes its kazoo partitioner and
+    creates a new one with the new weights. Leaving and joining the party
+    makes every other member release its buckets and allocate again, and they
+    all see the new version within ``interval`` seconds and do the same.
+    Until then members may disagree on the partitioning, but a bucket is
+    acquired only with its lock under the shared path, so it is never owned
+    by two nodes at once.
+    """
+    def __init__(self, kz_client, interval, partitioner_path, buckets,
+                 time_boundary, log, got_buckets, weights_path,
+                 rebalance_interval=600, threshold=1.25, clock=None):
+        """
+        See :obj:`Partitioner` for other parameters.
+
+        :param weights_path: ZooKeeper path to keep costs and weights in
+        :param number rebalance_interval: Minimum seconds between changes of
+            the weights
+        :param float threshold: Imbalance of loads, as per :func:`imbalance`,
+            above which buckets are rebalanced
+        """
+        super(WeightedPartitioner, self).__init__(
+            kz_client, interval, partitioner_path, buckets, time_boundary,
+            log, got_buckets, clock=clock)
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.clock = clock
+        self.weights_path = weights_path
+        self.rebalance_interval = rebalance_interval
+        self.threshold = threshold
+        self.identifier = '{}-{}'.format(socket.getfqdn(), os.getpid())
+        self.weights = {}
+        self.weights_version = None
+        self.partitioner = None
+        # Version of weights last seen by :meth:`rebalance` and local time
+        # when it was first seen
+        self._seen_version = None
+        self._seen_at = None
+
+    def startService(self):
+        """
+        Start checking weights. The kazoo partitioner is created after the
+        weights are read.
+        """
+        MultiService.startService(self)
+        self._delete_versioned_paths()
+
+    def _delete_versioned_paths(self):
+        """
+        Delete the ``<partitioner_path>/<version>`` directories that earlier
+        versions of this class partitioned on.
+
+        :return: Deferred fired when done. Errors are logged.
+        """
+        def is_version(child):
+            return child.lstrip('-').isdigit()
+
+        def delete(children):
+            return gatherResults(
+                [self.kz_client.delete(
+                    '{}/{}'.format(self.partitioner_path, child),
+                    recursive=True).addErrback(
+                        catch_failure(NoNodeError, lambda f: None))
+                 for child in children if is_version(child)],
+                consumeErrors=True)
+
+        d = self.kz_client.get_children(self.partitioner_path)
+        d.addCallbacks(delete, catch_failure(NoNodeError, lambda f: None))
+        return d.addErrback(
+            self.log.err, 'Could not delete old partitioner paths',
+            otter_msg_type='partition-delete-paths-error')
+
+    def stopService(self):
+        """Release the buckets."""
+        d = MultiService.stopService(self)
+        if self.partitioner is not None and self.partitioner.acquired:
+            d.addCallback(lambda _: self.partitioner.finish())
+        return d
+
+    def get_current_state(self):
+        """Return the current partitioner state."""
+        if self.partitioner is None:
+            return PartitionState.ALLOCATING
+        return self.partitioner.state
+
+    def health_check(self):
+        """See :meth:`Partitioner.health_check`."""
+        if self.running and self.partitioner is None:
+            return succeed((False, {'reason': 'Not acquired'}))
+        return super(WeightedPartitioner, self).health_check()
+
+    def _new_partitioner(self):
+        return self.kz_client.SetPartitioner(
+            self.partitioner_path,
+            set=self.buckets,
+            time_boundary=self.time_boundary,
+            identifier=self.identifier,
+            partition_func=partial(weighted_partition, self.weights))
+
+    def _get_weights(self):
+        """
+        Get weights from ZooKeeper.
+
+        :return: Deferred of (weights ``dict``, version). Version is -1 if
+            there are no weights.
+        """
+        d = self.kz_client.get(self.weights_path + '/weights')
+        d.addCallback(
+            lambda (content, stat): (json.loads(content), stat.version))
+        return d.addErrback(catch_failure(NoNodeError, lambda f: ({}, -1)))
+
+    def check_partition(self):
+        """
+        Re-create the kazoo partitioner if weights changed. Otherwise see
+        :meth:`Partitioner.check_partition`.
+        """
+        d = self._get_weights()
+        return d.addCallback(self._check_weights)
+
+    def _check_weights(self, (weights, version)):
+        if self.partitioner is not None and version == self.weights_version:
+            return super(WeightedPartitioner, self).check_partition()
+        self.log.msg('Got weights version {version}', version=version,
+                     old_version=self.weights_version,
+                     otter_msg_type='partition-weights-changed')
+        if self.partitioner is not None:
+            # Release the buckets and leave the party even if still
+            # allocating so that other members repartition
+            self.partitioner.finish()
+        self.weights, self.weights_version = weights, version
+        self.partitioner = self._new_partitioner()
+
+    def publish_costs(self, costs):
+        """
+        Publish costs of this node's buckets and rebalance if it is due.
+
+        :param dict costs: bucket -> cost of all buckets of this node
+        :return: Deferred fired when done
+        """
+        path = '{}/costs/{}'.format(self.weights_path, self.identifier)
+        content = json.dumps({str(b): cost for b, cost in costs.items()})
+        d = self.kz_client.set(path, content)
+        d.addErrback(catch_failure(
+            NoNodeError,
+            lambda f: self.kz_client.create(path, content, ephemeral=True,
+                                            makepath=True)))
+        return d.addCallback(lambda _: self.rebalance())
+
+    @inlineCallbacks
+    def _get_costs(self):
+        """
+        Get costs published by the nodes
+
+        :return: Deferred of ``dict`` of node identifier -> costs ``dict``
+        """
+        path = self.weights_path + '/costs'
+        children = yield self.kz_client.get_children(path).addErrback(
+            catch_failure(NoNodeError, lambda f: []))
+        contents = yield gatherResults(
+            [self.kz_client.get('{}/{}'.format(path, child)).addCallbacks(
+                lambda (content, _): json.loads(content),
+                catch_failure(NoNodeError, lambda f: None))
+             for child in children],
+            consumeErrors=True)
+        returnValue({child: costs for child, costs in zip(children, contents)
+                     if costs is not None})
+
+    @inlineCallbacks
+    def rebalance(self):
+        """
+        Merge costs published by the nodes into weights if the weights have
+        not changed in ``rebalance_interval`` seconds and it improves the
+        balance of loads that are more imbalanced than ``threshold``. A
+        bucket's cost is the highest one published.
+
+        Whether the weights changed is decided by their version and this
+        node's clock, so clocks of the nodes and ZooKeeper need not agree.
+
+        :return: Deferred of True if weights were changed, False otherwise
+        """
+        weights, version = yield self._get_weights()
+        now = self.clock.seconds()
+        if version != self._seen_version:
+            self._seen_version, self._seen_at = version, now
+        if version != -1 and now - self._seen_at < self.rebalance_interval:
+            returnValue(False)
+        costs = yield self._get_costs()
+        if not costs:
+            returnValue(False)
+        merged = {}
+        for node_costs in costs.values():
+            for bucket, cost in node_costs.items():
+                merged[bucket] = max(merged.get(bucket, 0), cost)
+        current = imbalance([sum(c.values()) for c in costs.values()])
+        balanced = imbalance(
+            [sum(merged.get(str(b), 0) for b in node_buckets)
+             for node_buckets in balance_buckets(
+                 merged, costs.keys(), self.buckets).values()])
+        if current <= self.threshold or balanced >= current:
+            returnValue(False)
+        path = self.weights_path + '/weights'
+        try:
+            if version == -1:
+                yield self.kz_client.create(path, json.dumps(merged),
+                                            makepath=True)
+            else:
+                yield self.kz_client.set(path, json.dumps(merged),
+                                         version=version)
+        except (NodeExistsError, BadVersionError):
+            # Another node changed the weights
+            returnValue(False)
+        self.log.msg('Rebalanced buckets', imbalance=current,
+                     new_imbalance=balanced,
+                     otter_msg_type='partition-rebalanced')
+        returnValue(True)
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+
+"""
+Benchmark convergence planning of ``launch_server`` groups on synthetic
+servers and load balancer nodes.
+
+For each group size, a population of servers is generated along with their
+CLB and RCv3 nodes, nodes of other load balancers of the tenant, and a
+desired state that requires servers to be created, deleted, drained and
+added to load balancers. Then following phases are timed:
+
+* parse: building :obj:`NovaServer` from server JSON
+* plan: :func:`converge_launch_server`
+* limit: :func:`limit_steps_by_count`
+* optimize: :func:`optimize_steps`
+* log: building the cloud feeds log effects of the steps and splitting the
+  ``execute-convergence`` event
+
+Each size is run in a separate process so that the peak memory reported is
+only of that size.
+
+Examples:
+`python bench_planning.py`
+`python bench_planning.py --sizes 1000 10000 --clbs 3 --rcv3 1 --repeat 5`
+"""
+
+from __future__ import print_function
+
+import json
+import resource
+import time
+from argparse import ArgumentParser
+from multiprocessing import Pool
+
+from pyrsistent import pmap, pset
+
+from otter.convergence.logging import log_steps
+from otter.convergence.model import (
+    CLB,
+    CLBDescription,
+    CLBNode,
+    CLBNodeCondition,
+    DesiredServerGroupState,
+    NovaServer,
+    RCv3Description,
+    RCv3Node)
+from otter.convergence.planning import converge_launch_server
+from otter.convergence.transforming import (
+    get_step_limits_from_conf, limit_steps_by_count, optimize_steps)
+from otter.log.spec import split_execute_convergence
+
+
+PHASES = ('parse', 'plan', 'limit', 'optimize', 'log')
+
+
+def address(i):
+    """ServiceNet address of ``i``th server"""
+    return '10.{}.{}.{}'.format(i >> 16 & 255, i >> 8 & 255, i & 255)
+
+
+def server_json(i, status, lbs):
+    """
+    Nova JSON of ``i``th server that is in given ``lbs`` as per its
+    metadata
+    """
+    metadata = {'rax:auto_scaling_group_id': 'gid',
+                'rax:autoscale:group:id': 'gid'}
+    for lb in lbs:
+        if isinstance(lb, CLBDescription):
+            metadata['rax:autoscale:lb:CloudLoadBalancer:{}'.format(
+                lb.lb_id)] = json.dumps([{'port': lb.port}])
+        else:
+            metadata['rax:autoscale:lb:RackConnectV3:{}'.format(
+                lb.lb_id)] = ''
+    return {
+        'id': 'server{}'.format(i),
+        'status': status,
+        'created': '2015-01-01T{:02}:{:02}:00Z'.format(i // 60 % 24, i % 60),
+        'image': {'id': 'image'},
+        'flavor': {'id': 'flavor'},
+        'links': [{'href': 'http://nova/servers/{}'.format(i),
+                   'rel': 'self'}],
+        'addresses': {'private': [{'addr': address(i), 'version': 4}]},
+        'metadata': metadata}
+
+
+def population(size, clbs, rcv3, other_nodes):
+    """
+    Generate a group of ``size`` servers that should be on ``clbs`` CLBs
+    and ``rcv3`` RCv3 pools. 5% of servers are in ERROR and another 5% are
+    in BUILD. 10% of the ACTIVE servers are not on the load balancers yet
+    and the desired capacity is 10% lower than the number of servers.
+
+    :param int other_nodes: Number of nodes of other servers of the tenant
+        on other CLBs
+
+    :return: (desired state, list of server JSON, list of nodes, lbs)
+    """
+    desired_lbs = pset(
+        [CLBDescription(lb_id=str(1000 + i), port=80) for i in range(clbs)] +
+        [RCv3Description(lb_id='pool{}'.format(i)) for i in range(rcv3)])
+    desired = DesiredServerGroupState(
+        server_config=pmap({'server': {'name': 'bench'}}),
+        capacity=size - size // 10, desired_lbs=desired_lbs,
+        draining_timeout=30.0)
+    errored = size // 20
+    building = size // 20
+    servers = (
+        [server_json(i, 'ERROR', desired_lbs) for i in range(errored)] +
+        [server_json(i, 'BUILD', desired_lbs)
+         for i in range(errored, errored + building)] +
+        [server_json(i, 'ACTIVE', desired_lbs)
+         for i in range(errored + building, size)])
+    nodes = []
+    for i, server in enumerate(servers[:size - size // 10]):
+        for lb in desired_lbs:
+            node_id = '{}-{}'.format(lb.lb_id, i)
+            if isinstance(lb, CLBDescription):
+                nodes.append(CLBNode(node_id=node_id, address=address(i),
+                                     description=lb))
+            else:
+                nodes.append(RCv3Node(node_id=node_id, description=lb,
+                                      cloud_server_id=server['id']))
+    nodes.extend(
+        CLBNode(node_id='other-{}'.format(i), address=address(size + i),
+                description=CLBDescription(lb_id=str(2000 + i % 100),
+                                           port=80,
+                                           condition=CLBNodeCondition.ENABLED))
+        for i in range(other_nodes))
+    lbs = pmap({lb.lb_id: CLB(True) for lb in desired_lbs
+                if isinstance(lb, CLBDescription)})
+    return desired, servers, nodes, lbs
+
+
+def timed(func, *args):
+    """Call ``func`` with ``args`` and return (seconds taken, result)"""
+    start = time.time()
+    result = func(*args)
+    return time.time() - start, result
+
+
+def run_once(desired, servers_json, nodes, lbs, step_limits):
+    """
+    Plan once and return ``dict`` of phase -> seconds and number of steps
+    """
+    now = time.time()
+    times = {}
+    times['parse'], servers = timed(
+        lambda: map(NovaServer.from_server_details_json, servers_json))
+    times['plan'], steps = timed(
+        converge_launch_server, desired, servers, nodes, lbs, now)
+    times['limit'], limited = timed(limit_steps_by_count, steps, step_limits)
+    times['optimize'], optimized = timed(optimize_steps, limited)
+    event = {'steps': optimized, 'now': now, 'desired': desired,
+             'servers': servers, 'lb_nodes': nodes, 'lbs': lbs}
+    times['log'], _ = timed(
+        lambda: (log_steps(optimized), split_execute_convergence(event)))
+    return times, len(steps), len(optimized)
+
+
+def bench(args):
+    """
+    Benchmark a size in this process.
+
+    :param tuple args: (size, clbs, rcv3, other nodes, repeat, step limits)
+    :return: ``dict`` of results
+    """
+    size, clbs, rcv3, other_nodes, repeat, limits = args
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    desired, servers, nodes, lbs = population(size, clbs, rcv3, other_nodes)
+    step_limits = get_step_limits_from_conf(limits)
+    runs = [run_once(desired, servers, nodes, lbs, step_limits)
+            for _ in range(repeat)]
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        'size': size,
+        'nodes': len(nodes),
+        'steps': runs[0][1],
+        'optimized_steps': runs[0][2],
+        'times': {phase: min(times[phase] for times, _, _ in runs)
+                  for phase in PHASES},
+        'peak_rss_kb': rss_after,
+        'rss_growth_kb': rss_after - rss_before}
+
+
+def print_results(results):
+    """Print results as a table"""
+    header = (['servers', 'nodes', 'steps', 'opt'] +
+              ['{}(ms)'.format(phase) for phase in PHASES] +
+              ['total(ms)', 'peak(MB)', 'growth(MB)'])
+    print(' '.join('{:>11}'.format(h) for h in header))
+    for r in results:
+        times = [r['times'][phase] * 1000 for phase in PHASES]
+        row = ([r['size'], r['nodes'], r['steps'], r['optimized_steps']] +
+               ['{:.1f}'.format(t) for t in times + [sum(times)]] +
+               ['{:.1f}'.format(r['peak_rss_kb'] / 1024.0),
+                '{:.1f}'.format(r['rss_growth_kb'] / 1024.0)])
+        print(' '.join('{:>11}'.format(c) for c in row))
+
+
+def main():
+    """Parse arguments and run the benchmarks"""
+    parser = ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument(
+        '--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000],
+        help='Number of servers in the group. Default: 10 100 1000 10000')
+    parser.add_argument(
+        '--clbs', type=int, default=2,
+        help='Number of CLBs each server should be on. Default: 2')
+    parser.add_argument(
+        '--rcv3', type=int, default=1,
+        help='Number of RCv3 pools each server should be on. Default: 1')
+    parser.add_argument(
+        '--other-nodes', type=int, default=None,
+        help=('Number of nodes of other servers on the tenant. '
+              'Default: 5 times the size'))
+    parser.add_argument(
+        '--repeat', type=int, default=3,
+        help='Times to plan each size. Fastest time is reported. Default: 3')
+    parser.add_argument(
+        '--step-limits', type=json.loads, default={},
+        help=('Step limits as in "converger.step_limits" config. '
+              'Default: {}'))
+    parser.add_argument(
+        '--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        other_nodes = (size * 5 if args.other_nodes is None
+                       else args.other_nodes)
+        pool = Pool(1)
+        try:
+            results.append(pool.apply(
+                bench, [(size, args.clbs, args.rcv3, other_nodes,
+                         args.repeat, args.step_limits)]))
+        finally:
+            pool.close()
+            pool.join()
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        print_results(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -184,16 +184,19 @@ def insert_deleting_false(reactor, conn, args):
     Insert false to all group's deleting column
     """
     store = CassScalingGroupCollection(conn, None, 3)
-    groups = yield store.get_scaling_group_rows()
     query = (
         'INSERT INTO scaling_group ("tenantId", "groupId", deleting) '
         'VALUES (:tenantId{i}, :groupId{i}, false);')
-    queries, params = [], {}
-    for i, group in enumerate(groups):
-        queries.append(query.format(i=i))
-        params['tenantId{}'.format(i)] = group['tenantId']
-        params['groupId{}'.format(i)] = group['groupId']
-    yield conn.execute(batch(queries), params, ConsistencyLevel.ONE)
+
+    def insert_page(groups):
+        queries, params = [], {}
+        for i, group in enumerate(groups):
+            queries.append(query.format(i=i))
+            params['tenantId{}'.format(i)] = group['tenantId']
+            params['groupId{}'.format(i)] = group['groupId']
+        return conn.execute(batch(queries), params, ConsistencyLevel.ONE)
+
+    yield store.each_scaling_group_page(insert_page)
     returnValue(None)
 
 
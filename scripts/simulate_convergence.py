@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+
+"""
+Load test convergence by running the real converger against simulated cloud
+services, scaling groups and ZooKeeper in this process.
+
+Synthetic tenants are generated with groups of given desired capacity, on
+given number of CLBs and RCv3 pools of the tenant. All the groups are then
+marked divergent and a :obj:`Converger` owning all the buckets converges them
+until none of them is divergent or the duration has passed. Requests to the
+simulated services take given latency and fail at given error rate. See note
+[Convergence simulator] in :mod:`otter.convergence.simulator`.
+
+Reported are the time taken, groups converged per second, number of requests
+made to and failed by each service and, if ``--tracing`` is given, the
+convergence phase histograms.
+
+Examples:
+`python simulate_convergence.py`
+`python simulate_convergence.py --tenants 1000 --groups 3 --desired 5 \
+    --clbs 2 --latency 0.2 --error-rate 0.01 --max-concurrent-groups 200`
+"""
+
+from __future__ import print_function
+
+import json
+import sys
+import time
+from argparse import ArgumentParser
+from functools import partial
+
+from twisted.internet import task
+from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.python.log import startLogging
+
+from txeffect import perform
+
+from otter.constants import CONVERGENCE_DIRTY_DIR
+from otter.convergence.service import Converger, mark_divergent_many
+from otter.convergence.simulator import (
+    SimulatedPartitioner,
+    Simulator,
+    SimulatorConfig,
+    get_simulator_dispatcher)
+from otter.convergence.tracing import PHASE_HISTOGRAMS
+from otter.log import log as otter_log
+from otter.util.config import set_config_data
+
+
+def print_results(results):
+    """Print results as a table"""
+    print('groups: {groups}, converged: {converged}, '
+          'seconds: {seconds:.1f}, groups/s: {groups_per_second:.2f}'
+          .format(**results))
+    print(' '.join('{:>22}'.format(h)
+                   for h in ['service', 'method', 'requests', 'errors']))
+    for service, method, requests, errors in results['requests']:
+        print(' '.join('{:>22}'.format(c)
+                       for c in [service, method, requests, errors]))
+    for phase, histogram in sorted(results.get('phases', {}).items()):
+        print('{:>22} {:>10} spans {:>10.3f} s avg'.format(
+            phase, histogram['count'],
+            histogram['sum'] / max(histogram['count'], 1)))
+
+
+@inlineCallbacks
+def simulate(reactor, args):
+    """
+    Converge synthetic groups with the simulator
+
+    :return: Deferred of ``dict`` of results
+    """
+    sim = Simulator(reactor, SimulatorConfig(
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        build_time=args.build_time, seed=args.seed))
+    groups = sim.populate(args.tenants, args.groups, args.desired,
+                          args.clbs, args.rcv3, args.stack_groups)
+    dispatcher = get_simulator_dispatcher(reactor, otter_log, sim)
+    converger = Converger(
+        otter_log, dispatcher, args.buckets,
+        partial(SimulatedPartitioner, interval=args.interval, clock=reactor),
+        args.build_timeout, args.interval / 2.0, args.limited_retries,
+        args.step_limits, max_concurrent_groups=args.max_concurrent_groups)
+    sim.zk.watch_children(CONVERGENCE_DIRTY_DIR, converger.divergent_changed)
+
+    start = time.time()
+    yield perform(dispatcher, mark_divergent_many(groups))
+    converger.startService()
+    while time.time() - start < args.duration:
+        divergent = yield sim.zk.get_children(CONVERGENCE_DIRTY_DIR)
+        if not divergent:
+            break
+        yield task.deferLater(reactor, 1, lambda: None)
+    seconds = time.time() - start
+    yield converger.stopService()
+
+    converged = len([g for g in groups if sim.is_converged(*g)])
+    results = {
+        'groups': len(groups),
+        'converged': converged,
+        'seconds': seconds,
+        'groups_per_second': converged / seconds,
+        'requests': [
+            [service, method, count, sim.errors[(service, method)]]
+            for (service, method), count in sorted(sim.requests.items())]}
+    if args.tracing:
+        results['phases'] = PHASE_HISTOGRAMS.as_json()
+    returnValue(results)
+
+
+def main(reactor, *argv):
+    """Parse arguments and run the simulation"""
+    parser = ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument(
+        '--tenants', type=int, default=100,
+        help='Number of tenants. Default: 100')
+    parser.add_argument(
+        '--groups', type=int, default=2,
+        help='Number of groups of each tenant. Default: 2')
+    parser.add_argument(
+        '--stack-groups', type=int, default=0,
+        help=('Number of each tenant\'s groups that are launch_stack '
+              'groups. Default: 0'))
+    parser.add_argument(
+        '--desired', type=int, default=3,
+        help='Desired capacity of each group. Default: 3')
+    parser.add_argument(
+        '--clbs', type=int, default=1,
+        help='Number of CLBs each group is on. Default: 1')
+    parser.add_argument(
+        '--rcv3', type=int, default=0,
+        help='Number of RCv3 pools each group is on. Default: 0')
+    parser.add_argument(
+        '--latency', type=float, default=0.1,
+        help='Seconds taken by each request. Default: 0.1')
+    parser.add_argument(
+        '--jitter', type=float, default=0.1,
+        help='Up to this many seconds are added to latency. Default: 0.1')
+    parser.add_argument(
+        '--error-rate', type=float, default=0,
+        help='Fraction of requests that fail with 500. Default: 0')
+    parser.add_argument(
+        '--build-time', type=float, default=5,
+        help='Seconds servers stay in BUILD. Default: 5')
+    parser.add_argument(
+        '--seed', type=int, default=0, help='Random seed. Default: 0')
+    parser.add_argument(
+        '--buckets', type=int, default=10,
+        help='Number of converger buckets. Default: 10')
+    parser.add_argument(
+        '--interval', type=float, default=10,
+        help=('Seconds between checking divergent groups as the '
+              'partitioner would. Default: 10'))
+    parser.add_argument(
+        '--build-timeout', type=float, default=3600,
+        help='Seconds after which building servers are deleted. '
+             'Default: 3600')
+    parser.add_argument(
+        '--limited-retries', type=int, default=10,
+        help='Iterations to wait for LIMITED_RETRY steps. Default: 10')
+    parser.add_argument(
+        '--step-limits', type=json.loads, default={},
+        help=('Step limits as in "converger.step_limits" config. '
+              'Default: {}'))
+    parser.add_argument(
+        '--max-concurrent-groups', type=int, default=None,
+        help='Limit tenants converged at a time. Default: no limit')
+    parser.add_argument(
+        '--converger-config', type=json.loads, default={},
+        help=('Other "converger" config like {"converged_fast_path": true}. '
+              'Default: {}'))
+    parser.add_argument(
+        '--tracing', action='store_true',
+        help='Trace convergence phases and report their histograms')
+    parser.add_argument(
+        '--duration', type=float, default=600,
+        help='Give up after this many seconds. Default: 600')
+    parser.add_argument(
+        '--log-file', help='Write otter logs to this file')
+    parser.add_argument(
+        '--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args(argv)
+
+    converger_config = dict(args.converger_config)
+    if args.tracing:
+        converger_config['tracing'] = True
+    set_config_data({'converger': converger_config})
+    if args.log_file is not None:
+        startLogging(open(args.log_file, 'a'), setStdout=False)
+
+    d = simulate(reactor, args)
+    if args.json:
+        d.addCallback(
+            lambda r: print(json.dumps(r, indent=2, sort_keys=True)))
+    else:
+        d.addCallback(print_results)
+    return d
+
+
+if __name__ == '__main__':
+    task.react(main, sys.argv[1:])